@@ -8,21 +8,42 @@
 """
 
 import os
+import uuid
+import socket
+import re
+import copy
 import json
 import time
 import random
+import asyncio
+import queue
+import threading
+import glob
+import hashlib
+import unicodedata
 import logging
 import argparse
 import traceback
 import pandas as pd
 import pymongo
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
 from bson.objectid import ObjectId
-from typing import Dict, List, Any, Tuple, Optional, Union
+from typing import Dict, List, Any, Tuple, Optional, Union, Iterator
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from datetime import datetime
-from openai import OpenAI
+from datetime import datetime, timedelta, timezone
+from openai import AsyncOpenAI
+from openai_client import create_openai_client, create_async_openai_client, proxy_url, connection_metrics
 from prompts import *
+from llm_cache import response_cache, LLMCacheMissError, LLM_CACHE_CONFIG
+from rate_limiter import AdaptiveRateLimiter, RateLimitedClient, RATE_LIMIT_CONFIG, estimate_request_tokens
+from request_hedging import RequestHedger, HEDGING_CONFIG
+from tag_library import TagLibrary, TAG_LIBRARY_CONFIG
+from usage_metrics import UsageMetrics, LatencyHistogram
+from cost_estimator import CostEstimator, usage_cost
+from label_schema import parse_json_content, repair_label, LABEL_SCHEMA_CONFIG
+from near_duplicate import NearDuplicateIndex, NEAR_DUPLICATE_CONFIG
 
 ###################
 # 配置部分
@@ -34,7 +55,9 @@ DB_CONFIG = {
     "db_name": "kinyo_db",
     "collections": {
         "reviews": "kinyo_new_reviews",
-        "llm_results": "kinyo_llm_results"
+        "llm_results": "kinyo_llm_results",
+        "label_cache": "kinyo_label_cache",
+        "label_status": "kinyo_label_status"  # 各项目/方案的标注状态补齐水位
     }
 }
 
@@ -42,11 +65,20 @@ DB_CONFIG = {
 MODEL_CONFIG = {
     "gpt_models": ["gpt-4o", "gpt-4o-mini","gpt-3.5-turbo"],
     "embedding_model": "text-embedding-3-small",
-    "default_model": "gpt-3.5-turbo"
+    "default_model": "gpt-3.5-turbo",
+    "base_url": None  # API地址，None表示官方地址（或环境变量OPENAI_BASE_URL）；压测时可指向mock_openai_server
+}
+
+# 级联模型路由配置
+CASCADE_CONFIG = {
+    "tiers": ["gpt-4o-mini", "gpt-4o"],  # 由便宜到强，每条评论先用第一档，不满足条件时逐档升级
+    "min_confidence": 0.6,  # 任一话题confidence低于该值时升级
+    "long_comment_chars": 30  # 评论不少于该字数而话题为空时升级
 }
 
 # 代理配置
 PROXY_CONFIG = {
+    "enabled": True,  # 访问本地模拟服务等无需代理时关闭
     "url": "http://127.0.0.1",
     "port": 6465  # 需替换为实际端口
 }
@@ -59,7 +91,117 @@ LOG_CONFIG = {
 
 # Token统计配置
 TOKEN_CONFIG = {
-    "report_file": "logs/1_first_label_token_usage_report.json"
+    "report_file": "logs/1_first_label_token_usage_report.json",
+    # --shard运行时各分片的报告，--merge-report合并为report_file
+    "shard_report_file": "logs/1_first_label_token_usage_report.{project_code}.shard{index}of{count}.json"
+}
+
+# 执行引擎配置
+ENGINE_CONFIG = {
+    "engines": ["thread", "async"],
+    "default_engine": "thread",
+    "async_concurrency": 200,  # async引擎同时在途的最大请求数
+    "pack_size": 1,  # 每次请求合并标注的评论数，1表示不合并
+    "stream_queue_size": 1000,  # 流式模式下待处理队列和结果队列的容量
+    "cursor_batch_size": 500  # 流式模式下MongoDB游标每批读取的文档数
+}
+
+# 结果写入配置
+WRITER_CONFIG = {
+    "batch_size": 500,  # 缓冲文档数达到该值时立即写入
+    "flush_interval": 2.0,  # 后台定时写入间隔（秒）
+    "key_fields": ["project_code", "solution", "review_id"]  # 结果文档的唯一键，重复运行时按此覆盖
+}
+
+# 标注状态配置
+LABEL_STATUS_CONFIG = {
+    "field_prefix": "label_status",  # 评论文档上的状态字段前缀，按解决方案区分: label_status.<solution>
+    "lease_prefix": "label_lease",  # 租约字段前缀: label_lease.<solution>.{worker_id, expires, attempts}
+    "done": "done",
+    "leased": "leased",
+    "failed": "failed",  # 领取次数达到上限仍未完成的评论，各模式都不再领取（清除状态字段后可重新标注）
+    "update_chunk_size": 1000  # 批量标记状态时每次更新的评论数
+}
+
+# 分布式任务租约配置
+LEASE_CONFIG = {
+    "batch_size": 50,  # 每次领取的评论数
+    "lease_seconds": 300,  # 租约有效期，过期未完成的评论可被其他节点重新领取
+    "renew_interval": 60,  # 续约间隔（秒）
+    "max_attempts": 3  # 单条评论最多被领取的次数，超过后不再领取（避免异常评论反复消耗token）
+}
+
+# 持续标注配置（--follow）
+FOLLOW_CONFIG = {
+    "modes": ["auto", "change_stream", "poll"],
+    "default_mode": "auto",  # auto: 可用时（副本集）使用change stream，否则按插入时间字段轮询
+    "timestamp_field": "_id",  # 插入时间字段，默认_id（ObjectId包含插入时间，天然有索引）；导入时写入了时间字段时可改用该字段
+    "poll_interval": 10.0,  # 轮询模式下没有新评论时的等待时间（秒）
+    "batch_size": 50,  # 每个微批的最大评论数
+    "max_wait": 5.0,  # change stream模式下微批的最长等待时间（秒），新评论不足batch_size时到期即处理
+    "sweep_interval": 60.0,  # 补扫间隔（秒）：处理插入时间早于当前位置的未标注评论（晚到或事件丢失的评论）
+    "retry_delay": 300.0,  # 标注失败的评论暂缓重试的时间（秒），按租约记录，领取次数达到LEASE_CONFIG["max_attempts"]后标记为failed
+    "report_interval": 60.0  # 输出积压与标注延迟并保存Token报告的间隔（秒）
+}
+
+# 规则预过滤配置：命中的评论（过短、纯表情/符号、平台默认文案等）不调用模型，直接生成空标注结果，笼统好评/差评生成整体评价话题
+PREFILTER_CONFIG = {
+    "enabled": True,
+    "min_length": 2,  # 去除表情、标点、空白后的最短有效长度，低于该值视为无效评论
+    "boilerplate_phrases": [  # 平台默认文案（去除标点空白后完全相同即命中）
+        "此用户没有填写评价",
+        "此用户没有填写评论",
+        "此用户未填写评价内容",
+        "该用户未填写评价内容",
+        "该用户未及时评价",
+        "用户未及时评价",
+        "用户未填写评价内容",
+        "系统默认好评",
+        "系统默认评价",
+        "默认好评",
+        "评价方未及时做出评价系统默认好评",
+        "您没有填写评价内容"
+    ],
+    "regex_rules": [  # 对去除首尾空白的原文匹配
+        r"^(.)\1+$",  # 单字重复，如“哈哈哈哈”
+        r"^[\d\s]+$"  # 纯数字（凑字数）
+    ],
+    # 只有笼统好评/差评、没有具体内容的短评（如“五星好评”、“好好好”、“差”、“垃圾”）不调用模型，
+    # 但不生成空标注，而是生成一条明确的整体评价话题，第三阶段仍计入好评/差评，好评与差评同等对待。
+    # 先于过短和单字重复规则匹配，对去除首尾空白的原文匹配
+    "generic_sentiment_rules": {
+        "generic_positive": {"regex": r"^(好评|好|五星|满分|赞|非常好|很好|不错)+[!！。.~～]*$", "polarity": "好评"},
+        "generic_negative": {"regex": r"^(差评|差|垃圾|坑|烂|太差|很差|不好)+[!！。.~～]*$", "polarity": "差评"}
+    },
+    "generic_topic": "整体评价"
+}
+
+# 标注缓存配置
+LABEL_CACHE_CONFIG = {
+    "enabled": True,
+    "lookup_chunk_size": 1000  # 批量查询缓存时每次$in查询的key数量
+}
+
+# 分层抽样配置
+SAMPLING_CONFIG = {
+    "strata_fields": ["来源平台", "来源店铺", "商品SKU"],  # 直接作为分层维度的评论字段
+    "time_field": "评论时间",  # 按月分层
+    "comment_field": "评论",  # 按评论长度分桶
+    "length_buckets": [10, 30, 80, 200],  # 评论长度分桶边界（字符数），如[0,10)、[10,30)...[200,∞)
+    "default_rate": 0.1,  # 默认抽样比例
+    "min_per_stratum": 1,  # 每层最少抽取的评论数（小层也有代表）
+    "default_seed": 20250410,  # 默认随机种子，相同种子与数据得到相同样本
+    "hash_field": "review_hash",  # 评论文档上由review_id计算的31位哈希值，作为可复现的随机排序键
+    "hash_modulus": 2147483647  # 2^31-1（素数），种子化排序键按该模数做两轮乘法散列
+}
+
+# 结果输出配置
+OUTPUT_CONFIG = {
+    "dir": "outputs",
+    "formats": ["parquet", "csv"],  # parquet为列式存储（话题表与画像表分别输出），csv为UTF-8-SIG文本
+    "default_format": "parquet",
+    "parquet_compression": "zstd",
+    "topic_fields": ["topic", "polarity", "confidence", "related_text"]  # 话题表从product_topic_result展开的字段
 }
 
 # 实验配置
@@ -114,16 +256,14 @@ logger = setup_logger(LOG_CONFIG["log_file"], LOG_CONFIG["log_level"])
 ###################
 
 class TokenCounter:
-    """Token使用统计类"""
+    """Token使用统计类（线程/协程安全，按线程分片记录，生成报告时合并）"""
     
     def __init__(self):
-        self.total_tokens = 0
-        self.call_count = 0
-        self.token_by_model = {}
-        self.token_by_operation = {}
-        self.prompt_tokens = 0
-        self.completion_tokens = 0
+        self.metrics = UsageMetrics()
         self.start_time = datetime.now()
+        self.throughput = {}
+        self.sections = {}
+        self.report_file = TOKEN_CONFIG["report_file"]  # --shard运行时在启动时改为本分片的报告文件
         
     def add_usage(self, tokens: int, model: str, operation: str = "default", prompt_tokens: int = None, completion_tokens: int = None):
         """添加token使用记录
@@ -136,67 +276,185 @@ class TokenCounter:
             completion_tokens: 生成token数量
         """
         if tokens:
-            self.total_tokens += tokens
-            self.call_count += 1
-            
-            # 记录提示词和生成token
-            if prompt_tokens is not None:
-                self.prompt_tokens += prompt_tokens
-            if completion_tokens is not None:
-                self.completion_tokens += completion_tokens
-            
-            # 按模型统计
-            if model in self.token_by_model:
-                self.token_by_model[model] += tokens
-            else:
-                self.token_by_model[model] = tokens
-            
-            # 按操作类型统计
-            if operation in self.token_by_operation:
-                self.token_by_operation[operation] += tokens
-            else:
-                self.token_by_operation[operation] = tokens
-            
+            self.metrics.add_usage(tokens, model, operation, prompt_tokens, completion_tokens)
             logger.debug(f"使用 {tokens} tokens ({model}, {operation})")
+    
+    def add_latency(self, seconds: float, operation: str = "default", model: str = ""):
+        """添加单次API调用耗时记录
+        
+        Args:
+            seconds: 调用耗时（秒）
+            operation: 操作类型
+            model: 使用的模型名称
+        """
+        self.metrics.add_latency(seconds, operation, model)
+    
+    def add_retry(self, operation: str, error: Exception = None):
+        """添加一次API调用重试记录
+        
+        Args:
+            operation: 操作类型
+            error: 触发重试的异常
+        """
+        self.metrics.add_retry(operation, error)
+    
+    def add_error(self, operation: str, error: Exception):
+        """添加一次API调用最终失败记录
+        
+        Args:
+            operation: 操作类型
+            error: 异常
+        """
+        self.metrics.add_error(operation, error)
+    
+    def get_latency_stats(self) -> Dict[str, Any]:
+        """获取API调用耗时统计（全部调用的p50/p95/p99）"""
+        return self.metrics.snapshot()["latency"]["overall"]
+    
+    def add_cache_result(self, hits: int = 0, misses: int = 0, tokens_saved: int = 0):
+        """添加标注缓存命中记录
+        
+        Args:
+            hits: 命中次数
+            misses: 未命中次数
+            tokens_saved: 命中所节省的token数量（按原始标注消耗计）
+        """
+        self.metrics.incr("label_cache.hits", hits)
+        self.metrics.incr("label_cache.misses", misses)
+        self.metrics.incr("label_cache.tokens_saved", tokens_saved)
+    
+    def add_prefilter_result(self, checked: int, hits_by_rule: Dict[str, int]):
+        """添加规则预过滤记录
+        
+        Args:
+            checked: 检查的评论数
+            hits_by_rule: 各规则命中的评论数
+        """
+        self.metrics.incr("prefilter.checked", checked)
+        for rule, count in hits_by_rule.items():
+            self.metrics.incr(f"prefilter.hit.{rule}", count)
+    
+    def add_near_duplicate_result(self, checked: int = 0, hits: int = 0, tokens_saved: int = 0):
+        """添加近似重复复用记录
+        
+        Args:
+            checked: 查询近似重复索引的评论数
+            hits: 复用已标注评论结果的评论数
+            tokens_saved: 复用所节省的token数量（按被复用评论的标注消耗计）
+        """
+        self.metrics.incr("near_duplicate.checked", checked)
+        self.metrics.incr("near_duplicate.hits", hits)
+        self.metrics.incr("near_duplicate.tokens_saved", tokens_saved)
+    
+    def set_section(self, name: str, data: Dict[str, Any]):
+        """在报告中添加/覆盖一个统计分区
+        
+        Args:
+            name: 分区名称
+            data: 统计数据
+        """
+        self.sections[name] = data
+    
+    def set_throughput(self, review_count: int, duration: float):
+        """记录批量分析的吞吐量
+        
+        Args:
+            review_count: 处理完成的评论数量
+            duration: 批量分析耗时（秒）
+        """
+        self.throughput = {
+            "review_count": review_count,
+            "duration_seconds": round(duration, 3),
+            "reviews_per_second": round(review_count / duration, 2) if duration > 0 else 0
+        }
                 
     def get_report(self) -> Dict[str, Any]:
         """获取使用报告"""
         end_time = datetime.now()
         duration = (end_time - self.start_time).total_seconds()
+        snapshot = self.metrics.snapshot()
+        total_tokens = snapshot["total_tokens"]
+        call_count = snapshot["call_count"]
+        prompt_tokens = snapshot["prompt_tokens"]
+        completion_tokens = snapshot["completion_tokens"]
+        counters = snapshot["counters"]
         
         # 如果没有明确记录提示词和生成token，则估算
-        if self.prompt_tokens == 0 and self.completion_tokens == 0 and self.total_tokens > 0:
+        if prompt_tokens == 0 and completion_tokens == 0 and total_tokens > 0:
             # 假设提示词占70%，生成占30%
-            self.prompt_tokens = int(self.total_tokens * 0.7)
-            self.completion_tokens = self.total_tokens - self.prompt_tokens
+            prompt_tokens = int(total_tokens * 0.7)
+            completion_tokens = total_tokens - prompt_tokens
         
-        # 计算成本估算（基于gpt-3.5-turbo价格）
-        input_cost = round(self.prompt_tokens * 0.0000015, 6)
-        output_cost = round(self.completion_tokens * 0.000002, 6)
-        total_cost = round(input_cost + output_cost, 6)
+        # 按价格表计算各模型的成本
+        cost_estimate = usage_cost(snapshot["usage_by_model"])
+        
+        cache_hits = counters.get("label_cache.hits", 0)
+        cache_misses = counters.get("label_cache.misses", 0)
+        prefilter_checked = counters.get("prefilter.checked", 0)
+        prefilter_hits = self.metrics.counters_with_prefix("prefilter.hit.", snapshot)
+        schema_checked = counters.get("schema.checked", 0)
+        near_checked = counters.get("near_duplicate.checked", 0)
+        near_hits = counters.get("near_duplicate.hits", 0)
         
         return {
-            "total_tokens": self.total_tokens,
-            "call_count": self.call_count,
-            "average_tokens_per_call": round(self.total_tokens / self.call_count if self.call_count > 0 else 0, 1),
-            "tokens_by_model": self.token_by_model,
-            "tokens_by_operation": self.token_by_operation,
+            "total_tokens": total_tokens,
+            "call_count": call_count,
+            "average_tokens_per_call": round(total_tokens / call_count if call_count > 0 else 0, 1),
+            "tokens_by_model": snapshot["tokens_by_model"],
+            "tokens_by_operation": snapshot["tokens_by_operation"],
+            "usage_by_model": snapshot["usage_by_model"],
             "duration_seconds": round(duration, 6),
             "start_time": self.start_time.isoformat(),
             "end_time": end_time.isoformat(),
             "report_time": datetime.now().isoformat(),
             "project_code": EXPERIMENT_CONFIG["project_code"],
-            "prompt_tokens": self.prompt_tokens,
-            "completion_tokens": self.completion_tokens,
-            "cost_estimate": {
-                "input_cost": input_cost,
-                "output_cost": output_cost,
-                "total_cost": total_cost
-            }
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_stats": snapshot["latency"]["overall"],
+            "latency_by_operation": snapshot["latency"]["by_operation"],
+            "retries": snapshot["retries"],
+            "errors": snapshot["errors"],
+            "throughput": self.throughput,
+            "label_cache": {
+                "hits": cache_hits,
+                "misses": cache_misses,
+                "hit_rate": round(cache_hits / (cache_hits + cache_misses), 4) if cache_hits + cache_misses > 0 else 0,
+                "tokens_saved": counters.get("label_cache.tokens_saved", 0)
+            },
+            "prefilter": {
+                "checked": prefilter_checked,
+                "hits": sum(prefilter_hits.values()),
+                "hit_rate": round(sum(prefilter_hits.values()) / prefilter_checked, 4) if prefilter_checked > 0 else 0,
+                "hits_by_rule": prefilter_hits
+            },
+            "near_duplicate": {
+                "checked": near_checked,
+                "hits": near_hits,
+                "reuse_rate": round(near_hits / near_checked, 4) if near_checked > 0 else 0,
+                "tokens_saved": counters.get("near_duplicate.tokens_saved", 0)
+            },
+            "schema": {
+                "checked": schema_checked,
+                "repaired": counters.get("schema.repaired", 0),
+                "repair_rate": round(counters.get("schema.repaired", 0) / schema_checked, 4) if schema_checked > 0 else 0,
+                "repairs": self.metrics.counters_with_prefix("schema.repair.", snapshot),
+                "fix_calls": counters.get("schema.fix_calls", 0),
+                "fixed_fields": counters.get("schema.fixed_fields", 0),
+                "unfixed_fields": counters.get("schema.unfixed_fields", 0),
+                "full_retries": counters.get("schema.full_retries", 0)
+            },
+            "llm_response_cache": response_cache.get_stats(),
+            **self.sections,
+            "cost_estimate": cost_estimate
         }
         
-    def save_report(self, output_file: str = TOKEN_CONFIG["report_file"]):
-        """保存报告到文件"""
+    def save_report(self, output_file: str = None):
+        """保存报告到文件
+        
+        Args:
+            output_file: 报告文件，None表示使用report_file
+        """
+        output_file = output_file or self.report_file
         with open(output_file, "w", encoding="utf-8") as f:
             json.dump(self.get_report(), f, ensure_ascii=False, indent=2)
         logger.info(f"Token使用报告已保存到 {output_file}")
@@ -254,11 +512,16 @@ def api_call_with_retry(max_retries=3, initial_delay=1):
             while retries <= max_retries:
                 try:
                     return func(*args, **kwargs)
+                except LLMCacheMissError:
+                    # replay-only模式下缓存未命中，重试没有意义
+                    raise
                 except Exception as e:
                     retries += 1
                     if retries > max_retries:
                         logger.error(f"API调用 {func.__name__} 失败，已达到最大重试次数: {str(e)}")
+                        token_counter.add_error(func.__name__, e)
                         raise
+                    token_counter.add_retry(func.__name__, e)
                     
                     # 使用指数退避算法
                     delay = initial_delay * (2 ** (retries - 1)) * (0.5 + random.random())
@@ -268,6 +531,33 @@ def api_call_with_retry(max_retries=3, initial_delay=1):
         return wrapper
     return decorator
 
+def async_api_call_with_retry(max_retries=3, initial_delay=1):
+    """带重试机制的异步API调用装饰器"""
+    def decorator(func):
+        async def wrapper(*args, **kwargs):
+            retries = 0
+            while retries <= max_retries:
+                try:
+                    return await func(*args, **kwargs)
+                except LLMCacheMissError:
+                    # replay-only模式下缓存未命中，重试没有意义
+                    raise
+                except Exception as e:
+                    retries += 1
+                    if retries > max_retries:
+                        logger.error(f"API调用 {func.__name__} 失败，已达到最大重试次数: {str(e)}")
+                        token_counter.add_error(func.__name__, e)
+                        raise
+                    token_counter.add_retry(func.__name__, e)
+                    
+                    # 使用指数退避算法
+                    delay = initial_delay * (2 ** (retries - 1)) * (0.5 + random.random())
+                    logger.warning(f"API调用 {func.__name__} 失败，{retries}/{max_retries}次重试，将在{delay:.2f}秒后重试: {str(e)}")
+                    await asyncio.sleep(delay)
+            return None
+        return wrapper
+    return decorator
+
 ###################
 # 数据库连接管理
 ###################
@@ -334,6 +624,44 @@ class MongoDBManager:
             cursor = cursor.limit(limit)
         return list(cursor)
     
+    def iter_documents(self, collection_name: str, query: Dict[str, Any], limit: int = 0,
+                       projection: Dict[str, Any] = None, batch_size: int = ENGINE_CONFIG["cursor_batch_size"]) -> Iterator[Dict[str, Any]]:
+        """以游标分批流式读取文档，不一次性加载到内存
+        
+        Args:
+            collection_name: 集合名称
+            query: 查询条件
+            limit: 限制返回文档数量，默认0表示不限制
+            projection: 指定返回的字段，默认None表示返回所有字段
+            batch_size: 游标每批从服务端读取的文档数
+            
+        Yields:
+            查询结果文档
+        """
+        collection = self.get_collection(collection_name)
+        cursor = collection.find(query, projection).batch_size(batch_size)
+        if limit > 0:
+            cursor = cursor.limit(limit)
+        try:
+            for doc in cursor:
+                yield doc
+        finally:
+            cursor.close()
+    
+    @timer_decorator
+    def count_documents(self, collection_name: str, query: Dict[str, Any]) -> int:
+        """统计满足条件的文档数量
+        
+        Args:
+            collection_name: 集合名称
+            query: 查询条件
+            
+        Returns:
+            文档数量
+        """
+        collection = self.get_collection(collection_name)
+        return collection.count_documents(query)
+    
     @timer_decorator
     def get_random_document(self, collection_name: str, size: int = 1) -> List[Dict[str, Any]]:
         """随机获取文档
@@ -379,6 +707,37 @@ class MongoDBManager:
         result = collection.insert_many(documents)
         return [str(id) for id in result.inserted_ids]
     
+    @timer_decorator
+    def bulk_upsert(self, collection_name: str, documents: List[Dict[str, Any]], key_fields: List[str]) -> Dict[str, int]:
+        """按唯一键批量覆盖写入文档（无序bulk_write，单条失败不影响其他文档）
+        
+        Args:
+            collection_name: 集合名称
+            documents: 要写入的文档列表
+            key_fields: 唯一键字段列表
+            
+        Returns:
+            写入统计，包含upserted、modified、failed数量及失败文档的下标failed_indexes
+        """
+        collection = self.get_collection(collection_name)
+        operations = []
+        for doc in documents:
+            doc = {k: v for k, v in doc.items() if k != "_id"}
+            operations.append(ReplaceOne({field: doc.get(field) for field in key_fields}, doc, upsert=True))
+        try:
+            result = collection.bulk_write(operations, ordered=False)
+            return {"upserted": result.upserted_count, "modified": result.modified_count, "failed": 0, "failed_indexes": []}
+        except BulkWriteError as e:
+            details = e.details or {}
+            errors = details.get("writeErrors", [])
+            logger.error(f"批量写入部分失败: {len(errors)}/{len(operations)} 条, 首个错误: {errors[0].get('errmsg') if errors else str(e)}")
+            return {
+                "upserted": details.get("nUpserted", 0),
+                "modified": details.get("nModified", 0),
+                "failed": len(errors),
+                "failed_indexes": [error.get("index") for error in errors]
+            }
+    
     def close(self):
         """关闭数据库连接"""
         if self.client:
@@ -393,33 +752,246 @@ class MongoDBManager:
 class ModelService:
     """OpenAI模型服务类"""
     
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, rate_limiter: Optional[AdaptiveRateLimiter] = None,
+                 hedger: Optional[RequestHedger] = None, base_url: Optional[str] = MODEL_CONFIG["base_url"],
+                 use_proxy: bool = PROXY_CONFIG["enabled"]):
         """初始化模型服务
         
         Args:
             api_key: OpenAI API密钥，默认从环境变量获取
+            rate_limiter: 自适应限流器，None表示不限流
+            hedger: 截止时间与对冲器，None表示按HEDGING_CONFIG创建
+            base_url: API地址，None表示官方地址（或环境变量OPENAI_BASE_URL）
+            use_proxy: 是否设置HTTP代理
         """
-        # 设置代理
-        self._setup_proxy()
-        
-        # 初始化客户端
+        # 初始化客户端（代理按客户端设置，不修改进程环境变量；同步客户端共用连接池）
         self.api_key = api_key or os.getenv('OPEN_AI_KEY')
-        self.client = OpenAI(api_key=self.api_key)
-        logger.info("OpenAI客户端已初始化")
+        self.base_url = base_url
+        self.proxy = proxy_url(dict(PROXY_CONFIG, enabled=use_proxy))
+        self.rate_limiter = rate_limiter
+        self.hedger = hedger or RequestHedger(metrics=token_counter.metrics)
+        self.client = self._wrap_client(create_openai_client(self.api_key, self.base_url, self.proxy))
+        self._async_client = None
+        logger.info(f"OpenAI客户端已初始化，代理: {self.proxy or '无'}")
+    
+    def _wrap_client(self, client):
+        """配置了限流器时为客户端加上限流"""
+        if self.rate_limiter is None:
+            return client
+        return RateLimitedClient(client, self.rate_limiter)
+    
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        """异步OpenAI客户端，首次使用时创建"""
+        if self._async_client is None:
+            self._async_client = self._wrap_client(create_async_openai_client(self.api_key, self.base_url, self.proxy))
+            logger.info("AsyncOpenAI客户端已初始化")
+        return self._async_client
+    
+    async def aclose(self):
+        """关闭异步客户端（需在创建它的事件循环中调用）"""
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+    
+    def _complete(self, operation: str, model: str, messages: List[Dict[str, str]],
+                  max_tokens: int = None) -> Tuple[Any, bool, float]:
+        """发送一次JSON输出的对话请求（经LLM响应缓存，受截止时间约束，慢请求按p95对冲）
+        
+        Args:
+            operation: 操作名称，决定截止时间
+            model: 使用的模型
+            messages: 对话消息
+            max_tokens: 最大输出token数，None表示不限制
+            
+        Returns:
+            (响应, 是否缓存命中, 耗时秒数)
+        """
+        request = self.build_request(model, messages, max_tokens)
+        call_start = time.perf_counter()
+        response, cache_hit = self.hedger.call(
+            operation, model, lambda timeout: response_cache.create(self.client, timeout=timeout, **request)
+        )
+        return response, cache_hit, time.perf_counter() - call_start
+    
+    async def _acomplete(self, operation: str, model: str, messages: List[Dict[str, str]],
+                         max_tokens: int = None) -> Tuple[Any, bool, float]:
+        """异步发送一次JSON输出的对话请求，落选的对冲请求直接取消，参数与返回同_complete"""
+        request = self.build_request(model, messages, max_tokens)
+        call_start = time.perf_counter()
+        response, cache_hit = await self.hedger.acall(
+            operation, model, lambda timeout: response_cache.acreate(self.async_client, timeout=timeout, **request),
+            estimated_tokens=estimate_request_tokens(request)
+        )
+        return response, cache_hit, time.perf_counter() - call_start
+    
+    @staticmethod
+    def build_request(model: str, messages: List[Dict[str, str]], max_tokens: int = None) -> Dict[str, Any]:
+        """构建JSON输出的chat.completions请求参数（成本预估按同样的参数计算token和查询响应缓存）"""
+        request = {"model": model, "messages": messages, "stream": False, "response_format": {'type': 'json_object'}}
+        if max_tokens:
+            request["max_tokens"] = max_tokens
+        return request
+    
+    @staticmethod
+    def _build_messages(review: Dict[str, Any]) -> List[Dict[str, str]]:
+        """构建评论分析的对话消息
+        
+        Args:
+            review: 评论数据
+            
+        Returns:
+            消息列表
+        """
+        return [
+            {"role": "system", "content": first_label_system_prompt()},
+            {"role": "user", "content": first_label_user_prompt(review['评论'], review['商品名称'])}
+        ]
+    
+    @staticmethod
+    def _record_usage(response, operation: str, model: str, latency: float, cache_hit: bool = False) -> int:
+        """记录一次响应的token消耗和调用耗时（缓存命中时不计入），返回总token数"""
+        token_usage = response.usage.total_tokens if hasattr(response, 'usage') else 0
+        prompt_tokens = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
+        completion_tokens = response.usage.completion_tokens if hasattr(response, 'usage') else 0
+        
+        if not cache_hit:
+            token_counter.add_usage(
+                tokens=token_usage,
+                model=model,
+                operation=operation,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens
+            )
+            token_counter.add_latency(latency, operation, model)
+        return token_usage
+    
+    def _parse_response(self, response, review: Dict[str, Any], model: str, latency: float, 
+                        cache_hit: bool = False) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """解析API响应、按结果结构在本地修复并记录token消耗
+        
+        Args:
+            response: chat.completions响应
+            review: 评论数据
+            model: 使用的模型
+            latency: 本次调用耗时（秒）
+            cache_hit: 响应是否来自LLM响应缓存（命中时不计入token消耗和调用耗时）
+            
+        Returns:
+            (分析结果, 本地无法修复的字段 -> 模型原输出)，无法修复的字段需要单独请求修复
+        """
+        review_id = review['review_id']
+        token_usage = self._record_usage(response, "analyze_review", model, latency, cache_hit)
+        
+        # 解析内容并按结构修复
+        content = response.choices[0].message.content
+        parsed_content = parse_json_content(content)
+        result, repairs, failed = repair_label(parsed_content, review['评论'])
+        failed_values = {
+            field: parsed_content.get(field) if isinstance(parsed_content, dict) else content
+            for field in failed
+        }
+        
+        # 补充元数据
+        result['token_usage'] = token_usage
+        result['review_id'] = review_id
+        result['analysis_time'] = datetime.now().isoformat()
+        if repairs or failed:
+            result['schema_repair'] = {"repairs": sorted(set(repairs)), "fixed_fields": [], "unfixed_fields": []}
         
-    def _setup_proxy(self):
-        """设置HTTP代理"""
-        proxy_url = PROXY_CONFIG["url"]
-        proxy_port = PROXY_CONFIG["port"]
-        os.environ['http_proxy'] = f'{proxy_url}:{proxy_port}'
-        os.environ['https_proxy'] = f'{proxy_url}:{proxy_port}'
-        logger.debug(f"HTTP代理已设置: {proxy_url}:{proxy_port}")
+        logger.info(f"成功分析评论 ID: {review_id}, 使用模型: {model}, 消耗tokens: {token_usage}, 耗时: {latency:.2f}秒")
+        return result, failed_values
+    
+    @staticmethod
+    def _build_fix_messages(review: Dict[str, Any], field: str, bad_value: Any) -> List[Dict[str, str]]:
+        """构建单个字段修复的对话消息（不带第一阶段的系统提示词）"""
+        return [
+            {"role": "user", "content": first_label_field_fix_prompt(field, review['评论'], review['商品名称'], bad_value)}
+        ]
+    
+    def _apply_fix(self, result: Dict[str, Any], field: str, response, model: str, latency: float, cache_hit: bool) -> bool:
+        """将字段修复请求的输出写回结果，返回是否修复成功"""
+        result['token_usage'] += self._record_usage(response, "label_fix", model, latency, cache_hit)
+        parsed = parse_json_content(response.choices[0].message.content)
+        value = parsed.get(field) if isinstance(parsed, dict) else None
+        fixed, _, failed = repair_label({field: value}, result.get('comment'))
+        if value is None or field in failed:
+            return False
+        result[field] = fixed[field]
+        return True
+    
+    @staticmethod
+    def _count_repairs(repairs: List[str]):
+        """记录一条结果的本地修复项"""
+        token_counter.metrics.incr("schema.repaired")
+        for repair in repairs:
+            token_counter.metrics.incr(f"schema.repair.{repair}")
+    
+    def _finish_schema(self, result: Dict[str, Any], failed_values: Dict[str, Any], fixed: List[str]) -> Dict[str, Any]:
+        """记录本地修复与字段修复的统计
+        
+        整个输出都无法解析且字段修复失败时抛出异常，由api_call_with_retry整体重试；
+        只有部分字段修复失败时该字段保持空值，并在schema_repair.unfixed_fields中标记。
+        """
+        schema_repair = result.get('schema_repair')
+        token_counter.metrics.incr("schema.checked")
+        if schema_repair is None:
+            return result
+        schema_repair["fixed_fields"] = fixed
+        schema_repair["unfixed_fields"] = [field for field in failed_values if field not in fixed]
+        self._count_repairs(schema_repair["repairs"])
+        token_counter.metrics.incr("schema.fixed_fields", len(fixed))
+        token_counter.metrics.incr("schema.unfixed_fields", len(schema_repair["unfixed_fields"]))
+        if "not_object" in schema_repair["repairs"] and schema_repair["unfixed_fields"]:
+            token_counter.metrics.incr("schema.full_retries")
+            raise ValueError(f"评论 {result['review_id']} 的输出无法解析且字段修复失败")
+        if schema_repair["unfixed_fields"]:
+            logger.warning(f"评论 {result['review_id']} 的字段修复失败，已置空: {schema_repair['unfixed_fields']}")
+        return result
+    
+    def _fix_fields(self, review: Dict[str, Any], model: str, result: Dict[str, Any], failed_values: Dict[str, Any]) -> Dict[str, Any]:
+        """对本地无法修复的字段逐个发送只修复该字段的小请求"""
+        fixed = []
+        for field, bad_value in failed_values.items():
+            token_counter.metrics.incr("schema.fix_calls")
+            try:
+                response, cache_hit, latency = self._complete(
+                    "label_fix", model, self._build_fix_messages(review, field, bad_value), LABEL_SCHEMA_CONFIG["fix_max_tokens"]
+                )
+            except LLMCacheMissError:
+                raise
+            except Exception as e:
+                logger.warning(f"字段修复请求失败 ID: {review['review_id']}, 字段: {field}, 错误: {str(e)}")
+                continue
+            if self._apply_fix(result, field, response, model, latency, cache_hit):
+                fixed.append(field)
+        return self._finish_schema(result, failed_values, fixed)
+    
+    async def _afix_fields(self, review: Dict[str, Any], model: str, result: Dict[str, Any], failed_values: Dict[str, Any]) -> Dict[str, Any]:
+        """异步字段修复，逻辑同_fix_fields"""
+        fixed = []
+        for field, bad_value in failed_values.items():
+            token_counter.metrics.incr("schema.fix_calls")
+            try:
+                response, cache_hit, latency = await self._acomplete(
+                    "label_fix", model, self._build_fix_messages(review, field, bad_value), LABEL_SCHEMA_CONFIG["fix_max_tokens"]
+                )
+            except LLMCacheMissError:
+                raise
+            except Exception as e:
+                logger.warning(f"字段修复请求失败 ID: {review['review_id']}, 字段: {field}, 错误: {str(e)}")
+                continue
+            if self._apply_fix(result, field, response, model, latency, cache_hit):
+                fixed.append(field)
+        return self._finish_schema(result, failed_values, fixed)
     
     @api_call_with_retry(max_retries=3, initial_delay=2)
     @timer_decorator
     def analyze_review(self, review: Dict[str, Any], model: str = MODEL_CONFIG["default_model"]) -> Dict[str, Any]:
         """分析评论
         
+        输出按结果结构在本地修复，本地无法修复的字段单独请求修复，只有整个输出无法解析且修复失败时才整体重试。
+        
         Args:
             review: 评论数据
             model: 使用的模型
@@ -427,183 +999,2457 @@ class ModelService:
         Returns:
             分析结果
         """
-        review_str = review['评论']
-        product_name = review['商品名称']
         review_id = review['review_id']
         
         logger.debug(f"开始分析评论 ID: {review_id}")
         
         try:
             # 调用API
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": first_label_system_prompt()},
-                    {"role": "user", "content": first_label_user_prompt(review_str, product_name)}
-                ],
-                stream=False,
-                response_format={'type': 'json_object'}
-            )
-
-            # 获取token消耗量
-            token_usage = response.usage.total_tokens if hasattr(response, 'usage') else 0
-            prompt_tokens = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
-            completion_tokens = response.usage.completion_tokens if hasattr(response, 'usage') else 0
-            
-            # 添加到token统计
-            token_counter.add_usage(
-                tokens=token_usage,
-                model=model,
-                operation=f"analyze_review",
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens
-            )
-            
-            # 解析内容
-            content = response.choices[0].message.content
-            parsed_content = json.loads(content)
-            
-            # 补充元数据
-            parsed_content['token_usage'] = token_usage
-            parsed_content['review_id'] = review_id
-            parsed_content['analysis_time'] = datetime.now().isoformat()
-            
-            logger.info(f"成功分析评论 ID: {review_id}, 使用模型: {model}, 消耗tokens: {token_usage}")
-            return parsed_content
+            response, cache_hit, latency = self._complete("analyze_review", model, self._build_messages(review))
+            result, failed_values = self._parse_response(response, review, model, latency, cache_hit)
+            return self._fix_fields(review, model, result, failed_values)
             
         except Exception as e:
             logger.error(f"分析评论失败 ID: {review_id}, 错误: {str(e)}")
             raise
-
-###################
-# 分析服务
-###################
-
-class AnalyzerService:
-    """评论分析服务类"""
-    
-    def __init__(self, db_manager: MongoDBManager, model_service: ModelService):
-        """初始化分析服务
-        
-        Args:
-            db_manager: 数据库管理器
-            model_service: 模型服务
-        """
-        self.db_manager = db_manager
-        self.model_service = model_service
-        logger.info("评论分析服务已初始化")
     
-    @timer_decorator
-    def analyze_single_review(self, review_id: str = None, model: str = MODEL_CONFIG["default_model"]) -> Dict[str, Any]:
-        """分析单条评论
+    @async_api_call_with_retry(max_retries=3, initial_delay=2)
+    async def analyze_review_async(self, review: Dict[str, Any], model: str = MODEL_CONFIG["default_model"]) -> Dict[str, Any]:
+        """异步分析评论，结果文档与analyze_review一致
         
         Args:
-            review_id: 评论ID，如果为None则随机选择一条
+            review: 评论数据
             model: 使用的模型
             
         Returns:
             分析结果
         """
-        if review_id:
-            review = self.db_manager.find_one(
-                DB_CONFIG["collections"]["reviews"], 
-                {"review_id": review_id}
-            )
-        else:
-            # 随机选择一条评论
-            random_reviews = self.db_manager.get_random_document(
-                DB_CONFIG["collections"]["reviews"], 1
-            )
-            review = random_reviews[0] if random_reviews else None
-            
-        if not review:
-            logger.warning(f"未找到评论: ID={review_id}")
-            return None
+        review_id = review['review_id']
+        
+        logger.debug(f"开始异步分析评论 ID: {review_id}")
+        
+        try:
+            # 调用API
+            response, cache_hit, latency = await self._acomplete("analyze_review", model, self._build_messages(review))
+            result, failed_values = self._parse_response(response, review, model, latency, cache_hit)
+            return await self._afix_fields(review, model, result, failed_values)
             
-        logger.info(f"正在分析单条评论: {review.get('review_id')}")
-        result = self.model_service.analyze_review(review, model)
-        return result
-    
-    @timer_decorator
-    def analyze_reviews_batch(
-        self,
-        reviews: List[Dict[str, Any]],
-        max_workers: int = 4,
-        show_progress: bool = True,
-        model: str = MODEL_CONFIG["default_model"],
-        solution: str = EXPERIMENT_CONFIG["solution"],
-        project_code: str = EXPERIMENT_CONFIG["project_code"],
-        test_mode: bool = True
-    ) -> List[Dict[str, Any]]:
-        """批量分析评论
+        except Exception as e:
+            logger.error(f"分析评论失败 ID: {review_id}, 错误: {str(e)}")
+            raise
+
+    @staticmethod
+    def _build_packed_messages(reviews: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+        """构建多评论合并标注的对话消息
         
         Args:
             reviews: 评论数据列表
-            max_workers: 最大线程数
-            show_progress: 是否显示进度条
-            model: 使用的模型
-            solution: 解决方案
-            project_code: 项目编号
-            test_mode: 测试模式(True不存储结果/False存储结果)
             
         Returns:
-            分析结果列表
+            消息列表
         """
-        logger.info(f"开始批量分析 {len(reviews)} 条评论 (线程数: {max_workers}, 模型: {model})")
+        return [
+            {"role": "system", "content": first_label_packed_system_prompt()},
+            {"role": "user", "content": first_label_packed_user_prompt(reviews)}
+        ]
+    
+    @staticmethod
+    def _is_valid_label(item: Any) -> bool:
+        """检查单条标注结果的基本结构是否完整（字段修复失败、已置空的结果视为无效）"""
+        return (
+            isinstance(item, dict)
+            and isinstance(item.get("product_topic_result"), list)
+            and isinstance(item.get("user_profile"), dict)
+            and not (item.get("schema_repair") or {}).get("unfixed_fields")
+        )
+    
+    def _split_packed_response(self, response, reviews: List[Dict[str, Any]], model: str, 
+                               latency: float, cache_hit: bool = False) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """将合并标注的响应拆分为单条评论的分析结果
         
-        # 初始化结果列表
-        results = []
+        Args:
+            response: chat.completions响应
+            reviews: 本次请求包含的评论
+            model: 使用的模型
+            latency: 本次调用耗时（秒）
+            cache_hit: 响应是否来自LLM响应缓存（命中时不计入token消耗和调用耗时）
+            
+        Returns:
+            (成功拆分的分析结果列表, 缺失或格式错误需要单独重试的(评论, 分摊的token数)列表)
+        """
+        token_usage = self._record_usage(response, "analyze_review_packed", model, latency, cache_hit)
+        # 按评论数平摊token消耗（余数分给前几条），单独重试的评论也分得一份并计入重试结果，
+        # 保证各阶段按文档累计的token总量不变
+        base_share, remainder = divmod(token_usage, len(reviews)) if reviews else (0, 0)
+        token_shares = [base_share + (1 if i < remainder else 0) for i in range(len(reviews))]
+        
+        # 解析内容，兼容results为列表或以review_id为键的字典
+        parsed = parse_json_content(response.choices[0].message.content)
+        items = parsed.get("results", []) if isinstance(parsed, dict) else None
+        if not isinstance(items, (list, dict)):
+            logger.warning(f"合并标注响应无法解析，{len(reviews)} 条评论将单独重试")
+            return [], list(zip(reviews, token_shares))
+        if isinstance(items, dict):
+            items = [dict(item, review_id=review_id) for review_id, item in items.items() if isinstance(item, dict)]
+        items_by_id = {
+            str(item.get("review_id")): item for item in items if isinstance(item, dict)
+        }
+        
+        analysis_time = datetime.now().isoformat()
+        results, missing = [], []
+        for review, token_share in zip(reviews, token_shares):
+            review_id = review['review_id']
+            item = items_by_id.get(str(review_id))
+            if item is None:
+                missing.append((review, token_share))
+                continue
+            # 本地修复后仍有字段不符合结构的评论单独重试
+            item, repairs, failed = repair_label(item, review['评论'])
+            if failed:
+                missing.append((review, token_share))
+                continue
+            token_counter.metrics.incr("schema.checked")
+            if repairs:
+                item['schema_repair'] = {"repairs": sorted(set(repairs)), "fixed_fields": [], "unfixed_fields": []}
+                self._count_repairs(item['schema_repair']["repairs"])
+            item['token_usage'] = token_share
+            item['review_id'] = review_id
+            item['analysis_time'] = analysis_time
+            item['pack_size'] = len(reviews)
+            results.append(item)
+        
+        logger.info(f"合并标注完成: {len(results)}/{len(reviews)} 条评论, 使用模型: {model}, 消耗tokens: {token_usage}, 耗时: {latency:.2f}秒")
+        return results, missing
+    
+    @api_call_with_retry(max_retries=3, initial_delay=2)
+    def _request_packed(self, reviews: List[Dict[str, Any]], model: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """发送一次合并标注请求（API错误时整体重试）"""
+        response, cache_hit, latency = self._complete("analyze_review_packed", model, self._build_packed_messages(reviews))
+        return self._split_packed_response(response, reviews, model, latency, cache_hit)
+    
+    @async_api_call_with_retry(max_retries=3, initial_delay=2)
+    async def _request_packed_async(self, reviews: List[Dict[str, Any]], model: str) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """异步发送一次合并标注请求（API错误时整体重试）"""
+        response, cache_hit, latency = await self._acomplete(
+            "analyze_review_packed", model, self._build_packed_messages(reviews)
+        )
+        return self._split_packed_response(response, reviews, model, latency, cache_hit)
+    
+    @timer_decorator
+    def analyze_reviews_packed(self, reviews: List[Dict[str, Any]], model: str = MODEL_CONFIG["default_model"]) -> List[Dict[str, Any]]:
+        """在一次请求中合并标注多条评论，缺失或格式错误的评论单独重试
+        
+        Args:
+            reviews: 评论数据列表
+            model: 使用的模型
+            
+        Returns:
+            分析结果列表（单独重试仍失败的评论不包含在内）
+        """
+        results, missing = self._request_packed(reviews, model)
+        for review, token_share in missing:
+            try:
+                result = self.analyze_review(review, model)
+            except LLMCacheMissError:
+                raise
+            except Exception as e:
+                logger.error(f"单独重试评论失败 ID: {review['review_id']}, 错误: {str(e)}")
+                continue
+            if result:
+                # 合并请求中分摊给该评论的token计入重试结果
+                result['token_usage'] = result.get('token_usage', 0) + token_share
+                results.append(result)
+        return results
+    
+    async def analyze_reviews_packed_async(self, reviews: List[Dict[str, Any]], model: str = MODEL_CONFIG["default_model"]) -> List[Dict[str, Any]]:
+        """异步合并标注多条评论，缺失或格式错误的评论单独重试
+        
+        Args:
+            reviews: 评论数据列表
+            model: 使用的模型
+            
+        Returns:
+            分析结果列表（单独重试仍失败的评论不包含在内）
+        """
+        results, missing = await self._request_packed_async(reviews, model)
+        retried = await asyncio.gather(
+            *(self.analyze_review_async(review, model) for review, _ in missing),
+            return_exceptions=True
+        )
+        for (review, token_share), result in zip(missing, retried):
+            if isinstance(result, LLMCacheMissError):
+                raise result
+            if isinstance(result, Exception):
+                logger.error(f"单独重试评论失败 ID: {review['review_id']}, 错误: {str(result)}")
+            elif result:
+                result['token_usage'] = result.get('token_usage', 0) + token_share
+                results.append(result)
+        return results
+
+###################
+# 级联模型路由
+###################
+
+class CascadeModelService:
+    """级联模型路由：每条评论先交给最便宜的模型，结果不满足条件时升级到更强的模型
+    
+    升级条件：输出不符合结构（或调用失败）、任一话题confidence低于阈值、长评论的话题为空。
+    与ModelService接口一致，AnalyzerService无需区分；结果文档的cascade字段记录各档模型的token消耗和升级原因，
+    token_usage为各档合计。
+    """
+    
+    def __init__(self, model_service: ModelService, tiers: List[str] = None, config: Dict[str, Any] = None):
+        """初始化级联路由
+        
+        Args:
+            model_service: 实际调用模型的服务
+            tiers: 由便宜到强的模型列表，默认使用CASCADE_CONFIG["tiers"]
+            config: 配置，默认使用CASCADE_CONFIG
+        """
+        self.model_service = model_service
+        self.config = config or CASCADE_CONFIG
+        self.tiers = list(tiers or self.config["tiers"])
+        self._lock = threading.Lock()
+        self.stats = {"reviews": 0, "escalated": 0, "reasons": {}, "by_tier": {}}
+        logger.info(f"级联模型路由已启用: {' -> '.join(self.tiers)}")
+    
+    @property
+    def name(self) -> str:
+        """级联路由的名称，作为结果文档的first_label_model和标注缓存键中的模型"""
+        return "cascade:" + ">".join(self.tiers)
+    
+    async def aclose(self):
+        """关闭异步客户端"""
+        await self.model_service.aclose()
+    
+    def check(self, review: Dict[str, Any], result: Any) -> Optional[str]:
+        """检查一档模型的结果，需要升级时返回原因
+        
+        Args:
+            review: 评论数据
+            result: 分析结果
+            
+        Returns:
+            升级原因（invalid/empty_topics/low_confidence），结果可接受时返回None
+        """
+        if not ModelService._is_valid_label(result):
+            return "invalid"
+        topics = result["product_topic_result"]
+        if not topics:
+            if len(str(review.get('评论') or '')) >= self.config["long_comment_chars"]:
+                return "empty_topics"
+            return None
+        for topic in topics:
+            try:
+                confidence = float(topic.get("confidence"))
+            except (AttributeError, TypeError, ValueError):
+                return "invalid"
+            if confidence < self.config["min_confidence"]:
+                return "low_confidence"
+        return None
+    
+    def _finish(self, attempts: List[Dict[str, Any]], candidates: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        """汇总各档尝试，返回最终结果并记录统计
+        
+        最终结果取最后一个结构有效的结果（都无效时取最后一个结果）。
+        """
+        valid = [candidate for candidate in candidates if ModelService._is_valid_label(candidate[1])]
+        final_model, result = (valid or candidates)[-1]
+        tokens_by_tier = {}
+        for attempt in attempts:
+            tokens_by_tier[attempt["model"]] = tokens_by_tier.get(attempt["model"], 0) + attempt["tokens"]
+        reasons = [attempt["reason"] for attempt in attempts if attempt["reason"]]
+        if isinstance(result, dict):
+            result['token_usage'] = sum(tokens_by_tier.values())
+            result['cascade'] = {
+                "model": final_model,
+                "tier": self.tiers.index(final_model),
+                "escalated": len(attempts) > 1,
+                "reasons": reasons,
+                "tokens_by_tier": tokens_by_tier
+            }
+        
+        with self._lock:
+            self.stats["reviews"] += 1
+            self.stats["escalated"] += len(attempts) > 1
+            for reason in reasons:
+                self.stats["reasons"][reason] = self.stats["reasons"].get(reason, 0) + 1
+            for attempt in attempts:
+                tier = self.stats["by_tier"].setdefault(attempt["model"], {"calls": 0, "tokens": 0, "final": 0})
+                tier["calls"] += 1
+                tier["tokens"] += attempt["tokens"]
+            self.stats["by_tier"][final_model]["final"] += 1
+        return result
+    
+    def _attempt(self, tier: int, review: Dict[str, Any], result: Any = None, error: Exception = None) -> Dict[str, Any]:
+        """记录一档模型的尝试（调用失败时原因为error）"""
+        reason = "error" if error is not None else self.check(review, result)
+        tokens = result.get('token_usage', 0) if isinstance(result, dict) else 0
+        if reason and tier + 1 < len(self.tiers):
+            logger.debug(f"评论 {review['review_id']} 升级到 {self.tiers[tier + 1]}，原因: {reason}")
+        return {"model": self.tiers[tier], "tokens": tokens, "reason": reason}
+    
+    def _cascade(self, review: Dict[str, Any], start: int, attempts: List[Dict[str, Any]],
+                 candidates: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        """从第start档开始逐档调用，直到结果可接受或用完所有档位"""
+        for tier in range(start, len(self.tiers)):
+            if attempts and not attempts[-1]["reason"]:
+                break
+            try:
+                result = self.model_service.analyze_review(review, self.tiers[tier])
+            except LLMCacheMissError:
+                raise
+            except Exception as e:
+                attempts.append(self._attempt(tier, review, error=e))
+                if not candidates and tier + 1 == len(self.tiers):
+                    raise
+                continue
+            candidates.append((self.tiers[tier], result))
+            attempts.append(self._attempt(tier, review, result))
+        return self._finish(attempts, candidates)
+    
+    async def _acascade(self, review: Dict[str, Any], start: int, attempts: List[Dict[str, Any]],
+                        candidates: List[Tuple[str, Any]]) -> Dict[str, Any]:
+        """异步逐档调用，逻辑同_cascade"""
+        for tier in range(start, len(self.tiers)):
+            if attempts and not attempts[-1]["reason"]:
+                break
+            try:
+                result = await self.model_service.analyze_review_async(review, self.tiers[tier])
+            except LLMCacheMissError:
+                raise
+            except Exception as e:
+                attempts.append(self._attempt(tier, review, error=e))
+                if not candidates and tier + 1 == len(self.tiers):
+                    raise
+                continue
+            candidates.append((self.tiers[tier], result))
+            attempts.append(self._attempt(tier, review, result))
+        return self._finish(attempts, candidates)
+    
+    def analyze_review(self, review: Dict[str, Any], model: str = None) -> Dict[str, Any]:
+        """级联分析评论（model参数仅为与ModelService接口一致，使用的模型由tiers决定）"""
+        return self._cascade(review, 0, [], [])
+    
+    async def analyze_review_async(self, review: Dict[str, Any], model: str = None) -> Dict[str, Any]:
+        """异步级联分析评论"""
+        return await self._acascade(review, 0, [], [])
+    
+    def analyze_reviews_packed(self, reviews: List[Dict[str, Any]], model: str = None) -> List[Dict[str, Any]]:
+        """第一档合并标注，不满足条件的评论逐条升级"""
+        first = {result['review_id']: result for result in self.model_service.analyze_reviews_packed(reviews, self.tiers[0])}
+        results = []
+        for review in reviews:
+            if review['review_id'] not in first:
+                continue
+            result = first[review['review_id']]
+            results.append(self._cascade(review, 1, [self._attempt(0, review, result)], [(self.tiers[0], result)]))
+        return results
+    
+    async def analyze_reviews_packed_async(self, reviews: List[Dict[str, Any]], model: str = None) -> List[Dict[str, Any]]:
+        """异步第一档合并标注，不满足条件的评论并发逐条升级"""
+        labeled = await self.model_service.analyze_reviews_packed_async(reviews, self.tiers[0])
+        first = {result['review_id']: result for result in labeled}
+        pending = [review for review in reviews if review['review_id'] in first]
+        return list(await asyncio.gather(*(
+            self._acascade(review, 1, [self._attempt(0, review, first[review['review_id']])],
+                           [(self.tiers[0], first[review['review_id']])])
+            for review in pending
+        )))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取升级率和各档模型的调用与token统计"""
+        with self._lock:
+            stats = copy.deepcopy(self.stats)
+        stats["tiers"] = self.tiers
+        stats["escalation_rate"] = round(stats["escalated"] / stats["reviews"], 4) if stats["reviews"] else 0
+        stats["min_confidence"] = self.config["min_confidence"]
+        return stats
+
+###################
+# 结果写入
+###################
+
+class LabelStatus:
+    """评论标注状态
+    
+    在评论文档上按解决方案记录标注状态（label_status.<solution>），并建立
+    (project_code, label_status.<solution>)索引。查找未标注评论直接走索引，
+    不再把全部已处理ID拉回本地再以$nin回传。
+    """
+    
+    def __init__(self, db_manager: MongoDBManager, collection_name: str = DB_CONFIG["collections"]["reviews"]):
+        """初始化标注状态
+        
+        Args:
+            db_manager: 数据库管理器
+            collection_name: 评论集合名称
+        """
+        self.db_manager = db_manager
+        self.collection_name = collection_name
+        self._ready = set()
+        self._ready_lock = threading.Lock()
+    
+    @staticmethod
+    def field(solution: str) -> str:
+        """获取解决方案对应的状态字段名（字段名中不能包含.和$）"""
+        return f"{LABEL_STATUS_CONFIG['field_prefix']}.{solution.replace('.', '_').replace('$', '_')}"
+    
+    @staticmethod
+    def lease_field(solution: str) -> str:
+        """获取解决方案对应的租约字段名"""
+        return f"{LABEL_STATUS_CONFIG['lease_prefix']}.{solution.replace('.', '_').replace('$', '_')}"
+    
+    def pending_query(self, project_code: str, solution: str) -> Dict[str, Any]:
+        """构建未标注评论的查询条件（未标注，或租约已过期）
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            
+        Returns:
+            查询条件
+        """
+        self.ensure_ready(project_code, solution)
+        field = self.field(solution)
+        return {
+            "project_code": project_code,
+            "$or": [
+                {field: None},
+                {field: LABEL_STATUS_CONFIG["leased"], f"{self.lease_field(solution)}.expires": {"$lt": datetime.now(timezone.utc)}}
+            ]
+        }
+    
+    def ensure_ready(self, project_code: str, solution: str):
+        """创建状态索引，并根据已有分析结果补齐状态（每个进程每个项目/方案只执行一次）
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+        """
+        with self._ready_lock:
+            if (project_code, solution) in self._ready:
+                return
+            field = self.field(solution)
+            collection = self.db_manager.get_collection(self.collection_name)
+            collection.create_index([
+                ("project_code", pymongo.ASCENDING),
+                (field, pymongo.ASCENDING),
+                (f"{self.lease_field(solution)}.expires", pymongo.ASCENDING)
+            ])
+            collection.create_index([("project_code", pymongo.ASCENDING), ("review_id", pymongo.ASCENDING)])
+            self._backfill(project_code, solution)
+            self._ready.add((project_code, solution))
+    
+    def _backfill(self, project_code: str, solution: str):
+        """按分析结果补齐状态（旧数据或中断的运行）
+        
+        补齐到的分析结果_id作为水位记录在状态集合中，之后只扫描水位之后写入的分析结果，
+        每条结果只扫描一次。分析结果数与已标记评论数不一致（如结果重复、对应评论已删除）时
+        不会因此在每次启动时重新全量扫描。
+        """
+        results_collection = DB_CONFIG["collections"]["llm_results"]
+        meta = self.db_manager.get_collection(DB_CONFIG["collections"]["label_status"])
+        key = f"{project_code}|{solution}"
+        results_query = {"project_code": project_code, "solution": solution}
+        marker = meta.find_one({"_id": key})
+        if marker is not None:
+            results_query["_id"] = {"$gt": marker["backfilled_until"]}
+        else:
+            # 首次补齐：数量一致时只记录水位，不扫描
+            results_count = self.db_manager.count_documents(results_collection, results_query)
+            done_count = self.db_manager.count_documents(
+                self.collection_name, {"project_code": project_code, self.field(solution): LABEL_STATUS_CONFIG["done"]}
+            )
+            if results_count == done_count:
+                latest = self.db_manager.get_collection(results_collection).find_one(
+                    results_query, {"_id": 1}, sort=[("_id", pymongo.DESCENDING)]
+                )
+                if latest is not None:
+                    self._save_watermark(meta, key, latest["_id"])
+                return
+            logger.info(f"补齐标注状态: 分析结果 {results_count} 条，已标记评论 {done_count} 条")
+        
+        watermark = None
+        scanned = marked = 0
+        chunk = []
+        for doc in self.db_manager.iter_documents(results_collection, results_query, projection={"review_id": 1}):
+            scanned += 1
+            if watermark is None or doc["_id"] > watermark:
+                watermark = doc["_id"]
+            if doc.get("review_id"):
+                chunk.append(doc["review_id"])
+            if len(chunk) >= LABEL_STATUS_CONFIG["update_chunk_size"]:
+                marked += self.mark_done(project_code, solution, chunk)
+                chunk = []
+        if chunk:
+            marked += self.mark_done(project_code, solution, chunk)
+        if watermark is not None:
+            self._save_watermark(meta, key, watermark)
+        if marked:
+            logger.info(f"补齐标注状态: 扫描分析结果 {scanned} 条，新标记评论 {marked} 条")
+    
+    @staticmethod
+    def _save_watermark(meta, key: str, watermark: Any):
+        """记录补齐水位（只前进不后退，多个进程同时补齐时取较大值）"""
+        meta.update_one(
+            {"_id": key},
+            {"$max": {"backfilled_until": watermark}, "$set": {"updated_time": datetime.now().isoformat()}},
+            upsert=True
+        )
+    
+    def mark_done(self, project_code: str, solution: str, review_ids: List[str]) -> int:
+        """将评论标记为已标注
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            review_ids: 评论ID列表
+            
+        Returns:
+            新标记的评论数
+        """
+        field = self.field(solution)
+        collection = self.db_manager.get_collection(self.collection_name)
+        result = collection.update_many(
+            {"project_code": project_code, "review_id": {"$in": review_ids}, field: {"$ne": LABEL_STATUS_CONFIG["done"]}},
+            {"$set": {field: LABEL_STATUS_CONFIG["done"]}, "$unset": {f"{self.lease_field(solution)}.expires": ""}}
+        )
+        return result.modified_count
+    
+    def defer(self, project_code: str, solution: str, review_ids: List[str], retry_seconds: float,
+              max_attempts: int = LEASE_CONFIG["max_attempts"], worker_id: str = None) -> int:
+        """暂缓标注失败的评论：领取次数加一并写入到期时间，到期后重新出现在未标注查询中；
+        领取次数达到上限的评论标记为failed，不再领取
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            review_ids: 评论ID列表
+            retry_seconds: 暂缓时间（秒）
+            max_attempts: 最多领取次数
+            worker_id: 记录在租约上的节点标识
+            
+        Returns:
+            标记为failed的评论数
+        """
+        field = self.field(solution)
+        lease_field = self.lease_field(solution)
+        collection = self.db_manager.get_collection(self.collection_name)
+        query = {"project_code": project_code, "review_id": {"$in": review_ids}}
+        collection.update_many(
+            {**query, field: {"$ne": LABEL_STATUS_CONFIG["done"]}},
+            {
+                "$set": {
+                    field: LABEL_STATUS_CONFIG["leased"],
+                    f"{lease_field}.worker_id": worker_id,
+                    f"{lease_field}.expires": datetime.now(timezone.utc) + timedelta(seconds=retry_seconds)
+                },
+                "$inc": {f"{lease_field}.attempts": 1}
+            }
+        )
+        result = collection.update_many(
+            {**query, field: LABEL_STATUS_CONFIG["leased"], f"{lease_field}.attempts": {"$gte": max_attempts}},
+            {"$set": {field: LABEL_STATUS_CONFIG["failed"]}, "$unset": {f"{lease_field}.expires": ""}}
+        )
+        return result.modified_count
+    
+    def mark_written(self, docs: List[Dict[str, Any]]):
+        """根据写入成功的分析结果标记评论状态
+        
+        Args:
+            docs: 已写入的分析结果文档
+        """
+        groups = {}
+        for doc in docs:
+            if doc.get("review_id"):
+                groups.setdefault((doc.get("project_code"), doc.get("solution")), []).append(doc["review_id"])
+        for (project_code, solution), review_ids in groups.items():
+            if project_code and solution:
+                self.mark_done(project_code, solution, review_ids)
+
+
+class ReviewLeaseQueue:
+    """基于租约的分布式标注任务队列
+    
+    多个节点（进程）共享同一评论集合时，每个节点通过find_one_and_update原子地领取评论
+    （状态置为leased并写入worker_id和租约到期时间），后台线程定期为本节点持有的租约续约；
+    节点崩溃后租约过期，评论可被其他节点重新领取。结果写入后评论状态置为done。
+    """
+    
+    def __init__(self, label_status: LabelStatus, project_code: str, solution: str, worker_id: str = None,
+                 batch_size: int = LEASE_CONFIG["batch_size"], lease_seconds: int = LEASE_CONFIG["lease_seconds"],
+                 renew_interval: int = LEASE_CONFIG["renew_interval"], max_attempts: int = LEASE_CONFIG["max_attempts"]):
+        """初始化任务队列
+        
+        Args:
+            label_status: 标注状态
+            project_code: 项目编号
+            solution: 解决方案
+            worker_id: 节点标识，默认为主机名-进程号-随机串
+            batch_size: 每次领取的评论数
+            lease_seconds: 租约有效期（秒）
+            renew_interval: 续约间隔（秒）
+            max_attempts: 单条评论最多被领取的次数
+        """
+        self.label_status = label_status
+        self.project_code = project_code
+        self.solution = solution
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.renew_interval = renew_interval
+        self.max_attempts = max_attempts
+        self.collection = label_status.db_manager.get_collection(label_status.collection_name)
+        self.status_field = label_status.field(solution)
+        self.lease_field = label_status.lease_field(solution)
+        self._stop_event = threading.Event()
+        self._renewer = None
+        self.stats = {"claimed": 0, "reclaimed": 0, "renewals": 0, "released": 0, "failed": 0}
+    
+    def _expires(self) -> datetime:
+        """计算新的租约到期时间"""
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+    
+    def claim_one(self) -> Optional[Dict[str, Any]]:
+        """原子地领取一条未标注（或租约已过期）的评论
+        
+        Returns:
+            领取到的评论，没有可领取的评论时返回None
+        """
+        query = self.label_status.pending_query(self.project_code, self.solution)
+        query[f"{self.lease_field}.attempts"] = {"$not": {"$gte": self.max_attempts}}
+        review = self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    self.status_field: LABEL_STATUS_CONFIG["leased"],
+                    f"{self.lease_field}.worker_id": self.worker_id,
+                    f"{self.lease_field}.expires": self._expires()
+                },
+                "$inc": {f"{self.lease_field}.attempts": 1}
+            },
+            return_document=pymongo.ReturnDocument.BEFORE
+        )
+        if review is None:
+            return None
+        self.stats["claimed"] += 1
+        # 领取前状态仍为leased，说明是其他节点过期未完成的租约
+        previous_status = review.get(LABEL_STATUS_CONFIG["field_prefix"], {}).get(self.status_field.split(".", 1)[1])
+        if previous_status == LABEL_STATUS_CONFIG["leased"]:
+            self.stats["reclaimed"] += 1
+        return review
+    
+    def claim_batch(self, size: int = None) -> List[Dict[str, Any]]:
+        """领取一批评论
+        
+        Args:
+            size: 领取数量，默认为batch_size
+            
+        Returns:
+            领取到的评论列表，为空表示当前没有可领取的评论
+        """
+        batch = []
+        for _ in range(size or self.batch_size):
+            review = self.claim_one()
+            if review is None:
+                break
+            batch.append(review)
+        if batch:
+            logger.debug(f"节点 {self.worker_id} 领取 {len(batch)} 条评论")
+        return batch
+    
+    def iter_claimed(self, limit: int = 0) -> Iterator[Dict[str, Any]]:
+        """逐批领取评论，直到没有可领取的评论或达到数量上限
+        
+        Args:
+            limit: 最多领取数量，0表示不限制
+            
+        Yields:
+            领取到的评论
+        """
+        self.start()
+        claimed = 0
+        while not self._stop_event.is_set():
+            size = self.batch_size if limit <= 0 else min(self.batch_size, limit - claimed)
+            if size <= 0:
+                return
+            batch = self.claim_batch(size)
+            if not batch:
+                return
+            claimed += len(batch)
+            yield from batch
+    
+    def renew(self) -> int:
+        """为本节点持有的全部未完成租约续约
+        
+        Returns:
+            续约的评论数
+        """
+        result = self.collection.update_many(
+            {
+                "project_code": self.project_code,
+                self.status_field: LABEL_STATUS_CONFIG["leased"],
+                f"{self.lease_field}.worker_id": self.worker_id
+            },
+            {"$set": {f"{self.lease_field}.expires": self._expires()}}
+        )
+        self.stats["renewals"] += 1
+        return result.modified_count
+    
+    def _renew_periodically(self):
+        """后台线程：定期续约"""
+        while not self._stop_event.wait(self.renew_interval):
+            try:
+                self.renew()
+            except Exception as e:
+                logger.error(f"租约续约失败: {str(e)}")
+    
+    def start(self):
+        """启动续约线程"""
+        if self._renewer is None:
+            self._renewer = threading.Thread(target=self._renew_periodically, name="lease-renewer", daemon=True)
+            self._renewer.start()
+            logger.info(f"分布式标注节点已启动: {self.worker_id}")
+    
+    def release(self) -> int:
+        """释放本节点持有的全部未完成租约，使评论可立即被其他节点领取
+        
+        领取次数已达上限的评论标记为failed而不是释放，否则会回到未标注状态，被非分布式模式反复重试。
+        
+        Returns:
+            释放的评论数
+        """
+        held = {
+            "project_code": self.project_code,
+            self.status_field: LABEL_STATUS_CONFIG["leased"],
+            f"{self.lease_field}.worker_id": self.worker_id
+        }
+        failed = self.collection.update_many(
+            {**held, f"{self.lease_field}.attempts": {"$gte": self.max_attempts}},
+            {"$set": {self.status_field: LABEL_STATUS_CONFIG["failed"]}, "$unset": {f"{self.lease_field}.expires": ""}}
+        )
+        if failed.modified_count:
+            logger.warning(f"{failed.modified_count} 条评论领取 {self.max_attempts} 次仍未完成，已标记为failed")
+        result = self.collection.update_many(
+            held, {"$unset": {self.status_field: "", f"{self.lease_field}.expires": ""}}
+        )
+        self.stats["failed"] += failed.modified_count
+        self.stats["released"] += result.modified_count
+        return result.modified_count
+    
+    def close(self):
+        """停止续约并释放未完成的租约（需在结果写入完成后调用）"""
+        self._stop_event.set()
+        if self._renewer is not None:
+            self._renewer.join(timeout=5)
+            self._renewer = None
+        self.release()
+        token_counter.set_section("lease_queue", {"worker_id": self.worker_id, **self.stats})
+        logger.info(f"节点 {self.worker_id} 已退出: {self.stats}")
+
+
+class BufferedResultWriter:
+    """缓冲批量写入分析结果
+    
+    结果先放入内存缓冲区，按数量或时间间隔以无序bulk_write批量写入，
+    以(project_code, solution, review_id)为唯一键覆盖写入，重复运行结果幂等。
+    """
+    
+    def __init__(self, db_manager: MongoDBManager, collection_name: str = DB_CONFIG["collections"]["llm_results"],
+                 batch_size: int = WRITER_CONFIG["batch_size"], flush_interval: float = WRITER_CONFIG["flush_interval"],
+                 key_fields: List[str] = None, label_status: Optional[LabelStatus] = None):
+        """初始化写入器
+        
+        Args:
+            db_manager: 数据库管理器
+            collection_name: 结果集合名称
+            batch_size: 缓冲文档数达到该值时立即写入
+            flush_interval: 后台定时写入间隔（秒）
+            key_fields: 唯一键字段列表
+            label_status: 标注状态，写入成功后标记对应评论为已标注，None表示不标记
+        """
+        self.db_manager = db_manager
+        self.label_status = label_status
+        self.collection_name = collection_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.key_fields = key_fields or WRITER_CONFIG["key_fields"]
+        self._buffer = []
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flusher = None
+        self.stats = {"written": 0, "failed": 0, "flushes": 0, "write_seconds": 0.0}
+        self._ensure_index()
+    
+    def _ensure_index(self):
+        """创建唯一键索引，已有重复数据时退化为普通索引"""
+        collection = self.db_manager.get_collection(self.collection_name)
+        keys = [(field, pymongo.ASCENDING) for field in self.key_fields]
+        try:
+            collection.create_index(keys, unique=True, name="result_key_unique")
+        except OperationFailure as e:
+            logger.warning(f"无法创建唯一索引（可能已存在重复结果），改用普通索引: {str(e)}")
+            collection.create_index(keys, name="result_key")
+    
+    def _start_flusher(self):
+        """启动后台定时写入线程（首次写入时启动）"""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_periodically, name="result-writer", daemon=True)
+            self._flusher.start()
+    
+    def _flush_periodically(self):
+        """后台线程：按时间间隔写入缓冲区"""
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"定时写入分析结果失败: {str(e)}")
+    
+    def add(self, doc: Dict[str, Any]):
+        """添加一条待写入的结果，缓冲区满时立即写入
+        
+        Args:
+            doc: 分析结果文档
+        """
+        with self._buffer_lock:
+            self._buffer.append(doc)
+            should_flush = len(self._buffer) >= self.batch_size
+        self._start_flusher()
+        if should_flush:
+            self.flush()
+    
+    def flush(self) -> int:
+        """写入缓冲区中的全部结果
+        
+        Returns:
+            本次写入的文档数
+        """
+        with self._flush_lock:
+            with self._buffer_lock:
+                batch, self._buffer = self._buffer, []
+            if not batch:
+                return 0
+            write_start = time.perf_counter()
+            result = self.db_manager.bulk_upsert(self.collection_name, batch, self.key_fields)
+            self.stats["write_seconds"] += time.perf_counter() - write_start
+            self.stats["written"] += len(batch) - result["failed"]
+            self.stats["failed"] += result["failed"]
+            self.stats["flushes"] += 1
+            if self.label_status is not None:
+                failed = set(result["failed_indexes"])
+                self.label_status.mark_written([doc for i, doc in enumerate(batch) if i not in failed])
+            logger.debug(f"批量写入 {len(batch)} 条分析结果")
+            return len(batch)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取写入统计"""
+        stats = dict(self.stats)
+        stats["write_seconds"] = round(stats["write_seconds"], 3)
+        return stats
+    
+    def close(self):
+        """停止后台线程并写入剩余结果"""
+        self._stop_event.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+            self._flusher = None
+        self.flush()
+        token_counter.set_section("result_writer", self.get_stats())
+        logger.info(f"分析结果写入完成: {self.get_stats()}")
+
+###################
+# 规则预过滤
+###################
+
+class ReviewPrefilter:
+    """规则预过滤：过短、纯表情/符号、平台默认文案等评论不调用模型，直接生成确定的空标注结果；
+    只有笼统好评的短评生成一条整体好评话题"""
+    
+    # 非有效字符（表情、标点、空白等），有效字符为中日韩文字、字母和数字
+    NOISE_PATTERN = re.compile(r"[^\w\u4e00-\u9fff]|_", re.UNICODE)
+    
+    def __init__(self, config: Dict[str, Any] = None):
+        """初始化预过滤规则
+        
+        Args:
+            config: 预过滤配置，默认使用PREFILTER_CONFIG
+        """
+        config = config or PREFILTER_CONFIG
+        self.min_length = config["min_length"]
+        self.boilerplate = {self.NOISE_PATTERN.sub("", phrase) for phrase in config["boilerplate_phrases"]}
+        self.regex_rules = [re.compile(rule) for rule in config["regex_rules"]]
+        self.generic_rules = {
+            name: (re.compile(rule["regex"]), rule["polarity"]) for name, rule in config["generic_sentiment_rules"].items()
+        }
+        self.generic_topic = config["generic_topic"]
+    
+    def match(self, comment: str) -> Optional[str]:
+        """判断评论是否命中预过滤规则
+        
+        Args:
+            comment: 评论文本
+            
+        Returns:
+            命中的规则名称（length、boilerplate、generic_positive、generic_negative、regex:<序号>），未命中返回None
+        """
+        text = unicodedata.normalize("NFKC", str(comment or "")).strip()
+        core = self.NOISE_PATTERN.sub("", text)
+        for name, (rule, _) in self.generic_rules.items():
+            if rule.match(text):
+                return name
+        if len(core) < self.min_length:
+            return "length"
+        if core in self.boilerplate:
+            return "boilerplate"
+        for i, rule in enumerate(self.regex_rules):
+            if rule.match(text):
+                return f"regex:{i}"
+        return None
+    
+    def make_result(self, review: Dict[str, Any], rule: str) -> Dict[str, Any]:
+        """生成预过滤命中评论的标注结果（与模型输出结构相同）
+
+        笼统好评/差评生成一条对应极性的整体评价话题，其余规则的标注为空。
+        """
+        topics = []
+        if rule in self.generic_rules:
+            topics.append({
+                "topic": self.generic_topic,
+                "polarity": self.generic_rules[rule][1],
+                "confidence": 1.0,
+                "related_text": str(review.get('评论') or "").strip()
+            })
+        return {
+            "comment": review.get('评论', ''),
+            "product_topic_result": topics,
+            "keyphrases": [],
+            "user_profile": {field: "" for field in FIRST_LABEL_PROFILE_FIELDS},
+            "token_usage": 0,
+            "review_id": review['review_id'],
+            "analysis_time": datetime.now().isoformat(),
+            "label_source": "prefilter",
+            "prefilter_rule": rule
+        }
+    
+    def apply(self, reviews: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """对一批评论进行预过滤
+        
+        Args:
+            reviews: 评论数据列表
+            
+        Returns:
+            (命中规则的评论的标注结果, 未命中需继续处理的评论)
+        """
+        results, remaining = [], []
+        hits_by_rule = {}
+        for review in reviews:
+            rule = self.match(review.get('评论'))
+            if rule is None:
+                remaining.append(review)
+            else:
+                results.append(self.make_result(review, rule))
+                hits_by_rule[rule] = hits_by_rule.get(rule, 0) + 1
+        token_counter.add_prefilter_result(len(reviews), hits_by_rule)
+        return results, remaining
+
+
+###################
+# 标注缓存
+###################
+
+class LabelCache:
+    """基于评论内容寻址的标注缓存
+    
+    以归一化评论文本、商品名称、模型和prompt版本的哈希为键，持久化保存标注结果，
+    "好评"、"默认好评"等重复评论只需调用一次大模型。
+    """
+    
+    # 缓存中保存的标注字段
+    LABEL_FIELDS = ("comment", "product_topic_result", "keyphrases", "user_profile")
+    
+    def __init__(self, db_manager: MongoDBManager, collection_name: str = DB_CONFIG["collections"]["label_cache"]):
+        """初始化标注缓存
+        
+        Args:
+            db_manager: 数据库管理器
+            collection_name: 缓存集合名称
+        """
+        self.db_manager = db_manager
+        self.collection_name = collection_name
+        self.prompt_version = first_label_prompt_version()
+        self.db_manager.get_collection(collection_name).create_index("cache_key", unique=True)
+        logger.info(f"标注缓存已初始化: {collection_name} (prompt版本: {self.prompt_version})")
+    
+    @staticmethod
+    def normalize_comment(text: Any) -> str:
+        """归一化评论文本：全半角统一、去除首尾及连续空白、英文小写"""
+        text = unicodedata.normalize("NFKC", str(text or ""))
+        return " ".join(text.split()).lower()
+    
+    def make_key(self, review: Dict[str, Any], model: str) -> str:
+        """计算评论的缓存键
+        
+        Args:
+            review: 评论数据
+            model: 使用的模型
+            
+        Returns:
+            缓存键（sha256十六进制字符串）
+        """
+        payload = json.dumps([
+            self.normalize_comment(review.get('评论')),
+            str(review.get('商品名称') or "").strip(),
+            model,
+            self.prompt_version
+        ], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+    
+    def get_many(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        """批量查询缓存
+        
+        Args:
+            keys: 缓存键列表
+            
+        Returns:
+            命中的缓存文档，键为缓存键
+        """
+        collection = self.db_manager.get_collection(self.collection_name)
+        chunk_size = LABEL_CACHE_CONFIG["lookup_chunk_size"]
+        found = {}
+        for i in range(0, len(keys), chunk_size):
+            for doc in collection.find({"cache_key": {"$in": keys[i:i + chunk_size]}}):
+                found[doc["cache_key"]] = doc
+        return found
+    
+    def put(self, key: str, result: Dict[str, Any], model: str):
+        """写入缓存，已存在的键保持不变
+        
+        Args:
+            key: 缓存键
+            result: 模型返回的分析结果
+            model: 使用的模型
+        """
+        entry = {field: result.get(field) for field in self.LABEL_FIELDS}
+        entry.update({
+            "cache_key": key,
+            "model": model,
+            "prompt_version": self.prompt_version,
+            "source_review_id": result.get("review_id"),
+            "source_token_usage": result.get("token_usage", 0),
+            "created_time": datetime.now().isoformat()
+        })
+        self.db_manager.get_collection(self.collection_name).update_one(
+            {"cache_key": key}, {"$setOnInsert": entry}, upsert=True
+        )
+    
+    @classmethod
+    def materialize(cls, cached: Dict[str, Any], review: Dict[str, Any], key: str) -> Dict[str, Any]:
+        """由缓存内容生成指定评论的分析结果
+        
+        Args:
+            cached: 缓存文档或同内容评论的分析结果
+            review: 目标评论
+            key: 缓存键
+            
+        Returns:
+            分析结果，token消耗记为0
+        """
+        result = copy.deepcopy({field: cached.get(field) for field in cls.LABEL_FIELDS})
+        result['token_usage'] = 0
+        result['review_id'] = review['review_id']
+        result['analysis_time'] = datetime.now().isoformat()
+        result['label_source'] = "label_cache"
+        result['cache_key'] = key
+        return result
+
+###################
+# 分层抽样
+###################
+
+def review_hash(review_id: Any) -> int:
+    """由review_id计算稳定的31位哈希值（与进程、运行无关）"""
+    digest = hashlib.sha1(str(review_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "big") & 0x7FFFFFFF
+
+
+def review_hash_key(review: Dict[str, Any]) -> Any:
+    """计算review_hash所用的键：review_id，缺失时退回文档_id（同一文档始终得到同一个值）"""
+    review_id = review.get("review_id")
+    return review_id if review_id is not None else f"_id:{review['_id']}"
+
+
+# 已创建review_hash索引的(集合, 项目编号)
+_review_hash_indexed = set()
+
+
+def ensure_review_hash(db_manager: MongoDBManager, project_code: str,
+                       collection_name: str = DB_CONFIG["collections"]["reviews"]) -> int:
+    """为缺少review_hash的评论补齐哈希值（每条评论只计算一次，多个进程同时补齐结果相同）
+
+    查询走(project_code, review_hash)索引，没有新评论时只是一次空的索引查找，可在每次取评论前调用。
+
+    Args:
+        db_manager: 数据库管理器
+        project_code: 项目编号
+        collection_name: 评论集合名称
+
+    Returns:
+        补齐的评论数
+    """
+    hash_field = SAMPLING_CONFIG["hash_field"]
+    collection = db_manager.get_collection(collection_name)
+    if (collection_name, project_code) not in _review_hash_indexed:
+        collection.create_index([("project_code", pymongo.ASCENDING), (hash_field, pymongo.ASCENDING)])
+        _review_hash_indexed.add((collection_name, project_code))
+    updates = []
+    updated = 0
+    for doc in db_manager.iter_documents(
+        collection_name, {"project_code": project_code, hash_field: None}, projection={"review_id": 1}
+    ):
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": {hash_field: review_hash(review_hash_key(doc))}}))
+        if len(updates) >= LABEL_STATUS_CONFIG["update_chunk_size"]:
+            updated += collection.bulk_write(updates, ordered=False).modified_count
+            updates = []
+    if updates:
+        updated += collection.bulk_write(updates, ordered=False).modified_count
+    if updated:
+        logger.info(f"已为 {updated} 条评论补齐{hash_field}")
+    return updated
+
+
+class StratifiedSampler:
+    """分层抽样：按平台、店铺、SKU、评论月份和评论长度分层，每层按比例抽取评论
+
+    抽样在MongoDB端完成（$setWindowFields，需MongoDB 5.0+）：每层按种子化的排序键取前n条，
+    相当于每层一次可复现的$sample（$sample本身不支持种子）。排序键由评论上预先计算的
+    review_hash与种子散列得到，相同种子与数据得到相同样本，不同种子得到不同样本。
+    每条样本记录所在层、层大小、层样本数和抽样权重（层大小/层样本数），
+    第三阶段按权重加权统计即可得到全量的无偏估计。
+    """
+
+    def __init__(self, db_manager: MongoDBManager, label_status: LabelStatus, rate: float = SAMPLING_CONFIG["default_rate"],
+                 seed: int = SAMPLING_CONFIG["default_seed"], min_per_stratum: int = SAMPLING_CONFIG["min_per_stratum"],
+                 collection_name: str = DB_CONFIG["collections"]["reviews"]):
+        """初始化分层抽样
+
+        Args:
+            db_manager: 数据库管理器
+            label_status: 标注状态（只返回样本中未标注的评论）
+            rate: 抽样比例，0-1
+            seed: 随机种子
+            min_per_stratum: 每层最少抽取的评论数
+            collection_name: 评论集合名称
+        """
+        if not 0 < rate <= 1:
+            raise ValueError(f"抽样比例需在(0, 1]之间: {rate}")
+        self.db_manager = db_manager
+        self.label_status = label_status
+        self.rate = rate
+        self.seed = seed
+        self.min_per_stratum = max(1, min_per_stratum)
+        self.collection_name = collection_name
+
+    def ensure_review_hash(self, project_code: str) -> int:
+        """为缺少review_hash的评论补齐哈希值（每条评论只计算一次）"""
+        return ensure_review_hash(self.db_manager, project_code, self.collection_name)
+
+    @staticmethod
+    def stratum_expression() -> Dict[str, Any]:
+        """各分层维度的聚合表达式"""
+        time_field = f"${SAMPLING_CONFIG['time_field']}"
+        comment_length = {"$strLenCP": {"$toString": {"$ifNull": [f"${SAMPLING_CONFIG['comment_field']}", ""]}}}
+        boundaries = SAMPLING_CONFIG["length_buckets"]
+        branches = []
+        lower = 0
+        for upper in boundaries:
+            branches.append({"case": {"$lt": [comment_length, upper]}, "then": f"{lower}-{upper - 1}"})
+            lower = upper
+
+        stratum = {field: {"$ifNull": [f"${field}", ""]} for field in SAMPLING_CONFIG["strata_fields"]}
+        # 评论时间可能是日期类型，也可能是"2025-04-10"形式的字符串
+        stratum["month"] = {"$cond": [
+            {"$eq": [{"$type": time_field}, "date"]},
+            {"$dateToString": {"format": "%Y-%m", "date": time_field}},
+            {"$substrCP": [{"$toString": {"$ifNull": [time_field, ""]}}, 0, 7]}
+        ]}
+        stratum["length_bucket"] = {"$switch": {"branches": branches, "default": f"{lower}+"}}
+        return stratum
+
+    def sort_key_expression(self) -> Dict[str, Any]:
+        """种子化的排序键：review_hash与种子经两轮乘法散列（模2^31-1），各值均在double精确范围内"""
+        modulus = SAMPLING_CONFIG["hash_modulus"]
+        seed = self.seed % modulus
+        first = {"$mod": [{"$multiply": [{"$add": [f"${SAMPLING_CONFIG['hash_field']}", seed]}, 48271]}, modulus]}
+        return {"$mod": [{"$multiply": [{"$add": [first, seed]}, 69621]}, modulus]}
+
+    def sample(self, project_code: str, solution: str, extra_query: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """抽取分层样本
+
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            extra_query: 附加的筛选条件（如哈希分片），各层在筛选后的评论中抽样
+
+        Returns:
+            样本评论列表，每条评论的sampling字段记录所在层和抽样权重
+        """
+        self.ensure_review_hash(project_code)
+        # 分层和权重按项目内全部评论计算，样本固定（由种子决定），只返回样本中仍未标注的评论，
+        # 中断后续跑或追加评论后，已标注与新标注的样本权重口径一致
+        pipeline = [
+            {"$match": {"project_code": project_code, **(extra_query or {})}},
+            {"$addFields": {"_stratum": self.stratum_expression(), "_sample_key": self.sort_key_expression()}},
+            {"$setWindowFields": {
+                "partitionBy": "$_stratum",
+                "sortBy": {"_sample_key": 1},
+                "output": {
+                    "_rank": {"$documentNumber": {}},
+                    "_stratum_size": {"$count": {}}
+                }
+            }},
+            {"$addFields": {"_stratum_quota": {"$min": [
+                "$_stratum_size",
+                {"$max": [self.min_per_stratum, {"$ceil": {"$multiply": ["$_stratum_size", self.rate]}}]}
+            ]}}},
+            {"$match": {"$expr": {"$lte": ["$_rank", "$_stratum_quota"]}}},
+            {"$match": self.label_status.pending_query(project_code, solution)},
+            {"$addFields": {"sampling": {
+                "stratum": "$_stratum",
+                "stratum_size": "$_stratum_size",
+                "stratum_sample_size": "$_stratum_quota",
+                "weight": {"$divide": ["$_stratum_size", "$_stratum_quota"]},
+                "rate": self.rate,
+                "seed": self.seed
+            }}},
+            {"$project": {"_stratum": 0, "_sample_key": 0, "_rank": 0, "_stratum_size": 0, "_stratum_quota": 0}}
+        ]
+        collection = self.db_manager.get_collection(self.collection_name)
+        reviews = list(collection.aggregate(pipeline, allowDiskUse=True))
+
+        strata = {}
+        for review in reviews:
+            review["sampling"]["weight"] = round(review["sampling"]["weight"], 6)
+            strata[json.dumps(review["sampling"]["stratum"], ensure_ascii=False, sort_keys=True, default=str)] = review["sampling"]["stratum_size"]
+        population = sum(strata.values())
+        logger.info(f"分层抽样完成: 样本所在层共 {population} 条评论，分为 {len(strata)} 层，待标注样本 {len(reviews)} 条 "
+                    f"(比例: {self.rate}, 种子: {self.seed})")
+        token_counter.set_section("sampling", {
+            "rate": self.rate,
+            "seed": self.seed,
+            "population": population,
+            "strata": len(strata),
+            "sample_size": len(reviews)
+        })
+        return reviews
+
+###################
+# 哈希分片
+###################
+
+class ReviewShard:
+    """评论哈希分片：review_hash % count == index的评论属于第index片（index从0开始）
+
+    分片条件作为查询条件下推到MongoDB，N个进程分别使用0/N到N-1/N，互不协调即可恰好覆盖项目内的全部评论。
+    """
+
+    def __init__(self, index: int, count: int):
+        """初始化分片
+
+        Args:
+            index: 分片序号，0到count-1
+            count: 分片总数
+        """
+        if count < 1 or not 0 <= index < count:
+            raise ValueError(f"分片序号需满足0 <= i < N: {index}/{count}")
+        self.index = index
+        self.count = count
+
+    @classmethod
+    def parse(cls, spec: str) -> "ReviewShard":
+        """解析"i/N"格式的分片参数"""
+        try:
+            index, count = (int(part) for part in spec.split("/"))
+        except ValueError:
+            raise ValueError(f"分片参数格式应为i/N，如0/4: {spec}")
+        return cls(index, count)
+
+    @property
+    def name(self) -> str:
+        """分片名称，如0/4"""
+        return f"{self.index}/{self.count}"
+
+    def contains(self, review: Dict[str, Any]) -> bool:
+        """评论是否属于本分片"""
+        return review_hash(review_hash_key(review)) % self.count == self.index
+
+    def query(self, db_manager: MongoDBManager, project_code: str) -> Dict[str, Any]:
+        """分片的查询条件；每次调用前为项目内缺少review_hash的评论（如启动后新写入的评论）补齐哈希值
+
+        Args:
+            db_manager: 数据库管理器
+            project_code: 项目编号
+
+        Returns:
+            查询条件，与其他条件合并使用
+        """
+        ensure_review_hash(db_manager, project_code)
+        return {SAMPLING_CONFIG["hash_field"]: {"$mod": [self.count, self.index]}}
+
+    def report_file(self, project_code: str) -> str:
+        """本分片的Token使用报告文件"""
+        return TOKEN_CONFIG["shard_report_file"].format(project_code=project_code, index=self.index, count=self.count)
+
+
+def merge_shard_reports(report_files: List[str], project_code: str) -> Dict[str, Any]:
+    """合并各分片的Token使用报告为项目报告
+
+    token、调用次数、缓存与预过滤等计数按分片求和（比例重新计算），成本按合并后的各模型用量重新计算，
+    耗时取最早开始到最晚结束；延迟分位数无法合并，保留在各分片的摘要中。
+
+    Args:
+        report_files: 分片报告文件列表
+        project_code: 项目编号
+
+    Returns:
+        项目报告，shards字段为各分片摘要，missing_shards为缺少报告的分片
+    """
+    reports = []
+    for report_file in report_files:
+        with open(report_file, "r", encoding="utf-8") as f:
+            reports.append((report_file, json.load(f)))
+    if not reports:
+        raise ValueError("没有可合并的分片报告")
+
+    def add_into(target: Dict[str, Any], source: Dict[str, Any]):
+        """按键累加数值（嵌套字典递归累加）"""
+        for key, value in (source or {}).items():
+            if isinstance(value, dict):
+                add_into(target.setdefault(key, {}), value)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                target[key] = target.get(key, 0) + value
+
+    merged = {"total_tokens": 0, "call_count": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    summed = {}
+    counts, seen, shards = set(), [], []
+    for report_file, report in reports:
+        for field in merged:
+            merged[field] += report.get(field, 0)
+        usage_by_model = report.get("usage_by_model") or {
+            model: {"total_tokens": tokens} for model, tokens in report.get("tokens_by_model", {}).items()
+        }
+        add_into(summed, {
+            "tokens_by_model": report.get("tokens_by_model"),
+            "tokens_by_operation": report.get("tokens_by_operation"),
+            "usage_by_model": usage_by_model,
+            "retries": report.get("retries"),
+            "errors": report.get("errors"),
+            "label_cache": report.get("label_cache"),
+            "prefilter": report.get("prefilter"),
+            "near_duplicate": report.get("near_duplicate"),
+            "schema": report.get("schema"),
+            "throughput": {"review_count": (report.get("throughput") or {}).get("review_count", 0)}
+        })
+        shard = report.get("shard") or {}
+        counts.add(shard.get("count"))
+        seen.append(shard.get("index"))
+        shards.append({
+            "shard": shard.get("name"),
+            "report_file": report_file,
+            "total_tokens": report.get("total_tokens", 0),
+            "call_count": report.get("call_count", 0),
+            "duration_seconds": report.get("duration_seconds", 0),
+            "throughput": report.get("throughput"),
+            "latency_stats": report.get("latency_stats")
+        })
+
+    # 比例字段按合并后的计数重新计算
+    label_cache = summed.get("label_cache", {})
+    if label_cache:
+        lookups = label_cache.get("hits", 0) + label_cache.get("misses", 0)
+        label_cache["hit_rate"] = round(label_cache.get("hits", 0) / lookups, 4) if lookups > 0 else 0
+    prefilter = summed.get("prefilter", {})
+    if prefilter:
+        prefilter["hit_rate"] = round(prefilter.get("hits", 0) / prefilter["checked"], 4) if prefilter.get("checked") else 0
+    near_duplicate = summed.get("near_duplicate", {})
+    if near_duplicate:
+        near_duplicate["reuse_rate"] = round(near_duplicate.get("hits", 0) / near_duplicate["checked"], 4) \
+            if near_duplicate.get("checked") else 0
+    schema = summed.get("schema", {})
+    if schema:
+        schema["repair_rate"] = round(schema.get("repaired", 0) / schema["checked"], 4) if schema.get("checked") else 0
+
+    start_time = min(report["start_time"] for _, report in reports)
+    end_time = max(report["end_time"] for _, report in reports)
+    duration = (datetime.fromisoformat(end_time) - datetime.fromisoformat(start_time)).total_seconds()
+    review_count = summed["throughput"]["review_count"]
+    count = next(iter(counts)) if len(counts) == 1 else None
+    missing = sorted(set(range(count)) - set(seen)) if isinstance(count, int) else []
+    duplicated = sorted({index for index in seen if seen.count(index) > 1})
+    if len(counts) != 1 or None in counts:
+        logger.warning(f"分片报告的分片总数不一致或缺少分片信息: {sorted(counts, key=str)}")
+    if missing or duplicated:
+        logger.warning(f"分片报告不完整: 缺少分片 {missing}，重复分片 {duplicated}")
+
+    return {
+        **merged,
+        "average_tokens_per_call": round(merged["total_tokens"] / merged["call_count"] if merged["call_count"] > 0 else 0, 1),
+        "tokens_by_model": summed.get("tokens_by_model", {}),
+        "tokens_by_operation": summed.get("tokens_by_operation", {}),
+        "usage_by_model": summed.get("usage_by_model", {}),
+        "duration_seconds": round(duration, 6),
+        "start_time": start_time,
+        "end_time": end_time,
+        "report_time": datetime.now().isoformat(),
+        "project_code": project_code,
+        "retries": summed.get("retries", {}),
+        "errors": summed.get("errors", {}),
+        "throughput": {
+            "review_count": review_count,
+            "duration_seconds": round(duration, 3),
+            "reviews_per_second": round(review_count / duration, 2) if duration > 0 else 0
+        },
+        "label_cache": label_cache,
+        "prefilter": prefilter,
+        "near_duplicate": near_duplicate,
+        "schema": schema,
+        "shard_count": count,
+        "missing_shards": missing,
+        "duplicated_shards": duplicated,
+        "shards": shards,
+        "cost_estimate": usage_cost(summed.get("usage_by_model", {}))
+    }
+
+###################
+# 持续标注
+###################
+
+class ReviewFollower:
+    """持续监听评论集合中新写入的评论，按微批交给分析服务
+
+    启动时先按插入时间顺序处理已积压的未标注评论，之后：
+    - change stream模式（MongoDB副本集）：监听insert事件，攒够batch_size条或等待max_wait秒后处理一批
+    - 轮询模式：按插入时间字段（有索引）查询晚于当前位置的未标注评论，不再全量扫描
+    两种模式都定期补扫插入时间早于当前位置的未标注评论。标注失败的评论通过标注状态的租约字段暂缓
+    retry_delay秒后重试，达到最多领取次数后标记为failed，不在内存中记录排除列表。
+    测试模式下结果不写库、评论始终为未标注状态，因此只按当前位置向后取评论，不做补扫。
+    记录积压数量（未标注评论数）和标注延迟（评论写入到结果写入的时间）。
+    """
+
+    def __init__(self, db_manager: MongoDBManager, label_status: LabelStatus, project_code: str, solution: str,
+                 mode: str = FOLLOW_CONFIG["default_mode"], shard: Optional[ReviewShard] = None,
+                 config: Dict[str, Any] = None, collection_name: str = DB_CONFIG["collections"]["reviews"],
+                 test_mode: bool = False):
+        """初始化监听器
+
+        Args:
+            db_manager: 数据库管理器
+            label_status: 标注状态
+            project_code: 项目编号
+            solution: 解决方案
+            mode: 监听方式，auto|change_stream|poll
+            shard: 哈希分片，None表示监听全部评论
+            config: 配置，默认使用FOLLOW_CONFIG
+            collection_name: 评论集合名称
+            test_mode: 测试模式（结果不写库，不补扫、不记录失败评论的状态）
+        """
+        if mode not in FOLLOW_CONFIG["modes"]:
+            raise ValueError(f"未知的监听方式: {mode}，可选: {FOLLOW_CONFIG['modes']}")
+        self.db_manager = db_manager
+        self.label_status = label_status
+        self.project_code = project_code
+        self.solution = solution
+        self.mode = mode
+        self.shard = shard
+        self.config = config or FOLLOW_CONFIG
+        self.collection = db_manager.get_collection(collection_name)
+        self.timestamp_field = self.config["timestamp_field"]
+        self.test_mode = test_mode
+        self.worker_id = f"follow-{socket.gethostname()}-{os.getpid()}"
+        self.position = None  # 已领取评论的最大插入时间
+        self.lag = LatencyHistogram()
+        self.stats = {"mode": None, "batches": 0, "reviews": 0, "succeeded": 0, "failed": 0, "gave_up": 0,
+                      "swept": 0, "backlog": None}
+
+    def _query(self, extra: Dict[str, Any] = None) -> Dict[str, Any]:
+        """未标注评论的查询条件（叠加分片和附加条件；暂缓重试的评论由标注状态排除）"""
+        query = self.label_status.pending_query(self.project_code, self.solution)
+        if self.shard is not None:
+            query.update(self.shard.query(self.db_manager, self.project_code))
+        query.update(extra or {})
+        return query
+
+    def _fetch(self, extra: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """按插入时间顺序取一批未标注评论，并推进当前位置"""
+        reviews = list(
+            self.collection.find(self._query(extra)).sort(self.timestamp_field, 1).limit(self.config["batch_size"])
+        )
+        positions = [review[self.timestamp_field] for review in reviews if review.get(self.timestamp_field) is not None]
+        if positions and (self.position is None or max(positions) > self.position):
+            self.position = max(positions)
+        return reviews
+
+    def _poll(self) -> List[Dict[str, Any]]:
+        """取插入时间晚于当前位置的未标注评论"""
+        return self._fetch({self.timestamp_field: {"$gt": self.position}} if self.position is not None else None)
+
+    def _sweep(self) -> List[Dict[str, Any]]:
+        """补扫插入时间不晚于当前位置的未标注评论（测试模式下已处理的评论仍为未标注，不补扫）"""
+        if self.position is None or self.test_mode:
+            return []
+        reviews = self._fetch({self.timestamp_field: {"$lte": self.position}})
+        if reviews:
+            self.stats["swept"] += len(reviews)
+            logger.info(f"补扫到 {len(reviews)} 条晚到的未标注评论")
+        return reviews
+
+    def _open_change_stream(self):
+        """打开insert事件的change stream，不支持时（非副本集）返回None"""
+        try:
+            return self.collection.watch(
+                [{"$match": {"operationType": "insert", "fullDocument.project_code": self.project_code}}],
+                max_await_time_ms=int(self.config["max_wait"] * 1000)
+            )
+        except PyMongoError as e:
+            if self.mode == "change_stream":
+                raise
+            logger.info(f"change stream不可用，改为轮询{self.timestamp_field}: {str(e)}")
+            return None
+
+    def _collect_changes(self, stream) -> List[Dict[str, Any]]:
+        """从change stream攒一个微批：达到batch_size条或等待max_wait秒，返回其中仍未标注的评论"""
+        ids = []
+        deadline = time.monotonic() + self.config["max_wait"]
+        while len(ids) < self.config["batch_size"] and time.monotonic() < deadline:
+            change = stream.try_next()
+            if change is not None:
+                ids.append(change["documentKey"]["_id"])
+        if not ids:
+            return []
+        return self._fetch({"_id": {"$in": ids}})
+
+    def batches(self) -> Iterator[List[Dict[str, Any]]]:
+        """持续产生待标注的评论微批（空闲时产生空列表，便于调用方定期输出统计）"""
+        self.collection.create_index([("project_code", 1), (self.timestamp_field, 1)])
+        stream = self._open_change_stream() if self.mode != "poll" else None
+        self.stats["mode"] = "change_stream" if stream is not None else "poll"
+        logger.info(f"开始监听新评论: 方式={self.stats['mode']}, 项目编号={self.project_code}, 方案={self.solution}")
+        try:
+            # 先处理启动时已积压的评论（change stream已打开，期间写入的评论不会遗漏）
+            while True:
+                reviews = self._poll()
+                if not reviews:
+                    break
+                yield reviews
+
+            next_sweep = time.monotonic() + self.config["sweep_interval"]
+            while True:
+                if stream is not None:
+                    reviews = self._collect_changes(stream)
+                else:
+                    reviews = self._poll()
+                    if not reviews:
+                        time.sleep(self.config["poll_interval"])
+                if time.monotonic() >= next_sweep:
+                    seen = {review["_id"] for review in reviews}
+                    reviews += [review for review in self._sweep() if review["_id"] not in seen]
+                    next_sweep = time.monotonic() + self.config["sweep_interval"]
+                yield reviews
+        finally:
+            if stream is not None:
+                stream.close()
+
+    def inserted_at(self, review: Dict[str, Any]) -> Optional[datetime]:
+        """评论的写入时间（UTC），取不到时返回None"""
+        value = review.get(self.timestamp_field)
+        if isinstance(value, ObjectId):
+            return value.generation_time
+        if isinstance(value, datetime):
+            return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return None
+
+    def record(self, reviews: List[Dict[str, Any]], results: List[Dict[str, Any]]):
+        """记录一个微批的处理结果和标注延迟，标注失败的评论暂缓重试
+
+        Args:
+            reviews: 本批评论
+            results: 本批的分析结果
+        """
+        done = {result.get("review_id") for result in results}
+        now = datetime.now(timezone.utc)
+        failed = []
+        for review in reviews:
+            review_id = review.get("review_id")
+            if review_id not in done:
+                failed.append(review_id)
+                continue
+            self.stats["succeeded"] += 1
+            inserted = self.inserted_at(review)
+            if inserted is not None:
+                self.lag.add(max(0.0, (now - inserted).total_seconds()))
+        self.stats["failed"] += len(failed)
+        self.stats["batches"] += 1
+        self.stats["reviews"] += len(reviews)
+        if failed and not self.test_mode:
+            gave_up = self.label_status.defer(
+                self.project_code, self.solution, failed, self.config["retry_delay"], worker_id=self.worker_id
+            )
+            self.stats["gave_up"] += gave_up
+            if gave_up:
+                logger.warning(f"{gave_up} 条评论多次标注失败，已标记为failed")
+
+    def backlog(self) -> int:
+        """当前积压的未标注评论数（走标注状态索引计数）"""
+        self.stats["backlog"] = self.collection.count_documents(self._query())
+        return self.stats["backlog"]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取监听统计"""
+        return {**self.stats, "lag": self.lag.summary(), "timestamp_field": self.timestamp_field}
+
+###################
+# 分析服务
+###################
+
+class AnalyzerService:
+    """评论分析服务类"""
+    
+    def __init__(self, db_manager: MongoDBManager, model_service: ModelService, label_cache: Optional[LabelCache] = None,
+                 result_writer: Optional[BufferedResultWriter] = None, prefilter: Optional[ReviewPrefilter] = None,
+                 shard: Optional[ReviewShard] = None, near_duplicates: Optional[NearDuplicateIndex] = None):
+        """初始化分析服务
+        
+        Args:
+            db_manager: 数据库管理器
+            model_service: 模型服务
+            label_cache: 标注缓存，None表示不使用缓存
+            result_writer: 结果写入器，None表示使用默认配置创建
+            prefilter: 规则预过滤，None表示不过滤
+            shard: 哈希分片，None表示处理全部评论；设置后只选取本分片的未处理评论
+            near_duplicates: 近似重复索引，None表示不复用近似重复评论的标注
+        """
+        self.db_manager = db_manager
+        self.model_service = model_service
+        self.label_cache = label_cache
+        self.prefilter = prefilter
+        self.near_duplicates = near_duplicates
+        self.shard = shard
+        self.label_status = LabelStatus(db_manager)
+        self.result_writer = result_writer or BufferedResultWriter(db_manager, label_status=self.label_status)
+        self.sampling = {}  # review_id -> 抽样信息（分层抽样模式下写入结果文档）
+        logger.info("评论分析服务已初始化")
+    
+    @timer_decorator
+    def analyze_single_review(self, review_id: str = None, model: str = MODEL_CONFIG["default_model"]) -> Dict[str, Any]:
+        """分析单条评论
+        
+        Args:
+            review_id: 评论ID，如果为None则随机选择一条
+            model: 使用的模型
+            
+        Returns:
+            分析结果
+        """
+        if review_id:
+            review = self.db_manager.find_one(
+                DB_CONFIG["collections"]["reviews"], 
+                {"review_id": review_id}
+            )
+        else:
+            # 随机选择一条评论
+            random_reviews = self.db_manager.get_random_document(
+                DB_CONFIG["collections"]["reviews"], 1
+            )
+            review = random_reviews[0] if random_reviews else None
+            
+        if not review:
+            logger.warning(f"未找到评论: ID={review_id}")
+            return None
+            
+        logger.info(f"正在分析单条评论: {review.get('review_id')}")
+        result = self.model_service.analyze_review(review, model)
+        return result
+    
+    @timer_decorator
+    def analyze_reviews_batch(
+        self,
+        reviews: List[Dict[str, Any]],
+        max_workers: int = 4,
+        show_progress: bool = True,
+        model: str = MODEL_CONFIG["default_model"],
+        solution: str = EXPERIMENT_CONFIG["solution"],
+        project_code: str = EXPERIMENT_CONFIG["project_code"],
+        test_mode: bool = True,
+        pack_size: int = ENGINE_CONFIG["pack_size"],
+        save_report: bool = True
+    ) -> List[Dict[str, Any]]:
+        """批量分析评论
+        
+        Args:
+            reviews: 评论数据列表
+            max_workers: 最大线程数
+            show_progress: 是否显示进度条
+            model: 使用的模型
+            solution: 解决方案
+            project_code: 项目编号
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            pack_size: 每次请求合并标注的评论数，1表示逐条请求
+            save_report: 是否记录本批吞吐量并保存Token报告（持续标注按间隔累计记录，不逐批保存）
+            
+        Returns:
+            分析结果列表
+        """
+        logger.info(f"开始批量分析 {len(reviews)} 条评论 (线程数: {max_workers}, 模型: {model}, 合并条数: {pack_size})")
+        batch_start = time.perf_counter()
+        
+        # 命中标注缓存的评论直接生成结果，重复评论只保留一条送模型
+        results, to_label, plan = self._prepare_reviews(reviews, model)
+        self._emit(results, plan, model, solution, project_code, test_mode, remember=False)
+        
+        # 创建线程池
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # 提交任务
+            futures = [executor.submit(self._label_unit, unit, model) for unit in self._make_units(to_label, pack_size)]
+            
+            # 获取结果
+            for future in tqdm(as_completed(futures), total=len(futures), disable=not show_progress):
+                try:
+                    results.extend(self._emit(future.result(), plan, model, solution, project_code, test_mode))
+                except LLMCacheMissError:
+                    # replay-only模式下缓存未命中，终止本次运行
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                except Exception as e:
+                    logger.error(f"处理评论任务失败: {str(e)}")
+        
+        logger.info(f"批量分析完成，成功处理 {len(results)}/{len(reviews)} 条评论")
+        self.result_writer.flush()
+        if save_report:
+            self._log_run_stats(len(results), time.perf_counter() - batch_start)
+            
+            # 保存token使用报告
+            token_counter.save_report()
+        
+        return results
+    
+    @timer_decorator
+    def analyze_reviews_batch_async(
+        self,
+        reviews: List[Dict[str, Any]],
+        concurrency: int = ENGINE_CONFIG["async_concurrency"],
+        show_progress: bool = True,
+        model: str = MODEL_CONFIG["default_model"],
+        solution: str = EXPERIMENT_CONFIG["solution"],
+        project_code: str = EXPERIMENT_CONFIG["project_code"],
+        test_mode: bool = True,
+        pack_size: int = ENGINE_CONFIG["pack_size"]
+    ) -> List[Dict[str, Any]]:
+        """使用asyncio批量分析评论，由信号量限制同时在途的请求数
+        
+        Args:
+            reviews: 评论数据列表
+            concurrency: 最大在途请求数
+            show_progress: 是否显示进度条
+            model: 使用的模型
+            solution: 解决方案
+            project_code: 项目编号
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            pack_size: 每次请求合并标注的评论数，1表示逐条请求
+            
+        Returns:
+            分析结果列表
+        """
+        logger.info(f"开始异步批量分析 {len(reviews)} 条评论 (在途请求上限: {concurrency}, 模型: {model}, 合并条数: {pack_size})")
+        batch_start = time.perf_counter()
+        
+        # 命中标注缓存的评论直接生成结果，重复评论只保留一条送模型
+        results, to_label, plan = self._prepare_reviews(reviews, model)
+        self._emit(results, plan, model, solution, project_code, test_mode, remember=False)
+        
+        results.extend(asyncio.run(self._run_async_batch(
+            self._make_units(to_label, pack_size), plan, concurrency, show_progress, model, solution, project_code, test_mode
+        )))
+        
+        logger.info(f"异步批量分析完成，成功处理 {len(results)}/{len(reviews)} 条评论")
+        self.result_writer.flush()
+        self._log_run_stats(len(results), time.perf_counter() - batch_start)
+        
+        # 保存token使用报告
+        token_counter.save_report()
+        
+        return results
+    
+    async def _run_async_batch(self, units, plan, concurrency, show_progress, model, solution, project_code, test_mode):
+        """异步批量分析的事件循环主体"""
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def analyze(unit):
+            async with semaphore:
+                return await self._label_unit_async(unit, model)
+        
+        results = []
+        tasks = [asyncio.ensure_future(analyze(unit)) for unit in units]
+        try:
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks), disable=not show_progress):
+                try:
+                    labeled = await task
+                    # 存储到数据库（放到线程中执行，避免阻塞事件循环）
+                    results.extend(await asyncio.to_thread(
+                        self._emit, labeled, plan, model, solution, project_code, test_mode
+                    ))
+                except LLMCacheMissError:
+                    # replay-only模式下缓存未命中，终止本次运行
+                    raise
+                except Exception as e:
+                    logger.error(f"处理评论任务失败: {str(e)}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            # 关闭异步客户端，释放连接
+            await self.model_service.aclose()
+        return results
+    
+    @timer_decorator
+    def analyze_reviews_stream(
+        self,
+        project_code: str = EXPERIMENT_CONFIG["project_code"],
+        solution: str = EXPERIMENT_CONFIG["solution"],
+        limit: int = 0,
+        max_workers: int = 4,
+        show_progress: bool = True,
+        model: str = MODEL_CONFIG["default_model"],
+        test_mode: bool = True,
+        pack_size: int = ENGINE_CONFIG["pack_size"],
+        queue_size: int = ENGINE_CONFIG["stream_queue_size"],
+        source: Optional[Iterator[Dict[str, Any]]] = None
+    ) -> Dict[str, int]:
+        """流式批量分析评论：游标读取线程 -> 有界队列 -> 工作线程 -> 结果队列 -> 写入（主线程）
+        
+        评论和结果都不在内存中累积，内存占用与集合大小无关，结果在完成后立即写入数据库。
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            limit: 限制处理数量，0表示不限制
+            max_workers: 工作线程数
+            show_progress: 是否显示进度条
+            model: 使用的模型
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            pack_size: 每次请求合并标注的评论数，1表示逐条请求
+            queue_size: 待处理队列和结果队列的容量
+            source: 评论来源迭代器，默认以游标读取未处理评论
+            
+        Returns:
+            处理统计，包含读取数量和成功数量
+        """
+        logger.info(f"开始流式分析评论 (线程数: {max_workers}, 模型: {model}, 合并条数: {pack_size}, 队列容量: {queue_size})")
+        batch_start = time.perf_counter()
+        unit_queue = queue.Queue(maxsize=queue_size)
+        result_queue = queue.Queue(maxsize=queue_size)
+        stop_event = threading.Event()
+        done_marker = object()
+        stats = {"read": 0, "succeeded": 0}
+        
+        def put_until_stopped(target_queue, item) -> bool:
+            """向有界队列放入元素，停止时放弃"""
+            while not stop_event.is_set():
+                try:
+                    target_queue.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def produce():
+            """游标读取线程：将评论按任务单元放入待处理队列"""
+            try:
+                pack = []
+                reviews = source if source is not None else self.iter_unprocessed_reviews(project_code, solution, limit)
+                for review in reviews:
+                    stats["read"] += 1
+                    if pack_size <= 1:
+                        if not put_until_stopped(unit_queue, review):
+                            return
+                        continue
+                    pack.append(review)
+                    if len(pack) >= pack_size:
+                        if not put_until_stopped(unit_queue, pack):
+                            return
+                        pack = []
+                if pack:
+                    put_until_stopped(unit_queue, pack)
+            except Exception as e:
+                logger.error(f"读取未处理评论失败: {str(e)}")
+                stop_event.set()
+            finally:
+                for _ in range(max_workers):
+                    put_until_stopped(unit_queue, done_marker)
+        
+        def work():
+            """工作线程：从待处理队列取任务单元进行标注，结果放入结果队列"""
+            try:
+                while not stop_event.is_set():
+                    try:
+                        unit = unit_queue.get(timeout=0.5)
+                    except queue.Empty:
+                        continue
+                    if unit is done_marker:
+                        return
+                    reviews = unit if isinstance(unit, list) else [unit]
+                    try:
+                        local_results, to_label, plan = self._prepare_reviews(reviews, model, verbose=False)
+                        labeled = []
+                        if to_label:
+                            labeled = self._label_unit(to_label if isinstance(unit, list) else to_label[0], model)
+                        put_until_stopped(result_queue, (local_results, labeled, plan))
+                    except LLMCacheMissError as e:
+                        logger.error(str(e))
+                        stop_event.set()
+                    except Exception as e:
+                        logger.error(f"处理评论任务失败: {str(e)}")
+            finally:
+                put_until_stopped(result_queue, done_marker)
+        
+        producer = threading.Thread(target=produce, name="review-producer", daemon=True)
+        workers = [threading.Thread(target=work, name=f"review-worker-{i}", daemon=True) for i in range(max_workers)]
+        producer.start()
+        for worker in workers:
+            worker.start()
+        
+        # 主线程负责写入结果
+        finished_workers = 0
+        progress = tqdm(total=limit if limit > 0 else None, disable=not show_progress)
+        try:
+            while finished_workers < max_workers:
+                try:
+                    item = result_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if stop_event.is_set() and not any(worker.is_alive() for worker in workers):
+                        break
+                    continue
+                if item is done_marker:
+                    finished_workers += 1
+                    continue
+                local_results, labeled, plan = item
+                try:
+                    docs = self._emit(local_results, plan, model, solution, project_code, test_mode, remember=False)
+                    docs += self._emit(labeled, plan, model, solution, project_code, test_mode)
+                    stats["succeeded"] += len(docs)
+                    progress.update(len(docs))
+                except Exception as e:
+                    logger.error(f"写入分析结果失败: {str(e)}")
+        except KeyboardInterrupt:
+            logger.warning("收到中断信号，停止流式分析")
+            stop_event.set()
+            raise
+        finally:
+            stop_event.set()
+            progress.close()
+            producer.join(timeout=5)
+            for worker in workers:
+                worker.join(timeout=5)
+        
+        logger.info(f"流式分析完成，成功处理 {stats['succeeded']}/{stats['read']} 条评论")
+        self.result_writer.flush()
+        self._log_run_stats(stats["succeeded"], time.perf_counter() - batch_start)
+        
+        # 保存token使用报告
+        token_counter.save_report()
+        
+        return stats
+    
+    def analyze_reviews_distributed(
+        self,
+        work_queue: ReviewLeaseQueue,
+        limit: int = 0,
+        max_workers: int = 4,
+        show_progress: bool = True,
+        model: str = MODEL_CONFIG["default_model"],
+        test_mode: bool = True,
+        pack_size: int = ENGINE_CONFIG["pack_size"]
+    ) -> Dict[str, int]:
+        """分布式批量分析评论：通过租约领取评论后按流式模式处理，可在多个节点上同时运行
         
-        # 创建线程池
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # 提交任务
-            futures = [executor.submit(self.model_service.analyze_review, review, model) for review in reviews]
+        Args:
+            work_queue: 租约任务队列
+            limit: 本节点最多处理数量，0表示不限制
+            max_workers: 工作线程数
+            show_progress: 是否显示进度条
+            model: 使用的模型
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            pack_size: 每次请求合并标注的评论数，1表示逐条请求
             
-            # 获取结果
-            for future in tqdm(as_completed(futures), total=len(futures), disable=not show_progress):
-                try:
-                    result = future.result()
-                    if result:
-                        # 添加元数据
-                        result["project_code"] = project_code
-                        result["solution"] = solution
-                        result["first_label_model"] = model
-                        
-                        # 添加到结果列表
-                        results.append(result)
-                        
-                        # 存储到数据库
-                        if not test_mode:
-                            self.db_manager.insert_one(DB_CONFIG["collections"]["llm_results"], result)
-                except Exception as e:
-                    logger.error(f"处理评论任务失败: {str(e)}")
+        Returns:
+            处理统计，包含读取数量和成功数量
+        """
+        try:
+            # 待处理队列只保留少量已领取的评论，避免领取过多导致其他节点无事可做
+            return self.analyze_reviews_stream(
+                project_code=work_queue.project_code,
+                solution=work_queue.solution,
+                limit=limit,
+                max_workers=max_workers,
+                show_progress=show_progress,
+                model=model,
+                test_mode=test_mode,
+                pack_size=pack_size,
+                queue_size=max(work_queue.batch_size, max_workers * max(pack_size, 1)),
+                source=work_queue.iter_claimed(limit)
+            )
+        finally:
+            # 先写入结果（评论置为done），再释放剩余租约
+            self.result_writer.flush()
+            work_queue.close()
+    
+    def analyze_reviews_follow(
+        self,
+        follower: ReviewFollower,
+        max_workers: int = 4,
+        model: str = MODEL_CONFIG["default_model"],
+        test_mode: bool = True,
+        pack_size: int = ENGINE_CONFIG["pack_size"],
+        report_interval: float = FOLLOW_CONFIG["report_interval"]
+    ) -> Dict[str, Any]:
+        """持续标注：监听新写入的评论，按微批标注并立即写入结果，直到中断（Ctrl-C）
         
-        logger.info(f"批量分析完成，成功处理 {len(results)}/{len(reviews)} 条评论")
+        Args:
+            follower: 新评论监听器
+            max_workers: 每个微批的线程数
+            model: 使用的模型
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            pack_size: 每次请求合并标注的评论数，1表示逐条请求
+            report_interval: 输出积压与标注延迟并保存Token报告的间隔（秒）
+            
+        Returns:
+            监听统计
+        """
+        logger.info(f"开始持续标注 (线程数: {max_workers}, 模型: {model}, 合并条数: {pack_size})")
+        follow_start = time.perf_counter()
+        next_report = time.monotonic() + report_interval
+        try:
+            for reviews in follower.batches():
+                if reviews:
+                    results = self.analyze_reviews_batch(
+                        reviews,
+                        max_workers=max_workers,
+                        show_progress=False,
+                        model=model,
+                        solution=follower.solution,
+                        project_code=follower.project_code,
+                        test_mode=test_mode,
+                        pack_size=pack_size,
+                        save_report=False
+                    )
+                    follower.record(reviews, results)
+                if time.monotonic() >= next_report:
+                    self._report_follow(follower, time.perf_counter() - follow_start)
+                    next_report = time.monotonic() + report_interval
+        except KeyboardInterrupt:
+            logger.warning("收到中断信号，停止持续标注")
+        finally:
+            self.result_writer.flush()
+            self._report_follow(follower, time.perf_counter() - follow_start)
+        return follower.get_stats()
+    
+    def _report_follow(self, follower: ReviewFollower, duration: float):
+        """输出持续标注的积压与标注延迟，按启动以来的累计数据记录吞吐量并保存Token报告
+        
+        Args:
+            follower: 新评论监听器
+            duration: 持续标注已运行的时间（秒）
+        """
+        token_counter.set_throughput(follower.stats["succeeded"], duration)
+        backlog = follower.backlog()
+        stats = follower.get_stats()
+        logger.info(
+            f"持续标注: 已处理 {stats['succeeded']} 条 (失败 {stats['failed']} 条)，积压 {backlog} 条，"
+            f"标注延迟 p50: {stats['lag']['p50_seconds']}秒, p95: {stats['lag']['p95_seconds']}秒, "
+            f"最大: {stats['lag']['max_seconds']}秒"
+        )
+        token_counter.set_section("follow", stats)
+        token_counter.save_report()
+    
+    def analyze_reviews_retrieval(
+        self,
+        library: TagLibrary,
+        project_code: str = EXPERIMENT_CONFIG["project_code"],
+        solution: str = EXPERIMENT_CONFIG["solution"],
+        limit: int = 0,
+        batch_size: int = ENGINE_CONFIG["cursor_batch_size"],
+        show_progress: bool = True,
+        test_mode: bool = True
+    ) -> Dict[str, int]:
+        """全量打标：基于标签样本库对未处理评论进行向量召回打标，不调用大模型
+        
+        Args:
+            library: 标签样本库
+            project_code: 项目编号
+            solution: 解决方案
+            limit: 限制处理数量，0表示不限制
+            batch_size: 每批向量化的评论数
+            show_progress: 是否显示进度条
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            
+        Returns:
+            处理统计，包含读取数量、成功数量和打上话题标签的数量
+        """
+        logger.info(f"开始全量打标 (样本库: {library.size}, 向量模型: {library.embedding_model}, 批大小: {batch_size})")
+        batch_start = time.perf_counter()
+        model = f"retrieval:{library.embedding_model}"
+        plan = {"keys": {}, "followers": {}}
+        stats = {"read": 0, "succeeded": 0, "with_topics": 0}
+        
+        def label(batch: List[Dict[str, Any]]):
+            results = library.label_batch(batch)
+            self._emit(results, plan, model, solution, project_code, test_mode, remember=False)
+            stats["succeeded"] += len(results)
+            stats["with_topics"] += sum(1 for result in results if result["product_topic_result"])
+            progress.update(len(results))
+        
+        progress = tqdm(total=limit if limit > 0 else None, disable=not show_progress)
+        try:
+            batch = []
+            for review in self.iter_unprocessed_reviews(project_code, solution, limit):
+                stats["read"] += 1
+                batch.append(review)
+                if len(batch) >= batch_size:
+                    label(batch)
+                    batch = []
+            if batch:
+                label(batch)
+        finally:
+            progress.close()
+        
+        logger.info(f"全量打标完成，成功处理 {stats['succeeded']}/{stats['read']} 条评论，其中 {stats['with_topics']} 条召回到话题标签")
+        self.result_writer.flush()
+        self._log_run_stats(stats["succeeded"], time.perf_counter() - batch_start)
+        token_counter.set_section("retrieval_labeling", {"library_size": library.size, **stats})
         
         # 保存token使用报告
         token_counter.save_report()
         
-        return results
+        return stats
+    
+    def estimate_cost(self, reviews: List[Dict[str, Any]], estimator: CostEstimator,
+                      model: str = MODEL_CONFIG["default_model"], pack_size: int = ENGINE_CONFIG["pack_size"]) -> Dict[str, Any]:
+        """预估标注这些评论的调用次数、token和成本，不调用API
+        
+        与实际运行相同：先经过规则预过滤和标注缓存，剩余评论按合并条数构建与实际一致的请求，在本地计算token。
+        
+        Args:
+            reviews: 评论数据列表
+            estimator: 成本预估器
+            model: 使用的模型
+            pack_size: 每次请求合并标注的评论数
+            
+        Returns:
+            预估报告
+        """
+        local_results, to_label, plan = self._prepare_reviews(reviews, model)
+        followers = sum(len(group) for group in plan["followers"].values())
+        near_duplicates = sum(1 for result in local_results if result.get('label_source') == NEAR_DUPLICATE_CONFIG["label_source"])
+        estimator.add_local("prefilter_or_label_cache", len(local_results) - near_duplicates)
+        estimator.add_local("near_duplicate", near_duplicates)
+        estimator.add_local("duplicate_comments", followers)
+        
+        per_review = CostEstimator.expected_completion_tokens("analyze_review_packed")
+        for unit in self._make_units(to_label, pack_size):
+            if isinstance(unit, list):
+                request = ModelService.build_request(model, ModelService._build_packed_messages(unit))
+                estimator.add("analyze_review_packed", request, completion_tokens=per_review * len(unit))
+            else:
+                estimator.add("analyze_review", ModelService.build_request(model, ModelService._build_messages(unit)))
+        return estimator.get_report()
+    
+    def _prepare_reviews(self, reviews: List[Dict[str, Any]], model: str, verbose: bool = True) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], Dict[str, Any]]:
+        """标注前的本地处理：规则预过滤、查询标注缓存并合并重复评论、复用近似重复评论的标注
+        
+        Args:
+            reviews: 评论数据列表
+            model: 使用的模型
+            verbose: 是否输出命中统计日志
+            
+        Returns:
+            (本地生成的分析结果, 需要送模型标注的评论, 处理计划)
+            处理计划包含keys（review_id到缓存键）、followers（代表评论review_id到同内容评论列表）
+            和fingerprints（需模型标注的评论review_id到近似重复指纹）
+        """
+        plan = {"keys": {}, "followers": {}, "fingerprints": {}}
+        local_results = []
+        if self.prefilter:
+            local_results, reviews = self.prefilter.apply(reviews)
+            if verbose and local_results:
+                logger.info(f"规则预过滤命中 {len(local_results)} 条评论，不调用模型")
+        if not self.label_cache:
+            return local_results, self._reuse_near_duplicates(list(reviews), local_results, plan, verbose), plan
+        
+        # 按缓存键分组，同内容评论只保留第一条作为代表
+        groups = {}
+        for review in reviews:
+            key = self.label_cache.make_key(review, model)
+            plan["keys"][review['review_id']] = key
+            groups.setdefault(key, []).append(review)
+        
+        cached = self.label_cache.get_many(list(groups.keys()))
+        to_label = []
+        hits = tokens_saved = 0
+        for key, group in groups.items():
+            if key in cached:
+                local_results.extend(self.label_cache.materialize(cached[key], review, key) for review in group)
+                hits += len(group)
+                tokens_saved += cached[key].get("source_token_usage", 0) * len(group)
+            else:
+                to_label.append(group[0])
+                if len(group) > 1:
+                    plan["followers"][group[0]['review_id']] = group[1:]
+        
+        token_counter.add_cache_result(hits=hits, misses=len(to_label), tokens_saved=tokens_saved)
+        if verbose:
+            logger.info(f"标注缓存命中 {hits} 条，合并重复评论 {len(reviews) - hits - len(to_label)} 条，需模型标注 {len(to_label)} 条")
+        return local_results, self._reuse_near_duplicates(to_label, local_results, plan, verbose), plan
+    
+    def _reuse_near_duplicates(self, reviews: List[Dict[str, Any]], local_results: List[Dict[str, Any]],
+                               plan: Dict[str, Any], verbose: bool = True) -> List[Dict[str, Any]]:
+        """复用同一商品中近似重复的已标注评论的结果
+        
+        命中的评论（及其同内容评论）的结果追加到local_results；未命中的评论记录指纹，标注完成后加入索引。
+        
+        Args:
+            reviews: 待标注的评论（标注缓存合并后的代表评论）
+            local_results: 本地生成的分析结果，本方法追加复用的结果
+            plan: 处理计划，本方法写入fingerprints并移除已复用评论的followers
+            verbose: 是否输出命中统计日志
+            
+        Returns:
+            仍需送模型标注的评论
+        """
+        if self.near_duplicates is None or not reviews:
+            return reviews
+        to_label = []
+        hits = tokens_saved = 0
+        for review in reviews:
+            fingerprint = self.near_duplicates.fingerprint(review)
+            match = self.near_duplicates.find(fingerprint)
+            if match is None:
+                to_label.append(review)
+                if fingerprint is not None:
+                    plan["fingerprints"][review['review_id']] = fingerprint
+                continue
+            entry, similarity = match
+            group = [review] + plan["followers"].pop(review['review_id'], [])
+            for member in group:
+                local_results.append(self._materialize_near_duplicate(entry, member, similarity))
+            hits += len(group)
+            tokens_saved += entry.get("token_usage", 0) * len(group)
+        
+        token_counter.add_near_duplicate_result(checked=len(reviews), hits=hits, tokens_saved=tokens_saved)
+        if verbose and hits:
+            logger.info(f"近似重复复用 {hits} 条，需模型标注 {len(to_label)} 条")
+        return to_label
+    
+    @staticmethod
+    def _materialize_near_duplicate(entry: Dict[str, Any], review: Dict[str, Any], similarity: float) -> Dict[str, Any]:
+        """由近似重复索引条目生成指定评论的分析结果
+        
+        Args:
+            entry: 近似重复索引条目
+            review: 目标评论
+            similarity: 与被复用评论的相似度
+            
+        Returns:
+            分析结果，comment为目标评论原文，话题的related_text取自目标评论，token消耗记为0
+        """
+        result = copy.deepcopy({field: entry["labels"].get(field) for field in LabelCache.LABEL_FIELDS})
+        result['comment'] = review.get('评论', result.get('comment'))
+        # 被复用评论的原文片段不一定出现在目标评论中，不在其中时改用目标评论原文
+        comment = str(review.get('评论') or "").strip()
+        for topic in result.get('product_topic_result') or []:
+            if isinstance(topic, dict) and str(topic.get('related_text') or "") not in comment:
+                topic['related_text'] = comment
+        result['token_usage'] = 0
+        result['review_id'] = review['review_id']
+        result['analysis_time'] = datetime.now().isoformat()
+        result['label_source'] = NEAR_DUPLICATE_CONFIG["label_source"]
+        result['near_duplicate'] = {"source_review_id": entry["source_review_id"], "similarity": similarity}
+        return result
     
-    def get_processed_review_ids(self, project_code: str, solution: str) -> List[str]:
-        """获取已处理的评论ID
+    def seed_near_duplicates(self, project_code: str, solution: str, model: str) -> int:
+        """用已有的模型标注结果填充近似重复索引（索引为空时调用，之后由新标注的结果增量加入）
         
         Args:
             project_code: 项目编号
             solution: 解决方案
+            model: 使用的模型
             
         Returns:
-            已处理的评论ID列表
+            加入索引的评论数
         """
-        collection_name = DB_CONFIG["collections"]["llm_results"]
-        results = self.db_manager.find_many(
-            collection_name=collection_name,
-            query={"project_code": project_code, "solution": solution},
-            projection={"review_id": 1}
+        query = {
+            "project_code": project_code,
+            "solution": solution,
+            "first_label_model": model,
+            "label_source": {"$exists": False}
+        }
+        projection = {field: 1 for field in LabelCache.LABEL_FIELDS}
+        projection.update({"review_id": 1, "token_usage": 1, "_id": 0})
+        chunk_size = LABEL_CACHE_CONFIG["lookup_chunk_size"]
+        added = 0
+        chunk = []
+        
+        def add_chunk(results: List[Dict[str, Any]]):
+            reviews = {
+                review['review_id']: review for review in self.db_manager.iter_documents(
+                    DB_CONFIG["collections"]["reviews"],
+                    {"project_code": project_code, "review_id": {"$in": [result['review_id'] for result in results]}},
+                    projection={"review_id": 1, "评论": 1, "商品名称": 1, "_id": 0}
+                )
+            }
+            count = 0
+            for result in results:
+                review = reviews.get(result['review_id'])
+                if review is None or not ModelService._is_valid_label(result):
+                    continue
+                self.near_duplicates.add(
+                    self.near_duplicates.fingerprint(review),
+                    {field: result.get(field) for field in LabelCache.LABEL_FIELDS},
+                    result['review_id'], result.get('token_usage', 0)
+                )
+                count += 1
+            return count
+        
+        for result in self.db_manager.iter_documents(DB_CONFIG["collections"]["llm_results"], query, projection=projection):
+            chunk.append(result)
+            if len(chunk) >= chunk_size:
+                added += add_chunk(chunk)
+                chunk = []
+        if chunk:
+            added += add_chunk(chunk)
+        logger.info(f"近似重复索引已由已有标注结果填充: {added} 条 (共 {self.near_duplicates.size} 条)")
+        return added
+    
+    def _emit(self, labeled: List[Dict[str, Any]], plan: Dict[str, Any], model: str, solution: str,
+              project_code: str, test_mode: bool, remember: bool = True) -> List[Dict[str, Any]]:
+        """处理一批标注完成的结果：补充元数据、分发给同内容评论、写入缓存和近似重复索引并存储
+        
+        Args:
+            labeled: 标注结果列表
+            plan: _prepare_reviews生成的处理计划
+            model: 使用的模型
+            solution: 解决方案
+            project_code: 项目编号
+            test_mode: 测试模式(True不存储结果/False存储结果)
+            remember: 是否将结果写入标注缓存和近似重复索引（本地生成的结果无需写入）
+            
+        Returns:
+            最终的分析结果列表（包含同内容评论的结果）
+        """
+        docs = []
+        for result in labeled:
+            review_id = result['review_id']
+            key = plan["keys"].get(review_id)
+            docs.append(result)
+            if not remember:
+                continue
+            
+            # 新标注的评论加入近似重复索引，供之后的近似评论复用
+            fingerprint = plan["fingerprints"].get(review_id)
+            if fingerprint is not None and not test_mode and ModelService._is_valid_label(result):
+                self.near_duplicates.add(
+                    fingerprint, {field: result.get(field) for field in LabelCache.LABEL_FIELDS},
+                    review_id, result.get('token_usage', 0)
+                )
+            if not key:
+                continue
+            
+            # 代表评论的结果未通过校验（如字段修复失败）时不分发、不写入缓存，
+            # 由同内容的下一条评论送模型重新标注，得到有效结果后再分发给其余评论
+            followers = list(plan["followers"].get(review_id, []))
+            representative = result
+            while followers and not ModelService._is_valid_label(representative):
+                relabeled = self._label_unit(followers.pop(0), model)
+                if relabeled:
+                    representative = relabeled[0]
+                    docs.append(representative)
+            if not ModelService._is_valid_label(representative):
+                continue
+            
+            # 同内容的评论直接复用标注结果
+            docs.extend(self.label_cache.materialize(representative, review, key) for review in followers)
+            token_counter.add_cache_result(
+                hits=len(followers), tokens_saved=representative.get('token_usage', 0) * len(followers)
+            )
+            if not test_mode:
+                self.label_cache.put(key, representative, model)
+        
+        for doc in docs:
+            self._finalize_result(doc, model, solution, project_code)
+            
+            # 放入写入缓冲区，批量存储到数据库
+            if not test_mode:
+                self.result_writer.add(doc)
+        return docs
+    
+    @staticmethod
+    def _make_units(reviews: List[Dict[str, Any]], pack_size: int) -> List[Any]:
+        """按合并条数切分任务单元，pack_size<=1时每条评论为一个单元"""
+        if pack_size <= 1:
+            return list(reviews)
+        return [reviews[i:i + pack_size] for i in range(0, len(reviews), pack_size)]
+    
+    def _label_unit(self, unit: Any, model: str) -> List[Dict[str, Any]]:
+        """标注一个任务单元（单条评论或合并的评论列表）
+        
+        Args:
+            unit: 单条评论，或需合并标注的评论列表
+            model: 使用的模型
+            
+        Returns:
+            分析结果列表
+        """
+        if isinstance(unit, list):
+            return self.model_service.analyze_reviews_packed(unit, model)
+        result = self.model_service.analyze_review(unit, model)
+        return [result] if result else []
+    
+    async def _label_unit_async(self, unit: Any, model: str) -> List[Dict[str, Any]]:
+        """异步标注一个任务单元（单条评论或合并的评论列表）"""
+        if isinstance(unit, list):
+            return await self.model_service.analyze_reviews_packed_async(unit, model)
+        result = await self.model_service.analyze_review_async(unit, model)
+        return [result] if result else []
+    
+    def _finalize_result(self, result: Dict[str, Any], model: str, solution: str, project_code: str):
+        """为分析结果添加元数据
+        
+        Args:
+            result: 分析结果
+            model: 使用的模型
+            solution: 解决方案
+            project_code: 项目编号
+        """
+        result["project_code"] = project_code
+        result["solution"] = solution
+        result["first_label_model"] = model
+        if result.get("review_id") in self.sampling:
+            result["sampling"] = self.sampling[result["review_id"]]
+    
+    def _log_run_stats(self, review_count: int, duration: float):
+        """记录并输出批量分析的吞吐量与调用延迟
+        
+        Args:
+            review_count: 成功处理的评论数量
+            duration: 批量分析耗时（秒）
+        """
+        token_counter.set_throughput(review_count, duration)
+        latency_stats = token_counter.get_latency_stats()
+        logger.info(
+            f"吞吐量: {token_counter.throughput['reviews_per_second']} 条/秒, "
+            f"调用延迟 p50: {latency_stats['p50_seconds']}秒, p95: {latency_stats['p95_seconds']}秒, "
+            f"p99: {latency_stats['p99_seconds']}秒 "
+            f"(共 {latency_stats['count']} 次调用)"
         )
-        processed_ids = [doc.get("review_id") for doc in results if doc.get("review_id")]
-        logger.info(f"已处理评论数量: {len(processed_ids)}")
-        return processed_ids
     
     def get_unprocessed_reviews(self, project_code: str, solution: str, limit: int = 0) -> List[Dict[str, Any]]:
         """获取未处理的评论
@@ -616,30 +3462,64 @@ class AnalyzerService:
         Returns:
             未处理的评论列表
         """
-        # 获取已处理的评论ID
-        processed_ids = self.get_processed_review_ids(project_code, solution)
-        
-        # 查询未处理的评论
-        collection_name = DB_CONFIG["collections"]["reviews"]
-        
-        # 构建查询条件：使用project_code作为数据范围筛选条件
-        query = {
-            "project_code": project_code,  # 添加项目编号作为筛选条件
-        }
-        
-        # 添加未处理条件
-        if processed_ids:
-            query["review_id"] = {"$nin": processed_ids}
-        
         unprocessed = self.db_manager.find_many(
-            collection_name=collection_name,
-            query=query,
+            collection_name=DB_CONFIG["collections"]["reviews"],
+            query=self._unprocessed_query(project_code, solution),
             limit=limit
         )
         
         logger.info(f"获取到 {len(unprocessed)} 条未处理评论，项目编号: {project_code}")
         return unprocessed
     
+    def get_sampled_reviews(self, sampler: StratifiedSampler, project_code: str, solution: str) -> List[Dict[str, Any]]:
+        """分层抽取未处理的评论，并登记抽样信息以写入结果文档
+        
+        Args:
+            sampler: 分层抽样器
+            project_code: 项目编号
+            solution: 解决方案
+            
+        Returns:
+            样本评论列表
+        """
+        reviews = sampler.sample(project_code, solution, extra_query=self._shard_query(project_code))
+        for review in reviews:
+            self.sampling[review["review_id"]] = review.pop("sampling")
+        return reviews
+    
+    def iter_unprocessed_reviews(self, project_code: str, solution: str, limit: int = 0) -> Iterator[Dict[str, Any]]:
+        """以游标流式读取未处理的评论
+        
+        Args:
+            project_code: 项目编号，用于限定数据范围
+            solution: 解决方案
+            limit: 限制返回数量，0表示不限制
+            
+        Yields:
+            未处理的评论
+        """
+        return self.db_manager.iter_documents(
+            collection_name=DB_CONFIG["collections"]["reviews"],
+            query=self._unprocessed_query(project_code, solution),
+            limit=limit
+        )
+    
+    def _unprocessed_query(self, project_code: str, solution: str) -> Dict[str, Any]:
+        """构建未处理评论的查询条件（走评论上的标注状态索引）
+        
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            
+        Returns:
+            查询条件
+        """
+        return {**self.label_status.pending_query(project_code, solution), **self._shard_query(project_code)}
+    
+    def _shard_query(self, project_code: str) -> Dict[str, Any]:
+        """哈希分片的查询条件，未分片时为空"""
+        return self.shard.query(self.db_manager, project_code) if self.shard is not None else {}
+    
     def get_analysis_results(self, project_code: str, solution: str, limit: int = 0) -> List[Dict[str, Any]]:
         """获取分析结果
         
@@ -661,7 +3541,7 @@ class AnalyzerService:
         return results
     
     def process_analysis_results(self, results: List[Dict[str, Any]]) -> pd.DataFrame:
-        """处理分析结果为DataFrame
+        """处理分析结果为话题表（每个话题一行）
         
         Args:
             results: 分析结果列表
@@ -675,30 +3555,81 @@ class AnalyzerService:
             return pd.DataFrame()
             
         logger.info(f"开始处理 {len(results)} 条分析结果")
+        topic_fields = OUTPUT_CONFIG["topic_fields"]
         
-        # 转换为DataFrame
-        df = pd.DataFrame(results)
+        # 按话题展开，每个话题一行
+        df = pd.DataFrame(results, columns=['_id', 'comment', 'review_id', 'product_topic_result'])
+        df = df.explode('product_topic_result', ignore_index=True)
+        df = df[df['product_topic_result'].map(lambda item: isinstance(item, dict))].reset_index(drop=True)
         
-        # 分析产品话题结果
-        topic_results = []
+        # 话题字段一次性展开为列
+        topics = pd.DataFrame(df['product_topic_result'].tolist(), columns=topic_fields)
+        topic_df = pd.concat([df[['_id', 'comment']], topics, df[['review_id']]], axis=1)
         
-        for index, row in df.iterrows():
-            for topic_result in row.get('product_topic_result', []):
-                topic_results.append({
-                    '_id': row.get('_id'),
-                    'comment': row.get('comment'),
-                    'topic': topic_result.get('topic'),
-                    'polarity': topic_result.get('polarity'),
-                    'confidence': topic_result.get('confidence'),
-                    'related_text': topic_result.get('related_text'),
-                    'review_id': row.get('review_id')
-                })
-        
-        # 创建包含话题的展开DataFrame
-        topic_df = pd.DataFrame(topic_results)
-        logger.info(f"处理完成，生成了包含 {len(topic_results)} 条话题记录的DataFrame")
+        # 统一列类型，便于列式存储后直接加载分析
+        topic_df['confidence'] = pd.to_numeric(topic_df['confidence'], errors='coerce')
+        for column in ['_id', 'comment', 'topic', 'polarity', 'related_text', 'review_id']:
+            topic_df[column] = topic_df[column].astype('string')
         
+        logger.info(f"处理完成，生成了包含 {len(topic_df)} 条话题记录的DataFrame")
         return topic_df
+    
+    def process_user_profiles(self, results: List[Dict[str, Any]]) -> pd.DataFrame:
+        """处理分析结果为用户画像表（每条评论一行，关键短语为列表列）
+        
+        Args:
+            results: 分析结果列表
+            
+        Returns:
+            处理后的DataFrame
+        """
+        if not results:
+            return pd.DataFrame()
+        
+        df = pd.DataFrame(results, columns=['review_id', 'comment', 'keyphrases', 'user_profile', 'sampling'])
+        profiles = pd.DataFrame(
+            [profile if isinstance(profile, dict) else {} for profile in df['user_profile']],
+            columns=FIRST_LABEL_PROFILE_FIELDS
+        )
+        profile_df = pd.concat([df[['review_id', 'comment']], profiles], axis=1).astype('string')
+        profile_df['keyphrases'] = df['keyphrases'].map(
+            lambda phrases: [str(phrase) for phrase in phrases] if isinstance(phrases, list) else []
+        )
+        # 分层抽样模式下的抽样权重，全量标注时为1
+        profile_df['sampling_weight'] = df['sampling'].map(
+            lambda sampling: float(sampling.get('weight', 1)) if isinstance(sampling, dict) else 1.0
+        )
+        
+        logger.info(f"处理完成，生成了包含 {len(profile_df)} 条用户画像记录的DataFrame")
+        return profile_df
+    
+    def save_analysis_tables(self, tables: Dict[str, pd.DataFrame], name: str,
+                             output_format: str = OUTPUT_CONFIG["default_format"]) -> List[str]:
+        """保存话题表、画像表等结果表，每张表一个文件
+        
+        Args:
+            tables: 表名 -> DataFrame
+            name: 文件名后缀（如项目编号、模型和时间）
+            output_format: parquet或csv；未安装pyarrow时parquet改为输出csv
+            
+        Returns:
+            输出文件路径列表
+        """
+        os.makedirs(OUTPUT_CONFIG["dir"], exist_ok=True)
+        paths = []
+        for table_name, table in tables.items():
+            path = os.path.join(OUTPUT_CONFIG["dir"], f"1_初打标_{table_name}_{name}")
+            if output_format == "parquet":
+                try:
+                    table.to_parquet(f"{path}.parquet", index=False, compression=OUTPUT_CONFIG["parquet_compression"])
+                    paths.append(f"{path}.parquet")
+                    continue
+                except ImportError as e:
+                    logger.warning(f"无法输出Parquet（{str(e)}），改为输出CSV")
+                    output_format = "csv"
+            table.to_csv(f"{path}.csv", index=False, encoding='utf-8-sig')
+            paths.append(f"{path}.csv")
+        return paths
 
 ###################
 # 主程序
@@ -723,33 +3654,284 @@ def main():
                         help='处理评论数量限制，默认10，0表示不限制')
     parser.add_argument('--workers', type=int, default=4, 
                         help='并行处理的线程数，默认: 4')
+    parser.add_argument('--engine', type=str, choices=ENGINE_CONFIG["engines"], default=ENGINE_CONFIG["default_engine"],
+                        help=f'批量执行引擎，thread为线程池，async为asyncio异步客户端（流式/分布式/持续标注模式只支持thread），默认: {ENGINE_CONFIG["default_engine"]}')
+    parser.add_argument('--concurrency', type=int, default=ENGINE_CONFIG["async_concurrency"],
+                        help=f'async引擎同时在途的最大请求数，默认: {ENGINE_CONFIG["async_concurrency"]}')
+    parser.add_argument('--stream', action='store_true',
+                        help='流式模式：游标分批读取评论，经有界队列交给工作线程，结果即时写入，内存占用与数据量无关')
+    parser.add_argument('--queue-size', type=int, default=ENGINE_CONFIG["stream_queue_size"],
+                        help=f'流式模式下队列容量，默认: {ENGINE_CONFIG["stream_queue_size"]}')
+    parser.add_argument('--pack-size', type=int, default=ENGINE_CONFIG["pack_size"],
+                        help=f'每次请求合并标注的评论数，大于1时启用合并标注模式，默认: {ENGINE_CONFIG["pack_size"]}')
+    parser.add_argument('--distributed', action='store_true',
+                        help='分布式模式：通过租约领取评论，可在多个节点上同时运行同一项目')
+    parser.add_argument('--lease-batch', type=int, default=LEASE_CONFIG["batch_size"],
+                        help=f'分布式模式每次领取的评论数，默认: {LEASE_CONFIG["batch_size"]}')
+    parser.add_argument('--lease-seconds', type=int, default=LEASE_CONFIG["lease_seconds"],
+                        help=f'分布式模式租约有效期（秒），默认: {LEASE_CONFIG["lease_seconds"]}')
+    parser.add_argument('--worker-id', type=str, default=None,
+                        help='分布式模式节点标识，默认为主机名-进程号-随机串')
+    parser.add_argument('--retrieval', action='store_true',
+                        help='全量打标模式：基于标签样本库向量召回打标，不调用大模型')
+    parser.add_argument('--library-solution', type=str, default=EXPERIMENT_CONFIG["solution"],
+                        help=f'全量打标模式中构建样本库所用的大模型标注方案，默认: {EXPERIMENT_CONFIG["solution"]}')
+    parser.add_argument('--rebuild-library', action='store_true',
+                        help='全量打标模式中忽略本地样本库，重新从标注结果构建')
+    parser.add_argument('--sample-rate', type=float, default=0,
+                        help='分层抽样模式：按平台/店铺/SKU/评论月份/评论长度分层，每层按该比例抽样标注（如0.1），'
+                             '结果文档记录抽样权重；启用时忽略--limit，默认不抽样')
+    parser.add_argument('--sample-seed', type=int, default=SAMPLING_CONFIG["default_seed"],
+                        help=f'分层抽样的随机种子，相同种子得到相同样本，默认: {SAMPLING_CONFIG["default_seed"]}')
+    parser.add_argument('--no-prefilter', action='store_true', default=not PREFILTER_CONFIG["enabled"],
+                        help='不使用规则预过滤，过短/默认文案评论也调用模型')
+    parser.add_argument('--no-label-cache', action='store_true', default=not LABEL_CACHE_CONFIG["enabled"],
+                        help='不使用标注缓存，重复评论也逐条调用模型')
+    parser.add_argument('--no-near-dup', action='store_true', default=not NEAR_DUPLICATE_CONFIG["enabled"],
+                        help='不复用近似重复评论（仅标点、表情或结尾套话不同）的标注结果')
+    parser.add_argument('--near-dup-threshold', type=float, default=NEAR_DUPLICATE_CONFIG["threshold"],
+                        help=f'近似重复的字符n-gram Jaccard相似度阈值（0-1），默认: {NEAR_DUPLICATE_CONFIG["threshold"]}')
+    parser.add_argument('--llm-cache', type=str, choices=LLM_CACHE_CONFIG["modes"], default=LLM_CACHE_CONFIG["default_mode"],
+                        help='LLM响应缓存模式：read-write读写缓存，replay-only只读缓存且未命中即失败，off不使用，'
+                             f'默认: {LLM_CACHE_CONFIG["default_mode"]}')
+    parser.add_argument('--rpm', type=int, default=RATE_LIMIT_CONFIG["rpm"],
+                        help='每分钟请求数上限，与--tpm任一大于0时启用自适应限流（并发按AIMD自动调整），默认不限制')
+    parser.add_argument('--tpm', type=int, default=RATE_LIMIT_CONFIG["tpm"],
+                        help='每分钟token数上限（按prompt预估token预占配额），默认不限制')
+    parser.add_argument('--base-url', type=str, default=MODEL_CONFIG["base_url"],
+                        help='OpenAI兼容API地址，如本地模拟服务 http://127.0.0.1:8765/v1，默认使用官方地址')
+    parser.add_argument('--no-proxy', action='store_true', default=not PROXY_CONFIG["enabled"],
+                        help=f'不设置HTTP代理（默认使用 {PROXY_CONFIG["url"]}:{PROXY_CONFIG["port"]}）')
+    parser.add_argument('--no-hedge', action='store_true', default=not HEDGING_CONFIG["enabled"],
+                        help='不发送对冲请求（仍按HEDGING_CONFIG中各操作的截止时间超时重试）；'
+                             '默认调用超过历史p95耗时未返回时发出一份对冲请求，先返回者胜出')
+    parser.add_argument('--output-format', type=str, choices=OUTPUT_CONFIG["formats"], default=OUTPUT_CONFIG["default_format"],
+                        help='结果文件格式：parquet按列存储话题表和用户画像表（可直接加载分析），csv为UTF-8-SIG文本，'
+                             f'默认: {OUTPUT_CONFIG["default_format"]}')
+    parser.add_argument('--cascade', action='store_true',
+                        help='级联模型路由：每条评论先用最便宜的模型，结果结构无效、话题置信度过低或长评论话题为空时升级到更强的模型'
+                             '（忽略--model）')
+    parser.add_argument('--cascade-models', type=str, nargs='+', default=CASCADE_CONFIG["tiers"],
+                        help=f'级联模型，由便宜到强排列，默认: {CASCADE_CONFIG["tiers"]}')
+    parser.add_argument('--min-confidence', type=float, default=CASCADE_CONFIG["min_confidence"],
+                        help=f'级联模式下话题confidence低于该值时升级，默认: {CASCADE_CONFIG["min_confidence"]}')
+    parser.add_argument('--estimate', action='store_true',
+                        help='成本预估：按--limit/--sample-rate选取的评论在本地构建实际请求并计算token和成本，不调用API、不写入结果'
+                             '（预估全部未处理评论时使用--limit 0）')
+    parser.add_argument('--follow', action='store_true',
+                        help='持续标注：处理完积压的未标注评论后继续监听新写入的评论（副本集上使用change stream，否则轮询插入时间），'
+                             '按微批标注并立即写入结果，Ctrl-C停止；定期输出积压数量和标注延迟（忽略--limit）')
+    parser.add_argument('--follow-mode', type=str, choices=FOLLOW_CONFIG["modes"], default=FOLLOW_CONFIG["default_mode"],
+                        help=f'持续标注的监听方式，默认: {FOLLOW_CONFIG["default_mode"]}')
+    parser.add_argument('--follow-batch', type=int, default=FOLLOW_CONFIG["batch_size"],
+                        help=f'持续标注每个微批的最大评论数，默认: {FOLLOW_CONFIG["batch_size"]}')
+    parser.add_argument('--poll-interval', type=float, default=FOLLOW_CONFIG["poll_interval"],
+                        help=f'轮询模式下没有新评论时的等待时间（秒），默认: {FOLLOW_CONFIG["poll_interval"]}')
+    parser.add_argument('--shard', type=str, default=None, metavar='i/N',
+                        help='哈希分片：只处理review_hash %% N == i的未处理评论（i从0开始），N个进程分别使用0/N到N-1/N即可不重复地覆盖整个项目；'
+                             'Token报告按分片单独保存')
+    parser.add_argument('--merge-report', type=str, nargs='*', default=None, metavar='REPORT',
+                        help='合并各分片的Token报告为项目报告后退出，不指定文件时合并当前项目的全部分片报告')
     parser.add_argument('--test-mode', action='store_true', 
                         help='测试模式，不存储结果到数据库')
     parser.add_argument('--single', action='store_true',
                         help='单评论模式，只处理一条随机评论')
     args = parser.parse_args()
+    if not 0 < args.near_dup_threshold <= 1:
+        parser.error("--near-dup-threshold需在(0, 1]之间")
+    if args.engine == "async":
+        # 流式、分布式和持续标注模式只有线程池实现
+        for option in ("stream", "distributed", "follow"):
+            if getattr(args, option):
+                parser.error(f"--{option}只支持--engine thread，不能与--engine async同时使用")
+    
+    shard = None
+    if args.shard:
+        if args.distributed:
+            parser.error("--shard与--distributed不能同时使用（租约队列已在节点间分配评论）")
+        try:
+            shard = ReviewShard.parse(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
+        # 运行中各处保存的Token报告都写入本分片的报告文件，避免多个分片进程互相覆盖项目报告
+        token_counter.report_file = shard.report_file(args.project_code)
+    
+    if args.merge_report is not None:
+        # 合并分片报告 - 不连接数据库、不调用模型
+        report_files = args.merge_report or sorted(glob.glob(
+            TOKEN_CONFIG["shard_report_file"].format(project_code=args.project_code, index="*", count="*")
+        ))
+        report = merge_shard_reports(report_files, args.project_code)
+        with open(TOKEN_CONFIG["report_file"], "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        logger.info(f"已合并 {len(report_files)} 个分片报告: 总tokens {report['total_tokens']}, "
+                    f"处理评论 {report['throughput']['review_count']} 条, 成本 {report['cost_estimate']['total_cost']} "
+                    f"{report['cost_estimate']['currency']}，项目报告已保存到 {TOKEN_CONFIG['report_file']}")
+        return
     
     try:
+        # 配置LLM响应缓存
+        response_cache.configure(args.llm_cache)
+        
         # 初始化数据库管理器
         db_manager = MongoDBManager()
         
-        # 初始化模型服务
-        model_service = ModelService()
+        # 初始化限流器，并发上限不超过所选引擎的并发数
+        rate_limiter = None
+        if args.rpm > 0 or args.tpm > 0:
+            rate_limiter = AdaptiveRateLimiter(
+                rpm=args.rpm,
+                tpm=args.tpm,
+                max_concurrency=args.concurrency if args.engine == "async" else args.workers
+            )
+        
+        # 初始化截止时间与对冲器
+        hedger = RequestHedger(hedge=not args.no_hedge, metrics=token_counter.metrics)
+        
+        # 初始化模型服务（成本预估不调用API，无需创建客户端）
+        model_service = None
+        if not args.estimate:
+            model_service = ModelService(rate_limiter=rate_limiter, hedger=hedger, base_url=args.base_url,
+                                         use_proxy=not args.no_proxy)
+        
+        # 级联模型路由，结果文档和标注缓存按级联名称区分
+        cascade = None
+        if args.cascade:
+            if args.estimate:
+                # 升级比例需实际运行才能得知，预估按第一档模型计算
+                args.model = args.cascade_models[0]
+            else:
+                cascade = CascadeModelService(
+                    model_service, tiers=args.cascade_models, config=dict(CASCADE_CONFIG, min_confidence=args.min_confidence)
+                )
+                model_service = cascade
+                args.model = cascade.name
+        
+        # 初始化标注缓存
+        label_cache = LabelCache(db_manager) if not args.no_label_cache else None
+        
+        # 初始化规则预过滤
+        prefilter = ReviewPrefilter() if not args.no_prefilter else None
+        
+        # 初始化近似重复索引
+        near_duplicates = None
+        if not args.no_near_dup:
+            near_duplicates = NearDuplicateIndex.open(
+                args.project_code, args.solution, args.model, first_label_prompt_version(),
+                config=dict(NEAR_DUPLICATE_CONFIG, threshold=args.near_dup_threshold)
+            )
         
         # 初始化分析服务
-        analyzer_service = AnalyzerService(db_manager, model_service)
+        analyzer_service = AnalyzerService(db_manager, model_service, label_cache, prefilter=prefilter, shard=shard,
+                                           near_duplicates=near_duplicates)
+        if near_duplicates is not None and near_duplicates.size == 0:
+            analyzer_service.seed_near_duplicates(args.project_code, args.solution, args.model)
+        if shard is not None:
+            logger.info(f"哈希分片: {shard.name}")
+            token_counter.set_section("shard", {"name": shard.name, "index": shard.index, "count": shard.count})
         
-        if args.single:
+        if args.estimate:
+            # 成本预估 - 与批量模式选取相同的评论，只在本地计算token
+            if args.sample_rate > 0:
+                sampler = StratifiedSampler(db_manager, analyzer_service.label_status, rate=args.sample_rate, seed=args.sample_seed)
+                reviews = analyzer_service.get_sampled_reviews(sampler, args.project_code, args.solution)
+            else:
+                reviews = analyzer_service.get_unprocessed_reviews(args.project_code, args.solution, limit=args.limit)
+            logger.info(f"成本预估: {len(reviews)} 条未处理的评论 (模型: {args.model}, 合并条数: {args.pack_size})")
+            estimator = CostEstimator("1_first_label")
+            analyzer_service.estimate_cost(reviews, estimator, model=args.model, pack_size=args.pack_size)
+            estimator.save_report(log=logger)
+        elif args.single:
             # 单评论模式 - 随机选择一条评论进行分析
             result = analyzer_service.analyze_single_review(model=args.model)
             logger.info(f"单评论分析结果: {json.dumps(mongo_doc_to_json_dict(result), ensure_ascii=False, indent=2)}")
-        else:
-            # 获取未处理的评论
-            unprocessed_reviews = analyzer_service.get_unprocessed_reviews(
+        elif args.retrieval:
+            # 全量打标模式 - 从大模型标注样本构建标签样本库，对未处理评论向量召回打标
+            if args.library_solution == args.solution:
+                logger.error("全量打标的结果方案(--solution)需与样本库方案(--library-solution)不同")
+                return
+            library = TagLibrary.load_or_build(
+                lambda: db_manager.iter_documents(
+                    DB_CONFIG["collections"]["llm_results"],
+                    {
+                        "project_code": args.project_code,
+                        "solution": args.library_solution,
+                        "label_source": {"$ne": TAG_LIBRARY_CONFIG["label_source"]}
+                    }
+                ),
+                project_code=args.project_code,
+                solution=args.library_solution,
+                rebuild=args.rebuild_library
+            )
+            analyzer_service.analyze_reviews_retrieval(
+                library,
+                project_code=args.project_code,
+                solution=args.solution,
+                limit=args.limit,
+                test_mode=args.test_mode
+            )
+        elif args.follow:
+            # 持续标注模式 - 监听新写入的评论，按微批标注
+            follower = ReviewFollower(
+                db_manager,
+                analyzer_service.label_status,
+                project_code=args.project_code,
+                solution=args.solution,
+                mode=args.follow_mode,
+                shard=shard,
+                config=dict(FOLLOW_CONFIG, batch_size=args.follow_batch, poll_interval=args.poll_interval),
+                test_mode=args.test_mode
+            )
+            analyzer_service.analyze_reviews_follow(
+                follower,
+                max_workers=args.workers,
+                model=args.model,
+                test_mode=args.test_mode,
+                pack_size=args.pack_size
+            )
+        elif args.distributed:
+            # 分布式模式 - 通过租约领取评论，多节点互不重复
+            work_queue = ReviewLeaseQueue(
+                analyzer_service.label_status,
+                project_code=args.project_code,
+                solution=args.solution,
+                worker_id=args.worker_id,
+                batch_size=args.lease_batch,
+                lease_seconds=args.lease_seconds,
+                renew_interval=max(1, args.lease_seconds // 5)
+            )
+            analyzer_service.analyze_reviews_distributed(
+                work_queue,
+                limit=args.limit,
+                max_workers=args.workers,
+                model=args.model,
+                test_mode=args.test_mode,
+                pack_size=args.pack_size
+            )
+        elif args.stream:
+            # 流式模式 - 结果在处理过程中直接写入数据库，不在内存中汇总
+            analyzer_service.analyze_reviews_stream(
                 project_code=args.project_code,
                 solution=args.solution,
-                limit=args.limit
+                limit=args.limit,
+                max_workers=args.workers,
+                model=args.model,
+                test_mode=args.test_mode,
+                pack_size=args.pack_size,
+                queue_size=args.queue_size
             )
+        else:
+            if args.sample_rate > 0:
+                # 分层抽样 - 每层按比例抽取未处理的评论
+                sampler = StratifiedSampler(db_manager, analyzer_service.label_status, rate=args.sample_rate, seed=args.sample_seed)
+                unprocessed_reviews = analyzer_service.get_sampled_reviews(sampler, args.project_code, args.solution)
+            else:
+                # 获取未处理的评论
+                unprocessed_reviews = analyzer_service.get_unprocessed_reviews(
+                    project_code=args.project_code,
+                    solution=args.solution,
+                    limit=args.limit
+                )
             
             if not unprocessed_reviews:
                 logger.warning(f"没有找到未处理的评论，项目编号: {args.project_code}, 解决方案: {args.solution}")
@@ -758,37 +3940,80 @@ def main():
             logger.info(f"找到 {len(unprocessed_reviews)} 条未处理的评论")
             
             # 批量处理评论
-            results = analyzer_service.analyze_reviews_batch(
-                reviews=unprocessed_reviews,
-                max_workers=args.workers,
-                model=args.model,
-                solution=args.solution,
-                project_code=args.project_code,
-                test_mode=args.test_mode
-            )
+            if args.engine == "async":
+                results = analyzer_service.analyze_reviews_batch_async(
+                    reviews=unprocessed_reviews,
+                    concurrency=args.concurrency,
+                    model=args.model,
+                    solution=args.solution,
+                    project_code=args.project_code,
+                    test_mode=args.test_mode,
+                    pack_size=args.pack_size
+                )
+            else:
+                results = analyzer_service.analyze_reviews_batch(
+                    reviews=unprocessed_reviews,
+                    max_workers=args.workers,
+                    model=args.model,
+                    solution=args.solution,
+                    project_code=args.project_code,
+                    test_mode=args.test_mode,
+                    pack_size=args.pack_size
+                )
             
             # 处理结果
             if results:
-                # 转换为DataFrame
+                # 转换为话题表和用户画像表
                 topic_df = analyzer_service.process_analysis_results(results)
+                profile_df = analyzer_service.process_user_profiles(results)
                 
                 # 输出统计信息
-                logger.info(f"话题分布情况:\n{topic_df['topic'].value_counts()}")
-                logger.info(f"情感分布情况:\n{topic_df['polarity'].value_counts()}")
-                
-                # 确保输出目录存在
-                os.makedirs("outputs", exist_ok=True)
+                if not topic_df.empty:
+                    logger.info(f"话题分布情况:\n{topic_df['topic'].value_counts()}")
+                    logger.info(f"情感分布情况:\n{topic_df['polarity'].value_counts()}")
                 
-                # 保存结果到CSV
-                output_csv = f"outputs/1_初打标_v{args.project_code}_{args.model}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-                topic_df.to_csv(output_csv, index=False, encoding='utf-8-sig')
-                logger.info(f"结果已保存到: {output_csv}")
+                # 保存结果
+                output_paths = analyzer_service.save_analysis_tables(
+                    {"话题": topic_df, "画像": profile_df},
+                    name=f"v{args.project_code}_{args.model}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                    output_format=args.output_format
+                )
+                logger.info(f"结果已保存到: {', '.join(output_paths)}")
     except Exception as e:
         logger.error(f"程序执行过程中发生错误: {str(e)}")
         logger.error(traceback.format_exc())
     finally:
-        # 保存token使用报告
-        token_counter.save_report()
+        # 写入缓冲区中剩余的结果（包括Ctrl-C中断时）
+        if 'analyzer_service' in locals():
+            analyzer_service.result_writer.close()
+        
+        # 记录限流统计
+        if locals().get('rate_limiter') is not None:
+            token_counter.set_section("rate_limiter", rate_limiter.get_stats())
+        
+        # 记录级联模型路由统计
+        if locals().get('cascade') is not None:
+            token_counter.set_section("cascade", cascade.get_stats())
+        
+        # 记录截止时间与对冲统计
+        if 'hedger' in locals():
+            token_counter.set_section("hedging", hedger.get_stats())
+        
+        # 记录HTTP连接池统计
+        if locals().get('model_service') is not None:
+            token_counter.set_section("http_pool", connection_metrics.get_stats())
+        
+        # 记录近似重复索引状态
+        if locals().get('near_duplicates') is not None:
+            token_counter.set_section("near_duplicate_index", {
+                "size": near_duplicates.size,
+                "threshold": near_duplicates.config["threshold"],
+                "path": near_duplicates.path
+            })
+        
+        # 保存token使用报告（成本预估不产生调用，保留上次运行的报告）
+        if not args.estimate:
+            token_counter.save_report()
         
         # 关闭数据库连接
         if 'db_manager' in locals():
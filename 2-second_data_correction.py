@@ -24,9 +24,13 @@ import pymongo
 from typing import Dict, Any, List, Set, Tuple
 from collections import Counter
 from datetime import datetime
-from openai import OpenAI
+from openai_client import create_openai_client, proxy_url, connection_metrics
 from sentence_transformers import SentenceTransformer
 from prompts import *
+from llm_cache import response_cache, LLMCacheMissError, LLM_CACHE_CONFIG
+from vector_index import open_text_index, top_k, VECTOR_INDEX_CONFIG
+from usage_metrics import UsageMetrics
+from cost_estimator import CostEstimator, usage_cost
 
 # 默认配置
 DEFAULT_CONFIG = {
@@ -40,7 +44,9 @@ DEFAULT_CONFIG = {
     },
     "openai": {
         "api_key_env": "OPEN_AI_KEY",
+        "base_url": None,  # API地址，None表示官方地址（或环境变量OPENAI_BASE_URL）；压测时可指向mock_openai_server
         "proxy": {
+            "enabled": True,  # 访问本地模拟服务等无需代理时关闭
             "url": "http://127.0.0.1",
             "port": 6465
         }
@@ -50,6 +56,10 @@ DEFAULT_CONFIG = {
         "default_llm_model": "gpt-3.5-turbo",
         "embedding_model": "BAAI/bge-base-zh"
     },
+    "vector_index": {
+        "index_dir": VECTOR_INDEX_CONFIG["index_dir"],  # 共享文本向量索引目录，已向量化的文本不再重复计算
+        "dtype": VECTOR_INDEX_CONFIG["dtype"]
+    },
     "project_code": "kinyo-data-10",
     "solution": "AI自动打标",
     "logging": {
@@ -62,6 +72,17 @@ DEFAULT_CONFIG = {
     "product_type": "扩音器"
 }
 
+# 用户画像字段及其分类类型（完整矫正流程使用）
+PROFILE_FIELDS_CONFIG = {
+    "gender": "性别",
+    "occupation": "职业",
+    "consumption_scene": "用户消费场景",
+    "consumption_frequency": "用户购买情况：首次|二次|多次",
+    "consumption_thrill_point": "产品给用户带来的超出预期的即时满足的特点",
+    "consumption_pain_point": "产品给用户带来的不得不解决的问题",
+    "consumption_itch_point": "产品给用户带来的不解决也行，但解决更爽的欲望"
+}
+
 ###################
 # 日志系统
 ###################
@@ -110,15 +131,10 @@ logger = setup_logger(DEFAULT_CONFIG["logging"]["log_file"], DEFAULT_CONFIG["log
 ###################
 
 class TokenCounter:
-    """Token使用统计类"""
+    """Token使用统计类（线程/协程安全，按线程分片记录，生成报告时合并）"""
     
     def __init__(self, project_code: str = DEFAULT_CONFIG["project_code"]):
-        self.total_tokens = 0
-        self.call_count = 0
-        self.token_by_model = {}
-        self.token_by_operation = {}
-        self.prompt_tokens = 0
-        self.completion_tokens = 0
+        self.metrics = UsageMetrics()
         self.start_time = datetime.now()
         self.project_code = project_code
         
@@ -133,63 +149,66 @@ class TokenCounter:
             completion_tokens: 生成token数量
         """
         if tokens:
-            self.total_tokens += tokens
-            self.call_count += 1
-            
-            # 记录提示词和生成token
-            if prompt_tokens is not None:
-                self.prompt_tokens += prompt_tokens
-            if completion_tokens is not None:
-                self.completion_tokens += completion_tokens
-            
-            # 按模型统计
-            if model in self.token_by_model:
-                self.token_by_model[model] += tokens
-            else:
-                self.token_by_model[model] = tokens
-            
-            # 按操作类型统计
-            if operation in self.token_by_operation:
-                self.token_by_operation[operation] += tokens
-            else:
-                self.token_by_operation[operation] = tokens
-            
+            self.metrics.add_usage(tokens, model, operation, prompt_tokens, completion_tokens)
             logger.debug(f"使用 {tokens} tokens ({model}, {operation})")
+    
+    def add_latency(self, seconds: float, operation: str = "default", model: str = ""):
+        """添加单次API调用耗时记录
+        
+        Args:
+            seconds: 调用耗时（秒）
+            operation: 操作类型
+            model: 使用的模型名称
+        """
+        self.metrics.add_latency(seconds, operation, model)
+    
+    def add_retry(self, operation: str, error: Exception = None):
+        """添加一次API调用重试记录"""
+        self.metrics.add_retry(operation, error)
+    
+    def add_error(self, operation: str, error: Exception):
+        """添加一次API调用最终失败记录"""
+        self.metrics.add_error(operation, error)
                 
     def get_report(self) -> Dict[str, Any]:
         """获取使用报告"""
         end_time = datetime.now()
         duration = (end_time - self.start_time).total_seconds()
+        snapshot = self.metrics.snapshot()
+        total_tokens = snapshot["total_tokens"]
+        call_count = snapshot["call_count"]
+        prompt_tokens = snapshot["prompt_tokens"]
+        completion_tokens = snapshot["completion_tokens"]
         
         # 如果没有明确记录提示词和生成token，则估算
-        if self.prompt_tokens == 0 and self.completion_tokens == 0 and self.total_tokens > 0:
+        if prompt_tokens == 0 and completion_tokens == 0 and total_tokens > 0:
             # 假设提示词占70%，生成占30%
-            self.prompt_tokens = int(self.total_tokens * 0.7)
-            self.completion_tokens = self.total_tokens - self.prompt_tokens
+            prompt_tokens = int(total_tokens * 0.7)
+            completion_tokens = total_tokens - prompt_tokens
         
-        # 计算成本估算（基于gpt-3.5-turbo价格）
-        input_cost = round(self.prompt_tokens * 0.0000015, 6)
-        output_cost = round(self.completion_tokens * 0.000002, 6)
-        total_cost = round(input_cost + output_cost, 6)
+        # 按价格表计算各模型的成本
+        cost_estimate = usage_cost(snapshot["usage_by_model"])
         
         return {
-            "total_tokens": self.total_tokens,
-            "call_count": self.call_count,
-            "average_tokens_per_call": round(self.total_tokens / self.call_count if self.call_count > 0 else 0, 1),
-            "tokens_by_model": self.token_by_model,
-            "tokens_by_operation": self.token_by_operation,
+            "total_tokens": total_tokens,
+            "call_count": call_count,
+            "average_tokens_per_call": round(total_tokens / call_count if call_count > 0 else 0, 1),
+            "tokens_by_model": snapshot["tokens_by_model"],
+            "tokens_by_operation": snapshot["tokens_by_operation"],
             "duration_seconds": round(duration, 6),
             "start_time": self.start_time.isoformat(),
             "end_time": end_time.isoformat(),
             "report_time": datetime.now().isoformat(),
             "project_code": self.project_code,
-            "prompt_tokens": self.prompt_tokens,
-            "completion_tokens": self.completion_tokens,
-            "cost_estimate": {
-                "input_cost": input_cost,
-                "output_cost": output_cost,
-                "total_cost": total_cost
-            }
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_stats": snapshot["latency"]["overall"],
+            "latency_by_operation": snapshot["latency"]["by_operation"],
+            "retries": snapshot["retries"],
+            "errors": snapshot["errors"],
+            "llm_response_cache": response_cache.get_stats(),
+            "http_pool": connection_metrics.get_stats(),
+            "cost_estimate": cost_estimate
         }
         
     def save_report(self, output_file: str = None):
@@ -237,11 +256,16 @@ def api_call_with_retry(max_retries=3, initial_delay=1):
             while retries <= max_retries:
                 try:
                     return func(*args, **kwargs)
+                except LLMCacheMissError:
+                    # replay-only模式下缓存未命中，重试没有意义
+                    raise
                 except Exception as e:
                     retries += 1
                     if retries > max_retries:
                         logger.error(f"API调用失败，已达到最大重试次数: {func.__name__}, 错误: {str(e)}")
+                        token_counter.add_error(func.__name__, e)
                         raise
+                    token_counter.add_retry(func.__name__, e)
                     
                     logger.warning(f"API调用失败，准备第{retries}次重试: {func.__name__}, 错误: {str(e)}")
                     # 指数退避策略
@@ -262,16 +286,10 @@ class DataCorrectionTool:
         config: 配置信息，如果为None则使用默认配置
         """
         self.config = config or DEFAULT_CONFIG
-        self._setup_environment()
+        self._encoders = {}
         self._connect_mongodb()
         self._init_openai_client()
         
-    def _setup_environment(self):
-        """设置环境变量，如代理等"""
-        proxy_config = self.config["openai"]["proxy"]
-        os.environ['http_proxy'] = f'{proxy_config["url"]}:{proxy_config["port"]}'
-        os.environ['https_proxy'] = f'{proxy_config["url"]}:{proxy_config["port"]}'
-        
     def _connect_mongodb(self):
         """连接MongoDB数据库"""
         mongodb_config = self.config["mongodb"]
@@ -282,15 +300,83 @@ class DataCorrectionTool:
         self.data_result_collection = self.db[mongodb_config["data_result_collection"]]
         
     def _init_openai_client(self):
-        """初始化OpenAI客户端"""
-        self.client = OpenAI(api_key=os.getenv(self.config["openai"]["api_key_env"]))
+        """初始化OpenAI客户端（共用连接池，代理按客户端设置，不修改进程环境变量）"""
+        self.client = create_openai_client(
+            api_key=os.getenv(self.config["openai"]["api_key_env"]),
+            base_url=self.config["openai"].get("base_url"),
+            proxy=proxy_url(self.config["openai"]["proxy"])
+        )
         
-    def _cosine_sim(self, a, b):
-        """计算两个向量的余弦相似度"""
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    def _embed(self, texts: List[str], embedding_model: str) -> np.ndarray:
+        """
+        获取文本向量，优先从本地向量索引读取，只对新文本调用向量化模型
+        
+        参数:
+        texts: 文本列表
+        embedding_model: 向量化模型名称
+        
+        返回:
+        ndarray: 与texts一一对应的单位向量
+        """
+        index_config = self.config.get("vector_index", DEFAULT_CONFIG["vector_index"])
+        index = open_text_index(embedding_model, index_config["index_dir"], index_config["dtype"])
+        
+        def encode(missing_texts):
+            if embedding_model not in self._encoders:
+                self._encoders[embedding_model] = SentenceTransformer(embedding_model)
+            return self._encoders[embedding_model].encode(missing_texts, normalize_embeddings=True)
+        
+        return index.ensure(texts, encode)
+    
+    def _assign_categories(self, texts: List[str], category_names: List[str], embedding_model: str) -> List[str]:
+        """
+        按向量相似度将文本归入最相近的标准分类
+        
+        参数:
+        texts: 原始文本列表
+        category_names: 标准分类列表
+        embedding_model: 向量化模型名称
+        
+        返回:
+        list: 与texts一一对应的归属分类
+        """
+        if not texts:
+            return []
+        category_vecs = self._embed(category_names, embedding_model)
+        text_vecs = self._embed(texts, embedding_model)
+        best_idx, _ = top_k(text_vecs, category_vecs, 1)
+        return [category_names[i] for i in best_idx[:, 0]]
 
 
     
+    @staticmethod
+    def _build_category_request(origin_category: str, category_type: str, is_product_topic: bool, model: str) -> Dict[str, Any]:
+        """
+        构建获取标准分类的请求参数（成本预估按同样的参数计算token和查询响应缓存）
+        
+        参数:
+        origin_category: 原始分类信息，逗号分隔的字符串
+        category_type: 分类类型
+        is_product_topic: 是否为商品话题分类
+        model: 使用的模型
+        
+        返回:
+        Dict: chat.completions.create的请求参数
+        """
+        if is_product_topic:
+            prompt = product_topic_classification_prompt(origin_category, category_type)
+        else:
+            prompt = user_profile_classification_prompt(origin_category, category_type)
+        return {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": "你是一个专业的分类专家"},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": False,
+            "response_format": {'type': 'json_object'}
+        }
+    
     @timer_decorator
     @api_call_with_retry(max_retries=3, initial_delay=2)
     def get_category_from_llm(self, origin_category: str, category_type: str, 
@@ -313,20 +399,11 @@ class DataCorrectionTool:
         operation_type = "product_topic_classification" if is_product_topic else "user_profile_classification"
         logger.info(f"开始获取{category_type}标准分类，使用模型: {model}")
             
-        if is_product_topic:
-            prompt = product_topic_classification_prompt(origin_category, category_type)
-        else:
-            prompt = user_profile_classification_prompt(origin_category, category_type)
-        
         try:
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的分类专家"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-                response_format={'type': 'json_object'}
+            call_start = time.perf_counter()
+            response, cache_hit = response_cache.create(
+                self.client,
+                **self._build_category_request(origin_category, category_type, is_product_topic, model)
             )
 
             # 获取token消耗数量
@@ -334,14 +411,16 @@ class DataCorrectionTool:
             prompt_tokens = response.usage.prompt_tokens if hasattr(response, 'usage') else 0
             completion_tokens = response.usage.completion_tokens if hasattr(response, 'usage') else 0
             
-            # 添加到token统计
-            token_counter.add_usage(
-                tokens=token_usage,
-                model=model,
-                operation=operation_type,
-                prompt_tokens=prompt_tokens,
-                completion_tokens=completion_tokens
-            )
+            # 添加到token统计（缓存命中不产生实际消耗）
+            if not cache_hit:
+                token_counter.add_usage(
+                    tokens=token_usage,
+                    model=model,
+                    operation=operation_type,
+                    prompt_tokens=prompt_tokens,
+                    completion_tokens=completion_tokens
+                )
+                token_counter.add_latency(time.perf_counter() - call_start, operation_type, model)
             
             # 解析内容
             content = response.choices[0].message.content
@@ -350,8 +429,10 @@ class DataCorrectionTool:
             parsed_content['prompt_tokens'] = prompt_tokens
             parsed_content['completion_tokens'] = completion_tokens
             
-            logger.info(f"成功获取{category_type}标准分类，使用模型: {model}, 消耗tokens: {token_usage}")
+            logger.info(f"成功获取{category_type}标准分类，使用模型: {model}, 消耗tokens: {token_usage}{'（缓存命中）' if cache_hit else ''}")
             return parsed_content
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             logger.error(f"调用LLM获取{category_type}标准分类失败: {str(e)}")
             logger.debug(traceback.format_exc())
@@ -405,6 +486,15 @@ class DataCorrectionTool:
 
         return result
     
+    @staticmethod
+    def _profile_values(profile_stats: Dict, field_name: str) -> List[str]:
+        """从画像统计中取出字段的非空原始取值"""
+        return [
+            str(item[field_name])
+            for item in profile_stats[field_name]
+            if item[field_name] is not None and str(item[field_name]).strip() != ''
+        ]
+    
     @timer_decorator
     def normalize_user_profile_field(self, field_name: str, category_type: str, 
                                     profile_stats: Dict, project_code: str = None, 
@@ -437,11 +527,7 @@ class DataCorrectionTool:
         logger.info(f"开始处理用户画像字段: {field_name} ({category_type})")
             
         # 1. 获取原始数据列表并过滤掉None值和非字符串值
-        original_list = [
-            str(item[field_name])
-            for item in profile_stats[field_name]
-            if item[field_name] is not None and str(item[field_name]).strip() != ''
-        ]
+        original_list = self._profile_values(profile_stats, field_name)
         
         logger.info(f"已获取 {len(original_list)} 个原始{category_type}类别")
         
@@ -462,25 +548,18 @@ class DataCorrectionTool:
         logger.info(f"获取到 {len(category_names)} 个标准{category_type}分类: {', '.join(category_names)}")
         print(f"重新的{category_type}分类：", category_names)
         
-        # 3. 向量化
-        logger.info(f"开始使用模型 {embedding_model} 进行向量化")
-        model = SentenceTransformer(embedding_model)
-        category_vecs = model.encode(category_names)
-        original_vecs = model.encode(original_list)
+        # 3. 向量化并按相似度归类
+        logger.info(f"开始使用模型 {embedding_model} 进行向量化和相似度归类")
+        assigned_categories = self._assign_categories(original_list, category_names, embedding_model)
         logger.info("向量化完成")
         
-        # 4. 相似度归类
-        logger.info("开始进行相似度归类")
+        # 4. 更新归类结果
         results = []
         update_count = 0
         empty_count = 0
         
-        for orig, orig_vec in zip(original_list, original_vecs):
+        for orig, assigned_category in zip(original_list, assigned_categories):
             if orig.strip() != '':
-                # 非空值，计算相似度
-                sims = [self._cosine_sim(orig_vec, cat_vec) for cat_vec in category_vecs]
-                idx = np.argmax(sims)
-                assigned_category = category_names[idx]
                 results.append({"原始类别": orig, "归属类别": assigned_category})
                 
                 # 更新MongoDB
@@ -516,6 +595,17 @@ class DataCorrectionTool:
         logger.info(f"{category_type}字段处理完成")
         return df
     
+    def _collect_topics(self, project_code: str, solution: str) -> List[str]:
+        """收集第一阶段结果中所有不同的非空话题"""
+        pipeline = [
+            {"$match": {"project_code": project_code, "solution": solution}},
+            {"$unwind": "$product_topic_result"},
+            {"$group": {"_id": "$product_topic_result.topic"}}
+        ]
+        
+        topic_results = list(self.llm_results_collection.aggregate(pipeline))
+        return [str(doc["_id"]) for doc in topic_results if doc["_id"] is not None and str(doc["_id"]).strip() != '']
+    
     @timer_decorator
     def normalize_product_topics(self, product_type: str = DEFAULT_CONFIG["product_type"], project_code: str = None, 
                                 solution: str = None, model_name: str = None,
@@ -546,14 +636,7 @@ class DataCorrectionTool:
             
         # 1. 收集所有不同的topic
         logger.info(f"开始从 MongoDB 收集原始话题分类，项目编号: {project_code}, 解决方案: {solution}")
-        pipeline = [
-            {"$match": {"project_code": project_code, "solution": solution}},
-            {"$unwind": "$product_topic_result"},
-            {"$group": {"_id": "$product_topic_result.topic"}}
-        ]
-        
-        topic_results = list(self.llm_results_collection.aggregate(pipeline))
-        original_topics = [str(doc["_id"]) for doc in topic_results if doc["_id"] is not None and str(doc["_id"]).strip() != '']
+        original_topics = self._collect_topics(project_code, solution)
         
         logger.info(f"已收集 {len(original_topics)} 个原始话题分类")
         
@@ -575,24 +658,17 @@ class DataCorrectionTool:
         logger.info(f"获取到 {len(category_names)} 个标准话题分类: {', '.join(category_names)}")
         print(f"重新的商品话题分类：", category_names)
         
-        # 3. 向量化
-        logger.info(f"开始使用模型 {embedding_model} 进行向量化")
-        model = SentenceTransformer(embedding_model)
-        category_vecs = model.encode(category_names)
-        topic_vecs = model.encode(original_topics)
+        # 3. 向量化并按相似度归类
+        logger.info(f"开始使用模型 {embedding_model} 进行向量化和相似度归类")
+        assigned_categories = self._assign_categories(original_topics, category_names, embedding_model)
         logger.info("向量化完成")
         
-        # 4. 相似度归类
-        logger.info("开始进行相似度归类")
+        # 4. 整理归类结果
         results = []
         topic_mapping = {}  # 用于存储映射关系
         
-        for topic, topic_vec in zip(original_topics, topic_vecs):
+        for topic, assigned_category in zip(original_topics, assigned_categories):
             if topic.strip() != '':
-                # 非空值，计算相似度
-                sims = [self._cosine_sim(topic_vec, cat_vec) for cat_vec in category_vecs]
-                idx = np.argmax(sims)
-                assigned_category = category_names[idx]
                 results.append({"原始话题": topic, "归属类别": assigned_category})
                 topic_mapping[topic] = assigned_category
         
@@ -647,15 +723,7 @@ class DataCorrectionTool:
         Dict: 包含每个字段处理结果的字典
         """
         if fields_config is None:
-            fields_config = {
-                "gender": "性别",
-                "occupation": "职业",
-                "consumption_scene": "用户消费场景",
-                "consumption_frequency": "用户购买情况：首次|二次|多次",
-                "consumption_thrill_point": "产品给用户带来的超出预期的即时满足的特点",
-                "consumption_pain_point": "产品给用户带来的不得不解决的问题",
-                "consumption_itch_point": "产品给用户带来的不解决也行，但解决更爽的欲望"
-            }
+            fields_config = PROFILE_FIELDS_CONFIG
             
         # 获取用户画像统计信息
         fields = list(fields_config.keys())
@@ -677,6 +745,42 @@ class DataCorrectionTool:
             
         return results
     
+    def estimate_cost(self, estimator: CostEstimator, fields_config: Dict[str, str], product_type: str = None,
+                      model_name: str = None) -> Dict[str, Any]:
+        """
+        预估画像字段和商品话题标准分类的调用次数、token和成本，不调用API
+        
+        参数:
+        estimator: 成本预估器
+        fields_config: 需要处理的画像字段，键为字段名，值为分类类型；为空时不处理画像字段
+        product_type: 产品类型，None表示不处理商品话题
+        model_name: 使用的LLM模型，默认使用配置中的模型
+        
+        返回:
+        Dict: 预估报告
+        """
+        if model_name is None:
+            model_name = self.config["models"]["default_llm_model"]
+        project_code = self.config["project_code"]
+        solution = self.config["solution"]
+        
+        # 与实际运行相同，从第一阶段结果收集原始分类构建请求
+        if fields_config:
+            profile_stats = self.get_profile_stats(list(fields_config.keys()))
+            for field_name, category_type in fields_config.items():
+                original_list = self._profile_values(profile_stats, field_name)
+                estimator.add(
+                    "user_profile_classification",
+                    self._build_category_request(",".join(original_list), category_type, False, model_name)
+                )
+        if product_type is not None:
+            original_topics = self._collect_topics(project_code, solution)
+            estimator.add(
+                "product_topic_classification",
+                self._build_category_request(",".join(original_topics), product_type, True, model_name)
+            )
+        return estimator.get_report()
+    
     def run_full_correction(self, product_type: str = "扩音器", model_name: str = None) -> Dict[str, Any]:
         """
         运行完整的数据矫正流程
@@ -728,6 +832,16 @@ def main():
                         help='指定token使用报告输出文件路径')
     parser.add_argument('--model', type=str, default=DEFAULT_CONFIG["models"]["default_llm_model"],
                         help=f'LLM模型，默认: {DEFAULT_CONFIG["models"]["default_llm_model"]}')
+    parser.add_argument('--llm-cache', type=str, choices=LLM_CACHE_CONFIG["modes"], default=LLM_CACHE_CONFIG["default_mode"],
+                        help='LLM响应缓存模式：read-write读写缓存，replay-only只读缓存且未命中即失败，off不使用，'
+                             f'默认: {LLM_CACHE_CONFIG["default_mode"]}')
+    parser.add_argument('--base-url', type=str, default=DEFAULT_CONFIG["openai"]["base_url"],
+                        help='OpenAI兼容API地址，如本地模拟服务 http://127.0.0.1:8765/v1，默认使用官方地址')
+    parser.add_argument('--no-proxy', action='store_true', default=not DEFAULT_CONFIG["openai"]["proxy"]["enabled"],
+                        help='不设置HTTP代理')
+    
+    parser.add_argument('--estimate', action='store_true',
+                        help='成本预估：按所选模式从第一阶段结果构建实际请求，在本地计算token和成本，不调用API、不更新数据')
     
     args = parser.parse_args()
     
@@ -738,10 +852,15 @@ def main():
         config["solution"] = args.solution
         config["product_type"] = args.product_type
         config["models"]["default_llm_model"] = args.model
+        config["openai"]["base_url"] = args.base_url
+        config["openai"]["proxy"]["enabled"] = not args.no_proxy
         
         # 更新token计数器的项目编号
         token_counter.project_code = args.project_code
         
+        # 配置LLM响应缓存
+        response_cache.configure(args.llm_cache)
+        
         logger.info(f"项目编号: {args.project_code}, 解决方案: {args.solution}")
         logger.info(f"处理模式: {args.mode}, 产品类型: {args.product_type}")
         logger.info(f"LLM模型: {args.model}")
@@ -750,7 +869,25 @@ def main():
         tool = DataCorrectionTool(config)
         
         # 根据模式执行不同的处理
-        if args.mode == 'all':
+        if args.estimate:
+            if args.mode == 'product_topic':
+                fields_config = {}
+            elif args.mode == 'user_profile' and args.field:
+                if args.field not in PROFILE_FIELDS_CONFIG:
+                    logger.error(f"错误: 未知的字段 '{args.field}'")
+                    return
+                fields_config = {args.field: PROFILE_FIELDS_CONFIG[args.field]}
+            else:
+                fields_config = PROFILE_FIELDS_CONFIG
+            estimator = CostEstimator("2_second_data_correction")
+            tool.estimate_cost(
+                estimator,
+                fields_config=fields_config,
+                product_type=args.product_type if args.mode in ('all', 'product_topic') else None,
+                model_name=args.model
+            )
+            estimator.save_report(log=logger)
+        elif args.mode == 'all':
             logger.info("开始执行完整矫正流程")
             results = tool.run_full_correction(
                 product_type=args.product_type,
@@ -801,8 +938,9 @@ def main():
         logger.error(f"程序执行过程中发生错误: {str(e)}")
         logger.error(traceback.format_exc())
     finally:
-        # 保存token使用报告
-        token_counter.save_report(args.token_report)
+        # 保存token使用报告（成本预估不产生调用，保留上次运行的报告）
+        if not args.estimate:
+            token_counter.save_report(args.token_report)
         
         # 记录结束时间
         end_time = datetime.now()
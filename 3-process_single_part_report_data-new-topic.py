@@ -1,6 +1,10 @@
 import logging
 import os
 from prompts import *
+from llm_cache import response_cache, LLMCacheMissError, LLM_CACHE_CONFIG
+from rate_limiter import AdaptiveRateLimiter, RateLimitedClient, RATE_LIMIT_CONFIG
+from cost_estimator import CostEstimator, COST_CONFIG, compute_cost, split_total_tokens
+from openai_client import create_openai_client, proxy_url, connection_metrics
 
 # 日志配置
 LOG_CONFIG = {
@@ -76,7 +80,9 @@ def get_config():
                 "completion": "gpt-3.5-turbo",
                 "embedding": "BAAI/bge-base-zh"
             },
+            "base_url": None,  # API地址，None表示官方地址（或环境变量OPENAI_BASE_URL）；压测时可指向mock_openai_server
             "proxy": {
+                "enabled": True,  # 访问本地模拟服务等无需代理时关闭
                 "url": "http://127.0.0.1",
                 "port": 6465  # 注意：请替换为你自己的端口
             }
@@ -207,6 +213,11 @@ class DataProcessor:
         self.config = config if config else get_config()
         self.experiment = self.config["experiment"]
     
+    @staticmethod
+    def _weight(doc):
+        """文档的统计权重：分层抽样标注的结果按抽样权重加权，其余为1"""
+        return (doc.get("sampling") or {}).get("weight", 1)
+    
     def profile_stats(self, fields, total_reviews):
         """统计用户画像数据"""
         query = {
@@ -223,7 +234,7 @@ class DataProcessor:
             user_profile = doc.get("user_profile", {})
             for field in fields:
                 value = user_profile.get(field, "")
-                field_counters[field][value] += 1
+                field_counters[field][value] += self._weight(doc)
         
         # 组织结果
         result = {}
@@ -251,14 +262,15 @@ class DataProcessor:
         stats = {}  # {new_topic: {"好评": count, "差评": count，"中评": count，"总数": count}}
         
         for doc in cursor:
+            weight = self._weight(doc)
             for topic_item in doc.get("product_topic_result", []):
                 new_topic = topic_item.get("new_topic")
                 polarity = topic_item.get("polarity")
                 if new_topic and polarity in ("好评", "差评", "中评"):
                     if new_topic not in stats:
                         stats[new_topic] = {"好评": 0, "差评": 0, "中评": 0, "总数": 0}
-                    stats[new_topic][polarity] += 1
-                    stats[new_topic]["总数"] += 1
+                    stats[new_topic][polarity] += weight
+                    stats[new_topic]["总数"] += weight
                 # 计算话题的好评占比和中差评占比,话题提及率
                 if stats[new_topic]["总数"] > 0:
                     stats[new_topic]["好评占比"] = stats[new_topic]["好评"] / stats[new_topic]["总数"]
@@ -268,12 +280,30 @@ class DataProcessor:
         return stats
     
     def get_total_reviews(self):
-        """获取评论总数"""
+        """获取评论总数（分层抽样标注的结果按抽样权重折算为全量评论数）
+
+        同一项目/方案下既有抽样结果（带sampling.weight）又有全量标注结果时，加权与不加权的计数
+        混在一起会重复计算已被权重代表的评论，此时拒绝统计。
+        """
         query = {
             "project_code": self.experiment["project_code"],
             "solution": self.experiment["solution"]
         }
-        return self.db_client.get_total_documents("llm_results", query)
+        cursor = self.db_client.find_documents("llm_results", query, {"sampling.weight": 1})
+        total = 0
+        weighted = unweighted = 0
+        for doc in cursor:
+            if (doc.get("sampling") or {}).get("weight") is None:
+                unweighted += 1
+            else:
+                weighted += 1
+            total += self._weight(doc)
+        if weighted and unweighted:
+            message = (f"分析结果中混有分层抽样结果 {weighted} 条和未加权结果 {unweighted} 条，"
+                       f"加权统计会重复计算，请只保留其中一种结果后再生成报告")
+            logger.error(message)
+            raise ValueError(message)
+        return total
 
     # todo：加总处理的评论的token_usage
 
@@ -285,13 +315,12 @@ class SummaryGenerator:
         """初始化摘要生成器"""
         self.config = config if config else get_config()
         
-        # 设置代理
-        proxy_config = self.config["openai"]["proxy"]
-        os.environ['http_proxy'] = f'{proxy_config["url"]}:{proxy_config["port"]}'
-        os.environ['https_proxy'] = f'{proxy_config["url"]}:{proxy_config["port"]}'
-        
-        # 初始化OpenAI客户端
-        self.client = OpenAI(api_key=os.getenv('OPEN_AI_KEY'))
+        # 初始化OpenAI客户端（共用连接池，代理按客户端设置，不修改进程环境变量）
+        self.client = create_openai_client(
+            api_key=os.getenv('OPEN_AI_KEY'),
+            base_url=self.config["openai"].get("base_url"),
+            proxy=proxy_url(self.config["openai"]["proxy"])
+        )
         self.model = self.config["openai"]["models"]["completion"]
         
         # 初始化token计数器
@@ -301,6 +330,9 @@ class SummaryGenerator:
             "total_tokens": 0,
             "calls_count": 0
         }
+        
+        # 成本预估器，设置后只记录请求、不调用API
+        self.estimator = None
     
     def generate_summary(self, reviews, summary_direction, direction_focus):
         """
@@ -322,33 +354,66 @@ class SummaryGenerator:
         prompt = summary_prompt(reviews, summary_direction, direction_focus)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的评论总结专家"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-            )
-            
-            # 记录token使用情况
-            usage = response.usage
-            self.token_usage["prompt_tokens"] += usage.prompt_tokens
-            self.token_usage["completion_tokens"] += usage.completion_tokens
-            self.token_usage["total_tokens"] += usage.total_tokens
-            self.token_usage["calls_count"] += 1
-            
-            # 打印当前调用的token使用情况
-            print(f"本次调用token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
-            
-            return response.choices[0].message.content
+            return self._chat("你是一个专业的评论总结专家", prompt, "本次调用", "generate_summary")
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             print(f"调用大模型总结出错: {e}")
             return None
             
+    def _record_usage(self, response, cache_hit, label):
+        """记录并打印一次调用的token使用情况
+        
+        Args:
+            response: chat.completions响应
+            cache_hit: 响应是否来自LLM响应缓存（命中时不计入token消耗）
+            label: 打印时使用的调用描述
+        """
+        usage = response.usage
+        if cache_hit:
+            self.token_usage["cache_hits"] = self.token_usage.get("cache_hits", 0) + 1
+            print(f"{label}命中LLM响应缓存: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
+            return
+        self.token_usage["prompt_tokens"] += usage.prompt_tokens
+        self.token_usage["completion_tokens"] += usage.completion_tokens
+        self.token_usage["total_tokens"] += usage.total_tokens
+        self.token_usage["calls_count"] += 1
+        
+        # 打印当前调用的token使用情况
+        print(f"{label}token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
+            
     def get_token_usage(self):
         """返回token使用情况统计"""
         return self.token_usage
+    
+    def _chat(self, system_prompt, prompt, label, operation):
+        """发送一次对话请求并记录token使用情况
+        
+        设置了成本预估器时只记录请求，返回与预估输出长度相当的占位文本（后续洞察的提示词会引用前面的结果）。
+        
+        Args:
+            system_prompt: 系统提示词
+            prompt: 用户提示词
+            label: 打印时使用的调用描述
+            operation: 操作名称，用于成本预估
+            
+        Returns:
+            生成的内容
+        """
+        request = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt}
+            ],
+            "stream": False
+        }
+        if self.estimator is not None:
+            return "占" * self.estimator.add(operation, request)
+        
+        response, cache_hit = response_cache.create(self.client, **request)
+        self._record_usage(response, cache_hit, label)
+        return response.choices[0].message.content
         
     def generate_user_profile_insight(self, user_profile_data):
         """
@@ -366,26 +431,9 @@ class SummaryGenerator:
         prompt = user_profile_insight_prompt(top_profile)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的电商数据分析师，擅长精简总结"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-            )
-            
-            # 记录token使用情况
-            usage = response.usage
-            self.token_usage["prompt_tokens"] += usage.prompt_tokens
-            self.token_usage["completion_tokens"] += usage.completion_tokens
-            self.token_usage["total_tokens"] += usage.total_tokens
-            self.token_usage["calls_count"] += 1
-            
-            # 打印当前调用的token使用情况
-            print(f"用户画像洞察生成token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
-            
-            return response.choices[0].message.content
+            return self._chat("你是一个专业的电商数据分析师，擅长精简总结", prompt, "用户画像洞察生成", "user_profile_insight")
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             print(f"调用大模型生成用户画像洞察出错: {e}")
             return None
@@ -435,26 +483,9 @@ class SummaryGenerator:
         prompt = quadrant_insight_prompt(quadrant_topics, avg_mention_rate, avg_satisfaction_rate)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的电商数据分析师，擅长精简总结"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-            )
-            
-            # 记录token使用情况
-            usage = response.usage
-            self.token_usage["prompt_tokens"] += usage.prompt_tokens
-            self.token_usage["completion_tokens"] += usage.completion_tokens
-            self.token_usage["total_tokens"] += usage.total_tokens
-            self.token_usage["calls_count"] += 1
-            
-            # 打印当前调用的token使用情况
-            print(f"四象限分析总结生成token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
-            
-            return response.choices[0].message.content
+            return self._chat("你是一个专业的电商数据分析师，擅长精简总结", prompt, "四象限分析总结生成", "quadrant_insight")
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             print(f"调用大模型生成四象限分析总结出错: {e}")
             return None
@@ -486,26 +517,9 @@ class SummaryGenerator:
         prompt = topic_insight_prompt(topics_stats=topics_stats, topics=topics)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的电商数据分析师，擅长精简总结"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-            )
-            
-            # 记录token使用情况
-            usage = response.usage
-            self.token_usage["prompt_tokens"] += usage.prompt_tokens
-            self.token_usage["completion_tokens"] += usage.completion_tokens
-            self.token_usage["total_tokens"] += usage.total_tokens
-            self.token_usage["calls_count"] += 1
-            
-            # 打印当前调用的token使用情况
-            print(f"话题洞察生成token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
-            
-            return response.choices[0].message.content
+            return self._chat("你是一个专业的电商数据分析师，擅长精简总结", prompt, "话题洞察生成", "topic_insight")
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             print(f"调用大模型生成话题洞察出错: {e}")
             return None
@@ -531,26 +545,9 @@ class SummaryGenerator:
         prompt = overall_insight_prompt(top_profile, topics_stats, topics, user_profile_insight, topic_insight, quadrant_insight)
         
         try:
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": "你是一个专业的电商数据分析师，擅长从数据中发现商业洞察"},
-                    {"role": "user", "content": prompt}
-                ],
-                stream=False,
-            )
-            
-            # 记录token使用情况
-            usage = response.usage
-            self.token_usage["prompt_tokens"] += usage.prompt_tokens
-            self.token_usage["completion_tokens"] += usage.completion_tokens
-            self.token_usage["total_tokens"] += usage.total_tokens
-            self.token_usage["calls_count"] += 1
-            
-            # 打印当前调用的token使用情况
-            print(f"整体洞察生成token使用: 提示词={usage.prompt_tokens}, 生成={usage.completion_tokens}, 总计={usage.total_tokens}")
-            
-            return response.choices[0].message.content
+            return self._chat("你是一个专业的电商数据分析师，擅长从数据中发现商业洞察", prompt, "整体洞察生成", "overall_insight")
+        except LLMCacheMissError:
+            raise
         except Exception as e:
             print(f"调用大模型生成整体洞察出错: {e}")
             return None
@@ -559,9 +556,9 @@ class SummaryGenerator:
 class DataPipelineManager:
     """管理整个数据处理和生成流程"""
     
-    def __init__(self):
+    def __init__(self, config=None):
         """初始化管理器"""
-        self.config = get_config()
+        self.config = config if config else get_config()
         self.db_client = MongoDBClient(self.config)
         self.data_processor = DataProcessor(self.db_client, self.config)
         self.summary_generator = SummaryGenerator(self.config)
@@ -891,10 +888,17 @@ class DataPipelineManager:
         total_tokens = 0
         reviews_count = 0
         
+        self.first_stage_tokens_by_model = {}
         for doc in cursor:
             if "token_usage" in doc:
                 total_tokens += doc["token_usage"]
                 reviews_count += 1
+                # 级联模式下按各档模型的实际消耗计入
+                tokens_by_model = doc.get("cascade", {}).get("tokens_by_tier") or {
+                    doc.get("first_label_model", "default"): doc["token_usage"]
+                }
+                for model, tokens in tokens_by_model.items():
+                    self.first_stage_tokens_by_model[model] = self.first_stage_tokens_by_model.get(model, 0) + tokens
         
         print(f"第一阶段共处理了 {reviews_count} 条评论，总计使用 {total_tokens} tokens")
         return total_tokens
@@ -943,6 +947,13 @@ class DataPipelineManager:
         # 计算总token使用量（第一阶段+第二阶段）
         total_all_stages = token_usage['total_tokens'] + first_stage_tokens
         
+        # 按价格表计算成本（第一阶段按各结果文档记录的标注模型计算）
+        cost = compute_cost(token_usage['prompt_tokens'], token_usage['completion_tokens'], self.result_data['model'])
+        first_stage_cost = round(sum(
+            compute_cost(model=model, **split_total_tokens(tokens))["total_cost"]
+            for model, tokens in self.first_stage_tokens_by_model.items()
+        ), 6)
+        
         token_report = {
             "total_tokens": token_usage['total_tokens'],
             "call_count": token_usage['calls_count'],
@@ -962,12 +973,14 @@ class DataPipelineManager:
             "completion_tokens": token_usage['completion_tokens'],
             "first_stage_tokens": first_stage_tokens,
             "all_stages_total_tokens": total_all_stages,
+            "llm_response_cache": response_cache.get_stats(),
+            "http_pool": connection_metrics.get_stats(),
+            "rate_limiter": self.summary_generator.client.limiter.get_stats() if isinstance(self.summary_generator.client, RateLimitedClient) else None,
             "cost_estimate": {
-                "input_cost": round(token_usage['prompt_tokens'] * 0.0000015, 6),  # 估算输入成本，按照gpt-3.5-turbo价格
-                "output_cost": round(token_usage['completion_tokens'] * 0.000002, 6),  # 估算输出成本
-                "total_cost": round(token_usage['prompt_tokens'] * 0.0000015 + token_usage['completion_tokens'] * 0.000002, 6),  # 总成本
-                "first_stage_cost": round(first_stage_tokens * 0.000003, 6),  # 估算第一阶段成本
-                "all_stages_total_cost": round(token_usage['prompt_tokens'] * 0.0000015 + token_usage['completion_tokens'] * 0.000002 + first_stage_tokens * 0.000003, 6)  # 所有阶段总成本
+                **cost,
+                "first_stage_cost": first_stage_cost,  # 第一阶段只记录了总token数，按提示词/生成比例拆分后计算
+                "all_stages_total_cost": round(cost["total_cost"] + first_stage_cost, 6),  # 所有阶段总成本
+                "currency": COST_CONFIG["currency"]
             }
         }
         
@@ -1059,6 +1072,24 @@ class DataPipelineManager:
         
         print("\n所有洞察总结生成完成")
     
+    def estimate_cost(self, estimator):
+        """预估生成报告的调用次数、token和成本：按实际流程统计数据并构建请求，不调用API、不保存结果
+        
+        Args:
+            estimator: 成本预估器
+            
+        Returns:
+            预估报告
+        """
+        self.summary_generator.estimator = estimator
+        try:
+            self.process_user_profiles()
+            self.process_topics()
+            self.process_insights()
+        finally:
+            self.summary_generator.estimator = None
+        return estimator.get_report()
+    
     def run(self):
         """运行完整的数据处理流程"""
         print("开始数据处理流程...")
@@ -1101,6 +1132,19 @@ def main():
                         help=f'解决方案，默认: {get_config()["experiment"]["solution"]}')
     parser.add_argument('--top_n', type=int, default=get_config()["sampling"]["top_topics_count"], 
                         help=f'话题排名前几的数量，默认: {get_config()["sampling"]["top_topics_count"]}')
+    parser.add_argument('--llm-cache', type=str, choices=LLM_CACHE_CONFIG["modes"], default=LLM_CACHE_CONFIG["default_mode"],
+                        help='LLM响应缓存模式：read-write读写缓存，replay-only只读缓存且未命中即失败，off不使用，'
+                             f'默认: {LLM_CACHE_CONFIG["default_mode"]}')
+    parser.add_argument('--rpm', type=int, default=RATE_LIMIT_CONFIG["rpm"],
+                        help='每分钟请求数上限，与--tpm任一大于0时启用自适应限流，默认不限制')
+    parser.add_argument('--tpm', type=int, default=RATE_LIMIT_CONFIG["tpm"],
+                        help='每分钟token数上限（按prompt预估token预占配额），默认不限制')
+    parser.add_argument('--base-url', type=str, default=get_config()["openai"]["base_url"],
+                        help='OpenAI兼容API地址，如本地模拟服务 http://127.0.0.1:8765/v1，默认使用官方地址')
+    parser.add_argument('--no-proxy', action='store_true', default=not get_config()["openai"]["proxy"]["enabled"],
+                        help='不设置HTTP代理')
+    parser.add_argument('--estimate', action='store_true',
+                        help='成本预估：按实际流程从数据库统计并构建摘要和洞察请求，在本地计算token和成本，不调用API、不保存结果')
     args = parser.parse_args()
     
     # 更新配置
@@ -1109,15 +1153,21 @@ def main():
     config["experiment"]["solution"] = args.solution
     config["openai"]["models"]["completion"] = args.model
     config["sampling"]["top_topics_count"] = args.top_n
+    config["openai"]["base_url"] = args.base_url
+    config["openai"]["proxy"]["enabled"] = not args.no_proxy
     
     logger.info(f"===== 开始执行分析报告生成程序 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} =====")
     logger.info(f"project_code: {args.project_code}")
     logger.info(f"solution: {args.solution}")
     logger.info(f"model: {args.model}")
     logger.info(f"top_n: {args.top_n}")
+    logger.info(f"llm_cache: {args.llm_cache}")
+    
+    # 配置LLM响应缓存
+    response_cache.configure(args.llm_cache)
     
     # 创建并运行数据管道
-    pipeline = DataPipelineManager()
+    pipeline = DataPipelineManager(config)
     # 手动更新 pipeline 的配置
     pipeline.config = config
     pipeline.db_client.config = config
@@ -1125,6 +1175,11 @@ def main():
     pipeline.data_processor.experiment = config["experiment"]
     pipeline.summary_generator.config = config
     pipeline.summary_generator.model = config["openai"]["models"]["completion"]
+    # 启用自适应限流
+    if args.rpm > 0 or args.tpm > 0:
+        pipeline.summary_generator.client = RateLimitedClient(
+            pipeline.summary_generator.client, AdaptiveRateLimiter(rpm=args.rpm, tpm=args.tpm)
+        )
     # 手动更新 top_topics_count 属性
     pipeline.top_topics_count = config["sampling"]["top_topics_count"]
     logger.info(f"pipeline.top_topics_count: {pipeline.top_topics_count}")
@@ -1134,6 +1189,12 @@ def main():
     pipeline.result_data["solution"] = config["experiment"]["solution"]
     pipeline.result_data["model"] = config["openai"]["models"]["completion"]
     pipeline.result_data["top_topics_count"] = config["sampling"]["top_topics_count"]
+    
+    if args.estimate:
+        estimator = CostEstimator("3_single_part_report")
+        pipeline.estimate_cost(estimator)
+        return estimator.save_report(log=logger)
+    
     result = pipeline.run()
     
     # 输出结果摘要
@@ -0,0 +1,388 @@
+"""
+电商点评AI分析系统 - 第一阶段吞吐量基准测试
+
+本脚本用合成评论数据测量第一阶段在不同数据规模、执行引擎和并发数下的扩展性：
+1. 按输入数据说明.md的字段结构生成合成评论（默认1k/10k/100k三档），写入独立的基准测试数据库
+2. 使用模拟模型服务（可配置对数正态延迟，标注内容与mock_openai_server一致，不访问OpenAI），
+   完整执行读取、标注、批量写入MongoDB、结果展开为话题表/画像表的流程
+3. 每个组合在独立子进程中运行，记录吞吐量（条/秒）、峰值RSS、MongoDB写入耗时、每条评论的CPU时间
+4. 结果保存为JSON（benchmarks/results/），便于不同版本之间对比
+
+使用方式：
+    python benchmarks/stage1_benchmark.py --sizes 1000 10000 --engines thread async --workers 4 16 64
+    python benchmarks/stage1_benchmark.py --sizes 1000 --latency-median 0 --pack-size 10
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import importlib.util
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Iterator
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from mock_openai_server import mock_first_label
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 基准测试配置
+BENCHMARK_CONFIG = {
+    "mongo_url": "mongodb://localhost:27017/",
+    "db_name": "kinyo_benchmark",  # 独立数据库，不影响正式数据
+    "sizes": [1000, 10000, 100000],
+    "engines": ["thread", "async", "stream"],
+    "workers": [4, 16, 64],  # thread/stream为线程数，async为在途请求数
+    "pack_size": 1,
+    "latency_median": 0.05,  # 模拟模型调用延迟中位数（秒）
+    "latency_sigma": 0.5,  # 对数正态分布形状参数
+    "seed": 42,
+    "insert_chunk_size": 10000,
+    "results_dir": os.path.join(ROOT_DIR, "benchmarks", "results"),
+    "model": "stub-model"
+}
+
+# 合成数据素材
+SYNTHETIC_PRODUCTS = [
+    {"来源平台": "淘宝", "来源店铺": "金运旗舰店", "来源品牌": "金运", "数据类型": "本品",
+     "商品名称": "金运M10无线领夹式小蜜蜂扩音器教师专用上课讲麦克风大音量喇叭", "商品SKU": 877779535954},
+    {"来源平台": "淘宝", "来源店铺": "索爱旗舰店", "来源品牌": "索爱", "数据类型": "竞品",
+     "商品名称": "索爱S655无线领夹小蜜蜂扩音器教师专用上课麦克风讲课喇叭扬声器", "商品SKU": 652301874411},
+    {"来源平台": "京东", "来源店铺": "索爱影音京东自营官方旗舰店", "来源品牌": "索爱", "数据类型": "竞品",
+     "商品名称": "索爱（soaiy）655无线磁吸领夹小蜜蜂扩音器教师专用蓝牙音箱", "商品SKU": 100133339041},
+    {"来源平台": "淘宝", "来源店铺": "伽克斯旗舰", "来源品牌": "伽克斯", "数据类型": "竞品",
+     "商品名称": "伽克斯小蜜蜂扩音器教师专用无线麦克风导游喇叭", "商品SKU": 713320045871},
+    {"来源平台": "京东", "来源店铺": "纽曼音箱音响京东自营旗舰店", "来源品牌": "纽曼", "数据类型": "竞品",
+     "商品名称": "纽曼小蜜蜂扩音器教师专用上课麦克风户外便携音箱", "商品SKU": 100047728312}
+]
+SYNTHETIC_SPECS = ["经典有线版丨粉色", "【尊享白】双芯防啸叫", "无线版丨黑色", "旗舰款丨28小时长续航"]
+SYNTHETIC_CLAUSES = [
+    "声音很大", "音质清晰", "有点杂音", "音量一般", "电池续航很久", "充电有点慢", "续航不行",
+    "外观好看", "颜值很高", "体积小巧方便携带", "物流很快", "快递包装完好", "发货太慢了",
+    "价格便宜", "性价比高", "有点贵", "质量不错", "做工一般", "用了一周就坏了",
+    "客服态度很好", "售后不理人", "操作简单", "蓝牙连接方便", "上课用很合适", "带团讲解很轻松",
+    "老师专用", "第二次购买了", "推荐购买", "还可以吧", "好评"
+]
+SYNTHETIC_PUNCTUATION = ["，", "，", "。", "！", " "]
+
+logger = logging.getLogger("stage1_benchmark")
+
+
+def generate_reviews(size: int, project_code: str, seed: int) -> Iterator[Dict[str, Any]]:
+    """生成合成评论（字段与kinyo_new_reviews一致，评论长度服从长尾分布）
+
+    Args:
+        size: 评论数量
+        project_code: 项目编号
+        seed: 随机种子，相同种子生成相同数据
+
+    Yields:
+        评论文档
+    """
+    rng = random.Random(seed)
+    start_date = datetime(2024, 5, 1)
+    for i in range(size):
+        product = rng.choice(SYNTHETIC_PRODUCTS)
+        clause_count = min(12, int(rng.paretovariate(1.5)))
+        parts = []
+        for _ in range(clause_count):
+            parts.append(rng.choice(SYNTHETIC_CLAUSES))
+            parts.append(rng.choice(SYNTHETIC_PUNCTUATION))
+        yield dict(
+            product,
+            评论="".join(parts[:-1]) if parts else "好评",
+            商品规格=rng.choice(SYNTHETIC_SPECS),
+            评论时间=(start_date + timedelta(days=rng.randrange(365))).strftime("%Y-%m-%d"),
+            客户ID=f"用户{rng.randrange(size * 2):07d}",
+            review_id=f"bench-{seed}-{size}-{i:07d}",
+            project_code=project_code
+        )
+
+
+class StubModelService:
+    """模拟模型服务：按对数正态分布等待后返回与mock_openai_server相同的确定标注，不访问网络"""
+
+    def __init__(self, latency_median: float, latency_sigma: float, seed: int, token_counter=None):
+        """初始化模拟服务
+
+        Args:
+            latency_median: 调用延迟中位数（秒），0表示不等待
+            latency_sigma: 对数正态分布形状参数
+            seed: 随机种子
+            token_counter: 第一阶段的Token计数器，用于记录模拟调用的耗时
+        """
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.seed = seed
+        self.token_counter = token_counter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _latency(self) -> float:
+        if self.latency_median <= 0:
+            return 0.0
+        with self._lock:
+            return self._random.lognormvariate(0, self.latency_sigma) * self.latency_median
+
+    def _label(self, review: Dict[str, Any], pack_size: int = 1) -> Dict[str, Any]:
+        result = mock_first_label(review["评论"], self.seed)
+        result["token_usage"] = 0
+        result["review_id"] = review["review_id"]
+        result["analysis_time"] = datetime.now().isoformat()
+        if pack_size > 1:
+            result["pack_size"] = pack_size
+        return result
+
+    def _record(self, operation: str, latency: float, model: str):
+        if self.token_counter is not None:
+            self.token_counter.add_latency(latency, operation, model)
+
+    def analyze_review(self, review: Dict[str, Any], model: str) -> Dict[str, Any]:
+        latency = self._latency()
+        time.sleep(latency)
+        self._record("analyze_review", latency, model)
+        return self._label(review)
+
+    def analyze_reviews_packed(self, reviews: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        latency = self._latency()
+        time.sleep(latency)
+        self._record("analyze_review_packed", latency, model)
+        return [self._label(review, len(reviews)) for review in reviews]
+
+    async def analyze_review_async(self, review: Dict[str, Any], model: str) -> Dict[str, Any]:
+        latency = self._latency()
+        await asyncio.sleep(latency)
+        self._record("analyze_review", latency, model)
+        return self._label(review)
+
+    async def analyze_reviews_packed_async(self, reviews: List[Dict[str, Any]], model: str) -> List[Dict[str, Any]]:
+        latency = self._latency()
+        await asyncio.sleep(latency)
+        self._record("analyze_review_packed", latency, model)
+        return [self._label(review, len(reviews)) for review in reviews]
+
+    async def aclose(self):
+        pass
+
+
+def load_stage1():
+    """加载第一阶段脚本（文件名不是合法的模块名）"""
+    spec = importlib.util.spec_from_file_location("first_label", os.path.join(ROOT_DIR, "1-first_label.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def cpu_seconds() -> float:
+    """当前进程（含所有线程）累计的CPU时间"""
+    times = os.times()
+    return times.user + times.system
+
+
+def peak_rss_mb() -> float:
+    """当前进程的峰值常驻内存（MB）"""
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位为KB，macOS为字节
+        return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+    try:
+        import psutil
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, "peak_wset", memory.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+def ensure_corpus(first_label, db_manager, size: int, seed: int) -> str:
+    """确保基准测试数据库中存在指定规模的合成评论，返回其项目编号"""
+    project_code = f"bench-{size}-{seed}"
+    collection_name = first_label.DB_CONFIG["collections"]["reviews"]
+    existing = db_manager.count_documents(collection_name, {"project_code": project_code})
+    if existing == size:
+        return project_code
+    collection = db_manager.get_collection(collection_name)
+    collection.delete_many({"project_code": project_code})
+    chunk = []
+    for review in generate_reviews(size, project_code, seed):
+        chunk.append(review)
+        if len(chunk) >= BENCHMARK_CONFIG["insert_chunk_size"]:
+            collection.insert_many(chunk, ordered=False)
+            chunk = []
+    if chunk:
+        collection.insert_many(chunk, ordered=False)
+    logger.info(f"已生成合成评论 {size} 条: {project_code}")
+    return project_code
+
+
+def run_once(args) -> Dict[str, Any]:
+    """在当前进程中执行一次基准测试（由子进程调用）"""
+    first_label = load_stage1()
+    first_label.logger.setLevel(args.log_level)
+    db_manager = first_label.MongoDBManager(args.mongo_url, args.db_name)
+    project_code = ensure_corpus(first_label, db_manager, args.size, args.seed)
+    solution = f"bench-{args.engine}-w{args.workers}-p{args.pack_size}-{os.getpid()}"
+    model_service = StubModelService(args.latency_median, args.latency_sigma, args.seed, first_label.token_counter)
+    analyzer = first_label.AnalyzerService(db_manager, model_service)
+
+    result = {"fetch_seconds": None, "process_results_seconds": None}
+    cpu_start = cpu_seconds()
+    wall_start = time.perf_counter()
+    try:
+        if args.engine == "stream":
+            stats = analyzer.analyze_reviews_stream(
+                project_code=project_code, solution=solution, max_workers=args.workers, show_progress=False,
+                model=args.model, test_mode=False, pack_size=args.pack_size
+            )
+            processed = stats["succeeded"]
+            results = None
+        else:
+            fetch_start = time.perf_counter()
+            reviews = analyzer.get_unprocessed_reviews(project_code, solution)
+            result["fetch_seconds"] = round(time.perf_counter() - fetch_start, 3)
+            if args.engine == "async":
+                results = analyzer.analyze_reviews_batch_async(
+                    reviews, concurrency=args.workers, show_progress=False, model=args.model,
+                    solution=solution, project_code=project_code, test_mode=False, pack_size=args.pack_size
+                )
+            else:
+                results = analyzer.analyze_reviews_batch(
+                    reviews, max_workers=args.workers, show_progress=False, model=args.model,
+                    solution=solution, project_code=project_code, test_mode=False, pack_size=args.pack_size
+                )
+            processed = len(results)
+        analyzer.result_writer.close()
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_used = cpu_seconds() - cpu_start
+
+        if results:
+            process_start = time.perf_counter()
+            analyzer.process_analysis_results(results)
+            analyzer.process_user_profiles(results)
+            result["process_results_seconds"] = round(time.perf_counter() - process_start, 3)
+
+        writer_stats = analyzer.result_writer.get_stats()
+        result.update({
+            "reviews": processed,
+            "wall_seconds": round(wall_seconds, 3),
+            "reviews_per_second": round(processed / wall_seconds, 1) if wall_seconds > 0 else None,
+            "cpu_seconds": round(cpu_used, 3),
+            "cpu_ms_per_review": round(cpu_used * 1000 / processed, 3) if processed else None,
+            "peak_rss_mb": peak_rss_mb(),
+            "mongo_write_seconds": writer_stats["write_seconds"],
+            "mongo_flushes": writer_stats["flushes"],
+            "mongo_write_failed": writer_stats["failed"],
+            "latency": first_label.token_counter.get_latency_stats()
+        })
+    finally:
+        # 清理本次运行的结果和标注状态，语料保留供后续运行复用
+        db_manager.get_collection(first_label.DB_CONFIG["collections"]["llm_results"]).delete_many(
+            {"project_code": project_code, "solution": solution}
+        )
+        db_manager.get_collection(first_label.DB_CONFIG["collections"]["reviews"]).update_many(
+            {"project_code": project_code},
+            {"$unset": {first_label.LabelStatus.field(solution): "", first_label.LabelStatus.lease_field(solution): ""}}
+        )
+        db_manager.close()
+    return result
+
+
+def run_in_subprocess(args, size: int, engine: str, workers: int) -> Dict[str, Any]:
+    """在独立子进程（临时工作目录）中执行一次基准测试，峰值内存与日志互不影响"""
+    work_dir = tempfile.mkdtemp(prefix="stage1_bench_")
+    command = [
+        sys.executable, os.path.abspath(__file__), "--run-one",
+        "--size", str(size), "--engine", engine, "--worker-count", str(workers),
+        "--pack-size", str(args.pack_size), "--latency-median", str(args.latency_median),
+        "--latency-sigma", str(args.latency_sigma), "--seed", str(args.seed),
+        "--mongo-url", args.mongo_url, "--db-name", args.db_name, "--log-level", args.log_level
+    ]
+    try:
+        completed = subprocess.run(command, cwd=work_dir, capture_output=True, text=True, encoding="utf-8")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if completed.returncode != 0:
+        logger.error(f"基准测试失败 (规模 {size}, 引擎 {engine}, 并发 {workers}):\n{completed.stderr[-2000:]}")
+        return {"error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "unknown"}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='第一阶段吞吐量基准测试')
+    parser.add_argument('--sizes', type=int, nargs='+', default=BENCHMARK_CONFIG["sizes"],
+                        help=f'合成评论规模，默认: {BENCHMARK_CONFIG["sizes"]}')
+    parser.add_argument('--engines', type=str, nargs='+', choices=BENCHMARK_CONFIG["engines"],
+                        default=BENCHMARK_CONFIG["engines"], help='执行引擎')
+    parser.add_argument('--workers', type=int, nargs='+', default=BENCHMARK_CONFIG["workers"],
+                        help=f'并发数（thread/stream为线程数，async为在途请求数），默认: {BENCHMARK_CONFIG["workers"]}')
+    parser.add_argument('--pack-size', type=int, default=BENCHMARK_CONFIG["pack_size"], help='每次请求合并标注的评论数')
+    parser.add_argument('--latency-median', type=float, default=BENCHMARK_CONFIG["latency_median"],
+                        help='模拟模型调用延迟中位数（秒），0表示不等待（只测量本地开销）')
+    parser.add_argument('--latency-sigma', type=float, default=BENCHMARK_CONFIG["latency_sigma"],
+                        help='模拟延迟对数正态分布形状参数')
+    parser.add_argument('--seed', type=int, default=BENCHMARK_CONFIG["seed"], help='合成数据与延迟的随机种子')
+    parser.add_argument('--mongo-url', type=str, default=BENCHMARK_CONFIG["mongo_url"])
+    parser.add_argument('--db-name', type=str, default=BENCHMARK_CONFIG["db_name"])
+    parser.add_argument('--output', type=str, default=None, help='结果JSON路径，默认benchmarks/results/stage1_<时间>.json')
+    parser.add_argument('--log-level', type=str, default="WARNING", help='第一阶段日志级别，默认WARNING')
+    # 子进程参数
+    parser.add_argument('--run-one', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--size', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--engine', type=str, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-count', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--model', type=str, default=BENCHMARK_CONFIG["model"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        args.workers = args.worker_count
+        print(json.dumps(run_once(args), ensure_ascii=False))
+        return
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    report = {
+        "created_time": datetime.now().isoformat(),
+        "host": {"platform": platform.platform(), "python": platform.python_version(), "cpu_count": os.cpu_count()},
+        "config": {
+            "pack_size": args.pack_size,
+            "latency_median": args.latency_median,
+            "latency_sigma": args.latency_sigma,
+            "seed": args.seed
+        },
+        "runs": []
+    }
+    for size in args.sizes:
+        for engine in args.engines:
+            for workers in args.workers:
+                logger.info(f"运行基准测试: 规模 {size}, 引擎 {engine}, 并发 {workers}")
+                run = {"size": size, "engine": engine, "workers": workers}
+                run.update(run_in_subprocess(args, size, engine, workers))
+                report["runs"].append(run)
+                if "error" not in run:
+                    logger.info(f"  {run['reviews_per_second']} 条/秒, 峰值内存 {run['peak_rss_mb']}MB, "
+                                f"MongoDB写入 {run['mongo_write_seconds']}秒, CPU {run['cpu_ms_per_review']}毫秒/条")
+
+    output = args.output or os.path.join(
+        BENCHMARK_CONFIG["results_dir"], f"stage1_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"基准测试结果已保存到: {output}")
+
+
+if __name__ == "__main__":
+    main()
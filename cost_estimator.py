@@ -0,0 +1,239 @@
+"""
+电商点评AI分析系统 - 价格表与成本预估模块
+
+本模块为三个阶段提供统一的模型价格表和运行前的成本预估：
+1. 价格表按模型配置每百万token的输入/输出价格，可用JSON文件覆盖，各阶段的Token报告按实际使用的模型计算成本
+2. CostEstimator在本地对即将发送的请求计算prompt token数（不调用API），按各操作预设的输出token数估算生成量
+3. LLM响应缓存中已有的请求、规则预过滤和标注缓存在本地完成的评论不产生费用，单独计数
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from typing import Dict, Any, Optional
+
+from prompts import estimate_messages_tokens
+from llm_cache import response_cache
+from label_schema import LABEL_SCHEMA_CONFIG
+
+# 价格与预估配置
+COST_CONFIG = {
+    "price_file": "config/model_prices.json",  # 存在时按模型覆盖默认价格表，格式同prices
+    "currency": "USD",
+    "prices": {  # 每百万token价格
+        "gpt-3.5-turbo": {"input": 1.5, "output": 2.0},
+        "gpt-4o": {"input": 2.5, "output": 10.0},
+        "gpt-4o-mini": {"input": 0.15, "output": 0.6},
+        "default": {"input": 1.5, "output": 2.0}  # 价格表中没有的模型
+    },
+    "prompt_ratio": 0.7,  # 只记录了总token数时，按该比例拆分为提示词和生成token
+    "expected_completion_tokens": {  # 各操作预估的输出token数（请求未指定max_tokens时）
+        "analyze_review": 350,
+        "analyze_review_packed": 300,  # 合并标注时每条评论的输出token数
+        "label_fix": LABEL_SCHEMA_CONFIG["fix_max_tokens"],  # 第一阶段单个字段的修复请求，与请求的max_tokens一致
+        "user_profile_classification": 300,
+        "product_topic_classification": 300,
+        "generate_summary": 120,
+        "user_profile_insight": 150,
+        "topic_insight": 150,
+        "quadrant_insight": 250,
+        "overall_insight": 600,
+        "default": 500
+    },
+    "report_file": "logs/{stage}_cost_estimate.json"
+}
+
+logger = logging.getLogger("cost_estimator")
+
+_price_table = None
+
+
+def load_price_table(price_file: str = None) -> Dict[str, Dict[str, float]]:
+    """加载价格表：默认价格表，价格文件中的模型覆盖同名项
+
+    Args:
+        price_file: 价格文件路径，None表示使用COST_CONFIG["price_file"]
+
+    Returns:
+        模型 -> {"input": 每百万输入token价格, "output": 每百万输出token价格}
+    """
+    global _price_table
+    price_file = price_file or COST_CONFIG["price_file"]
+    prices = {model: dict(price) for model, price in COST_CONFIG["prices"].items()}
+    if os.path.exists(price_file):
+        with open(price_file, "r", encoding="utf-8") as f:
+            prices.update(json.load(f))
+        logger.info(f"已加载价格文件: {price_file}")
+    _price_table = prices
+    return prices
+
+
+def get_price(model: str) -> Dict[str, float]:
+    """模型价格，精确匹配优先，其次按最长前缀匹配（如gpt-4o-mini-2024-07-18），都没有时使用default"""
+    prices = _price_table if _price_table is not None else load_price_table()
+    if model in prices:
+        return prices[model]
+    matches = [name for name in prices if name != "default" and model and model.startswith(name)]
+    return prices[max(matches, key=len)] if matches else prices["default"]
+
+
+def compute_cost(prompt_tokens: int, completion_tokens: int, model: str) -> Dict[str, float]:
+    """按价格表计算一个模型的成本
+
+    Args:
+        prompt_tokens: 提示词token数
+        completion_tokens: 生成token数
+        model: 模型名称
+
+    Returns:
+        {"input_cost", "output_cost", "total_cost"}
+    """
+    price = get_price(model)
+    input_cost = prompt_tokens * price["input"] / 1_000_000
+    output_cost = completion_tokens * price["output"] / 1_000_000
+    return {
+        "input_cost": round(input_cost, 6),
+        "output_cost": round(output_cost, 6),
+        "total_cost": round(input_cost + output_cost, 6)
+    }
+
+
+def split_total_tokens(total_tokens: int) -> Dict[str, int]:
+    """只有总token数时按COST_CONFIG["prompt_ratio"]拆分为提示词和生成token"""
+    prompt_tokens = int(total_tokens * COST_CONFIG["prompt_ratio"])
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": total_tokens - prompt_tokens}
+
+
+def usage_cost(usage_by_model: Dict[str, Dict[str, int]]) -> Dict[str, Any]:
+    """按模型汇总成本，用于各阶段Token报告的cost_estimate
+
+    Args:
+        usage_by_model: 模型 -> {"prompt_tokens", "completion_tokens", "total_tokens"}
+
+    Returns:
+        {"input_cost", "output_cost", "total_cost", "currency", "by_model"}
+    """
+    by_model = {}
+    for model, usage in usage_by_model.items():
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        if prompt_tokens == 0 and completion_tokens == 0 and usage.get("total_tokens", 0) > 0:
+            split = split_total_tokens(usage["total_tokens"])
+            prompt_tokens, completion_tokens = split["prompt_tokens"], split["completion_tokens"]
+        by_model[model] = compute_cost(prompt_tokens, completion_tokens, model)
+    return {
+        "input_cost": round(sum(cost["input_cost"] for cost in by_model.values()), 6),
+        "output_cost": round(sum(cost["output_cost"] for cost in by_model.values()), 6),
+        "total_cost": round(sum(cost["total_cost"] for cost in by_model.values()), 6),
+        "currency": COST_CONFIG["currency"],
+        "by_model": by_model
+    }
+
+
+class CostEstimator:
+    """运行前的调用次数、token和成本预估：只在本地计算token，不调用API"""
+
+    def __init__(self, stage: str):
+        """初始化预估器
+
+        Args:
+            stage: 阶段名称，用于报告文件名
+        """
+        self.stage = stage
+        self.operations = {}  # operation -> {"calls", "cached_calls", "prompt_tokens", "completion_tokens"}
+        self.models = {}  # model -> {"calls", "prompt_tokens", "completion_tokens"}
+        self.resolved_locally = {}  # 原因 -> 评论数（规则预过滤、标注缓存等，不需要调用模型）
+
+    @staticmethod
+    def expected_completion_tokens(operation: str, request: Dict[str, Any] = None) -> int:
+        """操作预估的输出token数，请求指定了max_tokens时以其为上限"""
+        expected = COST_CONFIG["expected_completion_tokens"]
+        tokens = expected.get(operation, expected["default"])
+        max_tokens = (request or {}).get("max_tokens")
+        return min(tokens, max_tokens) if max_tokens else tokens
+
+    def add(self, operation: str, request: Dict[str, Any], completion_tokens: int = None) -> int:
+        """记录一次将要发送的chat.completions请求
+
+        Args:
+            operation: 操作名称
+            request: 与实际调用相同的请求参数（model、messages等），用于计算prompt token和查询响应缓存
+            completion_tokens: 预估的输出token数，None表示按操作配置
+
+        Returns:
+            预估的输出token数
+        """
+        if completion_tokens is None:
+            completion_tokens = self.expected_completion_tokens(operation, request)
+        model = request.get("model", "default")
+        op_stats = self.operations.setdefault(
+            operation, {"calls": 0, "cached_calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        )
+        if response_cache.enabled and response_cache.contains(request):
+            op_stats["cached_calls"] += 1
+            return completion_tokens
+        prompt_tokens = estimate_messages_tokens(request.get("messages", []), model)
+        model_stats = self.models.setdefault(model, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0})
+        for stats in (op_stats, model_stats):
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+        return completion_tokens
+
+    def add_local(self, reason: str, count: int):
+        """记录在本地完成、不需要调用模型的评论数"""
+        if count:
+            self.resolved_locally[reason] = self.resolved_locally.get(reason, 0) + count
+
+    def get_report(self) -> Dict[str, Any]:
+        """获取预估报告"""
+        by_model = {}
+        for model, stats in self.models.items():
+            by_model[model] = dict(stats, total_tokens=stats["prompt_tokens"] + stats["completion_tokens"],
+                                   cost=compute_cost(stats["prompt_tokens"], stats["completion_tokens"], model),
+                                   price_per_million_tokens=get_price(model))
+        prompt_tokens = sum(stats["prompt_tokens"] for stats in self.models.values())
+        completion_tokens = sum(stats["completion_tokens"] for stats in self.models.values())
+        return {
+            "stage": self.stage,
+            "report_time": datetime.now().isoformat(),
+            "calls": sum(stats["calls"] for stats in self.models.values()),
+            "cached_calls": sum(stats["cached_calls"] for stats in self.operations.values()),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "total_cost": round(sum(model["cost"]["total_cost"] for model in by_model.values()), 6),
+            "currency": COST_CONFIG["currency"],
+            "by_model": by_model,
+            "by_operation": self.operations,
+            "resolved_locally": self.resolved_locally,
+            "expected_completion_tokens": COST_CONFIG["expected_completion_tokens"]
+        }
+
+    def save_report(self, output_file: str = None, log: Optional[logging.Logger] = None) -> Dict[str, Any]:
+        """保存预估报告并输出摘要日志
+
+        Args:
+            output_file: 输出文件路径，None表示使用COST_CONFIG["report_file"]
+            log: 输出摘要的日志器，默认使用本模块日志器（各阶段传入自己的日志器）
+
+        Returns:
+            预估报告
+        """
+        report = self.get_report()
+        output_file = output_file or COST_CONFIG["report_file"].format(stage=self.stage)
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        with open(output_file, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        log = log or logger
+        log.info(f"[{self.stage}] 预估调用 {report['calls']} 次（响应缓存已有 {report['cached_calls']} 次），"
+                    f"提示词 {report['prompt_tokens']} tokens，生成 {report['completion_tokens']} tokens，"
+                    f"预估成本 {report['total_cost']} {report['currency']}")
+        for model, stats in report["by_model"].items():
+            log.info(f"  {model}: {stats['calls']} 次, {stats['total_tokens']} tokens, {stats['cost']['total_cost']} {report['currency']}")
+        if report["resolved_locally"]:
+            log.info(f"  本地完成（不调用模型）: {report['resolved_locally']}")
+        log.info(f"预估报告已保存到 {output_file}")
+        return report
@@ -0,0 +1,240 @@
+"""
+电商点评AI分析系统 - 第一阶段标注结果校验与修复模块
+
+本模块定义第一阶段标注结果文档的严格结构，并在本地修复模型输出中常见的格式问题：
+1. JSON解析：去掉markdown代码块标记、截取最外层的JSON对象、删除多余的尾逗号
+2. 类型修正：product_topic_result/user_profile为JSON字符串或单个对象时展开，keyphrases为字符串时切分
+3. 取值修正：polarity同义词映射为"好评"/"中评"/"差评"，confidence转换为0-1之间的小数，用户画像缺失字段补空
+4. 丢弃无法修正的话题项（缺少topic或polarity无法识别）
+本地修复后仍不符合结构的字段由调用方发起只修复该字段的小请求，避免整条评论重新标注。
+"""
+
+import re
+import json
+from typing import Dict, List, Any, Tuple, Optional
+
+from prompts import FIRST_LABEL_PROFILE_FIELDS
+
+# 结构与修复配置
+LABEL_SCHEMA_CONFIG = {
+    "polarities": ["好评", "中评", "差评"],
+    "polarity_synonyms": {
+        "正面": "好评", "积极": "好评", "正向": "好评", "满意": "好评", "好": "好评", "positive": "好评",
+        "负面": "差评", "消极": "差评", "负向": "差评", "不满": "差评", "差": "差评", "negative": "差评",
+        "中性": "中评", "一般": "中评", "中立": "中评", "中": "中评", "neutral": "中评", "mixed": "中评"
+    },
+    "gender_synonyms": {"男性": "男", "女性": "女", "male": "男", "female": "女", "m": "男", "f": "女"},
+    "keyphrase_separators": r"[,，、;；/|]",
+    "fixable_fields": ["product_topic_result", "user_profile"],  # 本地修复失败时可单独请求修复的字段
+    "fix_max_tokens": 600  # 字段修复请求的最大输出token数
+}
+
+
+def parse_json_content(content: Any) -> Optional[Any]:
+    """解析模型输出的JSON，解析失败时做本地修复后再试
+
+    Args:
+        content: 模型输出文本
+
+    Returns:
+        解析结果，本地修复后仍无法解析时返回None
+    """
+    if not isinstance(content, str):
+        return None
+    try:
+        return json.loads(content)
+    except ValueError:
+        pass
+    text = re.sub(r"^\s*```(?:json)?\s*|\s*```\s*$", "", content.strip(), flags=re.IGNORECASE)
+    start, end = text.find("{"), text.rfind("}")
+    if start < 0 or end <= start:
+        return None
+    text = re.sub(r",\s*([}\]])", r"\1", text[start:end + 1])
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def normalize_polarity(value: Any) -> Optional[str]:
+    """将情感倾向映射为"好评"/"中评"/"差评"，无法识别时返回None"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if value in LABEL_SCHEMA_CONFIG["polarities"]:
+        return value
+    return LABEL_SCHEMA_CONFIG["polarity_synonyms"].get(value.lower())
+
+
+def normalize_confidence(value: Any) -> Optional[float]:
+    """将置信度转换为0-1之间的小数（兼容"85%"和0-100的写法），无法转换时返回None"""
+    if isinstance(value, str):
+        value = value.strip()
+        percent = value.endswith("%")
+        try:
+            value = float(value.rstrip("%")) / (100 if percent else 1)
+        except ValueError:
+            return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        return None
+    if 1 < value <= 100:
+        value = value / 100
+    return round(min(max(float(value), 0.0), 1.0), 4)
+
+
+def _text(value: Any) -> str:
+    """将字段值转换为字符串，列表用顿号连接，None为空字符串"""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return "、".join(_text(item) for item in value if item not in (None, ""))
+    return str(value).strip()
+
+
+def _expand(value: Any) -> Any:
+    """字段值为JSON字符串时展开，无法解析时原样返回"""
+    if isinstance(value, str) and value.strip()[:1] in ("[", "{"):
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+    return value
+
+
+def repair_topics(value: Any, repairs: List[str]) -> Optional[List[Dict[str, Any]]]:
+    """修复product_topic_result
+
+    Args:
+        value: 模型输出的字段值
+        repairs: 修复记录，本函数追加修复项
+
+    Returns:
+        修复后的话题列表，无法修复（不是列表/对象）时返回None
+    """
+    expanded = _expand(value)
+    if expanded is None:
+        repairs.append("topics_null")
+        return []
+    if isinstance(expanded, dict):
+        expanded = [expanded]
+        repairs.append("topics_object")
+    elif expanded is not value:
+        repairs.append("topics_string")
+    if not isinstance(expanded, list):
+        return None
+
+    topics = []
+    for item in expanded:
+        if not isinstance(item, dict) or not _text(item.get("topic")):
+            repairs.append("topic_dropped")
+            continue
+        polarity = normalize_polarity(item.get("polarity"))
+        if polarity is None:
+            repairs.append("topic_dropped")
+            continue
+        if polarity != item.get("polarity"):
+            repairs.append("polarity")
+        confidence = normalize_confidence(item.get("confidence"))
+        if confidence is None:
+            confidence = 0.0
+            repairs.append("confidence_missing")
+        elif confidence != item.get("confidence"):
+            repairs.append("confidence")
+        topics.append({
+            **item,
+            "topic": _text(item.get("topic")),
+            "polarity": polarity,
+            "confidence": confidence,
+            "related_text": _text(item.get("related_text"))
+        })
+    return topics
+
+
+def repair_profile(value: Any, repairs: List[str]) -> Optional[Dict[str, str]]:
+    """修复user_profile
+
+    Args:
+        value: 模型输出的字段值
+        repairs: 修复记录，本函数追加修复项
+
+    Returns:
+        修复后的用户画像（包含全部FIRST_LABEL_PROFILE_FIELDS），无法修复时返回None
+    """
+    expanded = _expand(value)
+    if expanded is None:
+        repairs.append("profile_null")
+        expanded = {}
+    elif expanded is not value:
+        repairs.append("profile_string")
+    if not isinstance(expanded, dict):
+        return None
+
+    profile = dict(expanded)
+    for field in FIRST_LABEL_PROFILE_FIELDS:
+        raw = expanded.get(field)
+        text = _text(raw)
+        if field not in expanded:
+            repairs.append("profile_field_missing")
+        elif raw is not None and not isinstance(raw, str):
+            repairs.append("profile_type")
+        profile[field] = text
+    gender = profile["gender"]
+    if gender and gender not in ("男", "女"):
+        profile["gender"] = LABEL_SCHEMA_CONFIG["gender_synonyms"].get(gender.lower(), "")
+        repairs.append("gender")
+    return profile
+
+
+def repair_keyphrases(value: Any, repairs: List[str]) -> List[str]:
+    """修复keyphrases为去重的字符串列表"""
+    expanded = _expand(value)
+    if isinstance(expanded, str):
+        expanded = re.split(LABEL_SCHEMA_CONFIG["keyphrase_separators"], expanded)
+        repairs.append("keyphrases_string")
+    elif not isinstance(expanded, list):
+        if expanded is not None:
+            repairs.append("keyphrases_type")
+        expanded = []
+    keyphrases = []
+    for item in expanded:
+        text = _text(item)
+        if text and text not in keyphrases:
+            keyphrases.append(text)
+    return keyphrases
+
+
+def repair_label(data: Any, comment: str = None) -> Tuple[Dict[str, Any], List[str], List[str]]:
+    """按第一阶段结果结构校验并在本地修复一条标注结果
+
+    Args:
+        data: 模型输出解析后的结果
+        comment: 原始评论文本，comment字段缺失或类型错误时使用
+
+    Returns:
+        (修复后的结果, 修复记录, 本地无法修复的字段列表)；无法修复的字段在结果中置为空值
+    """
+    repairs, failed = [], []
+    if not isinstance(data, dict):
+        return ({"comment": comment or "", "product_topic_result": [], "keyphrases": [],
+                 "user_profile": {field: "" for field in FIRST_LABEL_PROFILE_FIELDS}},
+                ["not_object"], list(LABEL_SCHEMA_CONFIG["fixable_fields"]))
+
+    result = dict(data)
+    if not isinstance(result.get("comment"), str) or (comment and not result["comment"].strip()):
+        result["comment"] = comment if comment is not None else _text(result.get("comment"))
+        repairs.append("comment")
+
+    topics = repair_topics(result.get("product_topic_result"), repairs)
+    if topics is None:
+        failed.append("product_topic_result")
+        topics = []
+    result["product_topic_result"] = topics
+
+    profile = repair_profile(result.get("user_profile"), repairs)
+    if profile is None:
+        failed.append("user_profile")
+        profile = {field: "" for field in FIRST_LABEL_PROFILE_FIELDS}
+    result["user_profile"] = profile
+
+    result["keyphrases"] = repair_keyphrases(result.get("keyphrases"), repairs)
+    return result, repairs, failed
@@ -0,0 +1,224 @@
+"""
+电商点评AI分析系统 - LLM响应缓存模块
+
+本模块为三个阶段的chat.completions调用提供统一的本地响应缓存：
+1. 以请求参数（模型、消息、输出格式等）的哈希为键，响应内容保存在本地SQLite文件中
+2. read-write：命中直接返回缓存响应，未命中调用API并写入缓存
+3. replay-only：只读缓存，未命中直接报错，用于确定性的离线重跑和基准测试
+4. off：不使用缓存
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+# 缓存配置
+LLM_CACHE_CONFIG = {
+    "modes": ["off", "read-write", "replay-only"],
+    "default_mode": "off",
+    "db_file": "cache/llm_response_cache.sqlite3",
+    # 不参与缓存键计算的请求参数（不影响响应内容）
+    "volatile_params": ["timeout", "extra_headers"]
+}
+
+logger = logging.getLogger("llm_cache")
+
+
+class LLMCacheMissError(RuntimeError):
+    """replay-only模式下缓存未命中"""
+
+
+class LLMResponseCache:
+    """基于请求哈希的LLM响应缓存"""
+
+    def __init__(self, mode: str = LLM_CACHE_CONFIG["default_mode"], db_file: str = LLM_CACHE_CONFIG["db_file"]):
+        """初始化缓存
+
+        Args:
+            mode: 缓存模式，off|read-write|replay-only
+            db_file: SQLite缓存文件路径
+        """
+        self._lock = threading.Lock()
+        self._conn = None
+        self.hits = 0
+        self.misses = 0
+        self.configure(mode, db_file)
+
+    def configure(self, mode: str, db_file: str = None):
+        """设置缓存模式和缓存文件
+
+        Args:
+            mode: 缓存模式，off|read-write|replay-only
+            db_file: SQLite缓存文件路径，None表示保持不变
+        """
+        if mode not in LLM_CACHE_CONFIG["modes"]:
+            raise ValueError(f"未知的LLM缓存模式: {mode}，可选: {LLM_CACHE_CONFIG['modes']}")
+        with self._lock:
+            self.mode = mode
+            if db_file and db_file != getattr(self, "db_file", None):
+                if self._conn is not None:
+                    self._conn.close()
+                    self._conn = None
+                self.db_file = db_file
+        if mode != "off":
+            logger.info(f"LLM响应缓存已启用: 模式={mode}, 文件={self.db_file}")
+
+    @property
+    def enabled(self) -> bool:
+        """是否启用缓存"""
+        return self.mode != "off"
+
+    def _connection(self) -> sqlite3.Connection:
+        """获取SQLite连接，首次使用时创建表（需在持有锁时调用）"""
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_file)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            self._conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "cache_key TEXT PRIMARY KEY, model TEXT, request TEXT, response TEXT, created_time TEXT)"
+            )
+            self._conn.commit()
+        return self._conn
+
+    @staticmethod
+    def make_key(request: Dict[str, Any]) -> str:
+        """计算请求的缓存键
+
+        Args:
+            request: chat.completions.create的请求参数
+
+        Returns:
+            缓存键（sha256十六进制字符串）
+        """
+        stable = {k: v for k, v in request.items() if k not in LLM_CACHE_CONFIG["volatile_params"]}
+        payload = json.dumps(stable, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[ChatCompletion]:
+        """查询缓存响应
+
+        Args:
+            key: 缓存键
+
+        Returns:
+            缓存的响应对象，未命中返回None
+        """
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT response FROM llm_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return ChatCompletion.model_validate(json.loads(row[0]))
+
+    def put(self, key: str, request: Dict[str, Any], response: ChatCompletion):
+        """写入缓存响应，已存在的键保持不变
+
+        Args:
+            key: 缓存键
+            request: 请求参数
+            response: 响应对象
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR IGNORE INTO llm_cache (cache_key, model, request, response, created_time) VALUES (?, ?, ?, ?, ?)",
+                (
+                    key,
+                    request.get("model"),
+                    json.dumps(request, ensure_ascii=False, default=str),
+                    json.dumps(response.model_dump(), ensure_ascii=False),
+                    datetime.now().isoformat()
+                )
+            )
+            conn.commit()
+
+    def contains(self, request: Dict[str, Any]) -> bool:
+        """缓存中是否已有该请求的响应（不计入命中统计，用于成本预估）"""
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT 1 FROM llm_cache WHERE cache_key = ?", (self.make_key(request),)
+            ).fetchone()
+        return row is not None
+
+    def _lookup(self, request: Dict[str, Any]) -> Tuple[str, Optional[ChatCompletion]]:
+        """按当前模式查询缓存，replay-only模式未命中时抛出LLMCacheMissError"""
+        key = self.make_key(request)
+        cached = self.get(key)
+        with self._lock:
+            if cached is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is None and self.mode == "replay-only":
+            raise LLMCacheMissError(f"LLM响应缓存未命中（replay-only模式）: 模型={request.get('model')}, key={key[:12]}")
+        return key, cached
+
+    def create(self, client, **request) -> Tuple[ChatCompletion, bool]:
+        """经由缓存调用client.chat.completions.create
+
+        Args:
+            client: OpenAI客户端
+            **request: chat.completions.create的请求参数
+
+        Returns:
+            (响应对象, 是否命中缓存)
+        """
+        if not self.enabled:
+            return client.chat.completions.create(**request), False
+        key, cached = self._lookup(request)
+        if cached is not None:
+            return cached, True
+        response = client.chat.completions.create(**request)
+        self.put(key, request, response)
+        return response, False
+
+    async def acreate(self, client, **request) -> Tuple[ChatCompletion, bool]:
+        """经由缓存调用异步客户端的chat.completions.create
+
+        Args:
+            client: AsyncOpenAI客户端
+            **request: chat.completions.create的请求参数
+
+        Returns:
+            (响应对象, 是否命中缓存)
+        """
+        if not self.enabled:
+            return await client.chat.completions.create(**request), False
+        key, cached = self._lookup(request)
+        if cached is not None:
+            return cached, True
+        response = await client.chat.completions.create(**request)
+        self.put(key, request, response)
+        return response, False
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        total = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total > 0 else 0
+        }
+
+    def close(self):
+        """关闭SQLite连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# 全局响应缓存，由各阶段脚本根据--llm-cache参数配置
+response_cache = LLMResponseCache()
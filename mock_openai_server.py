@@ -0,0 +1,376 @@
+"""
+电商点评AI分析系统 - 本地OpenAI兼容模拟服务
+
+本模块提供一个本地的chat.completions模拟服务，用于在不访问OpenAI、不经过代理的情况下对三个阶段进行压测：
+1. 按prompts.py中的prompt识别请求类型，返回对应结构的内容：
+   - 第一阶段单条/合并标注：product_topic_result、keyphrases、user_profile（合并标注为results列表）
+   - 第二阶段分类：categories
+   - 第三阶段总结与洞察：纯文本
+2. 相同请求返回相同内容（按请求内容和种子确定），便于对比多次压测的结果
+3. 可配置延迟分布（固定/均匀/对数正态）、错误率（429/500/超时）和token用量
+
+使用方式：
+    python mock_openai_server.py --port 8765 --latency-median 0.8 --error-429 0.02
+    python 1-first_label.py --base-url http://127.0.0.1:8765/v1 --no-proxy --limit 10000 --stream
+（OpenAI客户端仍要求提供API密钥，可设置任意值，如 OPEN_AI_KEY=mock）
+"""
+
+import re
+import json
+import time
+import random
+import hashlib
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Any, List, Optional, Tuple
+
+from prompts import FIRST_LABEL_PROFILE_FIELDS, estimate_messages_tokens, estimate_text_tokens
+
+# 模拟服务配置
+MOCK_SERVER_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8765,
+    "seed": 42,
+    "latency": {
+        "distribution": "lognormal",  # fixed | uniform | lognormal
+        "median": 0.8,  # fixed时为固定延迟，lognormal时为中位数（秒）
+        "sigma": 0.5,  # lognormal的形状参数，越大长尾越明显
+        "min": 0.2,  # uniform的下限（秒）
+        "max": 2.0  # uniform的上限（秒），也是lognormal的截断上限
+    },
+    "errors": {
+        "rate_429": 0.0,  # 返回429限流错误的比例
+        "rate_500": 0.0,  # 返回500服务错误的比例
+        "rate_timeout": 0.0,  # 挂起不响应（模拟超时）的比例
+        "timeout_seconds": 600.0  # 模拟超时时的挂起时间（秒），需大于客户端超时
+    },
+    "usage": {
+        "prompt_tokens": None,  # 固定的prompt token数，None表示按prompt内容估算
+        "completion_tokens": None  # 固定的输出token数，None表示按输出内容估算
+    },
+    "max_categories": 12  # 第二阶段分类请求返回的最大分类数
+}
+
+# 模拟标注使用的话题及触发词
+MOCK_TOPICS = {
+    "音质": ["声音", "音质", "音量", "杂音", "噪音", "清晰"],
+    "续航": ["电池", "续航", "充电", "电量"],
+    "外观": ["外观", "颜色", "好看", "颜值", "漂亮", "小巧"],
+    "物流": ["物流", "快递", "发货", "送货", "包装"],
+    "价格": ["价格", "便宜", "性价比", "划算", "贵"],
+    "质量": ["质量", "做工", "材质", "结实", "坏了"],
+    "服务": ["客服", "服务", "售后", "态度"],
+    "操作": ["操作", "使用", "方便", "简单", "连接", "蓝牙"]
+}
+NEGATIVE_WORDS = ["不", "差", "坏", "慢", "失望", "退", "杂音", "噪音", "没有", "贵", "难"]
+NEUTRAL_WORDS = ["一般", "还行", "凑合", "还可以"]
+MOCK_PROFILE_VALUES = {
+    "gender": ["", "", "男", "女"],
+    "occupation": ["", "", "", "教师", "导游", "学生", "销售"],
+    "consumption_frequency": ["", "首次", "复购"],
+    "consumption_scene": ["", "", "上课", "户外带团", "广场舞", "直播"],
+    "consumption_itch_point": ["", "", "", "增加颜色选择", "延长续航"]
+}
+CLAUSE_PATTERN = re.compile(r"[，,。.!！?？;；~～、\s]+")
+
+logger = logging.getLogger("mock_openai_server")
+
+
+def stable_hash(*parts: Any) -> int:
+    """按内容计算稳定的哈希值"""
+    payload = json.dumps(parts, ensure_ascii=False, sort_keys=True, default=str)
+    return int(hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12], 16)
+
+
+def mock_first_label(comment: str, seed: int) -> Dict[str, Any]:
+    """生成一条评论的模拟标注结果（结构与first_label_system_prompt的输出要求一致）"""
+    clauses = [clause for clause in CLAUSE_PATTERN.split(comment or "") if clause]
+    topics = []
+    keyphrases = []
+    for clause in clauses:
+        for topic, words in MOCK_TOPICS.items():
+            matched = [word for word in words if word in clause]
+            if not matched or any(item["topic"] == topic for item in topics):
+                continue
+            if any(word in clause for word in NEUTRAL_WORDS):
+                polarity = "中评"
+            elif any(word in clause for word in NEGATIVE_WORDS):
+                polarity = "差评"
+            else:
+                polarity = "好评"
+            topics.append({
+                "topic": topic,
+                "polarity": polarity,
+                "confidence": round(0.7 + stable_hash(seed, clause, topic) % 30 / 100, 2),
+                "related_text": clause
+            })
+            keyphrases.extend(word for word in matched if word not in keyphrases)
+    if not topics and clauses:
+        # 没有命中触发词的评论按内容确定一个话题
+        topic = list(MOCK_TOPICS)[stable_hash(seed, comment) % len(MOCK_TOPICS)]
+        topics.append({"topic": topic, "polarity": "好评", "confidence": 0.6, "related_text": clauses[0]})
+
+    h = stable_hash(seed, "profile", comment)
+    user_profile = {}
+    for i, field in enumerate(FIRST_LABEL_PROFILE_FIELDS):
+        values = MOCK_PROFILE_VALUES.get(field)
+        user_profile[field] = values[(h >> (4 * i)) % len(values)] if values else ""
+    user_profile["consumption_thrill_point"] = next((t["related_text"] for t in topics if t["polarity"] == "好评"), "")
+    user_profile["consumption_pain_point"] = next((t["related_text"] for t in topics if t["polarity"] == "差评"), "")
+    return {
+        "comment": comment,
+        "product_topic_result": topics,
+        "keyphrases": keyphrases[:5] or clauses[:3],
+        "user_profile": user_profile
+    }
+
+
+def _section(text: str, title: str) -> str:
+    """取prompt中"# 标题"之后、下一个"#"标题之前的内容"""
+    match = re.search(rf"#\s*{title}[^\n]*\n(.*?)(?:\n#|\Z)", text, re.S)
+    return match.group(1).strip() if match else ""
+
+
+def build_content(messages: List[Dict[str, Any]], seed: int, max_categories: int) -> Tuple[str, str]:
+    """按prompt识别请求类型并生成响应内容
+
+    Returns:
+        (请求类型, 响应内容)
+    """
+    system = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    user = "\n".join(str(m.get("content", "")) for m in messages if m.get("role") == "user")
+
+    if "批量输出要求" in system:
+        match = re.search(r"\[.*\]", user, re.S)
+        items = json.loads(match.group(0)) if match else []
+        results = [dict(mock_first_label(item.get("评论", ""), seed), review_id=item.get("review_id")) for item in items]
+        return "first_label_packed", json.dumps({"results": results}, ensure_ascii=False)
+    if "# 客户评论：" in user:
+        comment = _section(user, "客户评论：").lstrip("- ").strip()
+        return "first_label", json.dumps(mock_first_label(comment, seed), ensure_ascii=False)
+    if '"categories"' in user:
+        origin = _section(user, "原始(?:话题)?分类信息：")
+        phrases = []
+        for phrase in re.split(r"[,，、\n]+", origin):
+            phrase = phrase.strip()
+            if phrase and phrase not in phrases:
+                phrases.append(phrase)
+        return "classification", json.dumps({"categories": phrases[:max_categories] or ["其他"]}, ensure_ascii=False)
+    # 第三阶段总结与洞察：返回确定的短文本
+    h = stable_hash(seed, system, user)
+    return "summary", f"模拟总结{h % 10000:04d}：用户整体评价较好，主要关注音质与续航，少数反馈物流较慢。"
+
+
+class MockState:
+    """模拟服务的配置、随机源和统计"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.random = random.Random(config["seed"])
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "by_kind": {}, "errors": {"429": 0, "500": 0, "timeout": 0}, "total_tokens": 0}
+
+    def draw(self) -> Tuple[float, Optional[str]]:
+        """抽取本次请求的延迟和错误类型"""
+        latency_config = self.config["latency"]
+        errors = self.config["errors"]
+        with self.lock:
+            distribution = latency_config["distribution"]
+            if distribution == "fixed":
+                latency = latency_config["median"]
+            elif distribution == "uniform":
+                latency = self.random.uniform(latency_config["min"], latency_config["max"])
+            else:
+                latency = self.random.lognormvariate(0, latency_config["sigma"]) * latency_config["median"]
+            roll = self.random.random()
+        latency = min(latency, latency_config["max"]) if distribution != "fixed" else latency
+        error = None
+        if roll < errors["rate_429"]:
+            error = "429"
+        elif roll < errors["rate_429"] + errors["rate_500"]:
+            error = "500"
+        elif roll < errors["rate_429"] + errors["rate_500"] + errors["rate_timeout"]:
+            error = "timeout"
+        return latency, error
+
+    def record(self, kind: str = None, error: str = None, tokens: int = 0):
+        with self.lock:
+            self.stats["requests"] += 1
+            if kind:
+                self.stats["by_kind"][kind] = self.stats["by_kind"].get(kind, 0) + 1
+            if error:
+                self.stats["errors"][error] += 1
+            self.stats["total_tokens"] += tokens
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """OpenAI兼容接口：POST /v1/chat/completions、GET /v1/models、GET /stats"""
+
+    protocol_version = "HTTP/1.1"  # 支持长连接，与客户端连接池配合
+    state: MockState = None
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Dict[str, str] = None):
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, error_type: str, message: str, headers: Dict[str, str] = None):
+        self._send_json(status, {"error": {"message": message, "type": error_type, "param": None, "code": error_type}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "mock"}]})
+        elif self.path.rstrip("/") == "/stats":
+            with self.state.lock:
+                self._send_json(200, json.loads(json.dumps(self.state.stats)))
+        else:
+            self._send_error(404, "not_found", f"未知路径: {self.path}")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_error(400, "invalid_request_error", "请求体不是合法的JSON")
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, "not_found", f"未知路径: {self.path}")
+            return
+
+        config = self.state.config
+        latency, error = self.state.draw()
+        if error == "timeout":
+            self.state.record(error=error)
+            time.sleep(config["errors"]["timeout_seconds"])
+            self.close_connection = True
+            return
+        time.sleep(latency)
+        if error == "429":
+            self.state.record(error=error)
+            self._send_error(429, "rate_limit_exceeded", "模拟限流：请求过多", {"retry-after": "1"})
+            return
+        if error == "500":
+            self.state.record(error=error)
+            self._send_error(500, "server_error", "模拟服务错误")
+            return
+
+        messages = request.get("messages") or []
+        model = request.get("model") or "mock"
+        kind, content = build_content(messages, config["seed"], config["max_categories"])
+        usage_config = config["usage"]
+        prompt_tokens = usage_config["prompt_tokens"]
+        if prompt_tokens is None:
+            prompt_tokens = estimate_messages_tokens(messages, model)
+        completion_tokens = usage_config["completion_tokens"]
+        if completion_tokens is None:
+            completion_tokens = estimate_text_tokens(content, model)
+        self.state.record(kind=kind, tokens=prompt_tokens + completion_tokens)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{stable_hash(model, messages):012x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "system_fingerprint": "mock",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "logprobs": None,
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+
+
+def create_server(config: Dict[str, Any] = None) -> ThreadingHTTPServer:
+    """创建模拟服务（调用serve_forever启动，可在测试或压测脚本中放到后台线程运行）
+
+    Args:
+        config: 服务配置，默认使用MOCK_SERVER_CONFIG
+
+    Returns:
+        HTTP服务
+    """
+    config = config or MOCK_SERVER_CONFIG
+    handler = type("ConfiguredMockOpenAIHandler", (MockOpenAIHandler,), {"state": MockState(config)})
+    server = ThreadingHTTPServer((config["host"], config["port"]), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description='本地OpenAI兼容模拟服务（压测用）')
+    parser.add_argument('--host', type=str, default=MOCK_SERVER_CONFIG["host"])
+    parser.add_argument('--port', type=int, default=MOCK_SERVER_CONFIG["port"])
+    parser.add_argument('--seed', type=int, default=MOCK_SERVER_CONFIG["seed"],
+                        help='随机种子，决定响应内容和延迟/错误序列')
+    parser.add_argument('--latency-dist', type=str, choices=["fixed", "uniform", "lognormal"],
+                        default=MOCK_SERVER_CONFIG["latency"]["distribution"], help='延迟分布')
+    parser.add_argument('--latency-median', type=float, default=MOCK_SERVER_CONFIG["latency"]["median"],
+                        help='fixed的延迟或lognormal的中位数（秒）')
+    parser.add_argument('--latency-sigma', type=float, default=MOCK_SERVER_CONFIG["latency"]["sigma"],
+                        help='lognormal的形状参数')
+    parser.add_argument('--latency-min', type=float, default=MOCK_SERVER_CONFIG["latency"]["min"])
+    parser.add_argument('--latency-max', type=float, default=MOCK_SERVER_CONFIG["latency"]["max"],
+                        help='延迟上限（秒）')
+    parser.add_argument('--error-429', type=float, default=MOCK_SERVER_CONFIG["errors"]["rate_429"], help='429错误比例')
+    parser.add_argument('--error-500', type=float, default=MOCK_SERVER_CONFIG["errors"]["rate_500"], help='500错误比例')
+    parser.add_argument('--timeout-rate', type=float, default=MOCK_SERVER_CONFIG["errors"]["rate_timeout"],
+                        help='挂起不响应的比例')
+    parser.add_argument('--timeout-seconds', type=float, default=MOCK_SERVER_CONFIG["errors"]["timeout_seconds"],
+                        help='挂起时间（秒）')
+    parser.add_argument('--prompt-tokens', type=int, default=MOCK_SERVER_CONFIG["usage"]["prompt_tokens"],
+                        help='固定的prompt token数，默认按内容估算')
+    parser.add_argument('--completion-tokens', type=int, default=MOCK_SERVER_CONFIG["usage"]["completion_tokens"],
+                        help='固定的输出token数，默认按内容估算')
+    args = parser.parse_args()
+
+    config = {
+        "host": args.host,
+        "port": args.port,
+        "seed": args.seed,
+        "latency": {
+            "distribution": args.latency_dist,
+            "median": args.latency_median,
+            "sigma": args.latency_sigma,
+            "min": args.latency_min,
+            "max": args.latency_max
+        },
+        "errors": {
+            "rate_429": args.error_429,
+            "rate_500": args.error_500,
+            "rate_timeout": args.timeout_rate,
+            "timeout_seconds": args.timeout_seconds
+        },
+        "usage": {"prompt_tokens": args.prompt_tokens, "completion_tokens": args.completion_tokens},
+        "max_categories": MOCK_SERVER_CONFIG["max_categories"]
+    }
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    server = create_server(config)
+    logger.info(f"模拟服务已启动: http://{args.host}:{args.port}/v1 (延迟: {args.latency_dist} {args.latency_median}秒, "
+                f"429: {args.error_429}, 500: {args.error_500}, 超时: {args.timeout_rate})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        logger.info("模拟服务已停止")
+
+
+if __name__ == "__main__":
+    main()
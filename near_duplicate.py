@@ -0,0 +1,232 @@
+"""
+电商点评AI分析系统 - 近似重复评论模块
+
+本模块在第一阶段调用模型前识别与已标注评论近似重复的评论，直接复用其标注结果：
+1. 归一化：全半角统一、小写，去除标点、表情和空白，去掉结尾的"推荐购买"等套话
+2. MinHash：对归一化文本的字符n-gram计算MinHash签名，按LSH分段分桶，只与同一商品的评论比较
+3. 校验：LSH召回的候选按n-gram集合的Jaccard相似度精确校验，不低于阈值时取最相似的一条复用
+4. 索引按项目、解决方案、模型和prompt版本保存在本地（JSON Lines，追加写入），重复运行无需重新计算签名
+"""
+
+import os
+import re
+import json
+import zlib
+import random
+import hashlib
+import logging
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+# 近似重复配置
+NEAR_DUPLICATE_CONFIG = {
+    "enabled": True,
+    "index_dir": "cache/near_duplicate",
+    "threshold": 0.8,  # n-gram Jaccard相似度阈值，不低于该值视为近似重复
+    "ngram": 3,  # 字符n-gram长度
+    "num_perm": 64,  # MinHash签名长度
+    "bands": 16,  # LSH分段数（每段num_perm/bands行），Jaccard 0.8的评论几乎必然成为候选
+    "min_length": 6,  # 归一化后的最短长度，更短的评论只做精确去重（标注缓存）
+    "max_candidates": 50,  # 每条评论最多精确校验的候选数
+    "boilerplate_suffixes": ["推荐购买", "值得购买", "值得推荐", "强烈推荐", "五星好评"],  # 归一化时去掉的结尾套话
+    "seed": 20250410,  # MinHash哈希函数的随机种子，修改后需重建索引
+    "label_source": "near_duplicate"
+}
+
+# 归一化时去除的字符：标点、符号、表情和空白
+_NON_WORD_PATTERN = re.compile(r"[\W_]+")
+
+# MinHash使用的梅森素数
+_MERSENNE_PRIME = (1 << 61) - 1
+
+logger = logging.getLogger("near_duplicate")
+
+
+def normalize_text(text: Any, suffixes: List[str] = None) -> str:
+    """归一化评论文本：全半角统一、小写，去除标点/表情/空白和结尾套话
+
+    Args:
+        text: 评论文本
+        suffixes: 结尾套话，默认使用NEAR_DUPLICATE_CONFIG["boilerplate_suffixes"]
+
+    Returns:
+        归一化后的文本
+    """
+    text = _NON_WORD_PATTERN.sub("", unicodedata.normalize("NFKC", str(text or "")).lower())
+    suffixes = NEAR_DUPLICATE_CONFIG["boilerplate_suffixes"] if suffixes is None else suffixes
+    stripped = True
+    while stripped:
+        stripped = False
+        for suffix in suffixes:
+            if text.endswith(suffix) and len(text) > len(suffix):
+                text = text[:-len(suffix)]
+                stripped = True
+    return text
+
+
+def shingles(text: str, n: int = NEAR_DUPLICATE_CONFIG["ngram"]) -> set:
+    """字符n-gram集合（文本短于n时为整个文本）"""
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def jaccard(a: set, b: set) -> float:
+    """两个集合的Jaccard相似度"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class NearDuplicateIndex:
+    """同一商品内按MinHash/LSH检索近似重复的已标注评论，线程安全"""
+
+    def __init__(self, path: str = None, config: Dict[str, Any] = None):
+        """初始化索引
+
+        Args:
+            path: 索引文件路径（JSON Lines），None表示只在内存中使用
+            config: 配置，默认使用NEAR_DUPLICATE_CONFIG
+        """
+        self.config = config or NEAR_DUPLICATE_CONFIG
+        if self.config["num_perm"] % self.config["bands"]:
+            raise ValueError(f"num_perm需能被bands整除: {self.config['num_perm']}/{self.config['bands']}")
+        self.path = path
+        self.rows = self.config["num_perm"] // self.config["bands"]
+        rng = random.Random(self.config["seed"])
+        self._perms = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(0, _MERSENNE_PRIME)) for _ in range(self.config["num_perm"])
+        ]
+        self._lock = threading.Lock()
+        self.entries = []  # 已标注评论：product、text、labels、source_review_id、token_usage
+        self.buckets = {}  # (商品, 段号, 段内签名) -> 条目下标列表
+        self.review_ids = set()
+
+    @classmethod
+    def open(cls, project_code: str, solution: str, model: str, prompt_version: str,
+             config: Dict[str, Any] = None) -> "NearDuplicateIndex":
+        """打开项目、解决方案、模型与prompt版本对应的本地索引文件（不存在时创建空索引）
+
+        不同项目可能有同名商品，不同解决方案的标注口径不同，各自使用独立的索引。
+
+        Args:
+            project_code: 项目编号
+            solution: 解决方案
+            model: 标注模型
+            prompt_version: 第一阶段prompt版本
+            config: 配置，默认使用NEAR_DUPLICATE_CONFIG
+
+        Returns:
+            索引
+        """
+        config = config or NEAR_DUPLICATE_CONFIG
+        key = json.dumps([project_code, solution, model, prompt_version, config["seed"]], ensure_ascii=False)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        index = cls(os.path.join(config["index_dir"], f"{name}.jsonl"), config)
+        if os.path.exists(index.path):
+            with open(index.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        index._insert(json.loads(line))
+            logger.info(f"已加载近似重复索引: {index.path} ({index.size} 条)")
+        return index
+
+    @property
+    def size(self) -> int:
+        """索引中的已标注评论数"""
+        return len(self.entries)
+
+    def _signature(self, grams: set) -> List[int]:
+        """n-gram集合的MinHash签名"""
+        hashes = [zlib.crc32(gram.encode("utf-8")) for gram in grams]
+        return [min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in self._perms]
+
+    def _band_keys(self, product: str, signature: List[int]) -> List[Tuple]:
+        """LSH分桶键"""
+        return [
+            (product, band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+            for band in range(self.config["bands"])
+        ]
+
+    def fingerprint(self, review: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """计算评论的近似重复指纹
+
+        Args:
+            review: 评论数据（评论、商品名称）
+
+        Returns:
+            指纹（product、text、signature），评论过短时返回None
+        """
+        text = normalize_text(review.get('评论'), self.config["boilerplate_suffixes"])
+        if len(text) < self.config["min_length"]:
+            return None
+        return {
+            "product": str(review.get('商品名称') or "").strip(),
+            "text": text,
+            "signature": self._signature(shingles(text, self.config["ngram"]))
+        }
+
+    def find(self, fingerprint: Optional[Dict[str, Any]]) -> Optional[Tuple[Dict[str, Any], float]]:
+        """查找同一商品中最相似的已标注评论
+
+        Args:
+            fingerprint: fingerprint()的结果
+
+        Returns:
+            (索引条目, Jaccard相似度)，没有不低于阈值的评论时返回None
+        """
+        if fingerprint is None:
+            return None
+        with self._lock:
+            candidates = []
+            for key in self._band_keys(fingerprint["product"], fingerprint["signature"]):
+                for position in self.buckets.get(key, []):
+                    if position not in candidates:
+                        candidates.append(position)
+                if len(candidates) >= self.config["max_candidates"]:
+                    break
+            entries = [self.entries[position] for position in candidates[:self.config["max_candidates"]]]
+        if not entries:
+            return None
+        grams = shingles(fingerprint["text"], self.config["ngram"])
+        best, best_similarity = None, 0.0
+        for entry in entries:
+            similarity = jaccard(grams, shingles(entry["text"], self.config["ngram"]))
+            if similarity > best_similarity:
+                best, best_similarity = entry, similarity
+        if best is None or best_similarity < self.config["threshold"]:
+            return None
+        return best, round(best_similarity, 4)
+
+    def _insert(self, entry: Dict[str, Any]) -> bool:
+        """将条目加入内存索引（同一评论只加入一次），返回是否新增"""
+        with self._lock:
+            if entry["source_review_id"] in self.review_ids:
+                return False
+            self.review_ids.add(entry["source_review_id"])
+            self.entries.append(entry)
+            for key in self._band_keys(entry["product"], entry["signature"]):
+                self.buckets.setdefault(key, []).append(len(self.entries) - 1)
+            return True
+
+    def add(self, fingerprint: Optional[Dict[str, Any]], labels: Dict[str, Any], source_review_id: Any, token_usage: int = 0):
+        """加入一条已标注评论，并追加写入索引文件
+
+        Args:
+            fingerprint: 评论的指纹，None（评论过短）时忽略
+            labels: 标注字段
+            source_review_id: 评论ID
+            token_usage: 标注该评论消耗的token数（复用时计为节省）
+        """
+        if fingerprint is None:
+            return
+        entry = dict(fingerprint, labels=labels, source_review_id=source_review_id, token_usage=token_usage,
+                     created_time=datetime.now().isoformat())
+        if not self._insert(entry) or not self.path:
+            return
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
@@ -0,0 +1,207 @@
+"""
+电商点评AI分析系统 - OpenAI客户端工厂模块
+
+本模块为三个阶段统一创建OpenAI/AsyncOpenAI客户端，替代各阶段分别创建客户端并改写进程环境变量设置代理的做法：
+1. 连接池：显式配置最大连接数、keep-alive连接数和空闲过期时间；安装了h2时启用HTTP/2
+2. 代理：按客户端传入代理地址，不再修改http_proxy/https_proxy环境变量
+3. 共享：同一代理的同步客户端共用一个HTTP连接池；异步连接池与事件循环绑定，每个异步客户端单独创建
+4. 连接统计：新建连接数、TLS握手数、连接复用率、建连耗时，以及报告时各连接池的打开/空闲连接数
+"""
+
+import time
+import inspect
+import logging
+import threading
+import importlib.util
+import weakref
+from typing import Dict, Any, Optional
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+
+# 客户端与连接池配置
+OPENAI_CLIENT_CONFIG = {
+    "max_connections": 256,  # 连接池最大连接数，不低于各阶段的最大并发请求数
+    "max_keepalive_connections": 128,  # 保持keep-alive的空闲连接数上限
+    "keepalive_expiry": 60.0,  # 空闲连接保持时间（秒）
+    "connect_timeout": 10.0,  # 建立连接的超时时间（秒），请求整体超时由各阶段的截止时间控制
+    "timeout": 600.0,  # 读写超时（秒），与openai客户端默认值一致
+    "http2": True  # 安装了h2包时启用HTTP/2（单连接多路复用），否则使用HTTP/1.1
+}
+
+logger = logging.getLogger("openai_client")
+
+
+def proxy_url(proxy_config: Optional[Dict[str, Any]]) -> Optional[str]:
+    """由代理配置（enabled/url/port）得到代理地址，未启用时返回None"""
+    if not proxy_config or not proxy_config.get("enabled", True):
+        return None
+    return f'{proxy_config["url"]}:{proxy_config["port"]}'
+
+
+class ConnectionMetrics:
+    """HTTP连接统计，通过httpcore的trace扩展记录建连、TLS握手和请求发送事件"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = weakref.WeakValueDictionary()  # 名称 -> httpx客户端，报告时读取连接池状态
+        self.requests = 0
+        self.http2_requests = 0
+        self.connections = 0
+        self.tls_handshakes = 0
+        self.connect_seconds = 0.0
+        self.tls_seconds = 0.0
+
+    def register(self, name: str, http_client):
+        """登记连接池，报告时统计其打开和空闲连接数"""
+        self._pools[name] = http_client
+
+    def _on_event(self, event_name: str, started: Dict[str, float]):
+        """处理一个trace事件，started保存本次请求各步骤的开始时间"""
+        step, _, phase = event_name.rpartition(".")
+        now = time.perf_counter()
+        if phase == "started":
+            started[step] = now
+            return
+        if phase != "complete":
+            return
+        elapsed = now - started.pop(step, now)
+        with self._lock:
+            if step.endswith("connect_tcp"):
+                self.connections += 1
+                self.connect_seconds += elapsed
+            elif step.endswith("start_tls"):
+                self.tls_handshakes += 1
+                self.tls_seconds += elapsed
+            elif step.endswith("send_request_headers"):
+                self.requests += 1
+                self.http2_requests += step.startswith("http2")
+
+    def request_hook(self, request: httpx.Request):
+        """同步客户端的请求钩子：为每个请求挂上trace回调"""
+        started = {}
+        request.extensions["trace"] = lambda event_name, info: self._on_event(event_name, started)
+
+    async def arequest_hook(self, request: httpx.Request):
+        """异步客户端的请求钩子（httpcore异步连接池要求trace回调为协程函数）"""
+        started = {}
+
+        async def trace(event_name, info):
+            self._on_event(event_name, started)
+
+        request.extensions["trace"] = trace
+
+    @staticmethod
+    def _pool_state(http_client) -> Dict[str, int]:
+        """读取httpx客户端底层连接池的打开和空闲连接数"""
+        pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", None) or [])
+        return {
+            "open": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle())
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接统计"""
+        with self._lock:
+            stats = {
+                "requests": self.requests,
+                "http2_requests": self.http2_requests,
+                "new_connections": self.connections,
+                "tls_handshakes": self.tls_handshakes,
+                "reuse_ratio": round(1 - self.connections / self.requests, 4) if self.requests else 0,
+                "connect_seconds": round(self.connect_seconds, 4),
+                "tls_seconds": round(self.tls_seconds, 4),
+                "avg_setup_ms": round((self.connect_seconds + self.tls_seconds) * 1000 / self.connections, 2)
+                if self.connections else 0
+            }
+        pools = {name: self._pool_state(client) for name, client in list(self._pools.items())}
+        stats["open_connections"] = sum(pool["open"] for pool in pools.values())
+        stats["idle_connections"] = sum(pool["idle"] for pool in pools.values())
+        stats["pools"] = pools
+        stats["config"] = dict(OPENAI_CLIENT_CONFIG, http2=_http2_available())
+        return stats
+
+
+# 全局连接统计
+connection_metrics = ConnectionMetrics()
+
+_shared_clients = {}
+_shared_lock = threading.Lock()
+
+
+def _http2_available() -> bool:
+    """配置启用HTTP/2且安装了h2包"""
+    return OPENAI_CLIENT_CONFIG["http2"] and importlib.util.find_spec("h2") is not None
+
+
+def _client_options(proxy: Optional[str]) -> Dict[str, Any]:
+    """httpx客户端的公共参数"""
+    options = {
+        "limits": httpx.Limits(
+            max_connections=OPENAI_CLIENT_CONFIG["max_connections"],
+            max_keepalive_connections=OPENAI_CLIENT_CONFIG["max_keepalive_connections"],
+            keepalive_expiry=OPENAI_CLIENT_CONFIG["keepalive_expiry"]
+        ),
+        "timeout": httpx.Timeout(OPENAI_CLIENT_CONFIG["timeout"], connect=OPENAI_CLIENT_CONFIG["connect_timeout"]),
+        "http2": _http2_available(),
+        "follow_redirects": True
+    }
+    if proxy:
+        # httpx 0.26起使用proxy参数，更早的版本只支持proxies
+        options["proxy" if "proxy" in inspect.signature(httpx.Client.__init__).parameters else "proxies"] = proxy
+    return options
+
+
+def shared_http_client(proxy: Optional[str] = None) -> httpx.Client:
+    """获取共享的同步HTTP客户端，同一代理的所有OpenAI客户端共用一个连接池
+
+    Args:
+        proxy: 代理地址，None表示不设置代理（仍遵循进程已有的代理环境变量）
+
+    Returns:
+        httpx.Client
+    """
+    with _shared_lock:
+        client = _shared_clients.get(proxy)
+        if client is None or client.is_closed:
+            client = httpx.Client(event_hooks={"request": [connection_metrics.request_hook]}, **_client_options(proxy))
+            _shared_clients[proxy] = client
+            connection_metrics.register(f"sync:{proxy or 'direct'}", client)
+            logger.info(f"HTTP连接池已创建: 代理={proxy or '无'}, 最大连接数={OPENAI_CLIENT_CONFIG['max_connections']}, "
+                        f"HTTP/2={'是' if _http2_available() else '否'}")
+        return client
+
+
+def create_openai_client(api_key: str = None, base_url: str = None, proxy: Optional[str] = None) -> OpenAI:
+    """创建使用共享连接池的OpenAI客户端
+
+    Args:
+        api_key: API密钥
+        base_url: API地址，None表示官方地址（或环境变量OPENAI_BASE_URL）
+        proxy: 代理地址，None表示不设置代理
+
+    Returns:
+        OpenAI客户端（共享连接池随进程结束释放，不要单独关闭）
+    """
+    return OpenAI(api_key=api_key, base_url=base_url, http_client=shared_http_client(proxy))
+
+
+def create_async_openai_client(api_key: str = None, base_url: str = None, proxy: Optional[str] = None) -> AsyncOpenAI:
+    """创建AsyncOpenAI客户端，连接池参数与同步客户端一致
+
+    异步连接池与创建连接时的事件循环绑定，不能跨事件循环共享，因此每个异步客户端单独创建连接池，
+    由调用方在同一事件循环中关闭。
+
+    Args:
+        api_key: API密钥
+        base_url: API地址
+        proxy: 代理地址，None表示不设置代理
+
+    Returns:
+        AsyncOpenAI客户端
+    """
+    http_client = httpx.AsyncClient(event_hooks={"request": [connection_metrics.arequest_hook]}, **_client_options(proxy))
+    connection_metrics.register(f"async:{proxy or 'direct'}:{id(http_client)}", http_client)
+    return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+
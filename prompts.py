@@ -4,10 +4,24 @@
 本模块集中管理所有项目中使用的prompt模板，便于统一维护和更新。
 """
 
+import json
+import hashlib
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
 ###################
 # 1-first_label.py 中的prompt
 ###################
 
+# 第一阶段输出的用户画像字段
+FIRST_LABEL_PROFILE_FIELDS = [
+    "gender", "occupation", "consumption_frequency", "consumption_scene",
+    "consumption_thrill_point", "consumption_pain_point", "consumption_itch_point"
+]
+
 def first_label_system_prompt():
     """准备系统提示词 - 用于第一阶段标注"""
     system_prompt = """# 任务目标：
@@ -72,6 +86,77 @@ def first_label_user_prompt(review_str: str, product_name: str) -> str:
 """
     return user_prompt
 
+def first_label_prompt_version() -> str:
+    """第一阶段标注prompt的版本号（系统提示词与用户提示词模板的内容摘要）
+    
+    prompt内容变化时版本号随之变化，用于使基于旧prompt的标注缓存失效。
+    """
+    template = first_label_system_prompt() + first_label_user_prompt("{review_str}", "{product_name}")
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:12]
+
+def first_label_packed_system_prompt():
+    """准备系统提示词 - 用于第一阶段多评论合并标注"""
+    return first_label_system_prompt() + """
+# 批量输出要求：
+- 本次输入包含多条评论，每条评论以review_id唯一标识，请逐条独立分析，不要合并或遗漏。
+- 以json格式输出，仅包含一个字段results（数据类型：列表），列表中每个元素对应一条评论，包含以下字段：
+ 1. review_id: 输入中该评论的review_id，原样返回（数据类型：字符串）。
+ 2. comment、product_topic_result、keyphrases、user_profile: 与单条评论的输出要求完全一致。
+"""
+
+def first_label_packed_user_prompt(reviews) -> str:
+    """准备用户提示词 - 用于第一阶段多评论合并标注
+    
+    Args:
+        reviews: 评论列表，每个元素包含review_id、评论、商品名称
+        
+    Returns:
+        格式化后的用户提示词
+    """
+    review_items = [
+        {"review_id": review["review_id"], "评论": review["评论"], "商品名称": review["商品名称"]}
+        for review in reviews
+    ]
+    user_prompt = f"""# 客户评论列表（共{len(review_items)}条）：
+{json.dumps(review_items, ensure_ascii=False, indent=1)}
+- 请基于任务目标，对每条评论结合其产品名称分别提取出任务要求输出，并按review_id返回
+"""
+    return user_prompt
+
+def first_label_field_fix_prompt(field: str, review_str: str, product_name: str, bad_value) -> str:
+    """准备字段修复提示词 - 用于第一阶段标注结果中本地无法修复的单个字段
+
+    Args:
+        field: 需要修复的字段（product_topic_result或user_profile）
+        review_str: 评论文本
+        product_name: 产品名称
+        bad_value: 模型原先输出的字段值
+
+    Returns:
+        格式化后的提示词（只要求重新输出该字段，不重新输出整条标注结果）
+    """
+    field_specs = {
+        "product_topic_result": """列表，每个元素包含以下四个字段：
+  - topic：分类话题（数据类型：字符串）。
+  - polarity：情感倾向（数据类型：字符串，值只能为"好评"、"差评"或"中评"）。
+  - confidence：匹配置信度（数据类型：float，0.0-1.0）。
+  - related_text：与话题相关的评论片段（数据类型：字符串）。""",
+        "user_profile": f"""字典，包含以下字段（数据类型均为字符串，没有判断出来的时候就是空字符串）：
+  - {", ".join(FIRST_LABEL_PROFILE_FIELDS)}
+  - gender只能为"男"、"女"或空，consumption_frequency只能为"首次"、"复购"、"高频"或空。"""
+    }
+    return f"""# 任务：
+下面是对一条客户评论的标注结果中格式错误的字段{field}，请按要求的格式重新输出该字段，不要输出其他字段。
+# 客户评论：
+- {review_str}
+# 产品名称：
+- {product_name}
+# 原输出（格式错误）：
+{json.dumps(bad_value, ensure_ascii=False, default=str)}
+# 输出要求：
+- 以json格式输出，仅包含一个字段{field}（数据类型：{field_specs[field]}
+"""
+
 ###################
 # 2-second_data_correction.py/3-process_single_part_report_data.py 中的prompt
 ###################
@@ -332,4 +417,60 @@ def overall_insight_prompt(top_profile, topics_stats, topics, user_profile_insig
     prompt += "- 必须包含具体的商业洞察和可执行的改进建议\n"
     prompt += "- 必须提出至少一个创新的产品方向或市场机会\n"
     prompt += "- 直接输出洞察内容，不要添加额外的说明\n"
-    return prompt
\ No newline at end of file
+    return prompt
+
+###################
+# token估算（调用前预估请求消耗，用于限流和成本预估）
+###################
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_TOKEN_OVERHEAD = 4
+
+_encodings = {}
+
+def _get_encoding(model: str = None):
+    """获取模型对应的tiktoken编码，未安装tiktoken时返回None"""
+    if tiktoken is None:
+        return None
+    key = model or "default"
+    if key not in _encodings:
+        try:
+            _encodings[key] = tiktoken.encoding_for_model(model) if model else tiktoken.get_encoding("cl100k_base")
+        except KeyError:
+            _encodings[key] = tiktoken.get_encoding("cl100k_base")
+    return _encodings[key]
+
+def estimate_text_tokens(text: str, model: str = None) -> int:
+    """估算文本的token数
+    
+    安装了tiktoken时精确计算；否则按经验估算：中日韩字符约1个token/字，其余字符约4字符/token。
+    
+    Args:
+        text: 文本
+        model: 模型名称，用于选择tiktoken编码
+        
+    Returns:
+        估算的token数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text))
+    cjk = sum(1 for ch in text if '\u2e80' <= ch <= '\u9fff' or '\uf900' <= ch <= '\uffef')
+    return cjk + (len(text) - cjk + 3) // 4
+
+def estimate_messages_tokens(messages, model: str = None) -> int:
+    """估算chat消息列表的prompt token数
+    
+    Args:
+        messages: chat.completions的messages参数
+        model: 模型名称
+        
+    Returns:
+        估算的prompt token数
+    """
+    return sum(
+        MESSAGE_TOKEN_OVERHEAD + estimate_text_tokens(message.get("content") or "", model)
+        for message in messages
+    ) + 2
@@ -0,0 +1,284 @@
+"""
+电商点评AI分析系统 - 自适应限流模块
+
+本模块为各阶段的chat.completions调用提供客户端限流：
+1. RPM/TPM令牌桶：调用前按prompt预估token数预占配额，配额不足时等待，调用完成后按实际用量修正
+2. AIMD并发控制：调用成功时并发上限逐步加1，遇到429或超时时并发上限减半
+3. RateLimitedClient：包装OpenAI/AsyncOpenAI客户端，只对真正发出的请求限流（LLM响应缓存命中不占配额）
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Dict, Any, Optional
+
+import openai
+
+from prompts import estimate_messages_tokens
+
+# 限流配置
+RATE_LIMIT_CONFIG = {
+    "rpm": 0,  # 每分钟请求数上限，0表示不限制
+    "tpm": 0,  # 每分钟token数上限，0表示不限制
+    "initial_concurrency": 16,  # 初始并发上限
+    "min_concurrency": 1,
+    "max_concurrency": 200,
+    "decrease_factor": 0.5,  # 遇到429/超时时并发上限的缩减比例
+    "decrease_cooldown": 2.0,  # 两次缩减的最小间隔（秒），避免同一波失败连续减半
+    "default_completion_tokens": 500,  # 请求未指定max_tokens时预估的输出token数
+    "async_poll_interval": 0.02  # 异步调用等待并发名额的轮询间隔（秒）
+}
+
+logger = logging.getLogger("rate_limiter")
+
+
+def is_throttle_error(error: Exception) -> bool:
+    """判断异常是否为限流（429）或超时，这两类错误需要降低并发"""
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    return getattr(error, "status_code", None) == 429
+
+
+class TokenBucket:
+    """按分钟配额匀速补充的令牌桶
+
+    采用预占方式：取用时直接扣减（可扣为负数），返回需要等待的秒数，
+    同步和异步调用方各自sleep，桶本身不阻塞。
+    """
+
+    def __init__(self, per_minute: int):
+        """初始化令牌桶
+
+        Args:
+            per_minute: 每分钟配额
+        """
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """按流逝时间补充令牌（需在持有锁时调用）"""
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """预占配额
+
+        Args:
+            amount: 需要的配额，超过桶容量时按桶容量计算
+
+        Returns:
+            需要等待的秒数
+        """
+        with self._lock:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+            return 0.0 if self.level >= 0 else -self.level / self.rate
+
+    def adjust(self, delta: float):
+        """按实际用量修正配额（delta为实际用量与预估的差值）"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - delta)
+
+
+class AdaptiveRateLimiter:
+    """RPM/TPM令牌桶 + AIMD自适应并发的限流器，多线程和asyncio共用"""
+
+    def __init__(self, rpm: int = RATE_LIMIT_CONFIG["rpm"], tpm: int = RATE_LIMIT_CONFIG["tpm"],
+                 initial_concurrency: int = RATE_LIMIT_CONFIG["initial_concurrency"],
+                 min_concurrency: int = RATE_LIMIT_CONFIG["min_concurrency"],
+                 max_concurrency: int = RATE_LIMIT_CONFIG["max_concurrency"]):
+        """初始化限流器
+
+        Args:
+            rpm: 每分钟请求数上限，0表示不限制
+            tpm: 每分钟token数上限，0表示不限制
+            initial_concurrency: 初始并发上限
+            min_concurrency: 并发上限的下限
+            max_concurrency: 并发上限的上限
+        """
+        self.rpm_bucket = TokenBucket(rpm) if rpm > 0 else None
+        self.tpm_bucket = TokenBucket(tpm) if tpm > 0 else None
+        self.min_concurrency = max(1, min_concurrency)
+        self.max_concurrency = max(self.min_concurrency, max_concurrency)
+        self.limit = float(min(max(initial_concurrency, self.min_concurrency), self.max_concurrency))
+        self.in_flight = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self.stats = {
+            "requests": 0,
+            "throttle_errors": 0,
+            "increases": 0,
+            "decreases": 0,
+            "wait_seconds": 0.0,
+            "estimated_tokens": 0,
+            "actual_tokens": 0
+        }
+        logger.info(f"自适应限流已启用: RPM={rpm or '不限'}, TPM={tpm or '不限'}, "
+                    f"并发上限 {int(self.limit)} ({self.min_concurrency}-{self.max_concurrency})")
+
+    def _try_enter(self) -> bool:
+        """尝试占用一个并发名额（需在持有锁时调用）"""
+        if self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return True
+        return False
+
+    def _reserve(self, estimated_tokens: int) -> float:
+        """预占RPM/TPM配额，返回需要等待的秒数"""
+        wait = 0.0
+        if self.rpm_bucket is not None:
+            wait = max(wait, self.rpm_bucket.reserve(1))
+        if self.tpm_bucket is not None:
+            wait = max(wait, self.tpm_bucket.reserve(estimated_tokens))
+        with self._cond:
+            self.stats["requests"] += 1
+            self.stats["estimated_tokens"] += estimated_tokens
+            self.stats["wait_seconds"] += wait
+        return wait
+
+    def _release(self, estimated_tokens: int, actual_tokens: Optional[int], error: Optional[Exception]):
+        """释放并发名额，根据调用结果调整并发上限并修正TPM配额"""
+        if actual_tokens is not None and self.tpm_bucket is not None:
+            self.tpm_bucket.adjust(actual_tokens - estimated_tokens)
+        with self._cond:
+            self.in_flight -= 1
+            if actual_tokens is not None:
+                self.stats["actual_tokens"] += actual_tokens
+            if error is None:
+                # 加性增：大约每完成一轮（当前并发上限次）成功调用，上限加1
+                self._successes += 1
+                if self._successes >= int(self.limit) and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self._successes = 0
+                    self.stats["increases"] += 1
+            elif is_throttle_error(error):
+                # 乘性减：同一波失败只减半一次
+                self.stats["throttle_errors"] += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= RATE_LIMIT_CONFIG["decrease_cooldown"]:
+                    self.limit = max(self.min_concurrency, self.limit * RATE_LIMIT_CONFIG["decrease_factor"])
+                    self._last_decrease = now
+                    self._successes = 0
+                    self.stats["decreases"] += 1
+                    logger.warning(f"触发限流/超时，并发上限降为 {int(self.limit)}: {str(error)}")
+            self._cond.notify_all()
+
+    @contextmanager
+    def limit_call(self, estimated_tokens: int):
+        """同步调用的限流上下文：占用并发名额、等待配额，退出时根据结果调整
+
+        用法：
+            with limiter.limit_call(estimated) as usage:
+                response = client.chat.completions.create(...)
+                usage["tokens"] = response.usage.total_tokens
+        """
+        with self._cond:
+            while not self._try_enter():
+                self._cond.wait()
+        usage = {"tokens": None}
+        try:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                time.sleep(wait)
+            yield usage
+        except BaseException as e:
+            self._release(estimated_tokens, usage["tokens"], e)
+            raise
+        else:
+            self._release(estimated_tokens, usage["tokens"], None)
+
+    @asynccontextmanager
+    async def alimit_call(self, estimated_tokens: int):
+        """异步调用的限流上下文，用法同limit_call"""
+        while True:
+            with self._cond:
+                if self._try_enter():
+                    break
+            await asyncio.sleep(RATE_LIMIT_CONFIG["async_poll_interval"])
+        usage = {"tokens": None}
+        try:
+            wait = self._reserve(estimated_tokens)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield usage
+        except BaseException as e:
+            self._release(estimated_tokens, usage["tokens"], e)
+            raise
+        else:
+            self._release(estimated_tokens, usage["tokens"], None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取限流统计"""
+        with self._cond:
+            stats = dict(self.stats)
+            stats["current_concurrency_limit"] = int(self.limit)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 2)
+        return stats
+
+
+def estimate_request_tokens(request: Dict[str, Any]) -> int:
+    """预估一次chat.completions请求的总token数（prompt + 输出）"""
+    prompt_tokens = estimate_messages_tokens(request.get("messages", []), request.get("model"))
+    return prompt_tokens + (request.get("max_tokens") or RATE_LIMIT_CONFIG["default_completion_tokens"])
+
+
+class _LimitedCompletions:
+    """限流后的chat.completions接口"""
+
+    def __init__(self, completions, limiter: AdaptiveRateLimiter):
+        self._completions = completions
+        self._limiter = limiter
+
+    def create(self, **request):
+        estimated = estimate_request_tokens(request)
+        with self._limiter.limit_call(estimated) as usage:
+            response = self._completions.create(**request)
+            if getattr(response, "usage", None) is not None:
+                usage["tokens"] = response.usage.total_tokens
+        return response
+
+
+class _AsyncLimitedCompletions(_LimitedCompletions):
+    """限流后的异步chat.completions接口"""
+
+    async def create(self, **request):
+        estimated = estimate_request_tokens(request)
+        async with self._limiter.alimit_call(estimated) as usage:
+            response = await self._completions.create(**request)
+            if getattr(response, "usage", None) is not None:
+                usage["tokens"] = response.usage.total_tokens
+        return response
+
+
+class _LimitedChat:
+    """限流后的chat命名空间"""
+
+    def __init__(self, completions):
+        self.completions = completions
+
+
+class RateLimitedClient:
+    """为OpenAI/AsyncOpenAI客户端的chat.completions.create加上限流，其余属性原样转发"""
+
+    def __init__(self, client, limiter: AdaptiveRateLimiter):
+        """包装客户端
+
+        Args:
+            client: OpenAI或AsyncOpenAI客户端
+            limiter: 限流器
+        """
+        self._client = client
+        self.limiter = limiter
+        completions_cls = _AsyncLimitedCompletions if isinstance(client, openai.AsyncOpenAI) else _LimitedCompletions
+        self.chat = _LimitedChat(completions_cls(client.chat.completions, limiter))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
@@ -0,0 +1,316 @@
+"""
+电商点评AI分析系统 - 请求截止时间与对冲模块
+
+本模块为大模型调用提供按操作配置的截止时间和尾延迟对冲：
+1. 每类操作有独立的截止时间，到期仍未返回的调用抛出TimeoutError交给重试装饰器处理，不再等待客户端默认超时
+2. 调用耗时超过该操作历史耗时的p95仍未返回时，发出一份相同的对冲请求，先成功返回者胜出，落选请求取消
+3. 记录对冲次数、胜出次数和对冲及超时额外消耗的token，写入各阶段的Token报告
+"""
+
+import time
+import queue
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, Callable, Tuple
+
+from usage_metrics import LatencyHistogram, UsageMetrics
+
+# 截止时间与对冲配置
+HEDGING_CONFIG = {
+    "enabled": True,
+    "deadlines": {  # 各操作的截止时间（秒），包含对冲请求在内的总耗时上限
+        "default": 120.0,
+        "analyze_review": 60.0,
+        "analyze_review_packed": 180.0
+    },
+    "hedge_percentile": 95,  # 等待超过该分位数耗时后发出对冲请求
+    "min_samples": 20,  # 该操作累计完成的调用数达到该值后才启用对冲
+    "min_hedge_delay": 1.0,  # 对冲等待时间下限（秒）
+    "max_hedge_ratio": 0.1,  # 对冲请求数占调用数的上限，服务整体变慢时避免对冲成倍放大负载
+    "max_threads": 256  # 同步调用可能对冲时使用的常驻线程数上限（不低于同时在途的同步调用数的两倍）
+}
+
+logger = logging.getLogger("request_hedging")
+
+
+def response_tokens(response) -> int:
+    """响应的总token数，没有usage时为0"""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return 0
+    return getattr(usage, "total_tokens", 0) or 0
+
+
+class RequestHedger:
+    """按操作执行截止时间和p95对冲，多线程和asyncio共用
+
+    请求函数接收本次请求的超时秒数，返回(response, cache_hit)，与response_cache.create一致。
+    异步调用中落选的请求直接取消；同步调用无法中断进行中的HTTP请求，落选请求和截止时间之后才返回的请求
+    在后台结束后丢弃，其token计入额外消耗。同步调用不会对冲时（未启用、样本不足或对冲名额已用完）在调用线程内直接执行，
+    可能对冲时由复用的常驻线程池执行，不为每次调用创建线程。
+    """
+
+    def __init__(self, config: Dict[str, Any] = None, hedge: bool = None, metrics: Optional[UsageMetrics] = None):
+        """初始化对冲器
+
+        Args:
+            config: 配置，默认使用HEDGING_CONFIG
+            hedge: 是否启用对冲，None表示按配置；关闭时仍执行截止时间
+            metrics: 调用统计，落选请求的token以"<操作>_hedge"、超时后返回的请求以"<操作>_timeout"记入，
+                使总消耗包含对冲和截止时间的成本
+        """
+        self.config = config or HEDGING_CONFIG
+        self.hedge = self.config["enabled"] if hedge is None else hedge
+        self.metrics = metrics
+        self._latency = {}  # operation -> LatencyHistogram
+        self._lock = threading.Lock()
+        self._executor = None  # 同步调用可能对冲时使用的线程池，首次需要时创建
+        self.stats = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "losers_cancelled": 0,
+            "losers_discarded": 0,
+            "timeouts": 0,
+            "late_after_timeout": 0,  # 超过截止时间后才返回、结果被丢弃的同步请求数
+            "extra_tokens": 0,  # 丢弃的响应消耗的token（对冲落选与超时后返回）
+            "timeout_tokens": 0,  # 其中超时后返回的部分
+            "estimated_cancelled_tokens": 0
+        }
+
+    def deadline(self, operation: str) -> float:
+        """操作的截止时间（秒）"""
+        deadlines = self.config["deadlines"]
+        return float(deadlines.get(operation, deadlines["default"]))
+
+    def hedge_delay(self, operation: str) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足或未启用对冲时返回None"""
+        if not self.hedge:
+            return None
+        with self._lock:
+            histogram = self._latency.get(operation)
+            if histogram is None or histogram.count < self.config["min_samples"]:
+                return None
+            delay = histogram.percentile(self.config["hedge_percentile"])
+        delay = max(self.config["min_hedge_delay"], delay)
+        return delay if delay < self.deadline(operation) else None
+
+    def _record_latency(self, operation: str, seconds: float):
+        """记录一次实际发出（非缓存命中）的请求耗时"""
+        with self._lock:
+            histogram = self._latency.get(operation)
+            if histogram is None:
+                histogram = self._latency[operation] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def _incr(self, name: str, value: int = 1):
+        with self._lock:
+            self.stats[name] += value
+
+    def _hedge_budget_left(self) -> bool:
+        """对冲请求数是否仍低于上限（调用方持有锁）"""
+        return self.stats["hedged"] < max(1, self.stats["calls"] * self.config["max_hedge_ratio"])
+
+    def _try_start_hedge(self) -> bool:
+        """对冲请求数未超过上限时占用一次对冲名额"""
+        with self._lock:
+            if not self._hedge_budget_left():
+                return False
+            self.stats["hedged"] += 1
+            return True
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """同步调用的常驻线程池（线程复用，不随调用次数增长）"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.config["max_threads"], thread_name_prefix="hedge")
+            return self._executor
+
+    def _record_discarded(self, operation: str, model: str, response, cache_hit: bool = False, timed_out: bool = False):
+        """记录同步调用中被丢弃的响应（对冲落选，或超过截止时间后才返回）的token消耗
+
+        Args:
+            operation: 操作名称
+            model: 使用的模型
+            response: 被丢弃的响应
+            cache_hit: 响应是否来自LLM响应缓存（不产生消耗）
+            timed_out: 是否为截止时间之后才返回的响应
+        """
+        tokens = 0 if cache_hit else response_tokens(response)
+        with self._lock:
+            if timed_out:
+                self.stats["late_after_timeout"] += 1
+                self.stats["timeout_tokens"] += tokens
+            else:
+                self.stats["losers_discarded"] += 1
+            self.stats["extra_tokens"] += tokens
+        if self.metrics is not None and tokens:
+            self.metrics.add_usage(tokens, model, f"{operation}_{'timeout' if timed_out else 'hedge'}")
+
+    def _timeout_error(self, operation: str, deadline: float) -> TimeoutError:
+        self._incr("timeouts")
+        return TimeoutError(f"{operation} 调用超过截止时间 {deadline:.0f}秒")
+
+    def call(self, operation: str, model: str, request_fn: Callable[[float], Tuple[Any, bool]],
+             estimated_tokens: int = 0) -> Tuple[Any, bool]:
+        """同步执行请求，超过p95未返回时发出对冲请求
+
+        Args:
+            operation: 操作名称（决定截止时间和对冲等待时间）
+            model: 使用的模型
+            request_fn: 请求函数，参数为超时秒数，返回(response, cache_hit)
+            estimated_tokens: 预估token数（同步调用不使用，保持与acall一致）
+
+        Returns:
+            (response, cache_hit)
+        """
+        self._incr("calls")
+        deadline = self.deadline(operation)
+        delay = self.hedge_delay(operation)
+        start = time.perf_counter()
+        if delay is not None:
+            with self._lock:
+                if not self._hedge_budget_left():
+                    delay = None
+        if delay is None:
+            # 不会对冲：在调用线程内执行，截止时间由请求超时保证
+            try:
+                response, cache_hit = request_fn(deadline)
+            except Exception:
+                if time.perf_counter() - start >= deadline:
+                    raise self._timeout_error(operation, deadline)
+                raise
+            if not cache_hit:
+                self._record_latency(operation, time.perf_counter() - start)
+            return response, cache_hit
+
+        outcomes = queue.Queue()
+        state = {"winner": None}
+        state_lock = threading.Lock()
+
+        def run(role: str, timeout: float):
+            request_start = time.perf_counter()
+            try:
+                response, cache_hit = request_fn(timeout)
+            except BaseException as e:
+                outcomes.put((role, None, e))
+                return
+            if not cache_hit:
+                self._record_latency(operation, time.perf_counter() - request_start)
+            with state_lock:
+                winner = state["winner"]
+                if winner is None:
+                    state["winner"] = role
+            if winner is None:
+                outcomes.put((role, (response, cache_hit), None))
+            else:
+                self._record_discarded(operation, model, response, cache_hit, timed_out=winner == "timeout")
+
+        def launch(role: str, timeout: float):
+            self._get_executor().submit(run, role, timeout)
+
+        launch("primary", deadline)
+        pending = 1
+        first_error = None
+        while pending:
+            elapsed = time.perf_counter() - start
+            remaining = deadline - elapsed
+            if remaining <= 0:
+                with state_lock:
+                    state["winner"] = "timeout"
+                raise self._timeout_error(operation, deadline)
+            wait = remaining if delay is None else min(remaining, max(0.0, delay - elapsed))
+            try:
+                role, result, error = outcomes.get(timeout=wait)
+            except queue.Empty:
+                if delay is not None and time.perf_counter() - start >= delay:
+                    if self._try_start_hedge():
+                        logger.debug(f"{operation} 超过 {delay:.2f}秒未返回，发出对冲请求")
+                        launch("hedge", deadline - (time.perf_counter() - start))
+                        pending += 1
+                    delay = None
+                continue
+            pending -= 1
+            if error is None:
+                if role == "hedge":
+                    self._incr("hedge_wins")
+                return result
+            first_error = first_error or error
+            delay = None  # 已有请求失败时不再对冲，交给重试处理
+        raise first_error
+
+    async def acall(self, operation: str, model: str, request_fn: Callable[[float], Any],
+                    estimated_tokens: int = 0) -> Tuple[Any, bool]:
+        """异步执行请求，超过p95未返回时发出对冲请求，先成功者胜出，另一份取消
+
+        Args:
+            operation: 操作名称
+            model: 使用的模型
+            request_fn: 异步请求函数，参数为超时秒数，返回(response, cache_hit)
+            estimated_tokens: 预估token数，被取消的落选请求按此记入预估额外消耗
+
+        Returns:
+            (response, cache_hit)
+        """
+        self._incr("calls")
+        deadline = self.deadline(operation)
+        delay = self.hedge_delay(operation)
+        start = time.perf_counter()
+
+        async def run(timeout: float):
+            request_start = time.perf_counter()
+            response, cache_hit = await request_fn(timeout)
+            if not cache_hit:
+                self._record_latency(operation, time.perf_counter() - request_start)
+            return response, cache_hit
+
+        tasks = {asyncio.ensure_future(run(deadline)): "primary"}
+        first_error = None
+        won = timed_out = False
+        try:
+            while tasks:
+                elapsed = time.perf_counter() - start
+                remaining = deadline - elapsed
+                if remaining <= 0:
+                    timed_out = True
+                    raise self._timeout_error(operation, deadline)
+                wait = remaining if delay is None else min(remaining, max(0.0, delay - elapsed))
+                done, _ = await asyncio.wait(set(tasks), timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    role = tasks.pop(task)
+                    if task.exception() is None:
+                        won = True
+                        if role == "hedge":
+                            self._incr("hedge_wins")
+                        return task.result()
+                    first_error = first_error or task.exception()
+                    delay = None
+                if not done and delay is not None and time.perf_counter() - start >= delay:
+                    if self._try_start_hedge():
+                        logger.debug(f"{operation} 超过 {delay:.2f}秒未返回，发出对冲请求")
+                        tasks[asyncio.ensure_future(run(deadline - (time.perf_counter() - start)))] = "hedge"
+                    delay = None
+            raise first_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if won and tasks:
+                self._incr("losers_cancelled", len(tasks))
+            if (won or timed_out) and tasks:
+                # 落选或超时取消的请求可能已在服务端计费，按预估token数记入
+                self._incr("estimated_cancelled_tokens", estimated_tokens * len(tasks))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取截止时间与对冲统计"""
+        with self._lock:
+            stats = dict(self.stats)
+            operations = list(self._latency)
+        stats["hedge_enabled"] = self.hedge
+        stats["hedge_delay_seconds"] = {
+            operation: round(delay, 3) if delay is not None else None
+            for operation, delay in ((operation, self.hedge_delay(operation)) for operation in operations)
+        }
+        stats["deadlines"] = dict(self.config["deadlines"])
+        return stats
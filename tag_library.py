@@ -0,0 +1,298 @@
+"""
+电商点评AI分析系统 - 标签样本库模块（全量打标）
+
+本模块实现"分析样本 -> 标签样本库 -> 全量打标"路线中的后两步：
+1. 从已有的大模型标注结果（kinyo_llm_results）构建标签样本库：
+   - 话题库：product_topic_result中的related_text -> topic/new_topic/polarity
+   - 评论库：样本评论原文 -> user_profile、keyphrases
+2. 使用BAAI/bge-base-zh向量化样本库，对未标注评论进行近邻召回打标，不调用大模型：
+   - 评论按标点切分为短句，每个短句召回top-k相近的话题片段，按相似度加权投票确定话题和情感
+   - 整条评论召回最相近的样本评论，相似度足够高时复用其用户画像和评论中出现的关键词
+3. 输出与大模型标注相同结构的结果文档，样本库保存在本地，重复运行无需重新向量化
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Iterable
+
+import numpy as np
+
+from prompts import FIRST_LABEL_PROFILE_FIELDS
+from vector_index import open_text_index, top_k
+
+# 标签样本库配置
+TAG_LIBRARY_CONFIG = {
+    "embedding_model": "BAAI/bge-base-zh",
+    "library_dir": "cache/tag_library",
+    "encode_batch_size": 256,
+    "topic_top_k": 5,  # 每个短句召回的话题片段数
+    "topic_threshold": 0.75,  # 话题片段相似度阈值，低于该值不打话题标签
+    "profile_threshold": 0.85,  # 整条评论相似度阈值，低于该值用户画像留空
+    "min_clause_length": 2,  # 参与召回的最短短句长度
+    "label_source": "tag_library"
+}
+
+# 短句切分的标点
+CLAUSE_SPLIT_PATTERN = re.compile(r"[，,。.!！?？;；~～、\s]+")
+
+# 用户画像原始字段（与第一阶段输出一致）
+PROFILE_FIELDS = FIRST_LABEL_PROFILE_FIELDS
+
+logger = logging.getLogger("tag_library")
+
+
+def split_clauses(text: str, min_length: int = TAG_LIBRARY_CONFIG["min_clause_length"]) -> List[str]:
+    """将评论按标点切分为短句
+
+    Args:
+        text: 评论文本
+        min_length: 最短短句长度
+
+    Returns:
+        短句列表（去重，保持原顺序）
+    """
+    clauses = []
+    for clause in CLAUSE_SPLIT_PATTERN.split(text or ""):
+        clause = clause.strip()
+        if len(clause) >= min_length and clause not in clauses:
+            clauses.append(clause)
+    return clauses
+
+
+class TagLibrary:
+    """基于向量召回的标签样本库"""
+
+    def __init__(self, embedding_model: str = TAG_LIBRARY_CONFIG["embedding_model"]):
+        """初始化样本库
+
+        Args:
+            embedding_model: 向量化模型名称
+        """
+        self.embedding_model = embedding_model
+        self._model = None
+        self.topic_entries = []  # [{"related_text", "topic", "new_topic", "polarity", "count"}]
+        self.topic_vecs = np.zeros((0, 0), dtype=np.float32)
+        self.review_entries = []  # [{"comment", "user_profile", "keyphrases"}]
+        self.review_vecs = np.zeros((0, 0), dtype=np.float32)
+
+    @property
+    def model(self):
+        """向量化模型，首次使用时加载"""
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            logger.info(f"加载向量化模型: {self.embedding_model}")
+            self._model = SentenceTransformer(self.embedding_model)
+        return self._model
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """批量向量化文本（单位向量，点积即余弦相似度）"""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        vecs = self.model.encode(
+            texts,
+            batch_size=TAG_LIBRARY_CONFIG["encode_batch_size"],
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vecs, dtype=np.float32)
+
+    @property
+    def size(self) -> Dict[str, int]:
+        """样本库规模"""
+        return {"topics": len(self.topic_entries), "reviews": len(self.review_entries)}
+
+    def build(self, docs: Iterable[Dict[str, Any]]) -> "TagLibrary":
+        """从大模型标注结果构建样本库
+
+        Args:
+            docs: 标注结果文档（kinyo_llm_results中的文档）
+
+        Returns:
+            样本库本身
+        """
+        topics = {}
+        reviews = {}
+        for doc in docs:
+            for item in doc.get("product_topic_result") or []:
+                if not isinstance(item, dict):
+                    continue
+                related_text = str(item.get("related_text") or "").strip()
+                topic = str(item.get("topic") or "").strip()
+                if not related_text or not topic:
+                    continue
+                key = (related_text, topic, item.get("polarity"))
+                if key in topics:
+                    topics[key]["count"] += 1
+                else:
+                    topics[key] = {
+                        "related_text": related_text,
+                        "topic": topic,
+                        "new_topic": item.get("new_topic"),
+                        "polarity": item.get("polarity"),
+                        "count": 1
+                    }
+            comment = str(doc.get("comment") or "").strip()
+            if comment and comment not in reviews:
+                reviews[comment] = {
+                    "comment": comment,
+                    "user_profile": doc.get("user_profile") or {},
+                    "keyphrases": doc.get("keyphrases") or []
+                }
+
+        self.topic_entries = list(topics.values())
+        self.review_entries = list(reviews.values())
+        logger.info(f"开始向量化样本库: 话题片段 {len(self.topic_entries)} 条，样本评论 {len(self.review_entries)} 条")
+        # 样本文本经由共享向量索引向量化，与第二阶段等共用已计算的向量
+        index = open_text_index(self.embedding_model)
+        self.topic_vecs = index.ensure([entry["related_text"] for entry in self.topic_entries], self.encode)
+        self.review_vecs = index.ensure([entry["comment"] for entry in self.review_entries], self.encode)
+        logger.info("样本库构建完成")
+        return self
+
+    @staticmethod
+    def library_path(project_code: str, solution: str, embedding_model: str = TAG_LIBRARY_CONFIG["embedding_model"],
+                     library_dir: str = TAG_LIBRARY_CONFIG["library_dir"]) -> str:
+        """样本库在本地的保存路径（不含扩展名）"""
+        digest = hashlib.sha1(f"{project_code}|{solution}|{embedding_model}".encode("utf-8")).hexdigest()[:12]
+        return os.path.join(library_dir, f"{project_code}_{digest}")
+
+    def save(self, path: str):
+        """保存样本库（向量为.npz，条目为.json）"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez(f"{path}.npz", topic_vecs=self.topic_vecs, review_vecs=self.review_vecs)
+        with open(f"{path}.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "embedding_model": self.embedding_model,
+                "created_time": datetime.now().isoformat(),
+                "topic_entries": self.topic_entries,
+                "review_entries": self.review_entries
+            }, f, ensure_ascii=False)
+        logger.info(f"样本库已保存: {path}")
+
+    @classmethod
+    def load(cls, path: str) -> "TagLibrary":
+        """从本地加载样本库"""
+        with open(f"{path}.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        library = cls(meta["embedding_model"])
+        library.topic_entries = meta["topic_entries"]
+        library.review_entries = meta["review_entries"]
+        vecs = np.load(f"{path}.npz")
+        library.topic_vecs = vecs["topic_vecs"]
+        library.review_vecs = vecs["review_vecs"]
+        logger.info(f"样本库已加载: {path} {library.size}")
+        return library
+
+    @classmethod
+    def load_or_build(cls, docs_factory, project_code: str, solution: str,
+                      embedding_model: str = TAG_LIBRARY_CONFIG["embedding_model"], rebuild: bool = False) -> "TagLibrary":
+        """优先加载本地样本库，不存在或要求重建时从标注结果构建并保存
+
+        Args:
+            docs_factory: 无参函数，返回用于构建样本库的标注结果文档迭代器
+            project_code: 样本所属项目编号
+            solution: 样本所属解决方案
+            embedding_model: 向量化模型名称
+            rebuild: 是否强制重建
+
+        Returns:
+            样本库
+        """
+        path = cls.library_path(project_code, solution, embedding_model)
+        if not rebuild and os.path.exists(f"{path}.json") and os.path.exists(f"{path}.npz"):
+            return cls.load(path)
+        library = cls(embedding_model).build(docs_factory())
+        if not library.topic_entries:
+            raise ValueError(f"样本库为空：项目 {project_code} 方案 {solution} 下没有可用的标注结果")
+        library.save(path)
+        return library
+
+    def _vote_topics(self, clauses: List[str], top_idx: np.ndarray, top_sims: np.ndarray) -> List[Dict[str, Any]]:
+        """按短句召回的话题片段投票，返回product_topic_result
+
+        Args:
+            clauses: 一条评论的短句
+            top_idx: 各短句召回的话题片段下标 (len(clauses), k)
+            top_sims: 对应的相似度
+        """
+        best_by_topic = {}
+        for row, clause in enumerate(clauses):
+            votes = {}
+            for idx, sim in zip(top_idx[row], top_sims[row]):
+                sim = float(sim)
+                if sim < TAG_LIBRARY_CONFIG["topic_threshold"]:
+                    continue
+                entry = self.topic_entries[idx]
+                key = (entry["topic"], entry.get("new_topic"), entry.get("polarity"))
+                score, best_sim = votes.get(key, (0.0, 0.0))
+                votes[key] = (score + sim * entry.get("count", 1), max(best_sim, sim))
+            if not votes:
+                continue
+            (topic, new_topic, polarity), (_, confidence) = max(votes.items(), key=lambda kv: kv[1][0])
+            # 同一话题只保留置信度最高的片段
+            if topic not in best_by_topic or confidence > best_by_topic[topic]["confidence"]:
+                item = {"topic": topic, "polarity": polarity, "confidence": round(confidence, 4), "related_text": clause}
+                if new_topic:
+                    item["new_topic"] = new_topic
+                best_by_topic[topic] = item
+        return sorted(best_by_topic.values(), key=lambda item: -item["confidence"])
+
+    def label_batch(self, reviews: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """对一批评论进行召回打标
+
+        Args:
+            reviews: 评论列表，每条包含review_id和评论
+
+        Returns:
+            与大模型标注结构相同的结果列表（不含项目元数据）
+        """
+        comments = [str(review.get("评论") or "") for review in reviews]
+        clauses_per_review = [split_clauses(comment) for comment in comments]
+        flat_clauses = [clause for clauses in clauses_per_review for clause in clauses]
+
+        # 整批一起向量化和召回：全部短句一次top-k话题片段，全部评论一次top-1样本评论，再按偏移切分到各条评论
+        k = TAG_LIBRARY_CONFIG["topic_top_k"]
+        if flat_clauses and len(self.topic_entries):
+            topic_idx, topic_sims = top_k(self.encode(flat_clauses), self.topic_vecs, k)
+        else:
+            topic_idx = np.zeros((len(flat_clauses), 0), dtype=np.int64)
+            topic_sims = np.zeros((len(flat_clauses), 0), dtype=np.float32)
+        if comments and len(self.review_entries):
+            review_idx, review_sims = top_k(self.encode(comments), self.review_vecs, 1)
+        else:
+            review_idx = review_sims = None
+
+        results = []
+        offset = 0
+        for i, review in enumerate(reviews):
+            clauses = clauses_per_review[i]
+            topics = self._vote_topics(
+                clauses, topic_idx[offset:offset + len(clauses)], topic_sims[offset:offset + len(clauses)]
+            )
+            offset += len(clauses)
+
+            neighbour, similarity = {}, 0.0
+            if comments[i] and review_idx is not None:
+                neighbour, similarity = self.review_entries[int(review_idx[i, 0])], float(review_sims[i, 0])
+            if similarity >= TAG_LIBRARY_CONFIG["profile_threshold"]:
+                user_profile = {field: neighbour["user_profile"].get(field, "") for field in PROFILE_FIELDS}
+            else:
+                user_profile = {field: "" for field in PROFILE_FIELDS}
+            keyphrases = [phrase for phrase in neighbour.get("keyphrases", []) if phrase and phrase in comments[i]]
+
+            results.append({
+                "comment": comments[i],
+                "product_topic_result": topics,
+                "keyphrases": keyphrases,
+                "user_profile": user_profile,
+                "token_usage": 0,
+                "review_id": review["review_id"],
+                "analysis_time": datetime.now().isoformat(),
+                "label_source": TAG_LIBRARY_CONFIG["label_source"],
+                "retrieval_similarity": round(similarity, 4)
+            })
+        return results
@@ -0,0 +1,80 @@
+"""
+价格表与成本预估模块（cost_estimator）的测试
+"""
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+
+import cost_estimator
+from cost_estimator import (
+    COST_CONFIG, CostEstimator, split_total_tokens, compute_cost, get_price, usage_cost, load_price_table
+)
+
+
+@pytest.fixture(autouse=True)
+def default_price_table():
+    """每个测试使用默认价格表，结束后恢复"""
+    load_price_table("")
+    yield
+    cost_estimator._price_table = None
+
+
+@pytest.mark.parametrize("total", [0, 1, 999, 1000, 12345])
+def test_split_total_tokens(total):
+    """按prompt_ratio拆分，两部分之和等于总数"""
+    split = split_total_tokens(total)
+    assert split["prompt_tokens"] + split["completion_tokens"] == total
+    assert split["prompt_tokens"] == int(total * COST_CONFIG["prompt_ratio"])
+
+
+def test_get_price_matches_longest_prefix():
+    """精确匹配优先，带日期后缀的模型按最长前缀匹配，未知模型使用default"""
+    assert get_price("gpt-4o") == COST_CONFIG["prices"]["gpt-4o"]
+    assert get_price("gpt-4o-mini-2024-07-18") == COST_CONFIG["prices"]["gpt-4o-mini"]
+    assert get_price("unknown-model") == COST_CONFIG["prices"]["default"]
+
+
+def test_price_file_overrides_models(tmp_path):
+    price_file = tmp_path / "prices.json"
+    price_file.write_text(json.dumps({"gpt-4o": {"input": 1.0, "output": 2.0}}), encoding="utf-8")
+    prices = load_price_table(str(price_file))
+    assert prices["gpt-4o"] == {"input": 1.0, "output": 2.0}
+    assert prices["gpt-4o-mini"] == COST_CONFIG["prices"]["gpt-4o-mini"]
+
+
+def test_usage_cost_splits_total_only_usage():
+    """只记录了总token数的模型按比例拆分后计算成本"""
+    report = usage_cost({
+        "gpt-4o-mini": {"prompt_tokens": 1_000_000, "completion_tokens": 1_000_000, "total_tokens": 2_000_000},
+        "gpt-4o": {"total_tokens": 1_000_000}
+    })
+    mini = COST_CONFIG["prices"]["gpt-4o-mini"]
+    assert report["by_model"]["gpt-4o-mini"]["total_cost"] == pytest.approx(mini["input"] + mini["output"])
+    split = split_total_tokens(1_000_000)
+    assert report["by_model"]["gpt-4o"] == compute_cost(split["prompt_tokens"], split["completion_tokens"], "gpt-4o")
+    assert report["total_cost"] == pytest.approx(
+        report["by_model"]["gpt-4o-mini"]["total_cost"] + report["by_model"]["gpt-4o"]["total_cost"]
+    )
+    assert report["currency"] == COST_CONFIG["currency"]
+
+
+def test_estimator_counts_calls_and_local_reviews(monkeypatch, tmp_path):
+    """预估按操作的输出token数（不超过请求的max_tokens）累计，本地完成的评论单独计数"""
+    monkeypatch.setattr(cost_estimator, "estimate_messages_tokens", lambda messages, model: 100)
+    monkeypatch.setattr(cost_estimator.response_cache, "contains", lambda request: False)
+    estimator = CostEstimator("test")
+    request = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "烧水很快"}]}
+    assert estimator.add("analyze_review", request) == COST_CONFIG["expected_completion_tokens"]["analyze_review"]
+    assert estimator.add("analyze_review", dict(request, max_tokens=50)) == 50
+    assert estimator.add("unknown_operation", request) == COST_CONFIG["expected_completion_tokens"]["default"]
+    estimator.add_local("prefilter_or_label_cache", 3)
+    estimator.add_local("near_duplicate", 0)
+
+    report = estimator.save_report(str(tmp_path / "estimate.json"))
+    assert report["calls"] == 3
+    assert report["prompt_tokens"] == 300
+    assert report["by_operation"]["analyze_review"]["calls"] == 2
+    assert report["resolved_locally"] == {"prefilter_or_label_cache": 3}
+    assert json.loads((tmp_path / "estimate.json").read_text(encoding="utf-8"))["total_tokens"] == report["total_tokens"]
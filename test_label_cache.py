@@ -0,0 +1,100 @@
+"""
+第一阶段标注缓存与同内容评论复用（AnalyzerService._emit）的测试
+"""
+import os
+import importlib.util
+
+import pytest
+
+for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+    pytest.importorskip(dependency)
+
+_spec = importlib.util.spec_from_file_location(
+    "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+)
+first_label = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(first_label)
+
+
+def _label(review_id, token_usage=100, unfixed=None):
+    result = {
+        "comment": "烧水很快",
+        "product_topic_result": [{"topic": "加热速度", "polarity": "好评", "confidence": 0.9, "related_text": "烧水很快"}],
+        "keyphrases": ["烧水快"],
+        "user_profile": {},
+        "token_usage": token_usage,
+        "review_id": review_id
+    }
+    if unfixed:
+        result["schema_repair"] = {"unfixed_fields": unfixed}
+    return result
+
+
+class _Cache(first_label.LabelCache):
+    """只记录写入的标注缓存"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def put(self, key, result, model):
+        self.entries.setdefault(key, result)
+
+
+class _ModelService:
+    """按预设结果逐条返回的模型服务"""
+
+    def __init__(self, results):
+        self.results = results
+        self.calls = []
+
+    def analyze_review(self, review, model):
+        self.calls.append(review["review_id"])
+        return self.results.pop(0)
+
+
+class _Writer:
+    def __init__(self):
+        self.docs = []
+
+    def add(self, doc):
+        self.docs.append(doc)
+
+
+def _service(model_results):
+    cache = _Cache()
+    service = first_label.AnalyzerService(None, _ModelService(model_results), cache, result_writer=_Writer())
+    return service, cache
+
+
+def _plan(key="k1"):
+    followers = [{"review_id": f"r{i}", "评论": "烧水很快"} for i in (2, 3, 4)]
+    return {"keys": {"r1": key, **{review["review_id"]: key for review in followers}},
+            "followers": {"r1": followers}, "fingerprints": {}}
+
+
+def test_valid_result_is_fanned_out_and_cached():
+    service, cache = _service([])
+    docs = service._emit([_label("r1")], _plan(), "gpt-4o-mini", "s", "P", test_mode=False)
+    assert [doc["review_id"] for doc in docs] == ["r1", "r2", "r3", "r4"]
+    assert [doc["token_usage"] for doc in docs] == [100, 0, 0, 0]
+    assert cache.entries["k1"]["review_id"] == "r1"
+    assert service.model_service.calls == []
+
+
+def test_invalid_result_is_not_cached_and_followers_are_relabeled():
+    """字段修复失败的结果不分发、不写缓存，由下一条同内容评论重新标注后再分发"""
+    service, cache = _service([_label("r2", unfixed=["user_profile"]), _label("r3", token_usage=80)])
+    docs = service._emit([_label("r1", unfixed=["user_profile"])], _plan(), "gpt-4o-mini", "s", "P", test_mode=False)
+    assert service.model_service.calls == ["r2", "r3"]
+    assert [doc["review_id"] for doc in docs] == ["r1", "r2", "r3", "r4"]
+    assert docs[-1]["label_source"] == "label_cache" and docs[-1]["token_usage"] == 0
+    assert cache.entries["k1"]["review_id"] == "r3"
+    assert not first_label.ModelService._is_valid_label(docs[0])
+
+
+def test_all_invalid_results_are_never_cached():
+    service, cache = _service([_label(f"r{i}", unfixed=["product_topic_result"]) for i in (2, 3, 4)])
+    docs = service._emit([_label("r1", unfixed=["product_topic_result"])], _plan(), "gpt-4o-mini", "s", "P",
+                         test_mode=False)
+    assert len(docs) == 4
+    assert cache.entries == {}
@@ -0,0 +1,162 @@
+"""
+第一阶段标注结果校验与修复模块（label_schema）的测试
+"""
+import pytest
+
+from prompts import FIRST_LABEL_PROFILE_FIELDS
+from label_schema import (
+    LABEL_SCHEMA_CONFIG, parse_json_content, normalize_polarity, normalize_confidence, repair_label
+)
+
+
+def _valid_label():
+    return {
+        "comment": "烧水很快，就是有点吵",
+        "product_topic_result": [
+            {"topic": "加热速度", "polarity": "好评", "confidence": 0.9, "related_text": "烧水很快"},
+            {"topic": "噪音", "polarity": "差评", "confidence": 0.8, "related_text": "有点吵"}
+        ],
+        "user_profile": {field: "" for field in FIRST_LABEL_PROFILE_FIELDS},
+        "keyphrases": ["烧水快", "有点吵"]
+    }
+
+
+@pytest.mark.parametrize("content", [
+    '{"a": 1}',
+    '```json\n{"a": 1}\n```',
+    '好的，结果如下：{"a": 1} 以上',
+    '{"a": 1,}'
+])
+def test_parse_json_content_repairs_common_wrappers(content):
+    """代码块标记、前后说明文字和尾逗号在本地修复"""
+    assert parse_json_content(content) == {"a": 1}
+
+
+@pytest.mark.parametrize("content", [None, "", "没有JSON", "{broken"])
+def test_parse_json_content_unparseable(content):
+    """无法解析时返回None"""
+    assert parse_json_content(content) is None
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("好评", "好评"), (" 正面 ", "好评"), ("Negative", "差评"), ("中性", "中评"), ("未知", None), (1, None)
+])
+def test_normalize_polarity(value, expected):
+    assert normalize_polarity(value) == expected
+
+
+@pytest.mark.parametrize("value, expected", [
+    (0.85, 0.85), ("85%", 0.85), (85, 0.85), ("0.5", 0.5), (-1, 0.0), (True, None), ("高", None), (float("nan"), None)
+])
+def test_normalize_confidence(value, expected):
+    assert normalize_confidence(value) == expected
+
+
+def test_valid_label_needs_no_repair():
+    """符合结构的结果原样通过，没有修复项"""
+    result, repairs, failed = repair_label(_valid_label(), "烧水很快，就是有点吵")
+    assert result == _valid_label()
+    assert repairs == [] and failed == []
+
+
+def test_repairs_types_and_values():
+    """JSON字符串、单个对象、同义词、百分数置信度和字符串关键短语在本地修复"""
+    data = _valid_label()
+    data["product_topic_result"] = '{"topic": "外观", "polarity": "正面", "confidence": "90%"}'
+    data["user_profile"] = {"gender": "女性", "occupation": ["学生", "兼职"]}
+    data["keyphrases"] = "外观好看，颜色正、外观好看"
+    result, repairs, failed = repair_label(data, "外观好看")
+    assert failed == []
+    assert result["product_topic_result"] == [
+        {"topic": "外观", "polarity": "好评", "confidence": 0.9, "related_text": ""}
+    ]
+    assert result["user_profile"]["gender"] == "女"
+    assert result["user_profile"]["occupation"] == "学生、兼职"
+    assert set(result["user_profile"]) == set(FIRST_LABEL_PROFILE_FIELDS)
+    assert result["keyphrases"] == ["外观好看", "颜色正"]
+    for repair in ("topics_object", "polarity", "confidence", "gender", "profile_type", "profile_field_missing",
+                   "keyphrases_string"):
+        assert repair in repairs
+
+    data["product_topic_result"] = '[{"topic": "外观", "polarity": "好评", "confidence": 0.9}]'
+    result, repairs, _ = repair_label(data, "外观好看")
+    assert result["product_topic_result"][0]["topic"] == "外观"
+    assert "topics_string" in repairs
+
+
+def test_drops_unusable_topics():
+    """缺少topic或polarity无法识别的话题项被丢弃，缺失的置信度补0"""
+    data = _valid_label()
+    data["product_topic_result"] = [
+        {"topic": "", "polarity": "好评"},
+        {"topic": "包装", "polarity": "不知道"},
+        "不是对象",
+        {"topic": "物流", "polarity": "好评"}
+    ]
+    result, repairs, failed = repair_label(data)
+    assert failed == []
+    assert [topic["topic"] for topic in result["product_topic_result"]] == ["物流"]
+    assert result["product_topic_result"][0]["confidence"] == 0.0
+    assert repairs.count("topic_dropped") == 3
+    assert "confidence_missing" in repairs
+
+
+def test_unfixable_fields_are_reported_and_emptied():
+    """本地无法修复的字段列入failed并置为空值，由调用方单独请求修复"""
+    data = _valid_label()
+    data["product_topic_result"] = 42
+    data["user_profile"] = "男，学生"
+    result, _, failed = repair_label(data, "原文")
+    assert failed == ["product_topic_result", "user_profile"]
+    assert set(failed) <= set(LABEL_SCHEMA_CONFIG["fixable_fields"])
+    assert result["product_topic_result"] == []
+    assert result["user_profile"] == {field: "" for field in FIRST_LABEL_PROFILE_FIELDS}
+
+
+def test_non_object_output():
+    """输出不是JSON对象时返回空结构，全部可修复字段都需要修复"""
+    result, repairs, failed = repair_label(["不是对象"], "原文")
+    assert repairs == ["not_object"]
+    assert failed == LABEL_SCHEMA_CONFIG["fixable_fields"]
+    assert result["comment"] == "原文"
+    assert result["product_topic_result"] == [] and result["keyphrases"] == []
+
+
+def test_missing_comment_uses_review_text():
+    """comment缺失或为空时使用原始评论"""
+    data = _valid_label()
+    data["comment"] = " "
+    result, repairs, _ = repair_label(data, "原始评论")
+    assert result["comment"] == "原始评论"
+    assert "comment" in repairs
+
+
+def test_fix_requests_are_estimated_at_their_max_tokens():
+    """成本预估按字段修复请求的max_tokens估算输出"""
+    pytest.importorskip("openai")
+    from cost_estimator import CostEstimator
+    assert CostEstimator.expected_completion_tokens("label_fix") == LABEL_SCHEMA_CONFIG["fix_max_tokens"]
+
+
+def test_stage1_validator_and_fix_request():
+    """第一阶段的结构校验拒绝字段修复失败的结果，字段修复请求带max_tokens"""
+    for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+        pytest.importorskip(dependency)
+    import os
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(
+        "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+    )
+    first_label = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(first_label)
+    ModelService = first_label.ModelService
+
+    assert ModelService._is_valid_label(_valid_label())
+    assert not ModelService._is_valid_label(dict(_valid_label(), product_topic_result="加热速度"))
+    assert not ModelService._is_valid_label(dict(_valid_label(), schema_repair={"unfixed_fields": ["user_profile"]}))
+    assert ModelService._is_valid_label(dict(_valid_label(), schema_repair={"unfixed_fields": []}))
+
+    messages = ModelService._build_fix_messages({"评论": "原文", "商品名称": "水壶"}, "user_profile", "男，学生")
+    request = ModelService.build_request("gpt-4o-mini", messages, LABEL_SCHEMA_CONFIG["fix_max_tokens"])
+    assert request["max_tokens"] == LABEL_SCHEMA_CONFIG["fix_max_tokens"]
+    assert "max_tokens" not in ModelService.build_request("gpt-4o-mini", messages)
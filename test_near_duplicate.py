@@ -0,0 +1,92 @@
+"""
+近似重复评论模块（near_duplicate）的测试
+"""
+import os
+import importlib.util
+
+import pytest
+
+from near_duplicate import NearDuplicateIndex, NEAR_DUPLICATE_CONFIG, normalize_text, shingles, jaccard
+
+LABELS = {
+    "comment": "烧水速度很快，声音也不大，外观很好看，容量刚好够一家三口用，保温效果也不错",
+    "product_topic_result": [{"topic": "加热速度", "polarity": "好评", "confidence": 0.9, "related_text": "烧水速度很快"}],
+    "keyphrases": ["烧水快"],
+    "user_profile": {}
+}
+
+
+def _review(text, product="电水壶"):
+    return {"评论": text, "商品名称": product}
+
+
+def _config(tmp_path, **overrides):
+    return dict(NEAR_DUPLICATE_CONFIG, index_dir=str(tmp_path), **overrides)
+
+
+def test_normalize_text_strips_noise_and_suffixes():
+    """去除标点、表情、空白和结尾套话，全半角统一并转小写"""
+    assert normalize_text("烧水很快！！ＯＫ👍 推荐购买。五星好评") == "烧水很快ok"
+    assert normalize_text("推荐购买") == "推荐购买"
+    assert shingles("ab", 3) == {"ab"}
+    assert jaccard({"a", "b"}, {"b", "c"}) == pytest.approx(1 / 3)
+
+
+def test_find_near_duplicate_within_product():
+    """相似评论在同一商品内命中，不同商品或相似度低于阈值时不命中"""
+    index = NearDuplicateIndex()
+    index.add(index.fingerprint(_review(LABELS["comment"])), LABELS, "r1", token_usage=120)
+
+    entry, similarity = index.find(index.fingerprint(_review(LABELS["comment"] + "！推荐购买")))
+    assert entry["source_review_id"] == "r1" and similarity == 1.0
+    entry, similarity = index.find(index.fingerprint(_review("烧水速度很快，声音也不大，外观挺好看，容量刚好够一家三口用，保温效果也不错")))
+    assert entry["source_review_id"] == "r1" and NEAR_DUPLICATE_CONFIG["threshold"] <= similarity < 1
+    assert index.find(index.fingerprint(_review(LABELS["comment"], product="电饭煲"))) is None
+    assert index.find(index.fingerprint(_review("保温效果一般，用了一周就坏了"))) is None
+    assert index.fingerprint(_review("很好")) is None
+
+
+def test_same_review_added_once():
+    index = NearDuplicateIndex()
+    fingerprint = index.fingerprint(_review(LABELS["comment"]))
+    index.add(fingerprint, LABELS, "r1")
+    index.add(fingerprint, LABELS, "r1")
+    assert index.size == 1
+
+
+def test_open_persists_per_project_solution_and_model(tmp_path):
+    """索引文件按项目、解决方案、模型和prompt版本区分，重新打开后条目仍在"""
+    config = _config(tmp_path)
+    index = NearDuplicateIndex.open("P1", "s1", "gpt-4o-mini", "v1", config=config)
+    index.add(index.fingerprint(_review(LABELS["comment"])), LABELS, "r1")
+
+    reopened = NearDuplicateIndex.open("P1", "s1", "gpt-4o-mini", "v1", config=config)
+    assert reopened.path == index.path and reopened.size == 1
+    assert reopened.find(reopened.fingerprint(_review(LABELS["comment"]))) is not None
+    for key in (("P2", "s1", "gpt-4o-mini", "v1"), ("P1", "s2", "gpt-4o-mini", "v1"),
+                ("P1", "s1", "gpt-4o", "v1"), ("P1", "s1", "gpt-4o-mini", "v2")):
+        other = NearDuplicateIndex.open(*key, config=config)
+        assert other.path != index.path and other.size == 0
+
+
+def test_materialized_result_uses_duplicate_review_text():
+    """复用结果的comment和related_text取自目标评论，不沿用被复用评论的原文"""
+    for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+        pytest.importorskip(dependency)
+    spec = importlib.util.spec_from_file_location(
+        "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+    )
+    first_label = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(first_label)
+
+    entry = {"labels": LABELS, "source_review_id": "r1", "token_usage": 120}
+    review = {"review_id": "r2", "评论": "烧水速度很快，声音也不大，外观挺好看，容量刚好够一家三口用，保温效果也不错"}
+    result = first_label.AnalyzerService._materialize_near_duplicate(entry, review, 0.85)
+    assert result["comment"] == review["评论"]
+    assert result["product_topic_result"][0]["related_text"] == "烧水速度很快"
+
+    review = {"review_id": "r3", "评论": "烧水的速度很快，声音也不大，外观很好看，容量刚好够一家三口用，保温效果也不错"}
+    result = first_label.AnalyzerService._materialize_near_duplicate(entry, review, 0.82)
+    assert result["product_topic_result"][0]["related_text"] == review["评论"]
+    assert result["near_duplicate"] == {"source_review_id": "r1", "similarity": 0.82}
+    assert LABELS["product_topic_result"][0]["related_text"] == "烧水速度很快"
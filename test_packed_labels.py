@@ -0,0 +1,61 @@
+"""
+第一阶段合并标注（pack）的token分摊测试
+"""
+import os
+import json
+import importlib.util
+from types import SimpleNamespace
+
+import pytest
+
+for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+    pytest.importorskip(dependency)
+
+_spec = importlib.util.spec_from_file_location(
+    "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+)
+first_label = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(first_label)
+
+REVIEWS = [{"review_id": f"r{i}", "评论": "烧水很快", "商品名称": "水壶"} for i in range(3)]
+
+
+def _item(review_id):
+    return {
+        "review_id": review_id,
+        "comment": "烧水很快",
+        "product_topic_result": [{"topic": "加热速度", "polarity": "好评", "confidence": 0.9, "related_text": "烧水很快"}],
+        "keyphrases": ["烧水快"],
+        "user_profile": {field: "" for field in first_label.FIRST_LABEL_PROFILE_FIELDS}
+    }
+
+
+def _response(content, total_tokens=1000):
+    return SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+        usage=SimpleNamespace(total_tokens=total_tokens, prompt_tokens=total_tokens - 100, completion_tokens=100)
+    )
+
+
+def _service(content, retry_tokens=50):
+    """合并请求返回content、单独重试每条消耗retry_tokens的模型服务"""
+    service = first_label.ModelService.__new__(first_label.ModelService)
+    service._complete = lambda operation, model, messages, max_tokens=None: (_response(content), True, 0.0)
+    service.analyze_review = lambda review, model: dict(_item(review["review_id"]), token_usage=retry_tokens)
+    return service
+
+
+@pytest.mark.parametrize("returned", [["r0", "r1", "r2"], ["r0"], []])
+def test_packed_token_usage_is_preserved(returned):
+    """缺失的评论单独重试后，各结果的token_usage之和等于合并请求与重试请求的总消耗"""
+    service = _service(json.dumps({"results": [_item(review_id) for review_id in returned]}))
+    results = service.analyze_reviews_packed(REVIEWS, "gpt-4o-mini")
+    assert sorted(result["review_id"] for result in results) == ["r0", "r1", "r2"]
+    retries = len(REVIEWS) - len(returned)
+    assert sum(result["token_usage"] for result in results) == 1000 + 50 * retries
+
+
+def test_unparseable_packed_response_keeps_tokens():
+    service = _service("不是JSON")
+    results = service.analyze_reviews_packed(REVIEWS, "gpt-4o-mini")
+    assert sum(result["token_usage"] for result in results) == 1000 + 50 * 3
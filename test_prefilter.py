@@ -0,0 +1,74 @@
+"""
+第一阶段规则预过滤（ReviewPrefilter）的测试
+"""
+import os
+import importlib.util
+
+import pytest
+
+for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+    pytest.importorskip(dependency)
+
+_spec = importlib.util.spec_from_file_location(
+    "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+)
+first_label = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(first_label)
+
+prefilter = first_label.ReviewPrefilter()
+
+
+@pytest.mark.parametrize("comment, rule", [
+    ("", "length"),
+    ("👍👍👍", "length"),
+    ("。", "length"),
+    ("此用户没有填写评价！", "boilerplate"),
+    ("系统默认好评", "boilerplate"),
+    ("哈哈哈哈", "regex:0"),
+    ("123456", "regex:1"),
+    ("好评", "generic_positive"),
+    ("五星好评！！", "generic_positive"),
+    ("好好好", "generic_positive"),
+    ("赞", "generic_positive"),
+    ("差", "generic_negative"),
+    ("差差差", "generic_negative"),
+    ("烂", "generic_negative"),
+    ("坑！", "generic_negative"),
+    ("垃圾垃圾", "generic_negative"),
+    ("差评。", "generic_negative"),
+    ("不好", "generic_negative")
+])
+def test_match_content_free_and_generic_positive(comment, rule):
+    assert prefilter.match(comment) == rule
+
+
+@pytest.mark.parametrize("comment", ["好评，音质很好", "五星好评，物流快", "差评，漏水", "垃圾产品用两天就坏", "还行吧"])
+def test_reviews_with_content_are_not_filtered(comment):
+    """带有具体内容或非笼统好评的短评仍交给模型"""
+    assert prefilter.match(comment) is None
+
+
+def test_apply_labels_generic_sentiment_and_empties_the_rest():
+    """笼统好评/差评生成一条对应极性的整体评价话题，其余命中规则的评论标注为空"""
+    reviews = [
+        {"review_id": "r1", "评论": "五星好评"},
+        {"review_id": "r2", "评论": "此用户没有填写评价"},
+        {"review_id": "r3", "评论": "续航不错，充电有点慢"},
+        {"review_id": "r4", "评论": "差"}
+    ]
+    results, remaining = prefilter.apply(reviews)
+    assert [review["review_id"] for review in remaining] == ["r3"]
+    by_id = {result["review_id"]: result for result in results}
+    assert by_id["r1"]["product_topic_result"] == [{
+        "topic": first_label.PREFILTER_CONFIG["generic_topic"],
+        "polarity": "好评",
+        "confidence": 1.0,
+        "related_text": "五星好评"
+    }]
+    assert by_id["r1"]["prefilter_rule"] == "generic_positive"
+    assert by_id["r2"]["product_topic_result"] == []
+    assert by_id["r4"]["prefilter_rule"] == "generic_negative"
+    assert [(topic["topic"], topic["polarity"]) for topic in by_id["r4"]["product_topic_result"]] == [
+        (first_label.PREFILTER_CONFIG["generic_topic"], "差评")
+    ]
+    assert all(result["label_source"] == "prefilter" for result in results)
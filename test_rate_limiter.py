@@ -0,0 +1,63 @@
+"""
+自适应限流模块（rate_limiter）的测试
+"""
+import pytest
+
+pytest.importorskip("openai")
+
+import rate_limiter
+from rate_limiter import TokenBucket, AdaptiveRateLimiter, RATE_LIMIT_CONFIG, estimate_request_tokens
+
+
+def test_token_bucket_reserve_and_adjust():
+    """配额不足时返回按补充速率计算的等待时间，超过容量的请求按容量计算"""
+    bucket = TokenBucket(60)  # 每秒补充1个
+    assert bucket.reserve(60) == 0.0
+    assert bucket.reserve(2) == pytest.approx(2.0, abs=0.05)
+    bucket.adjust(-2)  # 实际用量比预估少2，退回配额
+    assert bucket.reserve(1) == pytest.approx(1.0, abs=0.05)
+    assert TokenBucket(60).reserve(1000) == 0.0
+
+
+def test_concurrency_increases_after_a_round_of_successes():
+    """每完成当前并发上限次成功调用，上限加1，不超过max_concurrency"""
+    limiter = AdaptiveRateLimiter(initial_concurrency=2, max_concurrency=3)
+    for _ in range(2):
+        with limiter.limit_call(10):
+            pass
+    assert limiter.get_stats()["current_concurrency_limit"] == 3
+    for _ in range(10):
+        with limiter.limit_call(10):
+            pass
+    assert limiter.get_stats()["current_concurrency_limit"] == 3
+    assert limiter.in_flight == 0
+
+
+def test_throttle_error_halves_concurrency_once_per_cooldown():
+    """429/超时使并发上限减半，同一波失败只减一次，其他异常不减"""
+    limiter = AdaptiveRateLimiter(initial_concurrency=16, min_concurrency=2)
+    for error in (TimeoutError(), TimeoutError(), ValueError()):
+        with pytest.raises(type(error)):
+            with limiter.limit_call(10):
+                raise error
+    stats = limiter.get_stats()
+    assert stats["current_concurrency_limit"] == int(16 * RATE_LIMIT_CONFIG["decrease_factor"])
+    assert stats["throttle_errors"] == 2 and stats["decreases"] == 1
+    assert limiter.in_flight == 0
+
+
+def test_actual_tokens_are_recorded():
+    limiter = AdaptiveRateLimiter(tpm=100000)
+    with limiter.limit_call(500) as usage:
+        usage["tokens"] = 120
+    stats = limiter.get_stats()
+    assert stats["estimated_tokens"] == 500 and stats["actual_tokens"] == 120
+
+
+def test_estimate_request_tokens_uses_max_tokens(monkeypatch):
+    """请求指定max_tokens时按其预估输出，否则按默认输出token数"""
+    monkeypatch.setattr(rate_limiter, "estimate_messages_tokens", lambda messages, model: 100)
+    messages = [{"role": "user", "content": "烧水很快"}]
+    assert estimate_request_tokens({"model": "gpt-4o-mini", "messages": messages, "max_tokens": 50}) == 150
+    assert estimate_request_tokens({"model": "gpt-4o-mini", "messages": messages}) == \
+        100 + RATE_LIMIT_CONFIG["default_completion_tokens"]
@@ -0,0 +1,85 @@
+"""
+请求截止时间与对冲模块（request_hedging）的测试
+"""
+import time
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from request_hedging import RequestHedger, HEDGING_CONFIG
+from usage_metrics import UsageMetrics
+
+
+def _config(**overrides):
+    config = dict(HEDGING_CONFIG, deadlines={"default": 0.3}, min_samples=1, min_hedge_delay=0.1, max_hedge_ratio=1.0)
+    config.update(overrides)
+    return config
+
+
+def _response(tokens):
+    return SimpleNamespace(usage=SimpleNamespace(total_tokens=tokens))
+
+
+def _sleeping_request(seconds, tokens=100, cache_hit=False):
+    def request(timeout):
+        time.sleep(seconds)
+        return _response(tokens), cache_hit
+    return request
+
+
+def test_inline_call_without_latency_samples():
+    """没有耗时样本时不对冲，在调用线程内直接执行"""
+    hedger = RequestHedger(_config())
+    response, cache_hit = hedger.call("op", "model-a", _sleeping_request(0.0))
+    assert response.usage.total_tokens == 100 and cache_hit is False
+    assert hedger.get_stats()["hedged"] == 0
+    assert hedger._executor is None
+
+
+def test_hedge_wins_and_loser_tokens_are_recorded():
+    """主请求慢于对冲等待时间时发出对冲请求，先返回者胜出，落选请求的token记为<操作>_hedge"""
+    metrics = UsageMetrics()
+    hedger = RequestHedger(_config(deadlines={"default": 2.0}), metrics=metrics)
+    hedger._record_latency("op", 0.05)
+    durations = iter([0.6, 0.0])
+
+    def request(timeout):
+        time.sleep(next(durations))
+        return _response(100), False
+
+    hedger.call("op", "model-a", request)
+    time.sleep(0.8)  # 等待落选的主请求结束
+    stats = hedger.get_stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    assert stats["losers_discarded"] == 1 and stats["extra_tokens"] == 100
+    assert metrics.snapshot()["tokens_by_operation"]["op_hedge"] == 100
+
+
+def test_responses_after_deadline_are_recorded():
+    """超过截止时间后才返回的请求被丢弃，其token记为<操作>_timeout"""
+    metrics = UsageMetrics()
+    hedger = RequestHedger(_config(), metrics=metrics)
+    hedger._record_latency("op", 0.05)
+    with pytest.raises(TimeoutError):
+        hedger.call("op", "model-a", _sleeping_request(0.5))
+    time.sleep(0.7)  # 等待主请求和对冲请求结束
+    stats = hedger.get_stats()
+    assert stats["timeouts"] == 1
+    assert stats["late_after_timeout"] == 2
+    assert stats["timeout_tokens"] == 200 and stats["extra_tokens"] == 200
+    assert metrics.snapshot()["tokens_by_operation"]["op_timeout"] == 200
+
+
+def test_async_timeout_counts_cancelled_requests():
+    """异步调用超时取消的请求按预估token数记入"""
+    hedger = RequestHedger(_config(), hedge=False)
+
+    async def request(timeout):
+        await asyncio.sleep(1.0)
+        return _response(100), False
+
+    with pytest.raises(TimeoutError):
+        asyncio.run(hedger.acall("op", "model-a", request, estimated_tokens=50))
+    stats = hedger.get_stats()
+    assert stats["timeouts"] == 1 and stats["estimated_cancelled_tokens"] == 50
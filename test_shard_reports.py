@@ -0,0 +1,99 @@
+"""
+第一阶段哈希分片（--shard）与分片报告合并（--merge-report）的测试
+"""
+import os
+import json
+import importlib.util
+
+import pytest
+
+for dependency in ("openai", "httpx", "pymongo", "pandas", "tqdm"):
+    pytest.importorskip(dependency)
+
+_spec = importlib.util.spec_from_file_location(
+    "first_label", os.path.join(os.path.dirname(os.path.abspath(__file__)), "1-first_label.py")
+)
+first_label = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(first_label)
+
+
+def _write_report(tmp_path, index, count, **fields):
+    """写入一个分片报告文件"""
+    report = {
+        "total_tokens": 1000,
+        "call_count": 10,
+        "prompt_tokens": 700,
+        "completion_tokens": 300,
+        "tokens_by_model": {"gpt-4o-mini": 1000},
+        "usage_by_model": {"gpt-4o-mini": {"prompt_tokens": 700, "completion_tokens": 300, "total_tokens": 1000}},
+        "start_time": "2025-04-10T10:00:00",
+        "end_time": "2025-04-10T10:10:00",
+        "throughput": {"review_count": 100},
+        "label_cache": {"hits": 10, "misses": 90, "hit_rate": 0.1, "tokens_saved": 50},
+        "prefilter": {"checked": 100, "hits": 5, "hit_rate": 0.05, "hits_by_rule": {"too_short": 5}},
+        "shard": {"name": f"{index}/{count}", "index": index, "count": count}
+    }
+    report.update(fields)
+    path = tmp_path / f"shard{index}of{count}.json"
+    path.write_text(json.dumps(report), encoding="utf-8")
+    return str(path)
+
+
+def test_shards_partition_reviews():
+    """每条评论恰好属于一个分片，没有review_id的评论按_id分片"""
+    shards = [first_label.ReviewShard(index, 4) for index in range(4)]
+    reviews = [{"_id": i, "review_id": f"r{i}"} for i in range(200)] + [{"_id": i, "review_id": None} for i in range(50)]
+    for review in reviews:
+        assert sum(shard.contains(review) for shard in shards) == 1
+    assert first_label.review_hash_key({"_id": 7, "review_id": None}) == first_label.review_hash_key({"_id": 7})
+    assert first_label.review_hash_key({"_id": 7, "review_id": "r7"}) == "r7"
+
+
+@pytest.mark.parametrize("spec", ["4/4", "-1/4", "0/0", "a/4", "1"])
+def test_shard_parse_rejects_invalid(spec):
+    """非法的分片参数抛出ValueError"""
+    with pytest.raises(ValueError):
+        first_label.ReviewShard.parse(spec)
+
+
+def test_merge_sums_counts_and_recomputes_rates(tmp_path):
+    """计数按分片求和，比例按合并后的计数重新计算，耗时取最早开始到最晚结束"""
+    files = [
+        _write_report(tmp_path, 0, 2),
+        _write_report(tmp_path, 1, 2, end_time="2025-04-10T10:20:00",
+                      label_cache={"hits": 30, "misses": 70, "hit_rate": 0.3, "tokens_saved": 10})
+    ]
+    report = first_label.merge_shard_reports(files, "P1")
+    assert report["total_tokens"] == 2000
+    assert report["call_count"] == 20
+    assert report["usage_by_model"]["gpt-4o-mini"]["prompt_tokens"] == 1400
+    assert report["label_cache"]["hits"] == 40
+    assert report["label_cache"]["hit_rate"] == 0.2
+    assert report["prefilter"]["hits_by_rule"] == {"too_short": 10}
+    assert report["throughput"]["review_count"] == 200
+    assert report["duration_seconds"] == 1200
+    assert report["shard_count"] == 2
+    assert report["missing_shards"] == []
+    assert report["cost_estimate"] == first_label.usage_cost(report["usage_by_model"])
+
+
+def test_merge_reports_missing_and_duplicated_shards(tmp_path):
+    """缺少或重复的分片在报告中列出"""
+    files = [_write_report(tmp_path, 0, 3), _write_report(tmp_path, 0, 3)]
+    report = first_label.merge_shard_reports(files, "P1")
+    assert report["missing_shards"] == [1, 2]
+    assert report["duplicated_shards"] == [0]
+
+
+def test_merge_requires_reports():
+    """没有分片报告时抛出ValueError"""
+    with pytest.raises(ValueError):
+        first_label.merge_shard_reports([], "P1")
+
+
+def test_token_counter_saves_to_its_report_file(tmp_path):
+    """未指定文件时保存到report_file（--shard启动时设为分片报告文件）"""
+    counter = first_label.TokenCounter()
+    counter.report_file = str(tmp_path / "report.json")
+    counter.save_report()
+    assert json.loads((tmp_path / "report.json").read_text(encoding="utf-8"))["total_tokens"] == 0
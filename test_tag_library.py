@@ -0,0 +1,78 @@
+"""
+标签样本库召回打标（tag_library）的测试
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from tag_library import TagLibrary, PROFILE_FIELDS, split_clauses
+
+VOCABULARY = ["烧水很快", "烧水快", "声音很大", "噪音大", "外观好看", "学生党很满意", "烧水很快声音很大"]
+
+
+class _Library(TagLibrary):
+    """按词表生成向量的样本库：同一文本相似度为1，不同文本相互正交，不在词表中的文本与所有样本正交"""
+
+    def encode(self, texts):
+        vecs = np.zeros((len(texts), len(VOCABULARY) + 1), dtype=np.float32)
+        for row, text in enumerate(texts):
+            vecs[row, VOCABULARY.index(text) if text in VOCABULARY else len(VOCABULARY)] = 1.0
+        return vecs
+
+
+def _library():
+    library = _Library()
+    library.topic_entries = [
+        {"related_text": "烧水快", "topic": "加热速度", "polarity": "好评", "count": 2},
+        {"related_text": "烧水很快", "topic": "加热速度", "polarity": "好评", "count": 1},
+        {"related_text": "噪音大", "topic": "噪音", "new_topic": "使用体验", "polarity": "差评", "count": 1},
+        {"related_text": "声音很大", "topic": "噪音", "new_topic": "使用体验", "polarity": "差评", "count": 1}
+    ]
+    library.topic_vecs = library.encode([entry["related_text"] for entry in library.topic_entries])
+    profile = {field: "" for field in PROFILE_FIELDS}
+    profile[PROFILE_FIELDS[0]] = "学生"
+    library.review_entries = [
+        {"comment": "烧水很快声音很大", "user_profile": profile, "keyphrases": ["烧水很快", "声音很大", "不存在"]},
+        {"comment": "学生党很满意", "user_profile": {}, "keyphrases": []}
+    ]
+    library.review_vecs = library.encode([entry["comment"] for entry in library.review_entries])
+    return library
+
+
+def test_label_batch_slices_batched_search_per_review():
+    """整批召回后按偏移切分，每条评论只得到自己短句的话题和最相近样本评论的画像"""
+    reviews = [
+        {"review_id": "r1", "评论": "烧水很快，声音很大"},
+        {"review_id": "r2", "评论": "外观好看"},
+        {"review_id": "r3", "评论": ""},
+        {"review_id": "r4", "评论": "噪音大"}
+    ]
+    results = _library().label_batch(reviews)
+    assert [result["review_id"] for result in results] == ["r1", "r2", "r3", "r4"]
+
+    r1, r2, r3, r4 = results
+    assert [(topic["topic"], topic["polarity"], topic["related_text"]) for topic in r1["product_topic_result"]] == [
+        ("加热速度", "好评", "烧水很快"), ("噪音", "差评", "声音很大")
+    ]
+    assert r1["product_topic_result"][1]["new_topic"] == "使用体验"
+    assert r1["user_profile"] == {field: "" for field in PROFILE_FIELDS}  # 整条评论不在词表中，相似度为0
+    assert r2["product_topic_result"] == [] and r3["product_topic_result"] == []
+    assert r3["retrieval_similarity"] == 0.0
+    assert [topic["related_text"] for topic in r4["product_topic_result"]] == ["噪音大"]
+
+
+def test_label_batch_reuses_profile_of_nearest_review():
+    reviews = [{"review_id": "r1", "评论": "烧水很快声音很大"}, {"review_id": "r2", "评论": "学生党很满意"}]
+    r1, r2 = _library().label_batch(reviews)
+    assert r1["retrieval_similarity"] == 1.0
+    assert r1["user_profile"][PROFILE_FIELDS[0]] == "学生"
+    assert r1["keyphrases"] == ["烧水很快", "声音很大"]
+    assert r2["user_profile"] == {field: "" for field in PROFILE_FIELDS}
+
+
+def test_empty_library_and_batch():
+    library = _Library()
+    assert library.label_batch([]) == []
+    result = library.label_batch([{"review_id": "r1", "评论": "烧水很快"}])[0]
+    assert result["product_topic_result"] == [] and result["retrieval_similarity"] == 0.0
+    assert split_clauses("烧水很快，，声音很大。烧水很快") == ["烧水很快", "声音很大"]
@@ -0,0 +1,85 @@
+"""
+调用统计模块（usage_metrics）的测试
+"""
+import threading
+
+from usage_metrics import LatencyHistogram, UsageMetrics, USAGE_METRICS_CONFIG
+
+
+def test_histogram_empty():
+    """没有记录时分位数为0"""
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) == 0.0
+    assert histogram.summary()["count"] == 0
+
+
+def test_histogram_percentiles_within_bucket_error():
+    """分位数的相对误差不超过一个分桶的宽度"""
+    histogram = LatencyHistogram()
+    for i in range(1, 1001):
+        histogram.add(i / 100)  # 0.01秒到10秒均匀分布
+    growth = USAGE_METRICS_CONFIG["latency_growth"]
+    for q, expected in ((50, 5.0), (95, 9.5), (99, 9.9)):
+        assert expected / growth <= histogram.percentile(q) <= expected * growth
+    assert histogram.percentile(100) == 10.0
+    assert histogram.summary()["max_seconds"] == 10.0
+
+
+def test_histogram_clamped_to_observed_range():
+    """分位数不超出实际记录的最小/最大值，低于最小边界的耗时归入0号桶"""
+    histogram = LatencyHistogram()
+    histogram.add(0.0001)
+    histogram.add(10000)
+    assert histogram.percentile(1) == USAGE_METRICS_CONFIG["latency_min_seconds"]
+    assert histogram.percentile(100) == 10000
+
+
+def test_histogram_merge():
+    """合并后的直方图与直接记录全部耗时的直方图一致"""
+    a, b, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+    for i, seconds in enumerate([0.1, 0.2, 0.5, 1.0, 2.0, 5.0]):
+        (a if i % 2 else b).add(seconds)
+        both.add(seconds)
+    a.merge(b)
+    assert a.counts == both.counts
+    assert a.summary() == both.summary()
+
+
+def test_metrics_aggregate_across_threads():
+    """多个线程写入的统计在快照中合并"""
+    metrics = UsageMetrics()
+
+    def work():
+        for _ in range(100):
+            metrics.add_usage(10, "model-a", "analyze_review", prompt_tokens=7, completion_tokens=3)
+            metrics.add_latency(0.5, "analyze_review", "model-a")
+            metrics.incr("label_cache.hits")
+        metrics.add_retry("analyze_review", TimeoutError())
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    snapshot = metrics.snapshot()
+    assert snapshot["total_tokens"] == 4000
+    assert snapshot["call_count"] == 400
+    assert snapshot["usage_by_model"]["model-a"] == {"prompt_tokens": 2800, "completion_tokens": 1200, "total_tokens": 4000}
+    assert snapshot["retries"] == {"analyze_review": 4}
+    assert snapshot["errors"] == {"analyze_review": {"TimeoutError": 4}}
+    assert snapshot["latency"]["by_operation"]["analyze_review|model-a"]["count"] == 400
+    assert metrics.counters_with_prefix("label_cache.", snapshot) == {"hits": 400}
+
+
+def test_finished_thread_shards_are_retired():
+    """已退出线程的分片并入退役汇总，分片数不随线程数增长，计数不丢失"""
+    metrics = UsageMetrics()
+    for _ in range(50):
+        thread = threading.Thread(target=lambda: metrics.add_usage(1, "model-a"))
+        thread.start()
+        thread.join()
+    metrics.add_usage(1, "model-a")  # 当前线程注册时回收已退出线程的分片
+    assert metrics.shard_count == 1
+    assert metrics.snapshot()["total_tokens"] == 51
+    assert metrics.shard_count == 1
@@ -0,0 +1,120 @@
+"""
+本地向量索引模块（vector_index）的测试
+"""
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from vector_index import VectorIndex, normalize, top_k, text_id
+
+
+def _vectors(n, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(n, dim)).astype(np.float32)
+
+
+def _assert_rows_match(index, ids, vectors):
+    """每个id对应的向量与写入时一致"""
+    for vector_id, vector in zip(ids, normalize(vectors)):
+        assert np.allclose(index.get([vector_id])[0], vector, atol=1e-5)
+
+
+def test_top_k_matches_full_sort():
+    """top_k与完整排序的前k个一致，按相似度降序"""
+    queries, matrix = normalize(_vectors(5, seed=1)), normalize(_vectors(100, seed=2))
+    idx, scores = top_k(queries, matrix, 7)
+    expected = np.argsort(-(queries @ matrix.T), axis=1)[:, :7]
+    assert (idx == expected).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+    assert top_k(queries, matrix, 0)[0].shape == (5, 0)
+    assert top_k(queries, matrix, 1000)[0].shape == (5, 100)
+
+
+def test_add_search_and_reload(tmp_path):
+    """追加的向量可检索，已有id跳过，重新打开后id与向量行一一对应"""
+    vectors = _vectors(50)
+    ids = [f"v{i}" for i in range(50)]
+    index = VectorIndex(str(tmp_path))
+    assert index.add(ids, vectors) == 50
+    assert index.add(ids[:10], vectors[:10]) == 0
+    results = index.search(vectors[:3], k=1)
+    assert [result[0][0] for result in results] == ids[:3]
+    assert results[0][0][1] == pytest.approx(1.0, abs=1e-5)
+
+    reopened = VectorIndex(str(tmp_path))
+    assert len(reopened) == 50 and "v49" in reopened
+    _assert_rows_match(reopened, ids, vectors)
+    with pytest.raises(ValueError):
+        reopened.add(["other"], _vectors(1, dim=8))
+
+
+def test_int8_search_close_to_float32(tmp_path):
+    """int8存储的检索结果与float32基本一致"""
+    vectors = _vectors(200)
+    ids = [f"v{i}" for i in range(200)]
+    index = VectorIndex(str(tmp_path), dtype="int8")
+    index.add(ids, vectors)
+    for query_id, result in zip(ids[:20], index.search(vectors[:20], k=1)):
+        assert result[0][0] == query_id
+        assert result[0][1] == pytest.approx(1.0, abs=0.02)
+
+
+def test_interrupted_append_is_truncated(tmp_path):
+    """中断的追加（向量和id写入了、count未更新）在下次追加前被截断，不会错位"""
+    vectors = _vectors(30)
+    index = VectorIndex(str(tmp_path))
+    index.add([f"v{i}" for i in range(10)], vectors[:10])
+    # 模拟中断：写入了向量和id，但meta.json的count仍为10
+    with open(tmp_path / "vectors.bin", "ab") as f:
+        f.write(normalize(vectors[10:15]).tobytes())
+    with open(tmp_path / "ids.txt", "a", encoding="utf-8") as f:
+        f.write("".join(f"stale{i}\n" for i in range(5)))
+
+    index = VectorIndex(str(tmp_path))
+    assert len(index) == 10
+    index.add([f"v{i}" for i in range(10, 30)], vectors[10:30])
+    reopened = VectorIndex(str(tmp_path))
+    assert len(reopened) == 30
+    assert not any(vector_id.startswith("stale") for vector_id in reopened.ids)
+    _assert_rows_match(reopened, [f"v{i}" for i in range(30)], vectors)
+
+
+def test_stale_instance_does_not_truncate_other_appends(tmp_path):
+    """两个实例（如两个进程）共用索引时，count过期的实例追加前先载入对方的追加"""
+    vectors = _vectors(40)
+    first, second = VectorIndex(str(tmp_path)), VectorIndex(str(tmp_path))
+    first.add([f"a{i}" for i in range(20)], vectors[:20])
+    second.add([f"b{i}" for i in range(20)] + ["a0"], np.vstack([vectors[20:], vectors[:1]]))
+    assert len(second) == 40
+
+    reopened = VectorIndex(str(tmp_path))
+    assert len(reopened) == 40
+    _assert_rows_match(reopened, [f"a{i}" for i in range(20)] + [f"b{i}" for i in range(20)], vectors)
+
+
+def test_ivf_search_and_append(tmp_path):
+    """训练IVF后检索仍能找到自身，之后追加的向量也分配分区"""
+    vectors = _vectors(300, seed=3)
+    ids = [f"v{i}" for i in range(300)]
+    index = VectorIndex(str(tmp_path))
+    index.add(ids[:250], vectors[:250])
+    index.train_ivf(8, seed=0)
+    index.add(ids[250:], vectors[250:])
+    assert len(index.assign) == 300
+    for query_id, result in zip(ids[240:260], index.search(vectors[240:260], k=1, nprobe=8)):
+        assert result[0][0] == query_id
+
+
+def test_ensure_encodes_only_missing(tmp_path):
+    """ensure只对索引中没有的文本调用向量化函数"""
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return _vectors(len(texts), seed=len(calls))
+
+    index = VectorIndex(str(tmp_path))
+    first = index.ensure(["好评", "物流快"], encode)
+    second = index.ensure(["物流快", "好评", "质量差"], encode)
+    assert calls[1] == ["质量差"]
+    assert np.allclose(second[0], first[1]) and np.allclose(second[1], first[0])
+    assert text_id("好评") in index
@@ -10,6 +10,9 @@ import logging
 from datetime import datetime
 from typing import Dict, Any
 
+from usage_metrics import UsageMetrics
+from cost_estimator import usage_cost
+
 # 日志配置
 LOG_CONFIG = {
     "log_file": "logs/data_correction.log",
@@ -58,7 +61,7 @@ def setup_logger(log_file: str = None, log_level: int = logging.INFO):
     return logger
 
 class TokenCounter:
-    """Token使用统计类"""
+    """Token使用统计类（线程/协程安全，按线程分片记录，生成报告时合并）"""
     
     def __init__(self, test_version: str = "default"):
         """初始化Token计数器
@@ -66,12 +69,7 @@ class TokenCounter:
         Args:
             test_version: 测试版本标识
         """
-        self.total_tokens = 0
-        self.call_count = 0
-        self.token_by_model = {}
-        self.token_by_operation = {}
-        self.prompt_tokens = 0
-        self.completion_tokens = 0
+        self.metrics = UsageMetrics()
         self.start_time = datetime.now()
         self.test_version = test_version
         
@@ -87,63 +85,64 @@ class TokenCounter:
             completion_tokens: 生成token数量
         """
         if tokens:
-            self.total_tokens += tokens
-            self.call_count += 1
-            
-            # 记录提示词和生成token
-            if prompt_tokens is not None:
-                self.prompt_tokens += prompt_tokens
-            if completion_tokens is not None:
-                self.completion_tokens += completion_tokens
-            
-            # 按模型统计
-            if model in self.token_by_model:
-                self.token_by_model[model] += tokens
-            else:
-                self.token_by_model[model] = tokens
-            
-            # 按操作类型统计
-            if operation in self.token_by_operation:
-                self.token_by_operation[operation] += tokens
-            else:
-                self.token_by_operation[operation] = tokens
-            
+            self.metrics.add_usage(tokens, model, operation, prompt_tokens, completion_tokens)
             logger.debug(f"使用 {tokens} tokens ({model}, {operation})")
+    
+    def add_latency(self, seconds: float, operation: str = "default", model: str = ""):
+        """添加单次API调用耗时记录
+        
+        Args:
+            seconds: 调用耗时（秒）
+            operation: 操作类型
+            model: 使用的模型名称
+        """
+        self.metrics.add_latency(seconds, operation, model)
+    
+    def add_retry(self, operation: str, error: Exception = None):
+        """添加一次API调用重试记录"""
+        self.metrics.add_retry(operation, error)
+    
+    def add_error(self, operation: str, error: Exception):
+        """添加一次API调用最终失败记录"""
+        self.metrics.add_error(operation, error)
                 
     def get_report(self) -> Dict[str, Any]:
         """获取使用报告"""
         end_time = datetime.now()
         duration = (end_time - self.start_time).total_seconds()
+        snapshot = self.metrics.snapshot()
+        total_tokens = snapshot["total_tokens"]
+        call_count = snapshot["call_count"]
+        prompt_tokens = snapshot["prompt_tokens"]
+        completion_tokens = snapshot["completion_tokens"]
         
         # 如果没有明确记录提示词和生成token，则估算
-        if self.prompt_tokens == 0 and self.completion_tokens == 0 and self.total_tokens > 0:
+        if prompt_tokens == 0 and completion_tokens == 0 and total_tokens > 0:
             # 假设提示词占70%，生成占30%
-            self.prompt_tokens = int(self.total_tokens * 0.7)
-            self.completion_tokens = self.total_tokens - self.prompt_tokens
+            prompt_tokens = int(total_tokens * 0.7)
+            completion_tokens = total_tokens - prompt_tokens
         
-        # 计算成本估算（基于gpt-3.5-turbo价格）
-        input_cost = round(self.prompt_tokens * 0.0000015, 6)
-        output_cost = round(self.completion_tokens * 0.000002, 6)
-        total_cost = round(input_cost + output_cost, 6)
+        # 按价格表计算各模型的成本
+        cost_estimate = usage_cost(snapshot["usage_by_model"])
         
         return {
-            "total_tokens": self.total_tokens,
-            "call_count": self.call_count,
-            "average_tokens_per_call": round(self.total_tokens / self.call_count if self.call_count > 0 else 0, 1),
-            "tokens_by_model": self.token_by_model,
-            "tokens_by_operation": self.token_by_operation,
+            "total_tokens": total_tokens,
+            "call_count": call_count,
+            "average_tokens_per_call": round(total_tokens / call_count if call_count > 0 else 0, 1),
+            "tokens_by_model": snapshot["tokens_by_model"],
+            "tokens_by_operation": snapshot["tokens_by_operation"],
             "duration_seconds": round(duration, 6),
             "start_time": self.start_time.isoformat(),
             "end_time": end_time.isoformat(),
             "report_time": datetime.now().isoformat(),
             "test_version": self.test_version,
-            "prompt_tokens": self.prompt_tokens,
-            "completion_tokens": self.completion_tokens,
-            "cost_estimate": {
-                "input_cost": input_cost,
-                "output_cost": output_cost,
-                "total_cost": total_cost
-            }
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "latency_stats": snapshot["latency"]["overall"],
+            "latency_by_operation": snapshot["latency"]["by_operation"],
+            "retries": snapshot["retries"],
+            "errors": snapshot["errors"],
+            "cost_estimate": cost_estimate
         }
         
     def save_report(self, output_file: str = None):
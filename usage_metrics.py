@@ -0,0 +1,267 @@
+"""
+电商点评AI分析系统 - 调用统计模块
+
+本模块为各阶段的Token统计提供线程/协程安全、低竞争的统计组件：
+1. 每个线程写入自己的分片（分片锁只在汇总时才会有竞争），生成报告时合并所有分片；
+   线程结束后其分片并入退役汇总，分片数不随线程的创建与退出增长
+2. 记录token消耗（按模型、按操作）、按操作和模型划分的调用耗时直方图（p50/p95/p99）、重试次数和错误类型
+3. 耗时直方图按对数分桶，内存占用固定，不随调用次数增长
+"""
+
+import math
+import threading
+from typing import Dict, Any, Optional
+
+# 统计配置
+USAGE_METRICS_CONFIG = {
+    "latency_min_seconds": 0.001,  # 直方图最小分桶边界
+    "latency_max_seconds": 3600.0,  # 直方图最大分桶边界
+    "latency_growth": 1.05  # 相邻分桶边界的比例，决定分位数的相对误差（约5%）
+}
+
+
+class LatencyHistogram:
+    """对数分桶的耗时直方图"""
+
+    _growth = USAGE_METRICS_CONFIG["latency_growth"]
+    _min = USAGE_METRICS_CONFIG["latency_min_seconds"]
+    _bucket_count = int(math.ceil(
+        math.log(USAGE_METRICS_CONFIG["latency_max_seconds"] / USAGE_METRICS_CONFIG["latency_min_seconds"])
+        / math.log(USAGE_METRICS_CONFIG["latency_growth"])
+    )) + 2
+
+    def __init__(self):
+        self.counts = [0] * self._bucket_count
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _bucket(self, seconds: float) -> int:
+        """耗时所在的分桶（0号桶为小于最小边界的耗时）"""
+        if seconds < self._min:
+            return 0
+        return min(self._bucket_count - 1, int(math.log(seconds / self._min) / math.log(self._growth)) + 1)
+
+    def add(self, seconds: float):
+        """记录一次耗时"""
+        self.counts[self._bucket(seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def merge(self, other: "LatencyHistogram"):
+        """合并另一个直方图"""
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, q: float) -> float:
+        """分位数（取所在分桶的上边界，并限制在实际最小/最大值之间）
+
+        Args:
+            q: 分位点，0-100
+
+        Returns:
+            分位数值（秒），没有记录时返回0
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q / 100 * self.count))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank:
+                if i == self._bucket_count - 1:
+                    return self.max  # 溢出桶没有上边界
+                upper = self._min * (self._growth ** i)
+                return min(max(upper, self.min), self.max)
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        """耗时统计摘要"""
+        return {
+            "count": self.count,
+            "mean_seconds": round(self.total / self.count, 3) if self.count else 0,
+            "p50_seconds": round(self.percentile(50), 3),
+            "p95_seconds": round(self.percentile(95), 3),
+            "p99_seconds": round(self.percentile(99), 3),
+            "max_seconds": round(self.max, 3)
+        }
+
+
+class _Shard:
+    """单个线程的统计分片"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total_tokens = 0
+        self.call_count = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.tokens_by_model = {}
+        self.usage_by_model = {}  # model -> [prompt_tokens, completion_tokens, total_tokens]
+        self.tokens_by_operation = {}
+        self.latency = {}  # (operation, model) -> LatencyHistogram
+        self.retries = {}  # operation -> 次数
+        self.errors = {}  # (operation, 错误类型) -> 次数
+        self.counters = {}  # 名称 -> 数值
+
+    def merge(self, other: "_Shard"):
+        """将另一个分片的统计累加到本分片（调用方持有两个分片的锁）"""
+        for field in ("total_tokens", "call_count", "prompt_tokens", "completion_tokens"):
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+        for target, source in ((self.tokens_by_model, other.tokens_by_model),
+                               (self.tokens_by_operation, other.tokens_by_operation),
+                               (self.retries, other.retries),
+                               (self.errors, other.errors),
+                               (self.counters, other.counters)):
+            for key, value in source.items():
+                target[key] = target.get(key, 0) + value
+        for model, values in other.usage_by_model.items():
+            usage = self.usage_by_model.setdefault(model, [0, 0, 0])
+            for i, value in enumerate(values):
+                usage[i] += value
+        for key, histogram in other.latency.items():
+            self.latency.setdefault(key, LatencyHistogram()).merge(histogram)
+
+
+class UsageMetrics:
+    """分片的调用统计：写入只锁当前线程的分片，生成报告时合并
+
+    同一线程内的协程共用该线程的分片；每次写入在分片锁内完成且不跨越await，因此协程间也不会丢失计数。
+    已退出线程的分片在注册新分片或生成快照时并入退役汇总，长时间运行的进程（如--follow、对冲请求线程）
+    中分片数只与存活线程数有关。
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._shards = []  # [(线程, 分片)]
+        self._retired = _Shard()  # 已退出线程的分片汇总
+        self._registry_lock = threading.Lock()
+
+    def _retire_finished(self):
+        """将已退出线程的分片并入退役汇总（调用方持有注册锁）"""
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+                continue
+            with self._retired.lock, shard.lock:
+                self._retired.merge(shard)
+        self._shards = alive
+
+    def _shard(self) -> _Shard:
+        """获取当前线程的分片，首次使用时注册"""
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = _Shard()
+            with self._registry_lock:
+                self._retire_finished()
+                self._shards.append((threading.current_thread(), shard))
+            self._local.shard = shard
+        return shard
+
+    @property
+    def shard_count(self) -> int:
+        """当前登记的线程分片数（不含退役汇总）"""
+        with self._registry_lock:
+            return len(self._shards)
+
+    def add_usage(self, tokens: int, model: str, operation: str = "default",
+                  prompt_tokens: int = None, completion_tokens: int = None):
+        """记录一次调用的token消耗"""
+        if not tokens:
+            return
+        shard = self._shard()
+        with shard.lock:
+            shard.total_tokens += tokens
+            shard.call_count += 1
+            shard.prompt_tokens += prompt_tokens or 0
+            shard.completion_tokens += completion_tokens or 0
+            shard.tokens_by_model[model] = shard.tokens_by_model.get(model, 0) + tokens
+            usage = shard.usage_by_model.setdefault(model, [0, 0, 0])
+            usage[0] += prompt_tokens or 0
+            usage[1] += completion_tokens or 0
+            usage[2] += tokens
+            shard.tokens_by_operation[operation] = shard.tokens_by_operation.get(operation, 0) + tokens
+
+    def add_latency(self, seconds: float, operation: str = "default", model: str = ""):
+        """记录一次调用耗时"""
+        shard = self._shard()
+        with shard.lock:
+            histogram = shard.latency.get((operation, model))
+            if histogram is None:
+                histogram = shard.latency[(operation, model)] = LatencyHistogram()
+            histogram.add(seconds)
+
+    def add_retry(self, operation: str, error: Optional[BaseException] = None):
+        """记录一次重试（及触发重试的错误类型）"""
+        shard = self._shard()
+        with shard.lock:
+            shard.retries[operation] = shard.retries.get(operation, 0) + 1
+            if error is not None:
+                key = (operation, type(error).__name__)
+                shard.errors[key] = shard.errors.get(key, 0) + 1
+
+    def add_error(self, operation: str, error: BaseException):
+        """记录一次错误"""
+        shard = self._shard()
+        with shard.lock:
+            key = (operation, type(error).__name__)
+            shard.errors[key] = shard.errors.get(key, 0) + 1
+
+    def incr(self, name: str, value: int = 1):
+        """累加自定义计数器"""
+        shard = self._shard()
+        with shard.lock:
+            shard.counters[name] = shard.counters.get(name, 0) + value
+
+    def snapshot(self) -> Dict[str, Any]:
+        """合并所有分片，返回统计快照"""
+        with self._registry_lock:
+            self._retire_finished()
+            shards = [shard for _, shard in self._shards] + [self._retired]
+        total = _Shard()
+        for shard in shards:
+            with shard.lock:
+                total.merge(shard)
+
+        errors = {}
+        for (operation, error_class), value in total.errors.items():
+            errors.setdefault(operation, {})[error_class] = value
+        overall = LatencyHistogram()
+        for histogram in total.latency.values():
+            overall.merge(histogram)
+        return {
+            "total_tokens": total.total_tokens,
+            "call_count": total.call_count,
+            "prompt_tokens": total.prompt_tokens,
+            "completion_tokens": total.completion_tokens,
+            "tokens_by_model": total.tokens_by_model,
+            "usage_by_model": {
+                model: {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": tokens}
+                for model, (prompt, completion, tokens) in total.usage_by_model.items()
+            },
+            "tokens_by_operation": total.tokens_by_operation,
+            "retries": total.retries,
+            "errors": errors,
+            "counters": total.counters,
+            "latency": {
+                "overall": overall.summary(),
+                "by_operation": {
+                    f"{operation}|{model}" if model else operation: histogram.summary()
+                    for (operation, model), histogram in sorted(total.latency.items())
+                }
+            }
+        }
+
+    def counters_with_prefix(self, prefix: str, snapshot: Dict[str, Any] = None) -> Dict[str, int]:
+        """取出以prefix开头的计数器（去掉前缀）"""
+        counters = (snapshot or self.snapshot())["counters"]
+        return {name[len(prefix):]: value for name, value in counters.items() if name.startswith(prefix)}
@@ -0,0 +1,438 @@
+"""
+电商点评AI分析系统 - 本地向量索引模块
+
+本模块为评论、话题短语、标签等文本向量提供持久化的本地索引，各阶段共享同一份向量，不再每次运行重新向量化：
+1. 向量以float32或int8矩阵保存在内存映射文件中，id映射按行追加保存，支持增量添加；
+   追加在进程间文件锁内进行，多个阶段或--shard进程共用同一索引时不会互相截断
+2. top-k余弦相似度检索：按块读取矩阵，批量NumPy矩阵乘法计算
+3. 可选的IVF粗分区（球面k-means）：大规模数据时只在最相近的若干分区内检索
+4. ensure()：按文本内容取向量，只对索引中没有的文本调用向量化模型
+"""
+
+import os
+import json
+import hashlib
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Tuple, Callable, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows没有fcntl，只保证进程内的线程安全
+    fcntl = None
+
+# 向量索引配置
+VECTOR_INDEX_CONFIG = {
+    "index_dir": "cache/vector_index",
+    "dtype": "float32",  # float32|int8，int8占用1/4空间，相似度有少量误差
+    "search_chunk_size": 65536,  # 暴力检索时每次读入内存的向量行数
+    "ivf_iterations": 10,  # IVF训练的k-means迭代次数
+    "ivf_train_sample": 100000,  # IVF训练的最大采样向量数
+    "ivf_nprobe": 8  # IVF检索时访问的分区数
+}
+
+logger = logging.getLogger("vector_index")
+
+
+def text_id(text: str) -> str:
+    """文本的向量id（内容摘要）"""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def normalize(vectors) -> np.ndarray:
+    """转为float32并归一化为单位向量（点积即余弦相似度）"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(queries: np.ndarray, matrix: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """计算查询向量与矩阵各行的相似度并取top-k
+
+    Args:
+        queries: 查询向量 (q, dim)，需已归一化
+        matrix: 候选向量 (n, dim)，需已归一化
+        k: 返回数量
+
+    Returns:
+        (下标 (q, k), 相似度 (q, k))，按相似度降序
+    """
+    scores = queries @ matrix.T
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        empty = np.zeros((scores.shape[0], 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    part = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-part, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class VectorIndex:
+    """基于内存映射文件的本地向量索引
+
+    目录结构：
+        meta.json          维度、存储类型、向量数量
+        ids.txt            向量id，每行一个，与向量行号一一对应
+        vectors.bin        向量矩阵（float32或int8）
+        scales.bin         int8存储时每行的反量化系数（float32）
+        ivf_centroids.npy  IVF分区中心（可选）
+        ivf_assign.bin     每行所属的IVF分区（int32，可选）
+        index.lock         进程间写锁（追加、训练IVF时持有）
+    """
+
+    def __init__(self, path: str, dtype: str = VECTOR_INDEX_CONFIG["dtype"]):
+        """打开或创建索引
+
+        Args:
+            path: 索引目录
+            dtype: 新建索引时的存储类型，float32|int8（已有索引以meta.json为准）
+        """
+        if dtype not in ("float32", "int8"):
+            raise ValueError(f"不支持的向量存储类型: {dtype}")
+        self.path = path
+        self.dtype = dtype
+        self.dim = None
+        self.count = 0
+        self.ids = []
+        self.id_map = {}
+        self.centroids = None
+        self._matrix = None
+        self._scales = None
+        self._assign = None
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def _file_lock(self):
+        """进程间写锁：同一索引目录同时只有一个进程追加或训练"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._file("index.lock"), "a") as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _read_meta(self) -> Optional[Dict[str, Any]]:
+        """读取meta.json，索引尚未写入时返回None"""
+        if not os.path.exists(self._file("meta.json")):
+            return None
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _load(self):
+        """加载元数据和id映射"""
+        meta = self._read_meta()
+        if meta is None:
+            return
+        self.dim = meta["dim"]
+        self.dtype = meta["dtype"]
+        self.count = meta["count"]
+        with open(self._file("ids.txt"), "r", encoding="utf-8") as f:
+            self.ids = [line.rstrip("\n") for _, line in zip(range(self.count), f)]
+        self.id_map = {vector_id: row for row, vector_id in enumerate(self.ids)}
+        if os.path.exists(self._file("ivf_centroids.npy")):
+            self.centroids = np.load(self._file("ivf_centroids.npy"))
+        logger.info(f"向量索引已加载: {self.path} ({self.count} 条, 维度 {self.dim}, {self.dtype})")
+
+    def _refresh(self):
+        """持有写锁时重新读取meta.json，载入其他进程在本进程打开索引后追加的id和IVF分区"""
+        meta = self._read_meta()
+        if meta is None:
+            return
+        ivf_lists = 0 if self.centroids is None else len(self.centroids)
+        if meta["count"] == self.count and meta.get("ivf_lists", 0) == ivf_lists:
+            return
+        if meta["count"] < self.count:
+            self.ids, self.id_map, self.centroids = [], {}, None
+            self._load()
+        else:
+            self.dim = meta["dim"]
+            self.dtype = meta["dtype"]
+            with open(self._file("ids.txt"), "r", encoding="utf-8") as f:
+                new_ids = [line.rstrip("\n") for _, line in zip(range(meta["count"]), f)][self.count:]
+            for vector_id in new_ids:
+                self.id_map[vector_id] = len(self.ids)
+                self.ids.append(vector_id)
+            self.count = meta["count"]
+            if meta.get("ivf_lists", 0) and os.path.exists(self._file("ivf_centroids.npy")):
+                self.centroids = np.load(self._file("ivf_centroids.npy"))
+        self._reset_maps()
+
+    def _save_meta(self):
+        """保存元数据（count最后写入，中断的追加不会被读到）"""
+        tmp_file = self._file("meta.json.tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump({
+                "dim": self.dim,
+                "dtype": self.dtype,
+                "count": self.count,
+                "ivf_lists": 0 if self.centroids is None else len(self.centroids),
+                "updated_time": datetime.now().isoformat()
+            }, f)
+        os.replace(tmp_file, self._file("meta.json"))
+
+    def _truncate(self, name: str, itemsize: int):
+        """截断文件中超出count的部分（上次追加中断时残留）"""
+        file_path = self._file(name)
+        if os.path.exists(file_path) and os.path.getsize(file_path) > self.count * itemsize:
+            with open(file_path, "r+b") as f:
+                f.truncate(self.count * itemsize)
+
+    def _truncate_ids(self):
+        """截断ids.txt中超出count行的部分（上次追加中断时残留），避免新id接在残留行之后错位"""
+        file_path = self._file("ids.txt")
+        if not os.path.exists(file_path):
+            return
+        with open(file_path, "r+b") as f:
+            offset = 0
+            for _ in range(self.count):
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+            if os.path.getsize(file_path) > offset:
+                f.truncate(offset)
+
+    @property
+    def matrix(self) -> np.memmap:
+        """向量矩阵的内存映射（只读）"""
+        if self._matrix is None and self.count:
+            self._matrix = np.memmap(self._file("vectors.bin"), dtype=self.dtype, mode="r", shape=(self.count, self.dim))
+            if self.dtype == "int8":
+                self._scales = np.memmap(self._file("scales.bin"), dtype=np.float32, mode="r", shape=(self.count,))
+        return self._matrix
+
+    @property
+    def assign(self) -> Optional[np.memmap]:
+        """每行所属的IVF分区"""
+        if self._assign is None and self.centroids is not None and self.count:
+            self._assign = np.memmap(self._file("ivf_assign.bin"), dtype=np.int32, mode="r", shape=(self.count,))
+        return self._assign
+
+    def _reset_maps(self):
+        self._matrix = None
+        self._scales = None
+        self._assign = None
+
+    def rows(self, row_idx) -> np.ndarray:
+        """读取指定行（切片或下标数组）并转为float32"""
+        block = np.asarray(self.matrix[row_idx], dtype=np.float32)
+        if self.dtype == "int8":
+            block = block * np.asarray(self._scales[row_idx], dtype=np.float32)[:, None]
+        return block
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __contains__(self, vector_id: str) -> bool:
+        return vector_id in self.id_map
+
+    def add(self, ids: List[str], vectors) -> int:
+        """追加向量，已存在的id跳过
+
+        Args:
+            ids: 向量id列表
+            vectors: 向量 (n, dim)
+
+        Returns:
+            新增的向量数
+        """
+        vectors = normalize(vectors) if len(ids) else np.zeros((0, self.dim or 0), dtype=np.float32)
+        with self._lock, self._file_lock():
+            # 其他进程可能已追加，以磁盘上的count为准再去重和截断
+            self._refresh()
+            keep, seen = [], set()
+            for i, vector_id in enumerate(ids):
+                if vector_id not in self.id_map and vector_id not in seen:
+                    keep.append(i)
+                    seen.add(vector_id)
+            if not keep:
+                return 0
+            vectors = vectors[keep]
+            new_ids = [ids[i] for i in keep]
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"向量维度不一致: 索引 {self.dim}, 新增 {vectors.shape[1]}")
+
+            for name, itemsize in (("vectors.bin", self.dim * np.dtype(self.dtype).itemsize), ("scales.bin", 4), ("ivf_assign.bin", 4)):
+                self._truncate(name, itemsize)
+            self._truncate_ids()
+            with open(self._file("vectors.bin"), "ab") as f:
+                if self.dtype == "int8":
+                    # 按行对称量化，保存反量化系数
+                    max_abs = np.abs(vectors).max(axis=1)
+                    max_abs[max_abs == 0] = 1.0
+                    f.write(np.round(vectors * (127.0 / max_abs)[:, None]).astype(np.int8).tobytes())
+                    with open(self._file("scales.bin"), "ab") as sf:
+                        sf.write((max_abs / 127.0).astype(np.float32).tobytes())
+                else:
+                    f.write(vectors.astype(np.float32).tobytes())
+            if self.centroids is not None:
+                with open(self._file("ivf_assign.bin"), "ab") as f:
+                    f.write(np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32).tobytes())
+            with open(self._file("ids.txt"), "a", encoding="utf-8") as f:
+                f.write("".join(f"{vector_id}\n" for vector_id in new_ids))
+
+            for vector_id in new_ids:
+                self.id_map[vector_id] = len(self.ids)
+                self.ids.append(vector_id)
+            self.count = len(self.ids)
+            self._reset_maps()
+            self._save_meta()
+            return len(new_ids)
+
+    def get(self, ids: List[str]) -> np.ndarray:
+        """按id取向量
+
+        Args:
+            ids: 向量id列表
+
+        Returns:
+            向量 (n, dim)
+        """
+        if not ids:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        rows = np.array([self.id_map[vector_id] for vector_id in ids], dtype=np.int64)
+        return self.rows(rows)
+
+    def ensure(self, texts: List[str], encode_fn: Callable[[List[str]], Any]) -> np.ndarray:
+        """按文本取向量，只对索引中没有的文本调用encode_fn
+
+        Args:
+            texts: 文本列表
+            encode_fn: 向量化函数，输入文本列表返回向量矩阵
+
+        Returns:
+            与texts一一对应的向量 (n, dim)
+        """
+        ids = [text_id(text) for text in texts]
+        missing = {}
+        for vector_id, text in zip(ids, texts):
+            if vector_id not in self.id_map:
+                missing.setdefault(vector_id, text)
+        if missing:
+            logger.info(f"向量索引未命中 {len(missing)}/{len(texts)} 条文本，开始向量化")
+            self.add(list(missing.keys()), encode_fn(list(missing.values())))
+        return self.get(ids)
+
+    def train_ivf(self, n_lists: int, iterations: int = VECTOR_INDEX_CONFIG["ivf_iterations"], seed: int = 0):
+        """训练IVF粗分区（球面k-means）并为全部向量分配分区
+
+        Args:
+            n_lists: 分区数，通常取sqrt(向量数)左右
+            iterations: k-means迭代次数
+            seed: 随机种子
+        """
+        if self.count < n_lists:
+            raise ValueError(f"向量数 {self.count} 少于分区数 {n_lists}")
+        rng = np.random.default_rng(seed)
+        sample_size = min(self.count, VECTOR_INDEX_CONFIG["ivf_train_sample"])
+        sample = normalize(self.rows(np.sort(rng.choice(self.count, sample_size, replace=False))))
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(n_lists):
+                members = sample[labels == c]
+                # 空分区重新随机初始化
+                centroids[c] = members.sum(axis=0) if len(members) else sample[rng.integers(sample_size)]
+            centroids = normalize(centroids)
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            chunk = VECTOR_INDEX_CONFIG["search_chunk_size"]
+            with open(self._file("ivf_assign.bin"), "wb") as f:
+                for start in range(0, self.count, chunk):
+                    block = self.rows(slice(start, min(start + chunk, self.count)))
+                    f.write(np.argmax(block @ centroids.T, axis=1).astype(np.int32).tobytes())
+            self.centroids = centroids.astype(np.float32)
+            np.save(self._file("ivf_centroids.npy"), self.centroids)
+            self._reset_maps()
+            self._save_meta()
+        logger.info(f"IVF分区训练完成: {n_lists} 个分区, 采样 {sample_size} 条")
+
+    def search(self, queries, k: int = 10, nprobe: int = None) -> List[List[Tuple[str, float]]]:
+        """top-k余弦相似度检索
+
+        Args:
+            queries: 查询向量 (q, dim)
+            k: 每个查询返回的数量
+            nprobe: IVF检索访问的分区数，None表示使用默认值；未训练IVF时暴力检索
+
+        Returns:
+            每个查询的[(id, 相似度), ...]列表，按相似度降序
+        """
+        queries = normalize(queries)
+        if not self.count:
+            return [[] for _ in range(len(queries))]
+        if self.centroids is not None:
+            return self._search_ivf(queries, k, nprobe or VECTOR_INDEX_CONFIG["ivf_nprobe"])
+
+        # 分块暴力检索，合并各块的top-k
+        chunk = VECTOR_INDEX_CONFIG["search_chunk_size"]
+        best_idx = np.zeros((len(queries), 0), dtype=np.int64)
+        best_scores = np.zeros((len(queries), 0), dtype=np.float32)
+        for start in range(0, self.count, chunk):
+            block = self.rows(slice(start, min(start + chunk, self.count)))
+            idx, scores = top_k(queries, block, k)
+            merged_idx = np.concatenate([best_idx, idx + start], axis=1)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            keep = np.argsort(-merged_scores, axis=1)[:, :k]
+            best_idx = np.take_along_axis(merged_idx, keep, axis=1)
+            best_scores = np.take_along_axis(merged_scores, keep, axis=1)
+        return [
+            [(self.ids[i], float(s)) for i, s in zip(row_idx, row_scores)]
+            for row_idx, row_scores in zip(best_idx, best_scores)
+        ]
+
+    def _search_ivf(self, queries: np.ndarray, k: int, nprobe: int) -> List[List[Tuple[str, float]]]:
+        """IVF检索：只在与查询最相近的nprobe个分区内计算相似度"""
+        list_idx, _ = top_k(queries, self.centroids, nprobe)
+        assign = np.asarray(self.assign)
+        results = []
+        for query, lists in zip(queries, list_idx):
+            rows = np.flatnonzero(np.isin(assign, lists))
+            if not len(rows):
+                results.append([])
+                continue
+            idx, scores = top_k(query[None, :], self.rows(rows), k)
+            results.append([(self.ids[rows[i]], float(s)) for i, s in zip(idx[0], scores[0])])
+        return results
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取索引统计"""
+        return {
+            "path": self.path,
+            "count": self.count,
+            "dim": self.dim,
+            "dtype": self.dtype,
+            "ivf_lists": 0 if self.centroids is None else len(self.centroids)
+        }
+
+
+def open_text_index(embedding_model: str, index_dir: str = VECTOR_INDEX_CONFIG["index_dir"],
+                    dtype: str = VECTOR_INDEX_CONFIG["dtype"]) -> VectorIndex:
+    """打开某个向量化模型对应的共享文本向量索引（各阶段共用）
+
+    Args:
+        embedding_model: 向量化模型名称
+        index_dir: 索引根目录
+        dtype: 新建索引时的存储类型
+
+    Returns:
+        向量索引
+    """
+    return VectorIndex(os.path.join(index_dir, embedding_model.replace("/", "__")), dtype=dtype)